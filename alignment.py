@@ -0,0 +1,351 @@
+"""
+Speaker alignment module for matching transcribed words to diarization turns
+"""
+from typing import Iterable, Iterator, List, Sequence, Tuple
+import numpy as np
+import config
+
+
+# (start_time, end_time, speaker_label, text)
+TranscriptLine = Tuple[float, float, str, str]
+
+
+class SpeakerIndex:
+    """Sorted interval index over diarization turns
+
+    Turns are sorted by start time and bucketed by length in powers of two
+    seconds. A turn can only overlap a query interval if it starts less than
+    its bucket's longest turn before the interval, so the candidates in each
+    bucket are located with two binary searches, and a few long turns (e.g.
+    one spanning the whole recording) do not widen the scan of the short ones.
+    A running maximum of end times finds the nearest turn before a gap.
+    """
+
+    def __init__(self, speaker_segments: Sequence[Tuple[float, float, str]]):
+        """
+        Build the index
+
+        Args:
+            speaker_segments: List of (start_time, end_time, speaker_label) tuples
+        """
+        count = len(speaker_segments)
+        starts = np.fromiter((s[0] for s in speaker_segments), dtype=np.float64, count=count)
+        ends = np.fromiter((s[1] for s in speaker_segments), dtype=np.float64, count=count)
+
+        # Map speaker labels to small integer ids in order of first appearance
+        self.speakers: List[str] = []
+        label_ids = {}
+        ids = np.empty(count, dtype=np.int32)
+        for i, (_, _, label) in enumerate(speaker_segments):
+            if label not in label_ids:
+                label_ids[label] = len(self.speakers)
+                self.speakers.append(label)
+            ids[i] = label_ids[label]
+
+        order = np.argsort(starts, kind="stable")
+        self.starts = starts[order]
+        self.ends = ends[order]
+        self.speaker_ids = ids[order]
+
+        if count:
+            # Running maximum of end times and the turn that reached it
+            self.max_ends = np.maximum.accumulate(self.ends)
+            positions = np.where(self.ends == self.max_ends, np.arange(count), 0)
+            self.max_end_turns = np.maximum.accumulate(positions)
+        else:
+            self.max_ends = np.empty(0, dtype=np.float64)
+            self.max_end_turns = np.empty(0, dtype=np.int64)
+
+        # (turns in start order, their starts, longest duration) per length bucket
+        durations = np.maximum(self.ends - self.starts, 0.0)
+        # Open-ended turns (end = inf) share the last bucket
+        lengths = np.ceil(np.log2(np.clip(durations, 1.0, 2.0 ** 62))).astype(np.int64)
+        self.buckets: List[Tuple[np.ndarray, np.ndarray, float]] = []
+        for length in np.unique(lengths).tolist():
+            members = np.nonzero(lengths == length)[0]
+            self.buckets.append((members, self.starts[members], float(durations[members].max())))
+
+    def __len__(self) -> int:
+        return len(self.starts)
+
+    def assign(
+        self,
+        starts: Sequence[float],
+        ends: Sequence[float],
+        max_gap: float = None
+    ) -> np.ndarray:
+        """
+        Assign each interval to the speaker whose turn overlaps it the most
+
+        Args:
+            starts: Start times of the intervals (e.g. words)
+            ends: End times of the intervals
+            max_gap: Intervals that overlap no turn are given to the nearest
+                     turn if it is at most this many seconds away
+
+        Returns:
+            Array of speaker ids (indices into ``speakers``), -1 if unassigned
+        """
+        if max_gap is None:
+            max_gap = config.ALIGNMENT_MAX_GAP
+
+        starts = np.asarray(starts, dtype=np.float64)
+        ends = np.asarray(ends, dtype=np.float64)
+        result = np.full(len(starts), -1, dtype=np.int32)
+        if len(starts) == 0 or len(self) == 0:
+            return result
+
+        best_overlap = np.zeros(len(starts), dtype=np.float64)
+        best_turn = np.full(len(starts), -1, dtype=np.int64)
+
+        for members, bucket_starts, longest in self.buckets:
+            # Candidate turns of the bucket are [lo, hi): every turn before lo
+            # ends before the interval starts, every turn from hi starts after it ends
+            lo = np.searchsorted(bucket_starts, starts - longest, side="left")
+            hi = np.searchsorted(bucket_starts, ends, side="left")
+
+            active = np.nonzero(lo < hi)[0]
+            position = lo[active]
+            while active.size:
+                turn = members[position]
+                overlap = (
+                    np.minimum(self.ends[turn], ends[active])
+                    - np.maximum(self.starts[turn], starts[active])
+                )
+                # Ties go to the earlier turn, whichever bucket it is in
+                better = (self.ends[turn] > starts[active]) & (
+                    (overlap > best_overlap[active])
+                    | ((overlap == best_overlap[active]) & (turn < best_turn[active]))
+                    | ((overlap >= 0) & (best_turn[active] < 0))
+                )
+                best_overlap[active[better]] = overlap[better]
+                best_turn[active[better]] = turn[better]
+
+                position = position + 1
+                keep = position < hi[active]
+                active = active[keep]
+                position = position[keep]
+
+        # Fall back to the nearest turn for intervals in gaps between turns
+        missing = np.nonzero(best_turn < 0)[0]
+        if missing.size and max_gap > 0:
+            lo = np.searchsorted(self.max_ends, starts[missing], side="right")
+            prev_idx = lo - 1
+            has_prev = prev_idx >= 0
+            prev_turn = self.max_end_turns[np.maximum(prev_idx, 0)]
+            prev_gap = np.where(has_prev, starts[missing] - self.max_ends[np.maximum(prev_idx, 0)], np.inf)
+
+            next_idx = np.searchsorted(self.starts, ends[missing], side="left")
+            has_next = next_idx < len(self)
+            next_turn = np.minimum(next_idx, len(self) - 1)
+            next_gap = np.where(has_next, self.starts[next_turn] - ends[missing], np.inf)
+
+            nearest = np.where(prev_gap <= next_gap, prev_turn, next_turn)
+            gap = np.minimum(prev_gap, next_gap)
+            close = gap <= max_gap
+            best_turn[missing[close]] = nearest[close]
+
+        assigned = best_turn >= 0
+        result[assigned] = self.speaker_ids[best_turn[assigned]]
+        return result
+
+
+def speech_chunks(
+    speaker_segments: Sequence[Tuple[float, float, str]],
+    policy: str = None,
+    max_seconds: float = None,
+    max_gap: float = None,
+    padding: float = None,
+    duration: float = None
+) -> List[Tuple[float, float]]:
+    """
+    Pack diarized speech turns into chunks for batched Whisper decoding
+
+    Turns are padded, and a turn overlapping the previous chunk starts where
+    that chunk ends, so no audio is decoded twice. Chunks longer than
+    max_seconds are split into equal parts.
+
+    Args:
+        speaker_segments: List of (start_time, end_time, speaker_label) tuples
+        policy: "merge" to join neighbouring turns, "turn" for one chunk per turn
+        max_seconds: Maximum chunk length
+        max_gap: Maximum silence bridged when merging
+        padding: Seconds added before and after every turn
+        duration: Audio length used to clip the padded chunks
+
+    Returns:
+        Sorted, non-overlapping (start, end) chunks in seconds
+    """
+    policy = policy or config.WHISPER_PACKING
+    max_seconds = max_seconds or config.WHISPER_CHUNK_SECONDS
+    max_gap = config.WHISPER_MERGE_GAP if max_gap is None else max_gap
+    padding = config.WHISPER_CHUNK_PADDING if padding is None else padding
+    if policy not in ("merge", "turn"):
+        raise ValueError(f"Unknown packing policy: {policy}")
+
+    chunks: List[Tuple[float, float]] = []
+    for start, end, _ in sorted(speaker_segments):
+        start = max(0.0, start - padding)
+        end = end + padding if duration is None else min(end + padding, duration)
+        if chunks and start < chunks[-1][1]:
+            start = chunks[-1][1]
+        if end <= start:
+            continue
+        if (policy == "merge" and chunks and start - chunks[-1][1] <= max_gap
+                and end - chunks[-1][0] <= max_seconds):
+            chunks[-1] = (chunks[-1][0], end)
+        else:
+            chunks.append((start, end))
+
+    result = []
+    for start, end in chunks:
+        pieces = int(np.ceil((end - start) / max_seconds))
+        bounds = np.linspace(start, end, pieces + 1)
+        result.extend(zip(bounds[:-1].tolist(), bounds[1:].tolist()))
+    return result
+
+
+def collect_units(segments: Iterable, use_words: bool = True) -> Tuple[list, list, list, str]:
+    """
+    Flatten faster-whisper segments into timed text units
+
+    Args:
+        segments: Iterable of faster-whisper segments
+        use_words: Use word timestamps when the segments carry them
+
+    Returns:
+        Tuple of (starts, ends, texts, joiner) where joiner is the string used
+        to concatenate consecutive units of one speaker
+    """
+    starts, ends, texts = [], [], []
+    for segment in segments:
+        words = getattr(segment, "words", None) if use_words else None
+        if words:
+            for word in words:
+                starts.append(word.start)
+                ends.append(word.end)
+                texts.append(word.word)
+        elif segment.text.strip():
+            starts.append(segment.start)
+            ends.append(segment.end)
+            # Word text keeps its own leading whitespace, so keep the segment's too
+            texts.append(segment.text if use_words else segment.text.strip())
+
+    return starts, ends, texts, "" if use_words else " "
+
+
+def align(
+    starts: Sequence[float],
+    ends: Sequence[float],
+    texts: Sequence[str],
+    index: SpeakerIndex,
+    joiner: str = "",
+    max_gap: float = None,
+    strip: bool = True
+) -> List[TranscriptLine]:
+    """
+    Give each text unit to exactly one speaker and merge consecutive units
+
+    Args:
+        starts: Start times of the text units
+        ends: End times of the text units
+        texts: Text of each unit
+        index: Index over the diarization turns
+        joiner: String inserted between consecutive units of one speaker
+        max_gap: See ``SpeakerIndex.assign``
+        strip: Strip surrounding whitespace from each line. Streaming callers
+               keep it so that pieces can later be joined by merge_lines()
+
+    Returns:
+        List of (start_time, end_time, speaker_label, text) lines
+    """
+    speaker_ids = index.assign(starts, ends, max_gap=max_gap)
+    kept = np.nonzero(speaker_ids >= 0)[0]
+    if kept.size == 0:
+        return []
+
+    kept_ids = speaker_ids[kept]
+    # A new line starts wherever the speaker changes
+    breaks = np.nonzero(np.diff(kept_ids))[0] + 1
+    run_starts = np.concatenate(([0], breaks))
+    run_ends = np.concatenate((breaks, [kept.size]))
+
+    lines = []
+    for first, last in zip(run_starts.tolist(), run_ends.tolist()):
+        members = kept[first:last].tolist()
+        text = joiner.join(texts[i] for i in members)
+        if strip:
+            text = text.strip()
+        if text.strip():
+            lines.append((
+                float(starts[members[0]]),
+                float(ends[members[-1]]),
+                index.speakers[kept_ids[first]],
+                text
+            ))
+    return lines
+
+
+def align_stream(
+    segments: Iterable,
+    index: SpeakerIndex,
+    units: Tuple[list, list, list, str] = None
+) -> Iterator[TranscriptLine]:
+    """
+    Align faster-whisper segments against speaker turns as they arrive
+
+    Args:
+        segments: Iterable of faster-whisper segments
+        index: Index over the diarization turns
+        units: Optional (starts, ends, texts, joiner) lists extended with every
+               unit seen, so callers can keep the speaker-independent result
+
+    Yields:
+        Unstripped (start_time, end_time, speaker_label, text) records
+    """
+    for segment in segments:
+        starts, ends, texts, joiner = collect_units([segment], use_words=config.WORD_TIMESTAMPS)
+        if units is not None:
+            units[0].extend(starts)
+            units[1].extend(ends)
+            units[2].extend(texts)
+        yield from align(starts, ends, texts, index, joiner=joiner, strip=False)
+
+
+def merge_lines(lines: Iterable[TranscriptLine], joiner: str = "") -> List[TranscriptLine]:
+    """
+    Merge consecutive lines of the same speaker, e.g. streamed pieces
+
+    Args:
+        lines: Unstripped lines from align(..., strip=False)
+        joiner: The joiner the lines were aligned with
+
+    Returns:
+        List of stripped (start_time, end_time, speaker_label, text) lines
+    """
+    merged = []
+    pieces = []
+    for start, end, speaker, text in lines:
+        if merged and merged[-1][2] == speaker:
+            merged[-1][1] = end
+            pieces[-1].append(text)
+        else:
+            merged.append([start, end, speaker])
+            pieces.append([text])
+    return [
+        (start, end, speaker, joiner.join(texts).strip())
+        for (start, end, speaker), texts in zip(merged, pieces)
+    ]
+
+
+def format_transcript(lines: Iterable[TranscriptLine]) -> str:
+    """
+    Format aligned lines as "SPEAKER_XX: text" rows
+
+    Args:
+        lines: Iterable of (start_time, end_time, speaker_label, text)
+
+    Returns:
+        Newline-joined transcription
+    """
+    return "\n".join(f"{speaker}: {text}" for _, _, speaker, text in lines)
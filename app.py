@@ -4,14 +4,225 @@ Streamlit UI for speaker diarization, transcription, and summarization
 """
 import streamlit as st
 import os
-import tempfile
+import contextvars
+import itertools
+import time
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
-import torch
 
 from diarization import SpeakerDiarizer
 from transcription import AudioTranscriber
 from summarization import ConversationSummarizer
+from pipeline import TranscriptionPipeline, cuda_available
+from result_cache import get_result_cache
+from audio_loader import save_upload
+from jobs import Job, JobRunner, find_job, prune_jobs
+from refine import make_draft_transcriber
+from service import ServiceClient
+from ollama_client import get_ollama_pool
+from alignment import format_transcript, merge_lines
+from transcript import Transcript
 import config
+import metrics
+
+
+# Transcript download formats: (label, MIME type)
+TRANSCRIPT_DOWNLOADS = {
+    "txt": ("テキスト", "text/plain"),
+    "srt": ("SRT字幕", "application/x-subrip"),
+    "vtt": ("WebVTT字幕", "text/vtt"),
+    "jsonl": ("JSON Lines（単語タイムスタンプ付き）", "application/jsonl"),
+}
+
+
+@st.cache_resource(show_spinner=False)
+def preload_models(hf_token: str) -> bool:
+    """Start loading the models into the process-wide registry once per process"""
+    TranscriptionPipeline(SpeakerDiarizer(huggingface_token=hf_token), AudioTranscriber()).preload()
+    if config.OLLAMA_POOLED:
+        # Ollama loads the LLM while the audio is processed, and keeps it
+        # loaded between jobs for config.OLLAMA_KEEP_ALIVE
+        get_ollama_pool().preload()
+    return True
+
+
+def show_results(full_transcription: str, summary: str, transcript: Transcript = None):
+    """
+    Show the transcript and the summary side by side with download buttons
+    
+    With a Transcript, the transcript can also be downloaded as subtitles
+    (SRT/WebVTT) or JSON Lines with timestamps.
+    """
+    # Create two columns for results
+    col1, col2 = st.columns(2)
+    
+    with col1:
+        st.header("📄 話者ラベル付き全文")
+        st.text_area(
+            "文字起こし結果",
+            value=full_transcription,
+            height=400,
+            label_visibility="collapsed"
+        )
+        
+        # Download button for transcription
+        fmt = "txt"
+        if transcript is not None:
+            fmt = st.selectbox(
+                "形式",
+                list(TRANSCRIPT_DOWNLOADS),
+                format_func=lambda name: TRANSCRIPT_DOWNLOADS[name][0]
+            )
+        st.download_button(
+            label="📥 全文をダウンロード",
+            data=full_transcription if fmt == "txt" else "".join(transcript.iter_format(fmt, words=True)),
+            file_name=f"transcription.{fmt}",
+            mime=TRANSCRIPT_DOWNLOADS[fmt][1]
+        )
+    
+    with col2:
+        st.header("📊 要約結果")
+        st.text_area(
+            "要約",
+            value=summary,
+            height=400,
+            label_visibility="collapsed"
+        )
+        
+        # Download button for summary
+        st.download_button(
+            label="📥 要約をダウンロード",
+            data=summary,
+            file_name="summary.txt",
+            mime="text/plain"
+        )
+
+
+def wait_for_refinement(runner: JobRunner, refining, status_text, view):
+    """
+    Show the transcript while a background refine() replaces the draft
+
+    Args:
+        runner: Runner whose refine() runs in the background
+        refining: Future of that refine() call
+        status_text: Placeholder for the progress message
+        view: Placeholder for the transcript
+    """
+    shown = None
+    while True:
+        refiner = runner.refiner
+        if refiner is not None and refiner.progress != shown:
+            shown = refiner.progress
+            status_text.text(f"✨ 高精度モデルで清書中... {shown:.0%}（下書きを順に置き換えています）")
+            view.text(runner.transcript.to_text())
+        if refining.done():
+            break
+        time.sleep(0.5)
+    view.empty()
+    # Raises the refinement's error, if any
+    refining.result()
+
+
+def show_finished_job(job: Job, hf_token: str):
+    """
+    Show a finished job's results with a control to change the number of speakers
+    
+    The job id is kept in the session state, so moving the slider (which
+    reruns the script) shows the results again instead of losing them.
+    Re-clustering uses the job's kept segmentation scores and embeddings
+    and takes a moment, not another diarization.
+    """
+    runner = JobRunner(job, None)
+    if runner.can_recluster():
+        options = ["自動"] + list(range(1, 11))
+        choice = st.select_slider(
+            "👥 話者数",
+            options=options,
+            value=st.session_state.get("speaker_count", "自動"),
+            help="話者の人数を変えて話者ラベルを付け直します（話者分離はやり直しません）"
+        )
+        if choice != st.session_state.get("speaker_count", "自動"):
+            st.session_state["speaker_count"] = choice
+            diarizer = SpeakerDiarizer(huggingface_token=hf_token)
+            runner.pipeline = TranscriptionPipeline(diarizer, AudioTranscriber())
+            try:
+                with st.spinner("話者ラベルを付け直しています..."):
+                    runner.recluster(num_speakers=None if choice == "自動" else choice)
+            finally:
+                diarizer.cleanup()
+            if job.load("summary") is not None:
+                st.caption("要約は付け直す前の話者ラベルのままです。")
+    
+    transcript = job.transcript()
+    full_transcription = transcript.to_text() if transcript is not None else ""
+    show_results(full_transcription, job.load("summary") or "", transcript)
+
+
+def show_service_job(uploaded_file, use_map_reduce: bool, use_draft: bool):
+    """
+    Process the upload in the job service and follow its progress
+    
+    The job id is kept in the session state, so a rerun of the script picks
+    the running job up again instead of starting it over.
+    
+    Args:
+        uploaded_file: Streamlit UploadedFile
+        use_map_reduce: Use MapReduce summarization
+        use_draft: Show a draft transcript first and refine it
+    """
+    client = ServiceClient(config.JOB_SERVICE_URL)
+    
+    if st.button("🚀 処理開始", type="primary"):
+        with st.spinner("ジョブを送信しています..."):
+            submitted = client.submit(uploaded_file, uploaded_file.name, use_map_reduce=use_map_reduce,
+                                      draft=use_draft)
+        st.session_state["service_job_id"] = submitted["job_id"]
+    
+    job_id = st.session_state.get("service_job_id")
+    if job_id is None:
+        return
+    
+    # Clicking reruns the script, which stops the polling below
+    if st.button("⏹️ キャンセル"):
+        client.cancel(job_id)
+    
+    progress_bar = st.progress(0)
+    status_text = st.empty()
+    live_view = st.empty()
+    messages = {
+        "queued": "⏳ 順番待ち...",
+        "running": "⚙️ 処理中...",
+        "diarization": "🗣️ 話者を分離しています...",
+        "transcription": "📝 文字起こしを実行中...",
+        "transcribed": "📝 文字起こしが完了しました",
+        "refining": "✨ 高精度モデルで清書中...",
+        "summarization": "📊 要約を生成中...",
+    }
+    
+    def _render(status: dict):
+        progress_bar.progress(min(int(status["progress"] * 100), 100))
+        key = status["message"] if status["status"] == "running" and status["message"] else status["status"]
+        status_text.text(f"{messages.get(key, key)}（ジョブ {job_id}）")
+        if status.get("preview"):
+            live_view.text(status["preview"])
+    
+    status = client.wait(job_id, on_status=_render)
+    live_view.empty()
+    
+    if status["status"] != "done":
+        st.error(f"❌ ジョブは {status['status']} で終了しました: {status.get('error') or ''}")
+        return
+    
+    status_text.text("✅ 処理完了！")
+    result = client.result(job_id)
+    st.success("🎉 処理が完了しました！")
+    st.info(f"検出された話者セグメント数: {len(result['speaker_segments'] or [])}")
+    show_results(result["transcription"], result["summary"] or "")
+    
+    if result["metrics"]:
+        with st.expander("⏱️ 処理時間の内訳"):
+            st.caption(f"合計 {result['metrics']['wall_seconds']:.1f} 秒")
+            st.json(result["metrics"]["spans"], expanded=False)
 
 
 def main():
@@ -49,11 +260,21 @@ def main():
             help="pyannote.audioを使用するために必要です。環境変数HF_TOKENから自動読み込み可能。"
         )
         
-        # Device selection
+        # Device selection (checked without importing torch, which would
+        # delay the first render by several seconds)
+        gpu_available = cuda_available()
         use_cuda = st.checkbox(
             "CUDAを使用",
-            value=torch.cuda.is_available(),
-            disabled=not torch.cuda.is_available()
+            value=gpu_available,
+            disabled=not gpu_available
+        )
+        
+        # Two-pass transcription
+        use_draft = st.checkbox(
+            "下書きを先に表示（2パス）",
+            value=config.DRAFT_ENABLED,
+            help=f"軽量モデル（{config.DRAFT_MODEL}）の下書きをすぐに表示し、"
+                 f"{config.TRANSCRIPTION_MODEL}で順に清書します"
         )
         
         # MapReduce option
@@ -75,6 +296,10 @@ def main():
         ```
         """)
     
+    # Warm the models while the user picks a file
+    if config.PRELOAD_MODELS and hf_token:
+        preload_models(hf_token)
+    
     # File uploader
     st.header("📁 音声ファイルのアップロード")
     uploaded_file = st.file_uploader(
@@ -83,63 +308,127 @@ def main():
         help="対応フォーマット: MP3, WAV"
     )
     
+    cancelled_job_id = st.session_state.pop("cancelled_summary_job", None)
+    if cancelled_job_id is not None:
+        st.warning(
+            f"⏹️ 要約を中止しました（ジョブ {cancelled_job_id}）。"
+            "同じファイルでもう一度処理を開始すると、文字起こし済みの結果から要約をやり直します。"
+        )
+    
     if uploaded_file is not None:
         # Display file information
         st.success(f"✅ ファイル: {uploaded_file.name} ({uploaded_file.size / 1024:.2f} KB)")
         
+        if config.JOB_SERVICE_URL:
+            # Processing runs in the job service; this session only submits and polls
+            show_service_job(uploaded_file, use_map_reduce, use_draft)
+        
         # Process button
-        if st.button("🚀 処理開始", type="primary"):
+        elif st.button("🚀 処理開始", type="primary"):
             
             # Validate HuggingFace token
             if not hf_token:
                 st.error("❌ HuggingFace Tokenを入力してください")
                 return
             
-            # Save uploaded file to temporary directory
-            with tempfile.NamedTemporaryFile(delete=False, suffix=Path(uploaded_file.name).suffix) as tmp_file:
-                tmp_file.write(uploaded_file.getvalue())
-                audio_path = tmp_file.name
+            # Copy the upload to disk in chunks, hashing it on the way; the hash
+            # keys the result cache and finds earlier jobs of the same file
+            upload_path, upload_hash = save_upload(
+                uploaded_file, suffix=Path(uploaded_file.name).suffix, directory=config.JOBS_DIR
+            )
+            
+            # Every stage is checkpointed in the job's working directory; an
+            # upload whose earlier job failed or was interrupted resumes it
+            prune_jobs()
+            job = find_job(upload_hash)
+            if job is None:
+                job = Job.create(upload_path, source_name=uploaded_file.name, audio_hash=upload_hash, move=True)
+            else:
+                os.unlink(upload_path)
+                completed = ", ".join(job.manifest["completed"]) or "なし"
+                st.info(f"♻️ 中断したジョブ {job.job_id} を再開します（完了済み: {completed}）")
+            
+            # Progress tracking
+            progress_bar = st.progress(0)
+            status_text = st.empty()
+            
+            # Step 1 & 2: Speaker Diarization and Transcription
+            status_text.text("🗣️ 話者分離と文字起こしを実行中...")
+            progress_bar.progress(10)
+            
+            diarizer = None
+            transcriber = None
+            draft_transcriber = None
+            refining = None
+            cache = get_result_cache()
+            # Per-stage timings of this job, shown below the results
+            job_metrics = metrics.JobMetrics(job_id=job.job_id)
             
             try:
-                # Progress tracking
-                progress_bar = st.progress(0)
-                status_text = st.empty()
-                
-                # Step 1: Speaker Diarization
-                status_text.text("🗣️ 話者分離を実行中...")
-                progress_bar.progress(10)
-                
-                diarizer = None
-                transcriber = None
-                
-                try:
+                with metrics.track(job_metrics):
+                    # Runs both stages concurrently when the models fit in memory,
+                    # otherwise sequentially, freeing VRAM between them.
+                    # Audio is decoded once, and only for stages not in the cache
+                    diarizer = SpeakerDiarizer(huggingface_token=hf_token)
+                    transcriber = AudioTranscriber()
+                    # With two passes, the draft model's text is shown first
+                    draft_transcriber = make_draft_transcriber(use_draft)
+                    pipeline = TranscriptionPipeline(diarizer, transcriber, cache=cache)
+                    runner = JobRunner(job, pipeline, draft_transcriber)
+                    
+                    # Lines are shown as soon as Whisper produces them
+                    live_view = st.empty()
+                    records = []
+                    joiner = "" if config.WORD_TIMESTAMPS else " "
+                    last_render = 0.0
+                    
                     with st.spinner("話者を分離しています..."):
-                        diarizer = SpeakerDiarizer(huggingface_token=hf_token)
-                        speaker_segments = diarizer.diarize(audio_path)
+                        stream = runner.stream()
+                        first_record = next(stream, None)
                     
-                    st.info(f"検出された話者セグメント数: {len(speaker_segments)}")
+                    status_text.text("📝 文字起こしを実行中...")
                     progress_bar.progress(35)
                     
-                    # Cleanup diarizer to free VRAM for next step
+                    for record in itertools.chain([first_record] if first_record else [], stream):
+                        records.append(record)
+                        if runner.duration:
+                            done = min(record[1] / runner.duration, 1.0)
+                            progress_bar.progress(35 + int(35 * done))
+                            status_text.text(
+                                f"📝 文字起こしを実行中... {record[1]:.0f} / {runner.duration:.0f} 秒"
+                            )
+                        # Re-render at most a few times per second
+                        now = time.monotonic()
+                        if now - last_render > 0.5:
+                            last_render = now
+                            tail = merge_lines(records[-200:], joiner)[-20:]
+                            live_view.text(format_transcript(tail))
+                    
+                    live_view.empty()
+                    speaker_segments = runner.speaker_segments
+                    full_transcription = runner.transcription
+                    
+                    st.info(f"検出された話者セグメント数: {len(speaker_segments)}")
+                    progress_bar.progress(70)
+                    
+                    # Release the models; they stay warm in the registry unless
+                    # config.MODEL_RESIDENCY is "per_stage"
                     if diarizer is not None:
                         diarizer.cleanup()
                         del diarizer
                         diarizer = None
                     
-                    # Step 2: Transcription
-                    status_text.text("📝 文字起こしを実行中...")
-                    
-                    with st.spinner("音声を文字起こししています..."):
-                        transcriber = AudioTranscriber()
-                        full_transcription = transcriber.transcribe_with_speakers(
-                            audio_path,
-                            speaker_segments
-                        )
+                    if runner.refiner is not None:
+                        # The draft is refined in the background; the script thread
+                        # only polls it, since Streamlit elements cannot be updated
+                        # from other threads
+                        executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="voxlens-refine")
+                        refining = executor.submit(contextvars.copy_context().run, runner.refine)
+                        executor.shutdown(wait=False)
+                        if config.DRAFT_SUMMARY_WAITS:
+                            wait_for_refinement(runner, refining, status_text, live_view)
                     
-                    progress_bar.progress(70)
-                    
-                    # Cleanup transcriber to free VRAM for next step
-                    if transcriber is not None:
+                    if transcriber is not None and (refining is None or refining.done()):
                         transcriber.cleanup()
                         del transcriber
                         transcriber = None
@@ -147,81 +436,114 @@ def main():
                     # Step 3: Summarization
                     status_text.text("📊 要約を生成中...")
                     
-                    with st.spinner("LLMで要約を生成しています..."):
-                        summarizer = ConversationSummarizer()
-                        summary = summarizer.summarize(
-                            full_transcription,
-                            use_map_reduce=use_map_reduce
-                        )
-                    
-                    progress_bar.progress(100)
-                    status_text.text("✅ 処理完了！")
-                    
-                    # Display results
-                    st.success("🎉 処理が完了しました！")
+                    # The summary is shown as Ollama generates it. Clicking the
+                    # button reruns the script, which closes the stream and so
+                    # the request; the transcript stays checkpointed in the job
+                    def _cancel_summary():
+                        st.session_state["cancelled_summary_job"] = job.job_id
                     
-                    # Create two columns for results
-                    col1, col2 = st.columns(2)
+                    st.button("⏹️ 要約を中止", on_click=_cancel_summary)
+                    summary_view = st.empty()
+                    summarizer = ConversationSummarizer(cache=cache)
+                    stream = runner.summarize_stream(summarizer, use_map_reduce=use_map_reduce)
+                    summary = ""
+                    started = time.monotonic()
+                    last_render = 0.0
+                    try:
+                        for piece in stream:
+                            summary += piece
+                            now = time.monotonic()
+                            if now - last_render < 0.1:
+                                continue
+                            last_render = now
+                            if summary:
+                                summary_view.text(summary)
+                            else:
+                                # MapReduce: partial summaries are still being generated
+                                status_text.text(f"📊 部分要約を作成中... {now - started:.0f} 秒")
+                    finally:
+                        stream.close()
+                    summary = summary.strip()
+                    summary_view.empty()
                     
-                    with col1:
-                        st.header("📄 話者ラベル付き全文")
-                        st.text_area(
-                            "文字起こし結果",
-                            value=full_transcription,
-                            height=400,
-                            label_visibility="collapsed"
-                        )
-                        
-                        # Download button for transcription
-                        st.download_button(
-                            label="📥 全文をダウンロード",
-                            data=full_transcription,
-                            file_name="transcription.txt",
-                            mime="text/plain"
-                        )
+                    if refining is not None:
+                        # The summary was written from the draft; the transcript is still refined
+                        wait_for_refinement(runner, refining, status_text, live_view)
                     
-                    with col2:
-                        st.header("📊 要約結果")
-                        st.text_area(
-                            "要約",
-                            value=summary,
-                            height=400,
-                            label_visibility="collapsed"
-                        )
-                        
-                        # Download button for summary
-                        st.download_button(
-                            label="📥 要約をダウンロード",
-                            data=summary,
-                            file_name="summary.txt",
-                            mime="text/plain"
-                        )
+                    runner.finish()
                 
-                except Exception as e:
-                    st.error(f"❌ エラーが発生しました: {str(e)}")
-                    st.exception(e)
+                progress_bar.progress(100)
+                status_text.text("✅ 処理完了！")
                 
-                finally:
-                    # Cleanup resources
-                    if diarizer is not None:
-                        try:
-                            diarizer.cleanup()
-                        except Exception:
-                            pass
-                    if transcriber is not None:
-                        try:
-                            transcriber.cleanup()
-                        except Exception:
-                            pass
+                metrics_path = job_metrics.save() if config.METRICS_ENABLED else None
+                
+                # Display results
+                st.success("🎉 処理が完了しました！")
+                if cache is not None:
+                    stats = cache.stats()
+                    st.caption(
+                        f"キャッシュ: ヒット {sum(stats['hits'].values())} / "
+                        f"ミス {sum(stats['misses'].values())} "
+                        f"({stats['size_mb']:.1f} MB)"
+                    )
+                
+                st.session_state["finished_job_id"] = job.job_id
+                st.session_state.pop("speaker_count", None)
+                show_finished_job(job, hf_token)
+                
+                with st.expander("⏱️ 処理時間の内訳"):
+                    st.dataframe(job_metrics.rows(), use_container_width=True)
+                    st.caption(
+                        f"合計 {job_metrics.wall_seconds:.1f} 秒"
+                        + (f" / 詳細: {metrics_path}" if metrics_path else "")
+                    )
+                    for stage, report in job_metrics.profiles.items():
+                        st.markdown(f"**cProfile: {stage}**")
+                        st.code(report)
+            
+            except Exception as e:
+                st.error(f"❌ エラーが発生しました: {str(e)}")
+                st.info(
+                    f"完了した段階はジョブ {job.job_id} に保存されています。"
+                    "同じファイルでもう一度処理を開始すると続きから再開します。"
+                )
+                st.exception(e)
             
             finally:
-                # Clean up temporary file
-                try:
-                    if os.path.exists(audio_path):
-                        os.unlink(audio_path)
-                except OSError as e:
-                    # Log but don't fail if cleanup fails
-                    st.warning(f"一時ファイルの削除に失敗しました: {e}")
+                if refining is not None and not refining.done():
+                    # The summary failed or was cancelled while the draft is being
+                    # refined with transcriber; stop the refinement before releasing it
+                    runner.cancel_refine()
+                    try:
+                        refining.result()
+                    except Exception:
+                        pass
+                # Cleanup resources
+                if diarizer is not None:
+                    try:
+                        diarizer.cleanup()
+                    except Exception:
+                        pass
+                if transcriber is not None:
+                    try:
+                        transcriber.cleanup()
+                    except Exception:
+                        pass
+                if draft_transcriber is not None:
+                    try:
+                        draft_transcriber.cleanup()
+                    except Exception:
+                        pass
+        
+        # Results of the last run in this session, e.g. after changing the
+        # number of speakers
+        elif st.session_state.get("finished_job_id"):
+            try:
+                job = Job.open(st.session_state["finished_job_id"])
+            except FileNotFoundError:
+                st.session_state.pop("finished_job_id")
+            else:
+                show_finished_job(job, hf_token)
     
     # Footer
     st.divider()
@@ -0,0 +1,245 @@
+"""
+Audio loading module that decodes an upload once for all processing stages
+"""
+from typing import BinaryIO, Optional, Tuple, Union
+import hashlib
+import os
+import struct
+import tempfile
+import numpy as np
+import config
+import metrics
+
+
+class AudioBuffer:
+    """Decoded 16 kHz mono float32 PCM shared by diarization and transcription
+
+    The samples are decoded once and handed out as views, so pyannote and
+    faster-whisper read the same memory instead of each decoding the file.
+    """
+
+    def __init__(self, samples: np.ndarray, sample_rate: int = None, path: Optional[str] = None):
+        """
+        Wrap decoded samples
+
+        Args:
+            samples: Mono PCM samples
+            sample_rate: Sample rate of the samples
+            path: Path of the file the samples were decoded from, if any
+        """
+        self.samples = np.ascontiguousarray(samples, dtype=np.float32)
+        self.sample_rate = sample_rate or config.SAMPLE_RATE
+        self.path = path
+
+    @classmethod
+    def from_file(cls, audio_path: str) -> "AudioBuffer":
+        """
+        Decode and resample an audio file
+
+        WAV files already at the target sample rate are read through a memory
+        map instead of the decoder, see from_wav().
+
+        Args:
+            audio_path: Path to audio file
+
+        Returns:
+            AudioBuffer holding the decoded samples
+        """
+        with metrics.span("audio.decode"):
+            buffer = cls.from_wav(audio_path) if audio_path.lower().endswith(".wav") else None
+            if buffer is None:
+                from faster_whisper import decode_audio
+
+                samples = decode_audio(audio_path, sampling_rate=config.SAMPLE_RATE)
+                buffer = cls(samples, config.SAMPLE_RATE, path=audio_path)
+            metrics.record(audio_seconds=buffer.duration, memory_mapped=buffer.memory_mapped)
+        return buffer
+
+    @classmethod
+    def from_wav(cls, audio_path: str, chunk_frames: int = 1 << 20) -> Optional["AudioBuffer"]:
+        """
+        Read a PCM WAV file through a memory map
+
+        Mono float32 files at config.SAMPLE_RATE are used in place without a
+        copy. 16-bit files and multi-channel files are converted into one
+        float32 array chunk by chunk, so nothing larger than the result is
+        ever allocated.
+
+        Args:
+            audio_path: Path to a WAV file
+            chunk_frames: Frames converted per step
+
+        Returns:
+            AudioBuffer, or None if the file needs resampling or has an
+            unsupported format (the caller then falls back to the decoder)
+        """
+        layout = read_wav_layout(audio_path)
+        if layout is None or layout["sample_rate"] != config.SAMPLE_RATE:
+            return None
+        dtype = {(1, 16): np.int16, (3, 32): np.float32}.get((layout["format"], layout["bits"]))
+        if dtype is None:
+            return None
+
+        channels = layout["channels"]
+        frames = layout["data_size"] // (np.dtype(dtype).itemsize * channels)
+        if frames == 0:
+            return cls(np.zeros(0, dtype=np.float32), config.SAMPLE_RATE, path=audio_path)
+        # Copy-on-write: writable for torch.from_numpy, yet pages stay shared with the file
+        mapped = np.memmap(audio_path, dtype=dtype, mode="c", offset=layout["data_offset"],
+                           shape=(frames, channels))
+
+        if dtype == np.float32 and channels == 1:
+            return cls(mapped[:, 0], config.SAMPLE_RATE, path=audio_path)
+
+        samples = np.empty(frames, dtype=np.float32)
+        scale = 1.0 / 32768.0 if dtype == np.int16 else 1.0
+        for first in range(0, frames, chunk_frames):
+            chunk = mapped[first:first + chunk_frames]
+            samples[first:first + len(chunk)] = chunk.mean(axis=1, dtype=np.float32) * scale
+        return cls(samples, config.SAMPLE_RATE, path=audio_path)
+
+    @property
+    def memory_mapped(self) -> bool:
+        """Whether the samples are read straight from the file's pages"""
+        base = self.samples
+        while base is not None:
+            if isinstance(base, np.memmap):
+                return True
+            base = getattr(base, "base", None)
+        return False
+
+    @property
+    def duration(self) -> float:
+        """Duration in seconds"""
+        return len(self.samples) / self.sample_rate
+
+    def slice(self, start: float, end: float = None) -> "AudioBuffer":
+        """
+        Return a time range of the audio as a view on the same samples
+
+        Args:
+            start: Start time in seconds
+            end: End time in seconds (defaults to the end of the audio)
+
+        Returns:
+            AudioBuffer without a path, since it no longer matches the file
+        """
+        first = max(0, int(round(start * self.sample_rate)))
+        last = len(self.samples) if end is None else int(round(end * self.sample_rate))
+        return AudioBuffer(self.samples[first:last], self.sample_rate)
+
+    def as_pyannote(self) -> dict:
+        """Return a pyannote input dict sharing memory with the samples"""
+        import torch
+
+        return {
+            "waveform": torch.from_numpy(self.samples).unsqueeze(0),
+            "sample_rate": self.sample_rate,
+        }
+
+    def as_whisper(self) -> np.ndarray:
+        """Return the samples as the ndarray faster-whisper expects"""
+        return self.samples
+
+
+AudioInput = Union[str, AudioBuffer]
+
+# WAVE_FORMAT_EXTENSIBLE stores the real format code in its sub-format GUID
+_WAVE_FORMAT_EXTENSIBLE = 0xFFFE
+
+
+def read_wav_layout(path: str) -> Optional[dict]:
+    """
+    Locate the sample data of a RIFF/WAVE file
+
+    Args:
+        path: Path to the file
+
+    Returns:
+        Dict with format (1 = PCM, 3 = float), channels, sample_rate, bits,
+        data_offset and data_size, or None if the file is not a readable WAV
+    """
+    file_size = os.path.getsize(path)
+    layout = {}
+    with open(path, "rb") as f:
+        header = f.read(12)
+        if len(header) < 12 or header[:4] != b"RIFF" or header[8:12] != b"WAVE":
+            return None
+        while True:
+            chunk = f.read(8)
+            if len(chunk) < 8:
+                return None
+            chunk_id, size = chunk[:4], struct.unpack("<I", chunk[4:])[0]
+            if chunk_id == b"fmt ":
+                fmt = f.read(size)
+                if len(fmt) < 16:
+                    return None
+                audio_format, channels, sample_rate, _, _, bits = struct.unpack("<HHIIHH", fmt[:16])
+                if audio_format == _WAVE_FORMAT_EXTENSIBLE and len(fmt) >= 26:
+                    audio_format = struct.unpack("<H", fmt[24:26])[0]
+                layout.update(format=audio_format, channels=channels, sample_rate=sample_rate, bits=bits)
+                if size % 2:
+                    f.seek(1, os.SEEK_CUR)
+            elif chunk_id == b"data":
+                if "format" not in layout or layout["channels"] < 1:
+                    return None
+                offset = f.tell()
+                # Streamed WAVs may leave the size at 0 or 0xFFFFFFFF
+                layout.update(data_offset=offset, data_size=min(size, file_size - offset) or file_size - offset)
+                return layout
+            else:
+                f.seek(size + size % 2, os.SEEK_CUR)
+
+
+def save_upload(
+    stream: BinaryIO,
+    suffix: str = "",
+    chunk_size: int = 1 << 20,
+    directory: str = None
+) -> Tuple[str, str]:
+    """
+    Copy an uploaded file to a temporary file in fixed-size chunks
+
+    The content is hashed while it is written, so no second pass over the
+    file is needed for the result cache, and no full copy of the upload is
+    made in memory.
+
+    Args:
+        stream: Readable binary file object, e.g. a Streamlit UploadedFile
+        suffix: Suffix of the temporary file (decoders use it to pick a format)
+        chunk_size: Bytes copied per step
+        directory: Directory of the temporary file (default: the system temp dir)
+
+    Returns:
+        Tuple of (path of the temporary file, hex SHA-256 of the content)
+    """
+    digest = hashlib.sha256()
+    if hasattr(stream, "seek"):
+        stream.seek(0)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    fd, path = tempfile.mkstemp(suffix=suffix, dir=directory)
+    try:
+        with os.fdopen(fd, "wb") as f:
+            for chunk in iter(lambda: stream.read(chunk_size), b""):
+                digest.update(chunk)
+                f.write(chunk)
+    except BaseException:
+        os.unlink(path)
+        raise
+    return path, digest.hexdigest()
+
+
+def load_audio(audio: AudioInput) -> AudioBuffer:
+    """
+    Get a decoded buffer for an audio input
+
+    Args:
+        audio: Path to audio file or an already decoded AudioBuffer
+
+    Returns:
+        AudioBuffer, decoded only if a path was given
+    """
+    if isinstance(audio, AudioBuffer):
+        return audio
+    return AudioBuffer.from_file(audio)
@@ -0,0 +1,343 @@
+"""
+Host calibration: pick the most accurate Whisper settings that keep up with a
+real-time-factor target, and save them as a host profile loaded at startup
+"""
+from typing import Any, Callable, Dict, List, Optional, Sequence
+import gc
+import json
+import os
+import platform
+import tempfile
+import threading
+import time
+import config
+from audio_loader import AudioBuffer
+from pipeline import cuda_available
+
+
+# Config settings a host profile may override
+PROFILE_SETTINGS = (
+    "DEVICE", "TRANSCRIPTION_MODEL", "COMPUTE_TYPE", "CPU_COMPUTE_TYPE", "BEAM_SIZE",
+    "WHISPER_CPU_THREADS", "WHISPER_NUM_WORKERS", "DIARIZATION_CPU_THREADS",
+)
+
+_applied = False
+_apply_lock = threading.Lock()
+
+
+def host_fingerprint() -> Dict[str, Any]:
+    """What a profile was measured on; a profile only applies to the same host"""
+    return {
+        "hostname": platform.node(),
+        "machine": platform.machine(),
+        "cpu_count": os.cpu_count(),
+        "cuda": cuda_available(),
+    }
+
+
+def load_host_profile(path: str = None) -> Optional[Dict[str, Any]]:
+    """
+    Read the host profile written by calibrate
+
+    Args:
+        path: Profile file (default: config.HOST_PROFILE_PATH)
+
+    Returns:
+        The profile, or None if there is none or it was measured on other hardware
+    """
+    path = path or config.HOST_PROFILE_PATH
+    try:
+        with open(path, encoding="utf-8") as f:
+            profile = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if profile.get("host") != host_fingerprint():
+        return None
+    return profile
+
+
+def apply_host_profile(path: str = None, force: bool = False) -> Optional[Dict[str, Any]]:
+    """
+    Override config with the host profile's settings, once per process
+
+    Called by AudioTranscriber and SpeakerDiarizer when they are created, so
+    every entry point picks the profile up. Does nothing when
+    config.HOST_PROFILE_ENABLED is False.
+
+    Args:
+        path: Profile file (default: config.HOST_PROFILE_PATH)
+        force: Apply again even if a profile was already applied
+
+    Returns:
+        The applied profile, or None
+    """
+    global _applied
+    with _apply_lock:
+        if (_applied and not force) or not config.HOST_PROFILE_ENABLED:
+            return None
+        _applied = True
+        profile = load_host_profile(path)
+        if profile is None:
+            return None
+        for name, value in profile["settings"].items():
+            if name in PROFILE_SETTINGS:
+                setattr(config, name, value)
+        return profile
+
+
+def save_host_profile(profile: Dict[str, Any], path: str = None) -> str:
+    """Write a profile atomically and return its path"""
+    path = path or config.HOST_PROFILE_PATH
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(path)), suffix=".tmp")
+    try:
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            json.dump(profile, f, ensure_ascii=False, indent=2)
+        os.replace(tmp_path, path)
+    except OSError:
+        if os.path.exists(tmp_path):
+            os.unlink(tmp_path)
+        raise
+    return path
+
+
+def candidate_threads(cores: int = None) -> List[int]:
+    """Thread counts worth probing: all, half and a quarter of the cores"""
+    cores = cores or os.cpu_count() or 1
+    return sorted({cores, max(1, cores // 2), max(1, cores // 4)}, reverse=True)
+
+
+class Calibrator:
+    """Search Whisper settings with short probe decodes
+
+    Models are tried from the first (most accurate) in the list. A model is
+    skipped when even its cheapest setting misses the target; otherwise its
+    settings are tried from the most accurate down - larger beams first,
+    then more precise compute types - and the first that meets the target
+    wins. On CPU, the thread count is tuned once beforehand with the
+    cheapest setting.
+    """
+
+    def __init__(
+        self,
+        audio: AudioBuffer,
+        target_rtf: float = None,
+        models: Sequence[str] = None,
+        compute_types: Sequence[str] = None,
+        beam_sizes: Sequence[int] = None,
+        device: str = None,
+        probe: Callable[[Dict[str, Any], AudioBuffer], float] = None,
+        diarization_probe: Callable[[int, AudioBuffer], float] = None
+    ):
+        """
+        Initialize the calibrator
+
+        Args:
+            audio: Probe recording; speech representative of real jobs
+            target_rtf: Processing seconds allowed per audio second
+                        (default: config.AUTOTUNE_TARGET_RTF)
+            models: Whisper models, most accurate first (default: config.AUTOTUNE_MODELS)
+            compute_types: Compute types, most precise first
+                           (default: config.AUTOTUNE_COMPUTE_TYPES for the device)
+            beam_sizes: Beam sizes, largest first (default: config.AUTOTUNE_BEAM_SIZES)
+            device: "cuda" or "cpu" (default: cuda if available)
+            probe: Function decoding the audio with a settings dict and
+                   returning the seconds it took (default: a faster-whisper decode)
+            diarization_probe: Function diarizing the audio with a torch thread
+                               count and returning the seconds it took; None
+                               leaves the diarization threads alone
+        """
+        self.audio = audio
+        self.target_rtf = target_rtf or config.AUTOTUNE_TARGET_RTF
+        self.device = device or ("cuda" if cuda_available() else "cpu")
+        self.models = list(models or config.AUTOTUNE_MODELS)
+        self.compute_types = list(compute_types or config.AUTOTUNE_COMPUTE_TYPES[self.device])
+        self.beam_sizes = sorted(beam_sizes or config.AUTOTUNE_BEAM_SIZES, reverse=True)
+        self.probe = probe or self._probe_decode
+        self.diarization_probe = diarization_probe
+        self.probes: List[Dict[str, Any]] = []
+        self._loaded = None
+
+    def measure(self, settings: Dict[str, Any]) -> float:
+        """Real-time factor of one probe decode (measured once per setting)"""
+        for result in self.probes:
+            if result["settings"] == settings:
+                return result["rtf"]
+        seconds = self.probe(settings, self.audio)
+        rtf = seconds / self.audio.duration
+        self.probes.append({"settings": dict(settings), "seconds": seconds, "rtf": rtf})
+        return rtf
+
+    def _settings(self, model: str, compute_type: str, beam_size: int, threads: int = 0) -> Dict[str, Any]:
+        return {"model": model, "device": self.device, "compute_type": compute_type,
+                "beam_size": beam_size, "cpu_threads": threads}
+
+    def tune_threads(self) -> int:
+        """Fastest CTranslate2 thread count for the cheapest setting of the smallest model"""
+        timings = {
+            threads: self.measure(self._settings(self.models[-1], self.compute_types[-1], self.beam_sizes[-1],
+                                                 threads))
+            for threads in candidate_threads()
+        }
+        return min(timings, key=timings.get)
+
+    def tune_diarization_threads(self) -> int:
+        """Fastest torch thread count for diarization"""
+        timings = {}
+        for threads in candidate_threads():
+            timings[threads] = self.diarization_probe(threads, self.audio)
+        return min(timings, key=timings.get)
+
+    def run(self) -> Dict[str, Any]:
+        """
+        Run the search
+
+        Returns:
+            Host profile: the host, the target, whether it was met, the
+            chosen config settings and every probe
+        """
+        threads, workers = 0, 1
+        if self.device == "cpu":
+            threads = self.tune_threads()
+            # Concurrent transcriptions (batch, service) share the cores
+            workers = max(1, (os.cpu_count() or 1) // threads)
+
+        chosen = None
+        for model in self.models:
+            cheapest = self._settings(model, self.compute_types[-1], self.beam_sizes[-1], threads)
+            if self.measure(cheapest) > self.target_rtf:
+                continue
+            for beam_size in self.beam_sizes:
+                for compute_type in self.compute_types:
+                    settings = self._settings(model, compute_type, beam_size, threads)
+                    if self.measure(settings) <= self.target_rtf:
+                        chosen = settings
+                        break
+                if chosen is not None:
+                    break
+            break
+        self._release()
+
+        met = chosen is not None
+        if chosen is None:
+            # Nothing keeps up; settle for the fastest setting measured
+            chosen = min(self.probes, key=lambda result: result["rtf"])["settings"]
+
+        settings = {
+            "DEVICE": chosen["device"],
+            "TRANSCRIPTION_MODEL": chosen["model"],
+            "COMPUTE_TYPE" if chosen["device"] == "cuda" else "CPU_COMPUTE_TYPE": chosen["compute_type"],
+            "BEAM_SIZE": chosen["beam_size"],
+            "WHISPER_CPU_THREADS": chosen["cpu_threads"],
+            "WHISPER_NUM_WORKERS": workers,
+        }
+        if self.device == "cpu" and self.diarization_probe is not None:
+            settings["DIARIZATION_CPU_THREADS"] = self.tune_diarization_threads()
+
+        return {
+            "host": host_fingerprint(),
+            "created": time.time(),
+            "target_rtf": self.target_rtf,
+            "probe_seconds": self.audio.duration,
+            "met": met,
+            "settings": settings,
+            "probes": self.probes,
+        }
+
+    def _probe_decode(self, settings: Dict[str, Any], audio: AudioBuffer) -> float:
+        """Decode with faster-whisper, reusing the loaded model across beam sizes"""
+        from transcription import WhisperModel
+
+        key = (settings["model"], settings["device"], settings["compute_type"], settings["cpu_threads"])
+        if self._loaded is None or self._loaded[0] != key:
+            self._release()
+            model = WhisperModel(
+                settings["model"],
+                device=settings["device"],
+                compute_type=settings["compute_type"],
+                cpu_threads=settings["cpu_threads"]
+            )
+            self._loaded = (key, model)
+        model = self._loaded[1]
+
+        started = time.perf_counter()
+        segments, _ = model.transcribe(
+            audio.as_whisper(),
+            language=config.TRANSCRIPTION_LANGUAGE,
+            beam_size=settings["beam_size"],
+            vad_filter=config.VAD_FILTER,
+            vad_parameters=dict(min_silence_duration_ms=500),
+            word_timestamps=config.WORD_TIMESTAMPS
+        )
+        for _ in segments:
+            pass
+        return time.perf_counter() - started
+
+    def _release(self):
+        """Drop the probe model before the next one is loaded"""
+        self._loaded = None
+        gc.collect()
+
+
+def diarization_probe(huggingface_token: str) -> Callable[[int, AudioBuffer], float]:
+    """Probe timing pyannote diarization with a given torch thread count"""
+    from diarization import SpeakerDiarizer
+
+    def _probe(threads: int, audio: AudioBuffer) -> float:
+        diarizer = SpeakerDiarizer(huggingface_token=huggingface_token, num_threads=threads)
+        diarizer.load_model()
+        started = time.perf_counter()
+        diarizer.diarize(audio)
+        seconds = time.perf_counter() - started
+        diarizer.cleanup()
+        return seconds
+
+    return _probe
+
+
+def add_arguments(parser):
+    """Register the calibrate subcommand's arguments"""
+    parser.add_argument("audio", help="Probe recording with typical speech")
+    parser.add_argument("--target-rtf", type=float, default=config.AUTOTUNE_TARGET_RTF,
+                        help="Processing seconds allowed per audio second (default: %(default)s)")
+    parser.add_argument("--seconds", type=float, default=config.AUTOTUNE_PROBE_SECONDS,
+                        help="Length of the probe taken from the recording (default: %(default)s)")
+    parser.add_argument("--models", nargs="+", default=None,
+                        help="Whisper models to consider, most accurate first (default: config.AUTOTUNE_MODELS)")
+    parser.add_argument("--device", choices=["cuda", "cpu"], default=None,
+                        help="Device to calibrate (default: cuda if available)")
+    parser.add_argument("--hf-token", default=os.getenv("HF_TOKEN"),
+                        help="HuggingFace token; also tunes diarization threads on CPU (default: HF_TOKEN)")
+    parser.add_argument("-o", "--output", default=None,
+                        help="Profile file (default: config.HOST_PROFILE_PATH)")
+
+
+def main(args) -> int:
+    """Calibrate this host and save the profile"""
+    from audio_loader import load_audio
+
+    # Measure from the config defaults, not from an earlier profile
+    config.HOST_PROFILE_ENABLED = False
+    audio = load_audio(args.audio)
+    if audio.duration > args.seconds:
+        audio = audio.slice(0.0, args.seconds)
+    calibrator = Calibrator(
+        audio,
+        target_rtf=args.target_rtf,
+        models=args.models,
+        device=args.device,
+        diarization_probe=diarization_probe(args.hf_token) if args.hf_token else None
+    )
+    profile = calibrator.run()
+
+    for result in profile["probes"]:
+        settings = result["settings"]
+        print(f"{settings['model']:<16} {settings['compute_type']:<13} beam={settings['beam_size']} "
+              f"threads={settings['cpu_threads']:<3} RTF {result['rtf']:.3f}")
+    path = save_host_profile(profile, args.output)
+    status = "meets" if profile["met"] else "MISSES"
+    print(f"Chosen settings ({status} RTF target {profile['target_rtf']}):")
+    for name, value in profile["settings"].items():
+        print(f"  {name} = {value!r}")
+    print(f"Saved: {path}")
+    return 0 if profile["met"] else 1
@@ -0,0 +1,405 @@
+"""
+Headless batch processing of a directory of recordings
+"""
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from pathlib import Path
+from typing import Dict, List, Optional
+import json
+import os
+import tempfile
+import threading
+import time
+import config
+import metrics
+from audio_loader import load_audio
+from result_cache import get_result_cache, hash_file
+
+
+def find_audio_files(directory: str, recursive: bool = False) -> List[Path]:
+    """
+    List supported audio files in a directory
+
+    Args:
+        directory: Directory to scan
+        recursive: Also scan subdirectories
+
+    Returns:
+        Sorted list of paths
+    """
+    pattern = "**/*" if recursive else "*"
+    return sorted(
+        path for path in Path(directory).glob(pattern)
+        if path.is_file() and path.suffix.lower().lstrip(".") in config.SUPPORTED_FORMATS
+    )
+
+
+def output_paths(audio_path: Path, output_dir: Path, input_dir: Optional[Path] = None) -> Dict[str, Path]:
+    """
+    Per-file output locations; the metadata file is written last and marks completion
+
+    Outputs keep the full file name, so "a.mp3" and "a.wav" do not collide,
+    and mirror the file's subdirectory below input_dir, so "x/a.mp3" and
+    "y/a.mp3" do not either.
+
+    Args:
+        audio_path: Path to audio file
+        output_dir: Directory receiving per-file outputs
+        input_dir: Directory the file was found in (None = by file name only)
+    """
+    relative = audio_path.relative_to(input_dir) if input_dir is not None else Path(audio_path.name)
+    base = output_dir / relative
+    return {
+        "transcript": base.with_name(f"{base.name}.transcript.txt"),
+        "summary": base.with_name(f"{base.name}.summary.txt"),
+        "meta": base.with_name(f"{base.name}.json"),
+        "metrics": base.with_name(f"{base.name}.metrics.json"),
+    }
+
+
+def write_text(path: Path, text: str):
+    """Write a file atomically so interrupted runs never leave partial outputs"""
+    path.parent.mkdir(parents=True, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=path.parent, suffix=".tmp")
+    try:
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            f.write(text)
+        os.replace(tmp_path, path)
+    except OSError:
+        if os.path.exists(tmp_path):
+            os.unlink(tmp_path)
+        raise
+
+
+class BatchProcessor:
+    """Process many recordings with warm models and a pool of workers
+
+    Models are shared through the process-wide model registry, so each is
+    loaded once for the whole batch. Workers are threads: the heavy work
+    runs in native code, and the Ollama calls are I/O bound.
+    """
+
+    def __init__(
+        self,
+        output_dir: str,
+        workers: int = 1,
+        huggingface_token: str = None,
+        summarize: bool = True,
+        use_map_reduce: bool = False,
+        force: bool = False,
+        shard: bool = None,
+        profile_stage: str = None,
+        input_dir: str = None
+    ):
+        """
+        Initialize the processor
+
+        Args:
+            output_dir: Directory receiving per-file outputs
+            workers: Number of files processed concurrently
+            huggingface_token: HuggingFace access token for pyannote
+            summarize: Also generate summaries
+            use_map_reduce: Use MapReduce summarization for every file
+            force: Reprocess files whose outputs already exist
+            shard: Split recordings longer than config.SHARD_MIN_DURATION into
+                   windows processed by a process pool (default: config.SHARD_ENABLED)
+            profile_stage: Metrics span to run under cProfile (default: config.PROFILE_STAGE)
+            input_dir: Directory the files were found in; outputs mirror their
+                       subdirectories below it (None = by file name only)
+        """
+        self.output_dir = Path(output_dir)
+        self.input_dir = Path(input_dir) if input_dir is not None else None
+        self.workers = max(1, workers)
+        self.huggingface_token = huggingface_token
+        self.summarize = summarize
+        self.use_map_reduce = use_map_reduce
+        self.force = force
+        self.shard = config.SHARD_ENABLED if shard is None else shard
+        self.profile_stage = profile_stage
+        self._sharded = None
+        self._sharded_lock = threading.Lock()
+        self.cache = get_result_cache()
+        self._print_lock = threading.Lock()
+
+    def is_done(self, audio_path: Path) -> bool:
+        """Check whether a file already has complete outputs"""
+        return output_paths(audio_path, self.output_dir, self.input_dir)["meta"].exists()
+
+    def _pipeline(self):
+        """TranscriptionPipeline over warm models from the registry"""
+        from diarization import SpeakerDiarizer
+        from transcription import AudioTranscriber
+        from pipeline import TranscriptionPipeline
+
+        return TranscriptionPipeline(
+            SpeakerDiarizer(huggingface_token=self.huggingface_token),
+            AudioTranscriber(num_workers=self.workers),
+            cache=self.cache
+        )
+
+    def process_file(self, audio_path: Path) -> Dict:
+        """
+        Diarize, transcribe and summarize one file and write its outputs
+
+        Args:
+            audio_path: Path to audio file
+
+        Returns:
+            Metadata dict with timings
+        """
+        job = self._new_job(audio_path)
+        with metrics.track(job["metrics"]):
+            return self._process(job)
+
+    def _process(self, job: Dict) -> Dict:
+        self._load(job)
+        audio = job.pop("audio")
+        job["audio_seconds"] = audio.duration
+        if self._use_shards(audio):
+            job["speaker_segments"], job["transcription"] = self._sharded_pipeline().run(audio, job["audio_hash"])
+            write_text(job["paths"]["transcript"], job["transcription"])
+            return self._summarize(job)
+
+        pipeline = self._pipeline()
+        try:
+            job["speaker_segments"], job["transcription"] = pipeline.run(audio, job["audio_hash"])
+        finally:
+            pipeline.diarizer.cleanup()
+            pipeline.transcriber.cleanup()
+        write_text(job["paths"]["transcript"], job["transcription"])
+        return self._summarize(job)
+
+    def _use_shards(self, audio) -> bool:
+        """Whether a recording goes to the shard workers instead of the warm models"""
+        return self.shard and audio.duration >= config.SHARD_MIN_DURATION
+
+    def _sharded_pipeline(self):
+        """ShardedPipeline whose worker pool is shared by all files of the run"""
+        from sharding import ShardedPipeline
+
+        with self._sharded_lock:
+            if self._sharded is None:
+                self._sharded = ShardedPipeline(huggingface_token=self.huggingface_token, cache=self.cache)
+            return self._sharded
+
+    def _new_job(self, audio_path: Path) -> Dict:
+        """State of one file as it moves through the stages"""
+        return {
+            "path": audio_path,
+            "paths": output_paths(audio_path, self.output_dir, self.input_dir),
+            "started": time.perf_counter(),
+            "metrics": metrics.JobMetrics(job_id=audio_path.stem, profile_stage=self.profile_stage),
+        }
+
+    def _load(self, job: Dict):
+        """Hash and decode the job's file"""
+        path = str(job["path"])
+        with metrics.span("audio.hash"):
+            job["audio_hash"] = hash_file(path) if self.cache is not None else None
+        job["audio"] = load_audio(path)
+
+    def _diarize(self, audio_path: Path) -> Dict:
+        """Pipelined stage 1: decode and diarize
+
+        Long recordings are diarized and transcribed by the shard workers
+        here in one go, see _use_shards.
+        """
+        job = self._new_job(audio_path)
+        with metrics.track(job["metrics"]):
+            self._load(job)
+            if self._use_shards(job["audio"]):
+                audio = job.pop("audio")
+                job["audio_seconds"] = audio.duration
+                job["speaker_segments"], job["transcription"] = self._sharded_pipeline().run(audio, job["audio_hash"])
+                return job
+            pipeline = self._pipeline()
+            try:
+                job["speaker_segments"] = pipeline.diarize(job["audio"], job["audio_hash"])
+            finally:
+                pipeline.diarizer.cleanup()
+        return job
+
+    def _transcribe(self, job: Dict) -> Dict:
+        """Pipelined stage 2: transcribe, align and write the transcript"""
+        if "transcription" in job:
+            # Already transcribed by the shard workers
+            write_text(job["paths"]["transcript"], job["transcription"])
+            return job
+        with metrics.track(job["metrics"]):
+            pipeline = self._pipeline()
+            audio = job.pop("audio")
+            try:
+                units = pipeline.transcribe(audio, job["audio_hash"], job["speaker_segments"])
+            finally:
+                pipeline.transcriber.cleanup()
+            job["audio_seconds"] = audio.duration
+            job["transcription"] = pipeline.transcriber.assign_speakers(units, job["speaker_segments"])
+        write_text(job["paths"]["transcript"], job["transcription"])
+        return job
+
+    def _summarize(self, job: Dict) -> Dict:
+        """Final stage: summarize and write the metadata that marks the file done"""
+        from summarization import ConversationSummarizer
+
+        if self.summarize:
+            with metrics.track(job["metrics"]):
+                summarizer = ConversationSummarizer(cache=self.cache)
+                summary = summarizer.summarize(job["transcription"], use_map_reduce=self.use_map_reduce)
+            write_text(job["paths"]["summary"], summary)
+
+        if config.METRICS_ENABLED:
+            write_text(job["paths"]["metrics"],
+                       json.dumps(job["metrics"].to_dict(), ensure_ascii=False, indent=2))
+
+        meta = {
+            "file": str(job["path"]),
+            "audio_hash": job["audio_hash"],
+            "audio_seconds": job["audio_seconds"],
+            "processing_seconds": time.perf_counter() - job["started"],
+            "speaker_segments": len(job["speaker_segments"]),
+            "transcription_model": config.TRANSCRIPTION_MODEL,
+            "llm_model": config.LLM_MODEL if self.summarize else None,
+        }
+        write_text(job["paths"]["meta"], json.dumps(meta, ensure_ascii=False, indent=2))
+        return meta
+
+    def run(self, files: List[Path], pipelined: bool = False) -> Dict:
+        """
+        Process files, skipping completed ones, and report throughput
+
+        Args:
+            files: Audio files to process
+            pipelined: Overlap stages across files with a StagePipeline
+                       instead of running whole files on a worker pool
+
+        Returns:
+            Statistics dict
+        """
+        self.output_dir.mkdir(parents=True, exist_ok=True)
+        pending = [f for f in files if self.force or not self.is_done(f)]
+        skipped = len(files) - len(pending)
+        mode = "stage pipeline" if pipelined else f"{self.workers} worker(s)"
+        self._log(f"{len(files)} files, {skipped} already done, {len(pending)} to process with {mode}")
+
+        self._warm_up(pending)
+
+        started = time.perf_counter()
+        totals = {"processed": 0, "audio_seconds": 0.0}
+        failed: List[str] = []
+
+        def _done(path: Path, meta: Dict):
+            totals["processed"] += 1
+            totals["audio_seconds"] += meta["audio_seconds"]
+            rtf = meta["processing_seconds"] / meta["audio_seconds"] if meta["audio_seconds"] else 0.0
+            self._log(f"✅ [{totals['processed'] + len(failed)}/{len(pending)}] {path.name}: "
+                      f"{meta['processing_seconds']:.1f}s for {meta['audio_seconds']:.1f}s audio "
+                      f"(RTF {rtf:.3f})")
+
+        def _failed(path: Path, error: BaseException):
+            failed.append(str(path))
+            self._log(f"❌ {path.name}: {error}")
+
+        stage_stats = None
+        if pipelined:
+            scheduler = self._stage_pipeline()
+            scheduler.run(pending, on_result=_done, on_error=lambda path, _, e: _failed(path, e))
+            stage_stats = scheduler.stats()
+        else:
+            with ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="voxlens-batch") as executor:
+                futures = {executor.submit(self.process_file, f): f for f in pending}
+                for future in as_completed(futures):
+                    try:
+                        meta = future.result()
+                    except Exception as e:
+                        _failed(futures[future], e)
+                        continue
+                    _done(futures[future], meta)
+        if self._sharded is not None:
+            self._sharded.close()
+            self._sharded = None
+
+        elapsed = time.perf_counter() - started
+        processed, audio_seconds = totals["processed"], totals["audio_seconds"]
+        stats = {
+            "processed": processed,
+            "skipped": skipped,
+            "failed": failed,
+            "elapsed_seconds": elapsed,
+            "audio_seconds": audio_seconds,
+            "files_per_hour": processed / elapsed * 3600 if elapsed else 0.0,
+            "real_time_factor": elapsed / audio_seconds if audio_seconds else 0.0,
+        }
+        if stage_stats is not None:
+            stats["stages"] = stage_stats
+            for name, stage in stage_stats.items():
+                self._log(f"  {name}: {stage['workers']} worker(s), utilization {stage['utilization']:.0%}, "
+                          f"queue depth mean {stage['queue_depth_mean']:.1f} / max {stage['queue_depth_max']}")
+        self._log(f"Done: {processed} processed, {skipped} skipped, {len(failed)} failed in {elapsed:.1f}s "
+                  f"({stats['files_per_hour']:.1f} files/hour, RTF {stats['real_time_factor']:.3f})")
+        return stats
+
+    def _stage_pipeline(self):
+        """diarize -> transcribe -> summarize connected by bounded queues"""
+        from scheduler import Stage, StagePipeline
+
+        workers = config.PIPELINE_STAGE_WORKERS
+        return StagePipeline([
+            Stage("diarize", self._diarize, workers.get("diarize", 1)),
+            Stage("transcribe", self._transcribe, workers.get("transcribe", 1)),
+            Stage("summarize", self._summarize, workers.get("summarize", 1)),
+        ], queue_size=config.PIPELINE_QUEUE_SIZE)
+
+    def _warm_up(self, pending: List[Path]):
+        """Load the models once before the workers start
+
+        The registry keeps them warm without holding them, so per-stage
+        residency can still unload them between stages. Nothing is loaded
+        when there is nothing to do, or when long recordings may go to the
+        shard workers, which load models of their own and need the memory.
+        """
+        if not pending or self.shard:
+            return
+        for thread in self._pipeline().preload():
+            thread.join()
+
+    def _log(self, message: str):
+        with self._print_lock:
+            print(message, flush=True)
+
+
+def add_arguments(parser):
+    """Register the batch subcommand's arguments"""
+    parser.add_argument("directory", help="Directory containing MP3/WAV files")
+    parser.add_argument("-o", "--output", help="Output directory (default: <directory>/voxlens_output)")
+    parser.add_argument("-w", "--workers", type=int, default=config.BATCH_WORKERS,
+                        help="Files processed concurrently")
+    parser.add_argument("-r", "--recursive", action="store_true", help="Include subdirectories")
+    parser.add_argument("--no-summary", action="store_true", help="Skip summarization")
+    parser.add_argument("--map-reduce", action="store_true", help="Always use MapReduce summarization")
+    parser.add_argument("--force", action="store_true", help="Reprocess files with existing outputs")
+    parser.add_argument("--pipelined", action="store_true",
+                        help="Overlap diarize/transcribe/summarize across files instead of using --workers")
+    parser.add_argument("--shard", action="store_true", default=None,
+                        help="Split long recordings into windows processed in parallel processes")
+    parser.add_argument("--profile", metavar="STAGE", default=None,
+                        help="Run a stage under cProfile, e.g. diarization.inference (report in <name>.metrics.json)")
+    parser.add_argument("--hf-token", default=os.getenv("HF_TOKEN"),
+                        help="HuggingFace token (default: HF_TOKEN environment variable)")
+
+
+def main(args) -> int:
+    """Run the batch subcommand"""
+    files = find_audio_files(args.directory, recursive=args.recursive)
+    output_dir = args.output or os.path.join(args.directory, "voxlens_output")
+    processor = BatchProcessor(
+        output_dir,
+        workers=args.workers,
+        huggingface_token=args.hf_token,
+        summarize=not args.no_summary,
+        use_map_reduce=args.map_reduce,
+        force=args.force,
+        shard=args.shard,
+        profile_stage=args.profile,
+        input_dir=args.directory
+    )
+    stats = processor.run(files, pipelined=args.pipelined)
+    return 1 if stats["failed"] else 0
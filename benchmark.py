@@ -0,0 +1,482 @@
+#!/usr/bin/env python
+"""
+VoxLens Benchmarks
+Measures processing stages on synthetic inputs
+Run with: python benchmark.py alignment --turns 10000
+      or: python benchmark.py transcription recording.wav
+      or: python benchmark.py suite --duration 600 -o after.json
+          python benchmark.py compare before.json after.json
+      or: python benchmark.py imports app
+"""
+import argparse
+import datetime
+import importlib.util
+import json
+import os
+import platform
+import resource
+import sys
+import threading
+import time
+
+import numpy as np
+
+from alignment import SpeakerIndex, align
+from metrics import current_rss_mb
+import config
+import lazy_imports
+
+
+def make_synthetic_alignment_input(num_turns: int, words_per_turn: int = 8, num_speakers: int = 4, seed: int = 0):
+    """
+    Generate synthetic diarization turns and word timings
+
+    Turns have random lengths with small gaps and occasional overlaps, words
+    are spread over the turns with jitter so that some of them straddle a
+    speaker change.
+
+    Returns:
+        Tuple of (speaker_segments, word_starts, word_ends, word_texts)
+    """
+    rng = np.random.default_rng(seed)
+    durations = rng.uniform(1.0, 8.0, num_turns)
+    gaps = rng.uniform(-0.3, 0.8, num_turns)
+    starts = np.cumsum(np.concatenate(([0.0], durations[:-1] + gaps[:-1])))
+    ends = starts + durations
+    speakers = rng.integers(0, num_speakers, num_turns)
+    speaker_segments = [
+        (float(s), float(e), f"SPEAKER_{k:02d}")
+        for s, e, k in zip(starts, ends, speakers)
+    ]
+
+    num_words = num_turns * words_per_turn
+    word_starts = np.sort(rng.uniform(0.0, float(ends[-1]), num_words))
+    word_ends = word_starts + rng.uniform(0.1, 0.6, num_words)
+    word_texts = [f" w{i}" for i in range(num_words)]
+    return speaker_segments, word_starts, word_ends, word_texts
+
+
+def legacy_overlap_scan(speaker_segments, starts, ends, texts):
+    """The previous O(turns x segments) matching, kept for comparison"""
+    lines = []
+    for start_time, end_time, speaker_label in speaker_segments:
+        matched = [
+            texts[i] for i in range(len(starts))
+            if starts[i] < end_time and ends[i] > start_time
+        ]
+        if matched:
+            lines.append((start_time, end_time, speaker_label, "".join(matched)))
+    return lines
+
+
+def bench_alignment(num_turns: int, words_per_turn: int, legacy_turns: int, spanning_turns: int = 1) -> dict:
+    """Time the sweep alignment and, on a smaller input, the legacy scan
+
+    The alignment is timed again with spanning_turns turns covering the whole
+    recording added, e.g. background speech diarized as one long turn.
+    """
+    segments, starts, ends, texts = make_synthetic_alignment_input(num_turns, words_per_turn)
+
+    t0 = time.perf_counter()
+    index = SpeakerIndex(segments)
+    t1 = time.perf_counter()
+    lines = align(starts, ends, texts, index)
+    t2 = time.perf_counter()
+
+    result = {
+        "turns": num_turns,
+        "words": len(starts),
+        "lines": len(lines),
+        "index_seconds": t1 - t0,
+        "align_seconds": t2 - t1,
+    }
+
+    if spanning_turns:
+        total = max(end for _, end, _ in segments)
+        spanning = [(0.0, total, f"SPEAKER_BG{i:02d}") for i in range(spanning_turns)]
+        index = SpeakerIndex(segments + spanning)
+        t0 = time.perf_counter()
+        align(starts, ends, texts, index)
+        t1 = time.perf_counter()
+        result.update({
+            "spanning_turns": spanning_turns,
+            "align_seconds_with_spanning": t1 - t0,
+        })
+
+    if legacy_turns:
+        small = make_synthetic_alignment_input(legacy_turns, words_per_turn)
+        t0 = time.perf_counter()
+        legacy_overlap_scan(*small)
+        t1 = time.perf_counter()
+        align(small[1], small[2], small[3], SpeakerIndex(small[0]))
+        t2 = time.perf_counter()
+        result.update({
+            "legacy_turns": legacy_turns,
+            "legacy_seconds": t1 - t0,
+            "sweep_seconds_same_input": t2 - t1,
+        })
+    return result
+
+
+def bench_transcription(audio_path: str, huggingface_token: str = None, repeat: int = 1) -> dict:
+    """
+    Compare sequential and batched Whisper decoding on a real recording
+
+    Diarization runs once; both modes then transcribe the same decoded audio
+    with warm models, so only the decoding strategy differs.
+
+    Args:
+        audio_path: Audio file to transcribe
+        huggingface_token: HuggingFace access token for pyannote
+        repeat: Timed runs per mode (the best one is reported)
+
+    Returns:
+        Timings, real-time factors and the share of audio inside speech chunks
+    """
+    import config
+    from alignment import speech_chunks
+    from audio_loader import load_audio
+    from diarization import SpeakerDiarizer
+    from transcription import AudioTranscriber
+
+    audio = load_audio(audio_path)
+    speaker_segments = SpeakerDiarizer(huggingface_token=huggingface_token).diarize(audio)
+    chunks = speech_chunks(speaker_segments, duration=audio.duration)
+    transcriber = AudioTranscriber()
+    transcriber.load_model()
+
+    result = {
+        "audio_seconds": audio.duration,
+        "speaker_turns": len(speaker_segments),
+        "speech_chunks": len(chunks),
+        "speech_fraction": sum(end - start for start, end in chunks) / audio.duration,
+        "batch_size": config.WHISPER_BATCH_SIZE,
+        "packing": config.WHISPER_PACKING,
+    }
+    previous_mode = config.TRANSCRIPTION_MODE
+    try:
+        for mode in ("sequential", "batched"):
+            config.TRANSCRIPTION_MODE = mode
+            best = None
+            for _ in range(max(1, repeat)):
+                t0 = time.perf_counter()
+                units = transcriber.transcribe(audio, speaker_segments)
+                elapsed = time.perf_counter() - t0
+                best = elapsed if best is None else min(best, elapsed)
+            result[f"{mode}_seconds"] = best
+            result[f"{mode}_rtf"] = best / audio.duration
+            result[f"{mode}_units"] = len(units[0])
+    finally:
+        config.TRANSCRIPTION_MODE = previous_mode
+    result["speedup"] = result["sequential_seconds"] / result["batched_seconds"]
+    return result
+
+
+def peak_rss_mb() -> float:
+    """Peak resident set size of this process so far in MB"""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return peak / 2**20 if sys.platform == "darwin" else peak / 1024
+
+
+class RSSSampler:
+    """Track the peak RSS while a block runs by sampling in a thread"""
+
+    def __init__(self, interval: float = 0.01):
+        self.interval = interval
+        self.peak_mb = 0.0
+        self._stop = threading.Event()
+        self._thread = None
+
+    def __enter__(self):
+        self.peak_mb = current_rss_mb()
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._sample, name="rss-sampler", daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+        self.peak_mb = max(self.peak_mb, current_rss_mb())
+
+    def _sample(self):
+        while not self._stop.wait(self.interval):
+            self.peak_mb = max(self.peak_mb, current_rss_mb())
+
+
+def measure(func, *args, audio_seconds: float = None, **kwargs):
+    """
+    Run a stage once and record its cost
+
+    Returns:
+        Tuple of (stage return value, stats dict with wall_seconds,
+        cpu_seconds, real_time_factor and peak_rss_mb)
+    """
+    with RSSSampler() as rss:
+        cpu0, t0 = time.process_time(), time.perf_counter()
+        value = func(*args, **kwargs)
+        cpu1, t1 = time.process_time(), time.perf_counter()
+    stats = {
+        "wall_seconds": t1 - t0,
+        "cpu_seconds": cpu1 - cpu0,
+        "real_time_factor": (t1 - t0) / audio_seconds if audio_seconds else None,
+        "peak_rss_mb": rss.peak_mb,
+    }
+    return value, stats
+
+
+def real_backends_available() -> bool:
+    """Whether pyannote and faster-whisper are installed and pyannote can authenticate"""
+    return (
+        importlib.util.find_spec("pyannote") is not None
+        and importlib.util.find_spec("faster_whisper") is not None
+        and bool(os.getenv("HF_TOKEN"))
+    )
+
+
+def _summarizers(base_url: str, transcript: str):
+    """(name, callable) pairs summarizing the transcript through the Ollama API at base_url"""
+    if importlib.util.find_spec("langchain") is not None:
+        from summarization import ConversationSummarizer
+
+        summarizer = ConversationSummarizer(base_url=base_url)
+        return [
+            ("summarization_stuff", lambda: summarizer.summarize(transcript, use_map_reduce=False)),
+            ("summarization_map_reduce", lambda: summarizer.summarize(transcript, use_map_reduce=True)),
+        ]
+
+    # Without LangChain, drive the MapReduce code directly over plain HTTP
+    from benchmark_stubs import OllamaHTTPClient
+    from mapreduce import MapReduceSummarizer
+
+    llm = OllamaHTTPClient(base_url)
+    return [("summarization_map_reduce", lambda: MapReduceSummarizer(llm).run(transcript))]
+
+
+def run_suite(
+    duration: float = 300.0,
+    num_speakers: int = 3,
+    transcript_turns: int = 300,
+    backend: str = "auto",
+    llm: str = "fake",
+    llm_latency: float = 0.05,
+    seed: int = 0
+) -> dict:
+    """
+    Run every stage on synthetic inputs and collect per-stage costs
+
+    Args:
+        duration: Length of the synthetic recording in seconds
+        num_speakers: Speakers in the recording and transcript
+        transcript_turns: Turns of the synthetic transcript to summarize
+        backend: "real" models, deterministic "stub" stand-ins, or "auto"
+                 (real when installed and HF_TOKEN is set)
+        llm: "fake" local Ollama server, "ollama" for config.OLLAMA_BASE_URL, or "none"
+        llm_latency: Seconds per response of the fake server
+        seed: Random seed for the synthetic inputs
+
+    Returns:
+        JSON-serializable dict with run metadata and a "stages" dict
+    """
+    import config
+    from benchmark_stubs import (
+        FakeOllamaServer, StubDiarizer, StubTranscriber,
+        make_synthetic_audio, make_synthetic_transcript
+    )
+    from pipeline import TranscriptionPipeline
+
+    if backend == "auto":
+        backend = "real" if real_backends_available() else "stub"
+    if backend == "real":
+        from diarization import SpeakerDiarizer
+        from transcription import AudioTranscriber
+        diarizer, transcriber = SpeakerDiarizer(), AudioTranscriber()
+        diarizer.load_model()
+        transcriber.load_model()
+    else:
+        diarizer, transcriber = StubDiarizer(), StubTranscriber()
+
+    stages = {}
+    audio, _ = make_synthetic_audio(duration, num_speakers, seed)
+
+    speaker_segments, stages["diarization"] = measure(diarizer.diarize, audio, audio_seconds=duration)
+    units, stages["transcription"] = measure(
+        transcriber.transcribe, audio, speaker_segments, audio_seconds=duration
+    )
+    _, stages["alignment"] = measure(
+        transcriber.assign_speakers, units, speaker_segments, audio_seconds=duration
+    )
+    stages["alignment"]["units"] = len(units[0])
+    # Stand-ins take no model memory, so there is no parallel-vs-sequential decision to measure
+    pipeline = TranscriptionPipeline(diarizer, transcriber, parallel=None if backend == "real" else False)
+    _, stages["pipeline"] = measure(pipeline.run, audio, audio_seconds=duration)
+    stages["pipeline"]["parallel"] = pipeline.can_run_parallel()
+
+    if llm != "none":
+        transcript = make_synthetic_transcript(transcript_turns, num_speakers, seed=seed)
+        server = FakeOllamaServer(latency=llm_latency) if llm == "fake" else None
+        if server is not None:
+            server.start()
+        try:
+            base_url = server.url if server is not None else config.OLLAMA_BASE_URL
+            for name, summarize in _summarizers(base_url, transcript):
+                calls_before = server.calls if server is not None else None
+                _, stats = measure(summarize)
+                stats["transcript_chars"] = len(transcript)
+                if server is not None:
+                    stats["llm_calls"] = server.calls - calls_before
+                    stats["llm_max_in_flight"] = server.max_in_flight
+                stages[name] = stats
+        finally:
+            if server is not None:
+                server.stop()
+
+    return {
+        "created": datetime.datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "backend": backend,
+        "llm": llm,
+        "parameters": {
+            "duration": duration,
+            "num_speakers": num_speakers,
+            "transcript_turns": transcript_turns,
+            "llm_latency": llm_latency,
+            "seed": seed,
+        },
+        "config": {
+            name: getattr(config, name) for name in (
+                "DEVICE", "COMPUTE_TYPE", "CPU_COMPUTE_TYPE", "TRANSCRIPTION_MODEL", "BEAM_SIZE",
+                "WHISPER_CPU_THREADS", "TRANSCRIPTION_MODE", "WORD_TIMESTAMPS",
+                "PARALLEL_STAGES", "LLM_MODEL", "LLM_CONTEXT_WINDOW", "MAP_CONCURRENCY",
+            )
+        },
+        "peak_rss_mb": peak_rss_mb(),
+        "stages": stages,
+    }
+
+
+def compare_results(before: dict, after: dict, threshold: float = 0.1) -> list:
+    """
+    Compare the stage timings of two suite results
+
+    Args:
+        before: Baseline result of run_suite()
+        after: New result of run_suite()
+        threshold: Relative slowdown counted as a regression
+
+    Returns:
+        Rows of (stage, before_seconds, after_seconds, change, regressed)
+        for stages present in both results
+    """
+    rows = []
+    for stage, new in after["stages"].items():
+        old = before["stages"].get(stage)
+        if old is None:
+            continue
+        change = new["wall_seconds"] / old["wall_seconds"] - 1 if old["wall_seconds"] else 0.0
+        rows.append((stage, old["wall_seconds"], new["wall_seconds"], change, change > threshold))
+    return rows
+
+
+def print_result(result: dict):
+    """Print a benchmark result one key per line"""
+    for key, value in result.items():
+        print(f"{key}: {value:.4f}" if isinstance(value, float) else f"{key}: {value}")
+
+
+def main(argv=None):
+    """Command line entry point"""
+    parser = argparse.ArgumentParser(description="VoxLens benchmarks")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    alignment_parser = subparsers.add_parser("alignment", help="Speaker alignment on synthetic turns")
+    alignment_parser.add_argument("--turns", type=int, default=10000)
+    alignment_parser.add_argument("--words-per-turn", type=int, default=8)
+    alignment_parser.add_argument(
+        "--legacy-turns", type=int, default=1000,
+        help="Input size for the legacy scan comparison (0 to skip)"
+    )
+    alignment_parser.add_argument(
+        "--spanning-turns", type=int, default=1,
+        help="Turns spanning the whole recording added for a second timing (0 to skip)"
+    )
+
+    transcription_parser = subparsers.add_parser(
+        "transcription", help="Sequential vs batched Whisper decoding on a recording"
+    )
+    transcription_parser.add_argument("audio", help="MP3/WAV file")
+    transcription_parser.add_argument("--repeat", type=int, default=1)
+    transcription_parser.add_argument("--hf-token", default=os.getenv("HF_TOKEN"))
+
+    suite_parser = subparsers.add_parser("suite", help="All stages on synthetic audio, results as JSON")
+    suite_parser.add_argument("--duration", type=float, default=300.0, help="Synthetic audio length in seconds")
+    suite_parser.add_argument("--speakers", type=int, default=3)
+    suite_parser.add_argument("--transcript-turns", type=int, default=300,
+                              help="Turns of the synthetic transcript to summarize")
+    suite_parser.add_argument("--backend", choices=["auto", "real", "stub"], default="auto")
+    suite_parser.add_argument("--llm", choices=["fake", "ollama", "none"], default="fake")
+    suite_parser.add_argument("--llm-latency", type=float, default=0.05,
+                              help="Seconds per response of the fake Ollama server")
+    suite_parser.add_argument("--seed", type=int, default=0)
+    suite_parser.add_argument("-o", "--output", default="benchmark.json")
+
+    compare_parser = subparsers.add_parser("compare", help="Compare two suite results")
+    compare_parser.add_argument("before")
+    compare_parser.add_argument("after")
+    compare_parser.add_argument("--threshold", type=float, default=0.1,
+                                help="Relative slowdown reported as a regression")
+
+    imports_parser = subparsers.add_parser(
+        "imports", help="Cold import time of modules, each in a fresh interpreter"
+    )
+    imports_parser.add_argument("modules", nargs="*", help="Modules to import (default: config.STARTUP_MODULES)")
+    imports_parser.add_argument("--budget", type=float, default=config.IMPORT_BUDGET_SECONDS)
+    imports_parser.add_argument("--top", type=int, default=10,
+                                help="Slowest imported modules to list per module (0 to skip)")
+
+    args = parser.parse_args(argv)
+
+    if args.command == "alignment":
+        print_result(bench_alignment(args.turns, args.words_per_turn, args.legacy_turns, args.spanning_turns))
+    elif args.command == "transcription":
+        print_result(bench_transcription(args.audio, args.hf_token, args.repeat))
+    elif args.command == "suite":
+        result = run_suite(args.duration, args.speakers, args.transcript_turns,
+                           args.backend, args.llm, args.llm_latency, args.seed)
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(result, f, ensure_ascii=False, indent=2)
+        for stage, stats in result["stages"].items():
+            rtf = stats["real_time_factor"]
+            print(f"{stage}: {stats['wall_seconds']:.3f}s"
+                  + (f", RTF {rtf:.4f}" if rtf is not None else "")
+                  + f", peak RSS {stats['peak_rss_mb']:.0f} MB"
+                  + (f", {stats['llm_calls']} LLM calls" if "llm_calls" in stats else ""))
+        print(f"Results written to {args.output}")
+    elif args.command == "compare":
+        with open(args.before, encoding="utf-8") as f:
+            before = json.load(f)
+        with open(args.after, encoding="utf-8") as f:
+            after = json.load(f)
+        rows = compare_results(before, after, args.threshold)
+        for stage, old, new, change, regressed in rows:
+            print(f"{stage:28s} {old:9.3f}s -> {new:9.3f}s  {change:+7.1%}" + ("  REGRESSION" if regressed else ""))
+        return 1 if any(row[4] for row in rows) else 0
+    elif args.command == "imports":
+        results = lazy_imports.check_startup(args.modules or config.STARTUP_MODULES, args.budget)
+        for result in results:
+            if result["error"]:
+                print(f"{result['module']:20s} failed: {result['error']}")
+                continue
+            print(f"{result['module']:20s} {result['seconds']:7.3f}s"
+                  + (f"  heavy: {', '.join(result['heavy'])}" if result["heavy"] else "")
+                  + ("" if result["ok"] else "  OVER BUDGET"))
+            for name, _, cumulative in lazy_imports.import_times(result["module"], top=args.top):
+                print(f"    {cumulative:7.3f}s  {name}")
+        return 0 if all(result["ok"] for result in results) else 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,332 @@
+"""
+Synthetic inputs and deterministic stand-in backends for the benchmark suite
+"""
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import List, Tuple
+import asyncio
+import json
+import threading
+import time
+import urllib.request
+import numpy as np
+import config
+from alignment import SpeakerIndex, align, collect_units, format_transcript
+from audio_loader import AudioBuffer, AudioInput, load_audio
+
+
+# Fundamental frequency of each synthetic speaker is BASE + k * STEP Hz
+SPEAKER_BASE_HZ = 120.0
+SPEAKER_STEP_HZ = 60.0
+
+_VOCABULARY = ["会議", "予算", "来週", "確認", "資料", "提案", "進捗", "課題", "対応", "共有",
+               "について", "ですね", "お願いします", "と思います", "了解です"]
+
+
+def make_synthetic_turns(
+    duration: float,
+    num_speakers: int = 3,
+    seed: int = 0
+) -> List[Tuple[float, float, str]]:
+    """
+    Random alternating speaker turns separated by short pauses
+
+    Returns:
+        List of (start_time, end_time, speaker_label) tuples covering duration
+    """
+    rng = np.random.default_rng(seed)
+    turns = []
+    now = 0.0
+    speaker = 0
+    while True:
+        now += rng.uniform(0.2, 1.0)
+        end = min(now + rng.uniform(1.5, 6.0), duration)
+        if end - now < 0.5:
+            return turns
+        turns.append((now, end, f"SPEAKER_{speaker:02d}"))
+        now = end
+        speaker = (speaker + int(rng.integers(1, num_speakers))) % num_speakers if num_speakers > 1 else 0
+
+
+def make_synthetic_audio(
+    duration: float,
+    num_speakers: int = 3,
+    seed: int = 0
+) -> Tuple[AudioBuffer, List[Tuple[float, float, str]]]:
+    """
+    Generate multi-speaker audio with known speaker turns
+
+    Every speaker is a harmonic tone at its own pitch, amplitude-modulated at
+    a syllable rate, with low background noise in the pauses.
+
+    Args:
+        duration: Length in seconds
+        num_speakers: Number of distinct speakers
+        seed: Random seed
+
+    Returns:
+        Tuple of (AudioBuffer, ground-truth speaker turns)
+    """
+    rate = config.SAMPLE_RATE
+    rng = np.random.default_rng(seed)
+    samples = (rng.standard_normal(int(duration * rate)) * 0.005).astype(np.float32)
+    turns = make_synthetic_turns(duration, num_speakers, seed)
+
+    for start, end, label in turns:
+        first, last = int(start * rate), int(end * rate)
+        t = np.arange(last - first, dtype=np.float32) / rate
+        pitch = SPEAKER_BASE_HZ + SPEAKER_STEP_HZ * int(label.rsplit("_", 1)[1])
+        tone = sum(np.sin(2 * np.pi * h * pitch * t) / h for h in (1, 2, 3))
+        envelope = 0.3 * (1.2 + np.sin(2 * np.pi * 4.0 * t))
+        samples[first:last] += (tone * envelope).astype(np.float32)
+
+    return AudioBuffer(samples, rate), turns
+
+
+def make_synthetic_transcript(num_turns: int, num_speakers: int = 3, words_per_turn: int = 20, seed: int = 0) -> str:
+    """Generate a speaker-labelled transcript in the "SPEAKER_XX: text" format"""
+    rng = np.random.default_rng(seed)
+    lines = []
+    for i in range(num_turns):
+        words = rng.choice(_VOCABULARY, words_per_turn)
+        lines.append(f"SPEAKER_{i % num_speakers:02d}: {''.join(words)}。")
+    return "\n".join(lines)
+
+
+def _speech_frames(audio: AudioBuffer, frame_seconds: float, threshold: float):
+    """RMS-gated frames and the dominant pitch of each"""
+    frame = int(frame_seconds * audio.sample_rate)
+    count = len(audio.samples) // frame
+    frames = audio.samples[:count * frame].reshape(count, frame)
+    voiced = np.sqrt(np.mean(frames ** 2, axis=1)) > threshold
+    spectrum = np.abs(np.fft.rfft(frames, axis=1))
+    freqs = np.fft.rfftfreq(frame, 1 / audio.sample_rate)
+    band = (freqs >= 60) & (freqs <= 1000)
+    # The fundamental is the strongest harmonic of the synthetic voices
+    pitch = freqs[band][np.argmax(spectrum[:, band], axis=1)]
+    return voiced, pitch
+
+
+class StubDiarizer:
+    """Deterministic stand-in for SpeakerDiarizer
+
+    Finds voiced frames by energy and labels them by pitch, so its cost grows
+    with the audio length like the real model's, at a fraction of the time.
+    """
+
+    def __init__(self, frame_seconds: float = 0.1, threshold: float = 0.05):
+        self.frame_seconds = frame_seconds
+        self.threshold = threshold
+        self.num_threads = 0
+
+    def diarize(self, audio: AudioInput) -> List[Tuple[float, float, str]]:
+        """Return (start_time, end_time, speaker_label) turns"""
+        audio = load_audio(audio)
+        voiced, pitch = _speech_frames(audio, self.frame_seconds, self.threshold)
+        speakers = np.clip(np.round((pitch - SPEAKER_BASE_HZ) / SPEAKER_STEP_HZ), 0, None).astype(int)
+        labels = np.where(voiced, speakers, -1)
+
+        turns = []
+        change = np.flatnonzero(np.diff(labels)) + 1
+        for first, last in zip(np.concatenate(([0], change)), np.concatenate((change, [len(labels)]))):
+            if labels[first] >= 0:
+                turns.append((float(first * self.frame_seconds), float(last * self.frame_seconds),
+                              f"SPEAKER_{labels[first]:02d}"))
+        return turns
+
+    def load_model(self):
+        pass
+
+    def cleanup(self, release: bool = None):
+        pass
+
+
+class _Word:
+    def __init__(self, start: float, end: float, word: str):
+        self.start, self.end, self.word = start, end, word
+
+
+class _Segment:
+    def __init__(self, words: List[_Word]):
+        self.words = words
+        self.start, self.end = words[0].start, words[-1].end
+        self.text = "".join(word.word for word in words)
+
+
+class StubTranscriber:
+    """Deterministic stand-in for AudioTranscriber
+
+    Emits one word every ``word_seconds`` of voiced audio, grouped into
+    Whisper-like segments with word timestamps.
+    """
+
+    def __init__(self, word_seconds: float = 0.35, threshold: float = 0.05):
+        self.word_seconds = word_seconds
+        self.threshold = threshold
+        self.cpu_threads = 0
+
+    def iter_segments(self, audio: AudioInput, speaker_segments=None):
+        """Yield segments of consecutive voiced words"""
+        audio = load_audio(audio)
+        voiced, _ = _speech_frames(audio, self.word_seconds, self.threshold)
+        words = []
+        for i in np.flatnonzero(voiced):
+            start = float(i * self.word_seconds)
+            if words and start - words[-1].end > 1e-6:
+                yield _Segment(words)
+                words = []
+            words.append(_Word(start, start + self.word_seconds, _VOCABULARY[i % len(_VOCABULARY)]))
+        if words:
+            yield _Segment(words)
+
+    def transcribe(self, audio: AudioInput, speaker_segments=None):
+        """Timed text units, see alignment.collect_units"""
+        return collect_units(self.iter_segments(audio, speaker_segments), use_words=True)
+
+    def assign_speakers(self, units, speaker_segments) -> str:
+        starts, ends, texts, joiner = units
+        return format_transcript(align(starts, ends, texts, SpeakerIndex(speaker_segments), joiner=joiner))
+
+    def load_model(self):
+        pass
+
+    def cleanup(self, release: bool = None):
+        pass
+
+
+class FakeOllamaServer:
+    """Local HTTP server answering the Ollama generate API with canned text
+
+    Responses are deterministic and their latency is configurable, so the
+    summarization code paths (chunking, concurrency, reduce levels) can be
+    measured without a model. Use as a context manager; ``calls`` counts
+    generate requests, ``prompt_chars`` their total prompt length and
+    ``last_payload`` is the most recent request.
+    """
+
+    def __init__(self, response_words: int = 40, latency: float = 0.0, word_latency: float = 0.0):
+        """
+        Configure the server
+
+        Args:
+            response_words: Words in every response
+            latency: Seconds before the first word
+            word_latency: Seconds per generated word
+        """
+        self.response_words = response_words
+        self.latency = latency
+        self.word_latency = word_latency
+        self.calls = 0
+        self.prompt_chars = 0
+        self.last_payload = None
+        self.max_in_flight = 0
+        self._in_flight = 0
+        self._lock = threading.Lock()
+        self._server = None
+        self._thread = None
+
+    @property
+    def url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def start(self):
+        """Start serving on a free local port"""
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, *args):
+                pass
+
+            def do_GET(self):
+                body = json.dumps({"models": [{"name": config.LLM_MODEL}]}).encode("utf-8")
+                self._send(body, "application/json")
+
+            def do_POST(self):
+                length = int(self.headers.get("Content-Length") or 0)
+                payload = json.loads(self.rfile.read(length) or b"{}")
+                if not self.path.startswith("/api/generate"):
+                    self._send(b"{}", "application/json")
+                    return
+                fake._generate(self, payload)
+
+            def _send(self, body: bytes, content_type: str):
+                self.send_response(200)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self._server.daemon_threads = True
+        self._thread = threading.Thread(target=self._server.serve_forever, name="fake-ollama", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """Stop serving"""
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+    def _generate(self, handler, payload: dict):
+        prompt = payload.get("prompt", "")
+        with self._lock:
+            self.calls += 1
+            self.prompt_chars += len(prompt)
+            self.last_payload = payload
+            self._in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self._in_flight)
+        try:
+            time.sleep(self.latency)
+            words = [_VOCABULARY[(len(prompt) + i) % len(_VOCABULARY)] for i in range(self.response_words)]
+            time.sleep(self.word_latency * len(words))
+            model = payload.get("model", config.LLM_MODEL)
+            if payload.get("stream", True):
+                lines = [json.dumps({"model": model, "response": word, "done": False}, ensure_ascii=False)
+                         for word in words]
+                lines.append(json.dumps({"model": model, "response": "", "done": True,
+                                         "eval_count": len(words)}))
+                body = ("\n".join(lines) + "\n").encode("utf-8")
+                content_type = "application/x-ndjson"
+            else:
+                body = json.dumps({"model": model, "response": "".join(words), "done": True,
+                                   "eval_count": len(words)}, ensure_ascii=False).encode("utf-8")
+                content_type = "application/json"
+            handler._send(body, content_type)
+        finally:
+            with self._lock:
+                self._in_flight -= 1
+
+
+class OllamaHTTPClient:
+    """Minimal Ollama client with the ainvoke() interface MapReduceSummarizer uses
+
+    Lets the benchmark exercise MapReduce summarization when LangChain is
+    not installed.
+    """
+
+    def __init__(self, base_url: str, model: str = None, timeout: float = 600.0):
+        self.base_url = base_url.rstrip("/")
+        self.model = model or config.LLM_MODEL
+        self.timeout = timeout
+
+    def invoke(self, prompt: str) -> str:
+        request = urllib.request.Request(
+            f"{self.base_url}/api/generate",
+            data=json.dumps({"model": self.model, "prompt": prompt, "stream": False}).encode("utf-8"),
+            headers={"Content-Type": "application/json"}
+        )
+        with urllib.request.urlopen(request, timeout=self.timeout) as response:
+            return json.loads(response.read())["response"]
+
+    async def ainvoke(self, prompt: str) -> str:
+        return await asyncio.to_thread(self.invoke, prompt)
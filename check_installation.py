@@ -3,21 +3,26 @@
 VoxLens Installation Checker
 Verifies that all required dependencies are installed correctly
 """
+import importlib.util
 import sys
 
 
 def check_import(module_name, package_name=None):
-    """Check if a module can be imported"""
+    """Check if a module is installed (located without importing it, which is slow for torch etc.)"""
     if package_name is None:
         package_name = module_name
     
     try:
-        __import__(module_name)
+        found = importlib.util.find_spec(module_name) is not None
+    except (ImportError, ValueError) as e:
+        found, reason = False, str(e)
+    else:
+        reason = "module not found"
+    if found:
         print(f"✅ {package_name}: OK")
         return True
-    except ImportError as e:
-        print(f"❌ {package_name}: NOT FOUND ({str(e)})")
-        return False
+    print(f"❌ {package_name}: NOT FOUND ({reason})")
+    return False
 
 
 def check_cuda():
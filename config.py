@@ -1,6 +1,7 @@
 """
 Configuration file for VoxLens application
 """
+import os
 
 # Model configurations
 DIARIZATION_MODEL = "pyannote/speaker-diarization-3.1"
@@ -16,18 +17,170 @@ LLM_MODEL = "llama3.2:8b"
 
 # Ollama configuration
 OLLAMA_BASE_URL = "http://localhost:11434"
+# Summaries go through a shared client (see ollama_client.py) that reuses
+# connections and spreads requests round-robin over these servers, e.g.
+# OLLAMA_BASE_URLS="http://gpu1:11434,http://gpu2:11434"
+OLLAMA_BASE_URLS = [url.strip() for url in os.getenv("OLLAMA_BASE_URLS", OLLAMA_BASE_URL).split(",") if url.strip()]
+OLLAMA_POOLED = True  # False = a LangChain Ollama LLM per summarizer, without pooling
+OLLAMA_KEEP_ALIVE = "30m"  # How long Ollama keeps LLM_MODEL loaded after a request (seconds or "30m"; -1 = until unloaded)
+OLLAMA_MAX_CONCURRENCY = 4  # Requests in flight per server (match the server's OLLAMA_NUM_PARALLEL)
+OLLAMA_TIMEOUT = 600  # Socket timeout of Ollama requests in seconds
 
 # Processing settings
 DEVICE = "cuda"  # or "cpu" if CUDA is not available
 COMPUTE_TYPE = "float16"  # for faster-whisper
+CPU_COMPUTE_TYPE = "int8"  # faster-whisper compute type when running on CPU
+WHISPER_CPU_THREADS = 0  # CTranslate2 threads on CPU (0 = library default)
+WHISPER_NUM_WORKERS = 1  # Transcriptions one Whisper model runs concurrently
+DIARIZATION_CPU_THREADS = 0  # torch threads for diarization on CPU (0 = library default)
 
 # Transcription settings
 TRANSCRIPTION_LANGUAGE = "ja"  # Language code (ja, en, zh, etc.)
 BEAM_SIZE = 5
 VAD_FILTER = True
+WORD_TIMESTAMPS = True  # Align speakers per word instead of per Whisper segment
+# "sequential" decodes the whole file window by window; "batched" cuts only the
+# diarized speech turns and decodes them together (skips silence entirely)
+TRANSCRIPTION_MODE = "sequential"
+WHISPER_BATCH_SIZE = 16  # Speech chunks decoded together in batched mode
+# Packing of speaker turns into chunks in batched mode:
+# "merge" joins neighbouring turns up to WHISPER_CHUNK_SECONDS (fewer, fuller chunks)
+# "turn" decodes every speaker turn on its own (cleaner speaker boundaries)
+WHISPER_PACKING = "merge"
+WHISPER_CHUNK_SECONDS = 30.0  # Whisper's input window; longer turns are split
+WHISPER_MERGE_GAP = 1.0  # Max silence in seconds bridged when merging turns
+WHISPER_CHUNK_PADDING = 0.2  # Seconds of context added around each turn
+
+# Two-pass transcription (see refine.py)
+# A fast draft model gives a speaker-aligned transcript first; the model above
+# then refines it region by region, replacing the draft in place
+DRAFT_ENABLED = False
+DRAFT_MODEL = "base"  # tiny or base; loaded alongside TRANSCRIPTION_MODEL
+DRAFT_BEAM_SIZE = 1  # Greedy decoding
+REFINE_REGION_SECONDS = 30.0  # Longest region refined at once; regions end in pauses between turns
+DRAFT_SUMMARY_WAITS = True  # Summarize the refined text (False summarizes the draft while it is refined)
+
+# Speaker alignment settings
+ALIGNMENT_MAX_GAP = 0.5  # Seconds; words outside any speaker turn go to the nearest turn within this gap
+
+# Pipeline settings
+PARALLEL_STAGES = "auto"  # True, False or "auto" (run diarization and transcription concurrently if both models fit)
+MEMORY_BUDGET_MB = None  # Memory the models may use; None = measure free VRAM (CUDA) or RAM (CPU)
+DIARIZATION_THREADS = 0  # torch intra-op threads when running in parallel on CPU (0 = half the cores)
+TRANSCRIPTION_THREADS = 0  # CTranslate2 threads when running in parallel on CPU (0 = remaining cores)
+
+# Model residency
+# "persistent": keep models warm across jobs in a process-wide registry
+# "per_stage": unload each model as soon as its stage finishes to free VRAM
+MODEL_RESIDENCY = "persistent"
+MODEL_REGISTRY_BUDGET_MB = 6000  # Evict least recently used models above this size (None = unbounded)
+PRELOAD_MODELS = True  # Load models in the background when the app starts
+
+# Approximate resident model sizes in MB, used to check the memory budget
+MODEL_MEMORY_MB = {
+    "pyannote/speaker-diarization-3.1": 1000,
+    "tiny": 150,
+    "base": 300,
+    "small": 700,
+    "medium": 1800,
+    "large": 3500,
+    "large-v2": 3500,
+    "large-v3": 3500,
+    "distil-large-v2": 2000,
+    "distil-large-v3": 2000,
+    "default": 3500,
+}
 
 # Summarization settings
 MAX_STUFF_CHAIN_LENGTH = 4000  # Maximum character length for StuffDocumentsChain
+LLM_CONTEXT_WINDOW = 8192  # Context size requested from Ollama (num_ctx); MapReduce chunks are sized to fit
+SUMMARY_MAX_TOKENS = 1024  # Tokens reserved for each LLM response when sizing chunks
+MAP_CONCURRENCY = 4  # Maximum concurrent MapReduce requests to Ollama (pooled client: its total capacity instead)
+MAP_CHUNK_BOUNDARY_TURNS = 4  # Average speaker turns between content-defined chunk boundaries (see mapreduce.stable_chunks)
+
+# Batch settings (python -m voxlens batch <directory>)
+BATCH_WORKERS = 2  # Files processed concurrently
+# With --pipelined, files flow through diarize -> transcribe -> summarize stages
+# connected by bounded queues; each stage has its own worker threads
+PIPELINE_STAGE_WORKERS = {"diarize": 1, "transcribe": 1, "summarize": 2}
+PIPELINE_QUEUE_SIZE = 2  # Files waiting between two stages (bounds memory held by decoded audio)
+
+# Sharded processing of long recordings (see sharding.py)
+# Recordings are cut into overlapping windows processed by a pool of worker
+# processes; speakers are re-linked across windows by embedding similarity
+SHARD_ENABLED = False  # Shard batch files longer than SHARD_MIN_DURATION (or use --shard)
+SHARD_MIN_DURATION = 1800.0  # Seconds; shorter recordings gain little from sharding
+SHARD_WINDOW = 600.0  # Window length in seconds
+SHARD_OVERLAP = 30.0  # Seconds shared by consecutive windows
+SHARD_WORKERS = 0  # Worker processes (0 = as many as CPU cores and memory allow)
+SHARD_LINK_THRESHOLD = 0.5  # Max cosine distance for two window speakers to be the same person
+
+# Live mode (see live.py)
+# A PCM stream is decoded on a rolling window; words are committed once two
+# consecutive decodes agree and get their speaker from periodic diarization
+# of the latest audio, linked across passes by embedding similarity
+LIVE_HOST = "127.0.0.1"  # Address `voxlens live --listen` accepts PCM on
+LIVE_PORT = 8766
+LIVE_CHUNK_SECONDS = 0.5  # Audio read from the source at a time
+LIVE_STEP_SECONDS = 1.0  # New audio between two decodes of the rolling window
+LIVE_MAX_WINDOW = 15.0  # Seconds; longer windows are trimmed at the last committed word (bounds lag)
+LIVE_PROMPT_CHARS = 200  # Tail of the committed text passed to Whisper as prompt
+LIVE_DIARIZATION_INTERVAL = 5.0  # New audio between two diarization passes
+LIVE_DIARIZATION_WINDOW = 20.0  # Seconds of audio each diarization pass looks at
+LIVE_DIARIZATION_GUARD = 1.0  # Newest seconds left to the next pass (too little context yet)
+
+# Result cache settings
+# Stage outputs are cached by audio content hash and the settings above, so
+# re-running with other summary settings reuses diarization and transcription
+CACHE_ENABLED = True
+CACHE_DIR = os.path.join(os.path.expanduser("~"), ".cache", "voxlens")
+CACHE_MAX_MB = 500
+
+# Host calibration (python -m voxlens calibrate <audio>, see autotune.py)
+# Probe decodes pick the most accurate Whisper model, compute type and beam
+# size that keep up with AUTOTUNE_TARGET_RTF, plus CPU threads; the result is
+# saved as a host profile that overrides the settings above at startup
+HOST_PROFILE_PATH = os.path.join(CACHE_DIR, "host_profile.json")
+HOST_PROFILE_ENABLED = True  # Apply the host profile if one was measured on this machine
+AUTOTUNE_TARGET_RTF = 0.5  # Processing seconds allowed per second of audio
+AUTOTUNE_PROBE_SECONDS = 60.0  # Length of the probe decodes
+AUTOTUNE_MODELS = ["large-v3", "distil-large-v3", "medium", "small", "base"]  # Most accurate first
+AUTOTUNE_COMPUTE_TYPES = {"cuda": ["float16", "int8_float16"], "cpu": ["float32", "int8"]}  # Most precise first
+AUTOTUNE_BEAM_SIZES = [5, 2, 1]
+
+# Metrics settings (see metrics.py)
+METRICS_ENABLED = True  # Time every stage and write a JSON report per job
+METRICS_DIR = os.path.join(CACHE_DIR, "metrics")  # Reports of UI jobs (batch writes next to its outputs)
+PROFILE_STAGE = None  # Span to run under cProfile, e.g. "diarization.inference" (None = off)
+# Cold start: modules that must import without torch/pyannote/faster-whisper/
+# LangChain (see lazy_imports.py), and the time each may take
+STARTUP_MODULES = ["diarization", "transcription", "summarization", "pipeline", "jobs", "service"]
+IMPORT_BUDGET_SECONDS = 1.0
+
+# Job settings (see jobs.py)
+# Every UI run is a job with its own working directory holding the recording
+# and a checkpoint of each finished stage; a failed or interrupted job resumes
+# from its last checkpoint, and Whisper from the last committed audio offset
+JOBS_DIR = os.path.join(CACHE_DIR, "jobs")
+JOB_KEEP_AUDIO = False  # Keep the recording in the working directory once the job is done
+JOB_MAX_AGE_DAYS = 7  # Delete working directories untouched for this many days (0 = keep forever)
+# Keep pyannote's segmentation scores and embeddings in the working directory
+# (a few MB per hour), so the speakers can be re-clustered for another
+# speaker count without diarizing again
+DIARIZATION_KEEP_ARTIFACTS = True
+
+# Job service (python -m voxlens serve, see service.py)
+# A local HTTP API queues jobs in SQLite for worker processes that own the
+# models; with JOB_SERVICE_URL set, app.py only submits jobs and shows progress
+JOB_SERVICE_URL = os.getenv("VOXLENS_SERVICE_URL")  # e.g. "http://127.0.0.1:8765" (None = process in the UI)
+JOB_SERVICE_HOST = "127.0.0.1"
+JOB_SERVICE_PORT = 8765
+JOB_SERVICE_WORKERS = 1  # Worker processes started by the service, each with its own models
+JOB_QUEUE_PATH = os.path.join(CACHE_DIR, "jobs.sqlite3")
+JOB_TIMEOUT = 3 * 3600.0  # Default time limit per job in seconds (0 = none)
+JOB_KILL_GRACE = 30.0  # Seconds a worker gets to stop a cancelled or timed out job before it is restarted
+JOB_MAX_ATTEMPTS = 2  # Runs of a job that crashed its worker before it is marked failed
 
 # Audio settings
 SUPPORTED_FORMATS = ["mp3", "wav"]
+SAMPLE_RATE = 16000  # Audio is decoded once to 16 kHz mono float32 for all stages
@@ -1,75 +1,392 @@
 """
 Speaker diarization module using pyannote.audio
 """
-from typing import List, Tuple
+from contextlib import contextmanager
+from typing import Any, Dict, List, Optional, Tuple
 import os
-import torch
-from pyannote.audio import Pipeline
+import tempfile
+import threading
+import numpy as np
+from audio_loader import AudioBuffer, AudioInput
+from model_registry import get_registry
 import config
+import metrics
+from autotune import apply_host_profile
+from lazy_imports import is_imported, lazy_attr, lazy_import
+
+# Imported on first use so that importing this module stays cheap
+torch = lazy_import("torch")
+Pipeline = lazy_attr("pyannote.audio", "Pipeline")
+SlidingWindow = lazy_attr("pyannote.core", "SlidingWindow")
+SlidingWindowFeature = lazy_attr("pyannote.core", "SlidingWindowFeature")
+binarize = lazy_attr("pyannote.audio.utils.signal", "binarize")
+
+
+# pyannote pipelines keep per-call state, so a shared warm pipeline must not
+# run on two threads at once
+_inference_lock = threading.Lock()
+
+
+class DiarizationArtifacts:
+    """Intermediate pyannote outputs of one recording, enough to redo the clustering
+    
+    Segmentation and embedding extraction are the expensive steps of
+    diarization; with these kept, SpeakerDiarizer.recluster() assigns
+    speakers again for another speaker count in a fraction of a second.
+    """
+    
+    def __init__(
+        self,
+        segmentation: np.ndarray,
+        segmentation_window: Tuple[float, float, float],
+        count: np.ndarray,
+        count_window: Tuple[float, float, float],
+        embeddings: np.ndarray
+    ):
+        """
+        Initialize the artifacts
+        
+        Args:
+            segmentation: Local speaker scores, (chunks, frames, local speakers)
+            segmentation_window: (start, duration, step) of the chunks
+            count: Number of active speakers per frame, (frames, 1)
+            count_window: (start, duration, step) of the count frames
+            embeddings: Embedding per chunk and local speaker, (chunks, local speakers, dimension)
+        """
+        self.segmentation = segmentation
+        self.segmentation_window = tuple(float(value) for value in segmentation_window)
+        self.count = count
+        self.count_window = tuple(float(value) for value in count_window)
+        self.embeddings = embeddings
+    
+    @classmethod
+    def from_pyannote(cls, segmentations, count, embeddings) -> "DiarizationArtifacts":
+        """Build from the SlidingWindowFeatures and embeddings pyannote passes to its hook"""
+        def _window(feature):
+            window = feature.sliding_window
+            return (window.start, window.duration, window.step)
+        
+        return cls(
+            # Scores are probabilities; half precision halves the file size
+            np.asarray(segmentations.data, dtype=np.float16),
+            _window(segmentations),
+            np.asarray(count.data, dtype=np.int8),
+            _window(count),
+            np.asarray(embeddings, dtype=np.float32)
+        )
+    
+    def segmentation_feature(self):
+        """Segmentation scores as the SlidingWindowFeature pyannote expects"""
+        start, duration, step = self.segmentation_window
+        return SlidingWindowFeature(
+            self.segmentation.astype(np.float32), SlidingWindow(start=start, duration=duration, step=step)
+        )
+    
+    def count_feature(self):
+        """Speaker count as the SlidingWindowFeature pyannote expects"""
+        start, duration, step = self.count_window
+        return SlidingWindowFeature(self.count.copy(), SlidingWindow(start=start, duration=duration, step=step))
+    
+    @property
+    def nbytes(self) -> int:
+        return self.segmentation.nbytes + self.count.nbytes + self.embeddings.nbytes
+    
+    def save(self, path: str):
+        """Write the artifacts as a compressed .npz file (atomically)"""
+        directory = os.path.dirname(os.path.abspath(path))
+        fd, tmp_path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                np.savez_compressed(
+                    f,
+                    segmentation=self.segmentation,
+                    segmentation_window=np.asarray(self.segmentation_window),
+                    count=self.count,
+                    count_window=np.asarray(self.count_window),
+                    embeddings=self.embeddings
+                )
+            os.replace(tmp_path, path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.unlink(tmp_path)
+            raise
+    
+    @classmethod
+    def load(cls, path: str) -> "DiarizationArtifacts":
+        """Read artifacts written by save()"""
+        with np.load(path) as data:
+            return cls(
+                data["segmentation"],
+                tuple(data["segmentation_window"]),
+                data["count"],
+                tuple(data["count_window"]),
+                data["embeddings"]
+            )
+
+
+@contextmanager
+def _torch_threads(num_threads: int):
+    """Use num_threads torch intra-op threads (0 = unchanged) and restore the count afterwards
+
+    The setting is process-wide, so it must not outlive the inference.
+    """
+    if not num_threads:
+        yield
+        return
+    previous = torch.get_num_threads()
+    torch.set_num_threads(num_threads)
+    try:
+        yield
+    finally:
+        torch.set_num_threads(previous)
+
+
+class _ArtifactCapture:
+    """pyannote hook keeping the outputs recluster() needs, passing every call on
+    
+    pyannote reports progress with total/completed set and calls the hook
+    once more with each step's final output.
+    """
+    
+    STEPS = ("segmentation", "speaker_counting", "embeddings")
+    
+    def __init__(self, hook):
+        self.hook = hook
+        self.outputs: Dict[str, Any] = {}
+    
+    def __call__(self, step_name: str, step_artifact: Any = None, file=None, total=None, completed=None):
+        if step_name in self.STEPS and step_artifact is not None and total is None:
+            self.outputs[step_name] = step_artifact
+        self.hook(step_name, step_artifact, file=file, total=total, completed=completed)
+    
+    def artifacts(self) -> Optional[DiarizationArtifacts]:
+        """The captured artifacts, or None if pyannote skipped a step (e.g. silent audio)"""
+        if any(step not in self.outputs for step in self.STEPS):
+            return None
+        return DiarizationArtifacts.from_pyannote(
+            self.outputs["segmentation"], self.outputs["speaker_counting"], self.outputs["embeddings"]
+        )
 
 
 class SpeakerDiarizer:
     """Speaker diarization using pyannote.audio"""
     
-    def __init__(self, huggingface_token: str = None):
+    def __init__(self, huggingface_token: str = None, num_threads: int = 0):
         """
         Initialize the speaker diarization pipeline
         
         Args:
             huggingface_token: HuggingFace access token for model download
                              If not provided, will try to read from HF_TOKEN environment variable
+            num_threads: torch intra-op threads on CPU (0 = config.DIARIZATION_CPU_THREADS)
         """
-        self.device = torch.device(config.DEVICE if torch.cuda.is_available() else "cpu")
+        # A calibrated host profile (see autotune.py) overrides the config defaults
+        apply_host_profile()
+        self._device = None
         self.pipeline = None
         # Use provided token, fallback to environment variable
         self.huggingface_token = huggingface_token or os.getenv("HF_TOKEN")
+        self.num_threads = num_threads or config.DIARIZATION_CPU_THREADS
+        # Segmentation scores and embeddings of the last run, for recluster()
+        self.last_artifacts: Optional[DiarizationArtifacts] = None
         
+    @property
+    def device(self):
+        """torch device the pipeline runs on (importing torch on first access)"""
+        if self._device is None:
+            self._device = torch.device(config.DEVICE if torch.cuda.is_available() else "cpu")
+        return self._device
+    
+    def model_key(self):
+        """Key of the diarization model in the model registry"""
+        return (config.DIARIZATION_MODEL, self.device.type, None)
+    
     def load_model(self):
-        """Load the diarization model"""
+        """Load the diarization model, reusing a warm instance if one is registered"""
         if self.pipeline is None:
-            self.pipeline = Pipeline.from_pretrained(
+            self.pipeline = get_registry().get(self.model_key(), self._load_pipeline)
+    
+    def _load_pipeline(self):
+        """Load the pyannote pipeline from the hub"""
+        with metrics.span("diarization.load_model"):
+            pipeline = Pipeline.from_pretrained(
                 config.DIARIZATION_MODEL,
                 use_auth_token=self.huggingface_token
             )
-            self.pipeline.to(self.device)
+            pipeline.to(self.device)
+        return pipeline
+    
+    def preload(self):
+        """Start loading the model into the registry in the background"""
+        return get_registry().preload(self.model_key(), self._load_pipeline)
     
-    def diarize(self, audio_path: str) -> List[Tuple[float, float, str]]:
+    def diarize(self, audio: AudioInput) -> List[Tuple[float, float, str]]:
         """
         Perform speaker diarization on audio file
         
         Args:
-            audio_path: Path to audio file
+            audio: Path to audio file or a decoded AudioBuffer
             
         Returns:
             List of tuples (start_time, end_time, speaker_label)
         """
+        segments, _ = self._run(audio, return_embeddings=False)
+        return segments
+    
+    def diarize_with_embeddings(
+        self,
+        audio: AudioInput
+    ) -> Tuple[List[Tuple[float, float, str]], Dict[str, np.ndarray]]:
+        """
+        Perform speaker diarization and return one embedding per speaker
+        
+        Args:
+            audio: Path to audio file or a decoded AudioBuffer
+            
+        Returns:
+            Tuple of (segments, {speaker_label: centroid embedding}). Speakers
+            pyannote could not embed get an all-NaN vector
+        """
+        return self._run(audio, return_embeddings=True)
+    
+    def _run(self, audio: AudioInput, return_embeddings: bool):
         if self.pipeline is None:
             self.load_model()
         
-        # Run diarization
-        diarization = self.pipeline(audio_path)
+        # Run diarization on the shared in-memory waveform when available
+        audio_seconds = audio.duration if isinstance(audio, AudioBuffer) else None
+        if isinstance(audio, AudioBuffer):
+            audio = audio.as_pyannote()
+        threads = self.num_threads if self.device.type == "cpu" else 0
+        with _inference_lock, _torch_threads(threads), \
+                metrics.span("diarization.inference", audio_seconds=audio_seconds):
+            # The hook splits the run into segmentation, embeddings and clustering
+            steps = metrics.PyannoteStepTimer()
+            hook = _ArtifactCapture(steps) if config.DIARIZATION_KEEP_ARTIFACTS else steps
+            if return_embeddings:
+                diarization, embeddings = self.pipeline(audio, hook=hook, return_embeddings=True)
+            else:
+                diarization, embeddings = self.pipeline(audio, hook=hook), None
+            steps.record()
+            metrics.record(speakers=len(diarization.labels()))
+        self.last_artifacts = hook.artifacts() if hook is not steps else None
         
         # Extract segments with speaker labels
         segments = []
         for turn, _, speaker in diarization.itertracks(yield_label=True):
             segments.append((turn.start, turn.end, speaker))
         
+        # Rows of the embedding matrix follow the order of labels()
+        speaker_embeddings = {}
+        if embeddings is not None:
+            for label, embedding in zip(diarization.labels(), embeddings):
+                speaker_embeddings[label] = np.asarray(embedding, dtype=np.float32)
+        
         # Clear VRAM cache after inference to optimize memory usage
         self.clear_cache()
         
-        return segments
+        return segments, speaker_embeddings
+    
+    def recluster(
+        self,
+        artifacts: DiarizationArtifacts,
+        num_speakers: int = None,
+        min_speakers: int = None,
+        max_speakers: int = None,
+        threshold: float = None
+    ) -> List[Tuple[float, float, str]]:
+        """
+        Assign speakers again from kept segmentation scores and embeddings
+        
+        Runs only pyannote's clustering and reconstruction steps, so trying
+        another speaker count takes a fraction of a second instead of a
+        full diarization.
+        
+        Args:
+            artifacts: Artifacts of an earlier run (see last_artifacts)
+            num_speakers: Exact number of speakers
+            min_speakers: Lower bound on the number of speakers
+            max_speakers: Upper bound on the number of speakers
+            threshold: Clustering distance threshold used when the number of
+                       speakers is not fixed (default: the pipeline's)
+            
+        Returns:
+            List of tuples (start_time, end_time, speaker_label)
+        """
+        if self.pipeline is None:
+            self.load_model()
+        pipeline = self.pipeline
+        
+        num_speakers, min_speakers, max_speakers = pipeline.set_num_speakers(
+            num_speakers=num_speakers, min_speakers=min_speakers, max_speakers=max_speakers
+        )
+        segmentations = artifacts.segmentation_feature()
+        count = artifacts.count_feature()
+        
+        with _inference_lock, metrics.span("diarization.recluster"):
+            # Same steps as SpeakerDiarization.apply() after the embeddings.
+            # Powerset segmentation models (3.1) output hard decisions and
+            # their pipelines have no segmentation.threshold
+            if pipeline._segmentation.model.specifications.powerset:
+                binarized = segmentations
+            else:
+                binarized = binarize(segmentations, onset=pipeline.segmentation.threshold, initial_state=False)
+            default_threshold = pipeline.clustering.threshold
+            if threshold is not None:
+                pipeline.clustering.threshold = threshold
+            try:
+                hard_clusters, _, _ = pipeline.clustering(
+                    embeddings=artifacts.embeddings,
+                    segmentations=binarized,
+                    num_clusters=num_speakers,
+                    min_clusters=min_speakers,
+                    max_clusters=max_speakers,
+                    frames=pipeline._segmentation.model.receptive_field
+                )
+            finally:
+                pipeline.clustering.threshold = default_threshold
+            
+            # Cap the instantaneous speaker count by max_speakers and mark
+            # local speakers that are never active
+            count.data = np.minimum(count.data, max_speakers).astype(np.int8)
+            inactive_speakers = np.sum(binarized.data, axis=1) == 0
+            hard_clusters[inactive_speakers] = -2
+            discrete_diarization = pipeline.reconstruct(segmentations, hard_clusters, count)
+            diarization = pipeline.to_annotation(
+                discrete_diarization,
+                min_duration_on=0.0,
+                min_duration_off=pipeline.segmentation.min_duration_off
+            )
+            diarization = diarization.rename_labels(
+                mapping=dict(zip(diarization.labels(), pipeline.classes()))
+            )
+            metrics.record(speakers=len(diarization.labels()))
+        
+        return [(turn.start, turn.end, speaker) for turn, _, speaker in diarization.itertracks(yield_label=True)]
     
     def clear_cache(self):
         """Clear GPU cache to free VRAM after inference"""
-        if torch.cuda.is_available():
+        # Nothing can be cached before torch has been imported
+        if is_imported(torch) and torch.cuda.is_available():
             torch.cuda.empty_cache()
     
-    def cleanup(self):
-        """Cleanup method to release resources and clear VRAM"""
+    def cleanup(self, release: bool = None):
+        """
+        Release this instance's model
+        
+        With config.MODEL_RESIDENCY = "persistent" the model stays warm in the
+        registry for the next job; with "per_stage" it is unloaded to free VRAM
+        unless another instance still holds it.
+        
+        Args:
+            release: Force unloading (True) or keeping (False) the model
+                     regardless of config.MODEL_RESIDENCY
+        """
+        if release is None:
+            release = config.MODEL_RESIDENCY == "per_stage"
         if self.pipeline is not None:
-            # Move pipeline to CPU before deletion to free GPU memory
-            if hasattr(self.pipeline, 'to'):
-                self.pipeline.to(torch.device('cpu'))
+            # The registry moves the pipeline to CPU once no other diarizer holds it
+            get_registry().release(self.model_key(), unload=release)
             del self.pipeline
             self.pipeline = None
         self.clear_cache()
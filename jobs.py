@@ -0,0 +1,762 @@
+"""
+Checkpointed, resumable processing jobs
+"""
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+import contextvars
+import json
+import os
+import shutil
+import socket
+import tempfile
+import threading
+import time
+import uuid
+import config
+from alignment import SpeakerIndex, TranscriptLine, align, collect_units
+from audio_loader import load_audio
+from diarization import DiarizationArtifacts
+from refine import TranscriptRefiner
+from result_cache import hash_file
+from transcript import FORMATS, Transcript
+
+
+# (starts, ends, texts, joiner), see alignment.collect_units
+Units = Tuple[list, list, list, str]
+
+
+def _write_atomic(path: Path, text: str):
+    """Replace a file in one step so a crash never leaves a partial checkpoint"""
+    fd, tmp_path = tempfile.mkstemp(dir=path.parent, suffix=".tmp")
+    try:
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            f.write(text)
+        os.replace(tmp_path, path)
+    except OSError:
+        if os.path.exists(tmp_path):
+            os.unlink(tmp_path)
+        raise
+
+
+def pid_alive(pid: Optional[int]) -> bool:
+    """Check whether a process of this host is still running"""
+    if not pid:
+        return False
+    if os.name == "nt":
+        # os.kill(pid, 0) would terminate the process on Windows
+        return True
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def _owner() -> Dict[str, Any]:
+    """Owner record of jobs started by this process"""
+    return {"pid": os.getpid(), "host": socket.gethostname()}
+
+
+class Job:
+    """Working directory of one recording with a checkpoint per finished stage
+
+    The directory holds:
+
+    - job.json: id, source file name, audio hash, status, completed stages,
+      last error and the process that owns the job (created or last ran it)
+    - audio.<ext>: the recording
+    - diarization.json, transcription.json, summary.json: stage outputs
+    - transcription.partial.jsonl: Whisper units committed while decoding,
+      one line per segment with the audio offset decoded up to then
+    - transcript.txt, summary.txt: the results
+    - transcript.npz: the transcript with line and word timings (see transcript.py)
+    - diarization_artifacts.npz: segmentation scores and embeddings for
+      re-clustering the speakers (see config.DIARIZATION_KEEP_ARTIFACTS)
+    """
+
+    STAGES = ("diarization", "transcription", "summary")
+    MANIFEST = "job.json"
+    PARTIAL = "transcription.partial.jsonl"
+    ARTIFACTS = "diarization_artifacts.npz"
+    TRANSCRIPT = "transcript.npz"
+
+    def __init__(self, workdir: str):
+        """
+        Open an existing job
+
+        Args:
+            workdir: The job's working directory
+        """
+        self.workdir = Path(workdir)
+        with open(self.workdir / self.MANIFEST, encoding="utf-8") as f:
+            self.manifest: Dict[str, Any] = json.load(f)
+        # The refinement may checkpoint on another thread while the summary is saved
+        self._lock = threading.RLock()
+
+    @classmethod
+    def create(
+        cls,
+        audio_path: str,
+        source_name: str = None,
+        audio_hash: str = None,
+        move: bool = False,
+        jobs_dir: str = None
+    ) -> "Job":
+        """
+        Start a job for a recording
+
+        Args:
+            audio_path: Recording to process
+            source_name: Original file name shown in listings (default: the file name)
+            audio_hash: Content hash of the recording, computed if not given
+            move: Move the recording into the working directory instead of copying it
+            jobs_dir: Parent of the working directories (default: config.JOBS_DIR)
+
+        Returns:
+            The new job
+        """
+        job_id = time.strftime("%Y%m%d-%H%M%S-") + uuid.uuid4().hex[:6]
+        workdir = Path(jobs_dir or config.JOBS_DIR) / job_id
+        workdir.mkdir(parents=True)
+
+        audio_name = "audio" + Path(audio_path).suffix.lower()
+        if move:
+            shutil.move(audio_path, workdir / audio_name)
+        else:
+            shutil.copyfile(audio_path, workdir / audio_name)
+
+        now = time.time()
+        manifest = {
+            "job_id": job_id,
+            "source": source_name or Path(audio_path).name,
+            "audio": audio_name,
+            "audio_hash": audio_hash or hash_file(str(workdir / audio_name)),
+            "status": "pending",
+            "completed": [],
+            "error": None,
+            "owner": _owner(),
+            "created": now,
+            "updated": now,
+        }
+        _write_atomic(workdir / cls.MANIFEST, json.dumps(manifest, ensure_ascii=False, indent=2))
+        return cls(workdir)
+
+    @classmethod
+    def open(cls, job_id: str, jobs_dir: str = None) -> "Job":
+        """Open a job by id; raises FileNotFoundError if it does not exist"""
+        return cls(Path(jobs_dir or config.JOBS_DIR) / job_id)
+
+    @property
+    def job_id(self) -> str:
+        return self.manifest["job_id"]
+
+    @property
+    def audio_path(self) -> Path:
+        return self.workdir / self.manifest["audio"]
+
+    @property
+    def audio_hash(self) -> str:
+        return self.manifest["audio_hash"]
+
+    @property
+    def artifacts_path(self) -> Path:
+        return self.workdir / self.ARTIFACTS
+
+    def transcript(self) -> Optional[Transcript]:
+        """The speaker-labelled transcript, or None if the transcription has not finished"""
+        path = self.workdir / self.TRANSCRIPT
+        return Transcript.load(str(path)) if path.exists() else None
+
+    @property
+    def status(self) -> str:
+        """One of pending, running, failed, interrupted and done"""
+        return self.manifest["status"]
+
+    def _update(self, **values: Any):
+        with self._lock:
+            self.manifest.update(values, updated=time.time())
+            _write_atomic(self.workdir / self.MANIFEST, json.dumps(self.manifest, ensure_ascii=False, indent=2))
+
+    def set_status(self, status: str, error: str = None):
+        """Record the job's state and the error that stopped it, if any
+
+        Setting it to running makes this process the job's owner.
+        """
+        if status == "running":
+            self._update(status=status, error=error, owner=_owner())
+        else:
+            self._update(status=status, error=error)
+
+    def owner_alive(self) -> bool:
+        """Whether the process owning the job still runs
+
+        An owner on another host is assumed to be alive, since it cannot be checked.
+        """
+        owner = self.manifest.get("owner")
+        if not owner:
+            return False
+        if owner.get("host") != socket.gethostname():
+            return True
+        return pid_alive(owner.get("pid"))
+
+    @property
+    def resumable(self) -> bool:
+        """Whether the job may be picked up: it failed, was interrupted or its owner died"""
+        if self.status in ("failed", "interrupted"):
+            return True
+        return self.status != "done" and not self.owner_alive()
+
+    def is_done(self, stage: str) -> bool:
+        """Check whether a stage's output is checkpointed"""
+        return stage in self.manifest["completed"]
+
+    def load(self, stage: str) -> Optional[Any]:
+        """
+        Read a stage's checkpoint
+
+        Returns:
+            Speaker segments, transcription units or the summary text, or
+            None if the stage has not finished
+        """
+        if not self.is_done(stage):
+            return None
+        with open(self.workdir / f"{stage}.json", encoding="utf-8") as f:
+            value = json.load(f)
+        if stage == "diarization":
+            return [tuple(segment) for segment in value]
+        if stage == "transcription":
+            return tuple(value)
+        return value
+
+    def save(self, stage: str, value: Any):
+        """
+        Checkpoint a finished stage
+
+        Args:
+            stage: One of STAGES
+            value: JSON-serializable stage output
+        """
+        _write_atomic(self.workdir / f"{stage}.json",
+                      json.dumps(value, ensure_ascii=False, separators=(",", ":")))
+        with self._lock:
+            completed = self.manifest["completed"] + ([stage] if stage not in self.manifest["completed"] else [])
+            self._update(completed=completed)
+        if stage == "transcription" and (self.workdir / self.PARTIAL).exists():
+            os.unlink(self.workdir / self.PARTIAL)
+
+    def commit_units(self, units: Units, offset: float):
+        """
+        Append the units of one decoded Whisper segment to the partial transcription
+
+        Args:
+            units: Units of the segment, times on the recording's timeline
+            offset: Audio decoded so far in seconds; a resumed run starts here
+        """
+        starts, ends, texts, _ = units
+        line = json.dumps({"offset": offset, "starts": starts, "ends": ends, "texts": texts},
+                          ensure_ascii=False)
+        with open(self.workdir / self.PARTIAL, "a", encoding="utf-8") as f:
+            f.write(line + "\n")
+
+    def committed_units(self, joiner: str) -> Tuple[Units, float]:
+        """
+        Units committed by an interrupted transcription
+
+        Args:
+            joiner: Joiner of the returned units
+
+        Returns:
+            Tuple of (units, offset to resume decoding from)
+        """
+        starts, ends, texts = [], [], []
+        offset = 0.0
+        path = self.workdir / self.PARTIAL
+        if not path.exists():
+            return (starts, ends, texts, joiner), offset
+
+        good = 0
+        with open(path, "rb") as f:
+            for line in f:
+                if not line.endswith(b"\n"):
+                    break
+                try:
+                    piece = json.loads(line)
+                except ValueError:
+                    break
+                starts += piece["starts"]
+                ends += piece["ends"]
+                texts += piece["texts"]
+                offset = piece["offset"]
+                good += len(line)
+        if good < path.stat().st_size:
+            # The last write was cut short; drop it so later commits start on a new line
+            os.truncate(path, good)
+        return (starts, ends, texts, joiner), offset
+
+    def write_text(self, name: str, text: str) -> Path:
+        """Write a result file into the working directory"""
+        path = self.workdir / name
+        _write_atomic(path, text)
+        return path
+
+    def remove_audio(self):
+        """Delete the recording, e.g. once the job is done"""
+        if self.audio_path.exists():
+            os.unlink(self.audio_path)
+
+
+def list_jobs(jobs_dir: str = None) -> List[Job]:
+    """All jobs, most recently updated first"""
+    root = Path(jobs_dir or config.JOBS_DIR)
+    jobs = []
+    if root.is_dir():
+        for workdir in root.iterdir():
+            try:
+                jobs.append(Job(workdir))
+            except (OSError, ValueError):
+                continue
+    return sorted(jobs, key=lambda job: job.manifest["updated"], reverse=True)
+
+
+def find_job(audio_hash: str, jobs_dir: str = None) -> Optional[Job]:
+    """Most recent resumable job for a recording, so an upload seen before resumes
+
+    Pending and running jobs are left to their owner unless it died.
+    """
+    for job in list_jobs(jobs_dir):
+        if job.audio_hash == audio_hash and job.resumable and job.audio_path.exists():
+            return job
+    return None
+
+
+def prune_jobs(jobs_dir: str = None, max_age_days: float = None) -> int:
+    """
+    Delete working directories of jobs not touched for a while
+
+    Args:
+        jobs_dir: Parent of the working directories
+        max_age_days: Age limit (default: config.JOB_MAX_AGE_DAYS, 0 keeps everything)
+
+    Returns:
+        Number of deleted jobs
+    """
+    max_age_days = config.JOB_MAX_AGE_DAYS if max_age_days is None else max_age_days
+    if not max_age_days:
+        return 0
+    cutoff = time.time() - max_age_days * 86400
+    removed = 0
+    for job in list_jobs(jobs_dir):
+        if job.manifest["updated"] < cutoff:
+            shutil.rmtree(job.workdir, ignore_errors=True)
+            removed += 1
+    return removed
+
+
+class JobRunner:
+    """Run a job through a TranscriptionPipeline, skipping checkpointed stages
+
+    Diarization and the summary are checkpointed as soon as they finish.
+    Whisper units are committed segment by segment, so an interrupted
+    transcription resumes at the end of the last committed segment instead
+    of decoding the recording from the start.
+
+    With a draft transcriber, stream() yields the draft model's decoding and
+    leaves a refiner; refine() then replaces the draft region by region with
+    the pipeline's transcriber, committing each refined region instead.
+    """
+
+    def __init__(self, job: Job, pipeline, draft_transcriber=None):
+        """
+        Initialize the runner
+
+        Args:
+            job: Job to run or resume
+            pipeline: TranscriptionPipeline providing the models and the result cache
+            draft_transcriber: Fast AudioTranscriber for a two-pass transcription
+                               (see refine.make_draft_transcriber)
+        """
+        self.job = job
+        self.pipeline = pipeline
+        self.draft_transcriber = draft_transcriber
+        # Set by stream() when the transcript is a draft still to be refined
+        self.refiner: Optional[TranscriptRefiner] = None
+        # Set while stream() runs, for progress reporting
+        self.speaker_segments = None
+        self.duration = None
+        # Audio offset the transcription resumed from (0.0 for a fresh run)
+        self.resumed_from = 0.0
+        self.transcription: Optional[str] = None
+        self._transcript: Optional[Transcript] = None
+        # Set when refine() replaced a region since the transcript was last built
+        self._transcript_stale = False
+        self._transcript_lock = threading.Lock()
+        self._refine_cancelled = threading.Event()
+
+    @property
+    def transcript(self) -> Optional[Transcript]:
+        """The speaker-labelled transcript; during refine() the refined regions and the draft of the rest
+
+        Rebuilt from the refiner on access, not after every refined region,
+        so the refinement stays linear in the number of units.
+        """
+        with self._transcript_lock:
+            refiner = self.refiner
+            if self._transcript_stale and refiner is not None:
+                self._transcript_stale = False
+                self._transcript = Transcript.from_units(refiner.units(), self.speaker_segments)
+            return self._transcript
+
+    @transcript.setter
+    def transcript(self, transcript: Optional[Transcript]):
+        with self._transcript_lock:
+            self._transcript = transcript
+            self._transcript_stale = False
+
+    @contextmanager
+    def _tracking(self):
+        """Record failures and interruptions in the job before passing them on"""
+        self.job.set_status("running")
+        try:
+            yield
+        except Exception as e:
+            self.job.set_status("failed", f"{type(e).__name__}: {e}")
+            raise
+        except BaseException:
+            # Generator closed early, KeyboardInterrupt or a Streamlit rerun
+            self.job.set_status("interrupted")
+            raise
+
+    def stream(self) -> Iterator[TranscriptLine]:
+        """
+        Diarize and transcribe, yielding speaker-labelled records like TranscriptionPipeline.stream
+
+        Records of committed units are replayed first, then decoding
+        continues from the committed offset. Afterwards ``transcript`` holds
+        the speaker-labelled transcript (written to transcript.npz) and
+        ``transcription`` its text (written to transcript.txt). In a two-pass
+        run these are the draft, and ``refiner`` is set unless the
+        transcription came from a checkpoint or the cache.
+
+        Yields:
+            Unstripped (start_time, end_time, speaker_label, text) records
+        """
+        with self._tracking():
+            yield from self._stream()
+
+    def _stream(self) -> Iterator[TranscriptLine]:
+        job, pipeline = self.job, self.pipeline
+        joiner = "" if config.WORD_TIMESTAMPS else " "
+        speaker_segments = job.load("diarization")
+        if speaker_segments is None:
+            speaker_segments = pipeline.lookup("diarization", job.audio_hash)
+        units = job.load("transcription")
+        if units is None:
+            units = pipeline.lookup("transcription", job.audio_hash)
+        committed, offset = job.committed_units(joiner) if units is None else (None, 0.0)
+        self.resumed_from = offset
+
+        audio = None
+        if speaker_segments is None or units is None:
+            audio = load_audio(str(job.audio_path))
+            self.duration = audio.duration
+
+        # Whisper pass that streams: the draft model in a two-pass run
+        transcriber = self.draft_transcriber or pipeline.transcriber
+        segments = None
+        if speaker_segments is None:
+            if units is None and offset == 0.0 and pipeline.can_run_parallel():
+                segments, speaker_segments = pipeline._diarize_while_decoding(audio, transcriber)
+            else:
+                speaker_segments = pipeline.diarizer.diarize(audio)
+                if units is None:
+                    # Free VRAM before the transcription model is loaded if it needs the room
+                    pipeline.diarizer.cleanup(release=pipeline.release_before_transcription(transcriber))
+            pipeline.store("diarization", job.audio_hash, speaker_segments)
+            artifacts = getattr(pipeline.diarizer, "last_artifacts", None)
+            if isinstance(artifacts, DiarizationArtifacts):
+                artifacts.save(str(job.artifacts_path))
+        if not job.is_done("diarization"):
+            job.save("diarization", speaker_segments)
+
+        self.speaker_segments = speaker_segments
+        index = SpeakerIndex(speaker_segments)
+
+        if units is None:
+            units = committed
+            if units[0]:
+                yield from align(units[0], units[1], units[2], index, joiner=joiner, strip=False)
+            if segments is None:
+                segments = self._remaining_segments(audio, offset, speaker_segments, transcriber)
+            for segment in segments:
+                starts, ends, texts, _ = collect_units([segment], use_words=config.WORD_TIMESTAMPS)
+                piece = ([start + offset for start in starts], [end + offset for end in ends], texts, joiner)
+                if self.draft_transcriber is None:
+                    job.commit_units(piece, offset + segment.end)
+                units[0].extend(piece[0])
+                units[1].extend(piece[1])
+                units[2].extend(texts)
+                yield from align(piece[0], piece[1], texts, index, joiner=joiner, strip=False)
+            if self.draft_transcriber is not None:
+                # Only refined regions are committed; the draft is shown until refine() replaces it
+                self.refiner = TranscriptRefiner(pipeline.transcriber, audio, speaker_segments, units,
+                                                 refined_until=offset)
+                self._write_transcript(units, speaker_segments)
+                return
+            pipeline.store("transcription", job.audio_hash, units)
+        if not job.is_done("transcription"):
+            job.save("transcription", units)
+
+        self._write_transcript(units, speaker_segments)
+
+    def _write_transcript(self, units: Units, speaker_segments):
+        """Align the units to the speaker turns and write transcript.npz and transcript.txt"""
+        self.transcript = Transcript.from_units(units, speaker_segments)
+        self.transcript.save(str(self.job.workdir / Job.TRANSCRIPT))
+        self.transcription = self.transcript.to_text()
+        self.job.write_text("transcript.txt", self.transcription)
+
+    def can_recluster(self) -> bool:
+        """Whether the job kept what recluster() needs"""
+        return self.job.artifacts_path.exists() and self.job.is_done("transcription")
+
+    def recluster(self, num_speakers: int = None, min_speakers: int = None, max_speakers: int = None) -> str:
+        """
+        Assign the speakers again for another speaker count, without diarizing again
+
+        Re-runs only pyannote's clustering on the kept artifacts and
+        relabels the checkpointed transcription units. The diarization
+        checkpoint and the transcript files are replaced; a checkpointed summary
+        keeps the speaker labels it was written with.
+
+        Args:
+            num_speakers: Exact number of speakers
+            min_speakers: Lower bound on the number of speakers
+            max_speakers: Upper bound on the number of speakers
+
+        Returns:
+            The relabelled transcript
+        """
+        job, pipeline = self.job, self.pipeline
+        units = job.load("transcription")
+        if units is None or not job.artifacts_path.exists():
+            raise FileNotFoundError(f"Job {job.job_id} has no diarization artifacts to re-cluster")
+        artifacts = DiarizationArtifacts.load(str(job.artifacts_path))
+        speaker_segments = pipeline.diarizer.recluster(
+            artifacts, num_speakers=num_speakers, min_speakers=min_speakers, max_speakers=max_speakers
+        )
+        job.save("diarization", speaker_segments)
+        self.speaker_segments = speaker_segments
+        self._write_transcript(units, speaker_segments)
+        return self.transcription
+
+    def refine(self, on_update: Callable[[TranscriptRefiner], None] = None) -> str:
+        """
+        Replace the draft left by stream() region by region with the pipeline's transcriber
+
+        Each refined region is committed like a decoded segment, so an
+        interrupted refinement resumes after the last refined region, and
+        ``transcript`` shows the refined regions. The finished transcription is
+        checkpointed and cached as the transcription stage. Without a draft
+        this does nothing.
+
+        Args:
+            on_update: Called with the refiner after each refined region
+
+        Returns:
+            The refined transcript
+        """
+        refiner = self.refiner
+        if refiner is None:
+            return self.transcription
+        job = self.job
+        with self._tracking():
+            for index in refiner.iter_refine():
+                job.commit_units(refiner.region_units[index] + (refiner.joiner,), refiner.regions[index][1])
+                self._transcript_stale = True
+                if on_update is not None:
+                    on_update(refiner)
+                if self._refine_cancelled.is_set():
+                    break
+        if not refiner.done:
+            # Cancelled; a resumed run refines the rest after the committed regions
+            job.set_status("interrupted")
+            return self.transcription
+        units = refiner.units()
+        self.pipeline.store("transcription", job.audio_hash, units)
+        job.save("transcription", units)
+        self._write_transcript(units, self.speaker_segments)
+        self.refiner = None
+        return self.transcription
+
+    def cancel_refine(self):
+        """Stop a refine() running on another thread after the region it is refining
+
+        The job is left interrupted, so it can be resumed. Wait for refine()
+        to return before releasing the pipeline's transcriber.
+        """
+        self._refine_cancelled.set()
+
+    def _remaining_segments(self, audio, offset: float, speaker_segments, transcriber=None) -> Iterator:
+        """Whisper segments of the audio after offset, times relative to offset"""
+        if offset:
+            audio = audio.slice(offset)
+            speaker_segments = [
+                (max(start - offset, 0.0), end - offset, label)
+                for start, end, label in speaker_segments if end > offset
+            ]
+        return (transcriber or self.pipeline.transcriber).iter_segments(audio, speaker_segments)
+
+    def summarize(self, summarizer, use_map_reduce: bool = False) -> str:
+        """
+        Summarize the transcript unless a summary is checkpointed
+
+        Args:
+            summarizer: ConversationSummarizer instance
+            use_map_reduce: Use MapReduce for long transcripts
+
+        Returns:
+            Summary text, also written to summary.txt
+        """
+        summary = self.job.load("summary")
+        if summary is None:
+            with self._tracking():
+                summary = summarizer.summarize(self.transcription, use_map_reduce=use_map_reduce)
+            self.job.save("summary", summary)
+            self.job.write_text("summary.txt", summary)
+        return summary
+
+    def summarize_stream(self, summarizer, use_map_reduce: bool = False) -> Iterator[str]:
+        """
+        Like summarize(), yielding the summary as it is generated
+
+        A checkpointed summary is yielded whole. The summary is checkpointed
+        once complete; closing the generator early leaves the job
+        interrupted, and the summary is generated again on resume.
+
+        Args:
+            summarizer: ConversationSummarizer instance
+            use_map_reduce: Use MapReduce for long transcripts
+
+        Yields:
+            Pieces of the summary (empty strings while MapReduce map calls run)
+        """
+        summary = self.job.load("summary")
+        if summary is not None:
+            yield summary
+            return
+        pieces = []
+        with self._tracking():
+            stream = summarizer.summarize_stream(self.transcription, use_map_reduce=use_map_reduce)
+            try:
+                for piece in stream:
+                    pieces.append(piece)
+                    yield piece
+            finally:
+                stream.close()
+        summary = "".join(pieces).strip()
+        self.job.save("summary", summary)
+        self.job.write_text("summary.txt", summary)
+
+    def finish(self):
+        """Mark the job done and drop the recording unless config.JOB_KEEP_AUDIO"""
+        self.job.set_status("done")
+        if not config.JOB_KEEP_AUDIO:
+            self.job.remove_audio()
+
+    def run(self, summarizer=None, use_map_reduce: bool = False) -> Dict[str, Any]:
+        """
+        Run or resume every stage of the job
+
+        In a two-pass run the summary is written from the refined text, or
+        from the draft while it is refined if config.DRAFT_SUMMARY_WAITS is off.
+
+        Args:
+            summarizer: ConversationSummarizer instance (None skips the summary)
+            use_map_reduce: Use MapReduce for long transcripts
+
+        Returns:
+            Dict with speaker_segments, transcription and summary
+        """
+        for _ in self.stream():
+            pass
+        summary = None
+        if self.refiner is not None and summarizer is not None and not config.DRAFT_SUMMARY_WAITS:
+            with ThreadPoolExecutor(max_workers=1, thread_name_prefix="voxlens-refine") as executor:
+                # Each thread needs its own copy of the context, see metrics.track
+                refining = executor.submit(contextvars.copy_context().run, self.refine)
+                summary = self.summarize(summarizer, use_map_reduce)
+                refining.result()
+        else:
+            self.refine()
+            if summarizer is not None:
+                summary = self.summarize(summarizer, use_map_reduce)
+        self.finish()
+        return {
+            "speaker_segments": self.speaker_segments,
+            "transcription": self.transcription,
+            "summary": summary,
+        }
+
+
+def add_arguments(parser):
+    """Register the jobs subcommand's arguments"""
+    parser.add_argument("--resume", metavar="JOB_ID", help="Resume a failed or interrupted job")
+    parser.add_argument("--export", metavar="JOB_ID", help="Export a finished job's transcript")
+    parser.add_argument("--format", choices=FORMATS, default="srt", help="Export format (default: srt)")
+    parser.add_argument("--words", action="store_true", help="Include word timings (jsonl only)")
+    parser.add_argument("-o", "--output", help="Export file (default: transcript.<format> in the job directory)")
+    parser.add_argument("--no-summary", action="store_true", help="Skip summarization when resuming")
+    parser.add_argument("--map-reduce", action="store_true", help="Always use MapReduce summarization")
+    parser.add_argument("--hf-token", default=os.getenv("HF_TOKEN"),
+                        help="HuggingFace token (default: HF_TOKEN environment variable)")
+
+
+def main(args) -> int:
+    """List jobs, resume one or export its transcript"""
+    if args.export:
+        job = Job.open(args.export)
+        transcript = job.transcript()
+        if transcript is None:
+            print(f"Job {job.job_id} has no finished transcript")
+            return 1
+        path = args.output or str(job.workdir / f"transcript.{args.format}")
+        print(f"Exported: {transcript.export(path, args.format, words=args.words)}")
+        return 0
+
+    if not args.resume:
+        for job in list_jobs():
+            stages = ", ".join(job.manifest["completed"]) or "-"
+            error = f"  {job.manifest['error']}" if job.manifest["error"] else ""
+            print(f"{job.job_id}  {job.status:<11}  {job.manifest['source']}  [{stages}]{error}")
+        return 0
+
+    from diarization import SpeakerDiarizer
+    from transcription import AudioTranscriber
+    from pipeline import TranscriptionPipeline
+    from refine import make_draft_transcriber
+    from result_cache import get_result_cache
+    from summarization import ConversationSummarizer
+
+    job = Job.open(args.resume)
+    cache = get_result_cache()
+    pipeline = TranscriptionPipeline(
+        SpeakerDiarizer(huggingface_token=args.hf_token), AudioTranscriber(), cache=cache
+    )
+    draft_transcriber = make_draft_transcriber()
+    runner = JobRunner(job, pipeline, draft_transcriber)
+    summarizer = None if args.no_summary else ConversationSummarizer(cache=cache)
+    try:
+        runner.run(summarizer, use_map_reduce=args.map_reduce)
+    finally:
+        pipeline.diarizer.cleanup()
+        pipeline.transcriber.cleanup()
+        if draft_transcriber is not None:
+            draft_transcriber.cleanup()
+    if runner.resumed_from:
+        print(f"Resumed transcription at {runner.resumed_from:.1f}s")
+    print(f"Done: {job.workdir}")
+    return 0
@@ -0,0 +1,202 @@
+"""
+Deferred imports of heavy dependencies and import-time measurement
+"""
+from typing import Any, Dict, List, Sequence, Tuple
+import importlib
+import json
+import os
+import subprocess
+import sys
+import threading
+
+
+# Packages that take seconds to import; none of them may be imported just
+# by importing app.py or the pipeline modules
+HEAVY_MODULES = ("torch", "torchaudio", "pyannote", "faster_whisper", "ctranslate2", "langchain",
+                 "langchain_community", "langchain_core")
+
+
+class LazyModule:
+    """Stand-in for a module that is imported on first attribute access
+
+    Replaces ``import torch`` at the top of a module, so importing that
+    module stays cheap. The name is still a module attribute, so tests can
+    patch it (e.g. ``patch("diarization.torch")``).
+    """
+
+    def __init__(self, name: str):
+        object.__setattr__(self, "_name", name)
+        object.__setattr__(self, "_module", None)
+        object.__setattr__(self, "_lock", threading.Lock())
+
+    def _load(self):
+        module = self._module
+        if module is None:
+            with self._lock:
+                if self._module is None:
+                    object.__setattr__(self, "_module", importlib.import_module(self._name))
+                module = self._module
+        return module
+
+    def __getattr__(self, attr: str) -> Any:
+        if attr.startswith("_") and self._module is None:
+            # Introspection (unittest.mock, inspect, copy) probes private names,
+            # which must not trigger the import; they resolve once loaded
+            raise AttributeError(attr)
+        return getattr(self._load(), attr)
+
+    def __setattr__(self, attr: str, value: Any):
+        setattr(self._load(), attr, value)
+
+    def __dir__(self):
+        return dir(self._load())
+
+    def __repr__(self) -> str:
+        state = "imported" if self._module is not None else "not imported"
+        return f"<lazy module {self._name!r} ({state})>"
+
+
+class LazyAttribute:
+    """Stand-in for a class or function of a module imported on first use
+
+    Calls and attribute access are forwarded, so ``WhisperModel(...)`` and
+    ``Pipeline.from_pretrained(...)`` work unchanged.
+    """
+
+    def __init__(self, module: str, name: str):
+        object.__setattr__(self, "_module_name", module)
+        object.__setattr__(self, "_name", name)
+        object.__setattr__(self, "_target", None)
+        object.__setattr__(self, "_lock", threading.Lock())
+
+    def _load(self):
+        target = self._target
+        if target is None:
+            with self._lock:
+                if self._target is None:
+                    module = importlib.import_module(self._module_name)
+                    object.__setattr__(self, "_target", getattr(module, self._name))
+                target = self._target
+        return target
+
+    def __call__(self, *args, **kwargs):
+        return self._load()(*args, **kwargs)
+
+    def __getattr__(self, attr: str) -> Any:
+        if attr.startswith("_") and self._target is None:
+            raise AttributeError(attr)
+        return getattr(self._load(), attr)
+
+    def __repr__(self) -> str:
+        state = "imported" if self._target is not None else "not imported"
+        return f"<lazy {self._module_name}.{self._name} ({state})>"
+
+
+def lazy_import(name: str) -> LazyModule:
+    """Module imported on first use, for ``torch = lazy_import("torch")``"""
+    return LazyModule(name)
+
+
+def lazy_attr(module: str, name: str) -> LazyAttribute:
+    """Module member imported on first use, for ``Pipeline = lazy_attr("pyannote.audio", "Pipeline")``"""
+    return LazyAttribute(module, name)
+
+
+def is_imported(obj: Any) -> bool:
+    """
+    Whether a lazy stand-in has loaded its target
+
+    Lets cleanup code skip work that only matters once a library is in use,
+    e.g. clearing the CUDA cache when torch was never imported. Anything
+    that is not a lazy stand-in counts as imported.
+    """
+    if isinstance(obj, LazyModule):
+        return obj._module is not None
+    if isinstance(obj, LazyAttribute):
+        return obj._target is not None
+    return True
+
+
+_PROBE = """
+import json, sys, time
+started = time.perf_counter()
+import {module}
+elapsed = time.perf_counter() - started
+heavy = sorted({{name.split(".")[0] for name in sys.modules}} & set({heavy!r}))
+print(json.dumps({{"seconds": elapsed, "heavy": heavy}}))
+"""
+
+
+def probe_import(module: str, python: str = None) -> Dict[str, Any]:
+    """
+    Import a module in a fresh interpreter
+
+    Args:
+        module: Module name, e.g. "app"
+        python: Interpreter to use (default: the current one)
+
+    Returns:
+        Dict with the import's wall time in seconds and the heavy packages
+        (see HEAVY_MODULES) it pulled in
+    """
+    code = _PROBE.format(module=module, heavy=HEAVY_MODULES)
+    completed = subprocess.run(
+        [python or sys.executable, "-c", code],
+        capture_output=True, text=True, cwd=os.path.dirname(os.path.abspath(__file__))
+    )
+    if completed.returncode != 0:
+        raise ImportError(completed.stderr.strip().splitlines()[-1] if completed.stderr else module)
+    return json.loads(completed.stdout.strip().splitlines()[-1])
+
+
+def import_times(module: str, python: str = None, top: int = 20) -> List[Tuple[str, float, float]]:
+    """
+    Time every module imported along with a module, using ``python -X importtime``
+
+    Args:
+        module: Module name
+        python: Interpreter to use (default: the current one)
+        top: Number of entries to return
+
+    Returns:
+        (module, self_seconds, cumulative_seconds) sorted by cumulative time
+    """
+    completed = subprocess.run(
+        [python or sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        capture_output=True, text=True, cwd=os.path.dirname(os.path.abspath(__file__))
+    )
+    rows = []
+    for line in completed.stderr.splitlines():
+        # import time:  self [us] | cumulative | imported package
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|")
+        rows.append((name.strip(), int(self_us) / 1e6, int(cumulative_us) / 1e6))
+    rows.sort(key=lambda row: row[2], reverse=True)
+    return rows[:top]
+
+
+def check_startup(modules: Sequence[str], budget: float) -> List[Dict[str, Any]]:
+    """
+    Probe modules against an import-time budget
+
+    Args:
+        modules: Module names to import, each in a fresh interpreter
+        budget: Allowed seconds per import
+
+    Returns:
+        One dict per module with its name, seconds, heavy packages, the
+        import error (if any) and whether it stayed within the budget
+        without importing heavy packages
+    """
+    results = []
+    for module in modules:
+        try:
+            probe = probe_import(module)
+            probe["error"] = None
+        except ImportError as e:
+            probe = {"seconds": 0.0, "heavy": [], "error": str(e)}
+        probe["module"] = module
+        probe["ok"] = probe["error"] is None and probe["seconds"] <= budget and not probe["heavy"]
+        results.append(probe)
+    return results
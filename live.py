@@ -0,0 +1,452 @@
+"""
+Live transcription of a PCM stream: rolling-window Whisper decoding with
+committed and tentative text, and incremental speaker assignment
+"""
+from typing import Any, BinaryIO, Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+import contextvars
+import os
+import queue
+import socket
+import threading
+import time
+import numpy as np
+import config
+import metrics
+from alignment import SpeakerIndex, TranscriptLine, align, merge_lines
+from audio_loader import AudioBuffer, AudioInput, load_audio
+from sharding import SpeakerLinker
+
+
+# (start_time, end_time, text) of a decoded word on the stream's timeline
+Word = Tuple[float, float, str]
+
+
+def pcm_chunks(stream: BinaryIO, chunk_seconds: float = None) -> Iterator[np.ndarray]:
+    """
+    Read 16-bit little-endian mono PCM at config.SAMPLE_RATE from a binary stream
+
+    Args:
+        stream: e.g. a socket's makefile("rb") or sys.stdin.buffer
+        chunk_seconds: Audio per chunk (default: config.LIVE_CHUNK_SECONDS)
+
+    Yields:
+        float32 sample chunks until the stream ends
+    """
+    chunk_bytes = int((chunk_seconds or config.LIVE_CHUNK_SECONDS) * config.SAMPLE_RATE) * 2
+    pending = b""
+    while True:
+        data = stream.read(chunk_bytes)
+        if not data:
+            return
+        pending += data
+        usable = len(pending) - len(pending) % 2
+        if usable:
+            yield np.frombuffer(pending[:usable], dtype="<i2").astype(np.float32) / 32768.0
+            pending = pending[usable:]
+
+
+def listen(host: str = None, port: int = None, chunk_seconds: float = None) -> Iterator[np.ndarray]:
+    """
+    Accept one TCP connection and read its PCM (see pcm_chunks)
+
+    A microphone can be streamed with e.g.
+    ``ffmpeg -f pulse -i default -ac 1 -ar 16000 -f s16le tcp://127.0.0.1:8766``.
+    """
+    with socket.create_server((host or config.LIVE_HOST, port or config.LIVE_PORT)) as server:
+        connection, _ = server.accept()
+        with connection, connection.makefile("rb") as stream:
+            yield from pcm_chunks(stream, chunk_seconds)
+
+
+def replay(audio: AudioInput, chunk_seconds: float = None, speed: float = 1.0) -> Iterator[np.ndarray]:
+    """
+    Play a recording back as a live source, for testing and measuring lag
+
+    Args:
+        audio: Path to audio file or a decoded AudioBuffer
+        chunk_seconds: Audio per chunk (default: config.LIVE_CHUNK_SECONDS)
+        speed: Playback speed relative to real time (0 = as fast as it is read)
+
+    Yields:
+        float32 sample chunks, each released when it would have been recorded
+    """
+    audio = load_audio(audio)
+    step = int((chunk_seconds or config.LIVE_CHUNK_SECONDS) * audio.sample_rate)
+    started = time.monotonic()
+    for first in range(0, len(audio.samples), step):
+        chunk = audio.samples[first:first + step]
+        if speed:
+            delay = started + (first + len(chunk)) / audio.sample_rate / speed - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+        yield chunk
+
+
+class LocalAgreement:
+    """Commit the words two consecutive decodes of the rolling window agree on
+
+    Whisper's last words change as more audio arrives. A word is committed
+    once the longest common prefix of the current and the previous
+    hypothesis (after the already committed words) contains it; the rest
+    stays tentative.
+    """
+
+    def __init__(self):
+        self.tentative: List[Word] = []
+        self.committed_until = 0.0
+
+    @staticmethod
+    def _same(a: Word, b: Word) -> bool:
+        return a[2].strip().casefold() == b[2].strip().casefold()
+
+    def update(self, words: List[Word]) -> List[Word]:
+        """
+        Compare a new hypothesis with the previous one
+
+        Args:
+            words: Words decoded from the rolling window
+
+        Returns:
+            Newly committed words
+        """
+        words = [word for word in words if (word[0] + word[1]) / 2 > self.committed_until]
+        agreed = []
+        for new, old in zip(words, self.tentative):
+            if not self._same(new, old):
+                break
+            agreed.append(new)
+        self.tentative = words[len(agreed):]
+        if agreed:
+            self.committed_until = agreed[-1][1]
+        return agreed
+
+    def flush(self) -> List[Word]:
+        """Commit the tentative words, e.g. at the end of the stream"""
+        words, self.tentative = self.tentative, []
+        if words:
+            self.committed_until = words[-1][1]
+        return words
+
+
+class LiveTranscriber:
+    """Transcribe a live PCM stream with bounded lag
+
+    Every step seconds of new audio, Whisper decodes the rolling window
+    (audio since the last trim, at most max_window seconds) with the
+    committed text as prompt, and LocalAgreement commits the stable words.
+    The window is trimmed at the last committed word once it grows past
+    max_window, so a decode never covers more than that and the lag stays
+    bounded even when the host is slow; audio that arrives during a decode
+    is picked up whole by the next step.
+
+    Speakers come from diarizing the latest diarization_window seconds every
+    diarization_interval seconds and linking the local speakers to the
+    session's speakers by embedding (online clustering, see
+    sharding.SpeakerLinker). Committed words are released with their
+    speaker once the diarization covers them.
+    """
+
+    def __init__(
+        self,
+        transcriber=None,
+        diarizer=None,
+        decode: Callable[[AudioBuffer, float, str], List[Word]] = None,
+        step: float = None,
+        max_window: float = None,
+        diarization_interval: float = None,
+        diarization_window: float = None,
+        link_threshold: float = None
+    ):
+        """
+        Initialize the session
+
+        Args:
+            transcriber: AudioTranscriber (default: a new one, unless decode is given)
+            diarizer: SpeakerDiarizer; None labels everything SPEAKER_00
+            decode: Function decoding a window (audio, its start time, prompt) into
+                    words on the stream's timeline (default: faster-whisper via transcriber)
+            step: Seconds of new audio between decodes (default: config.LIVE_STEP_SECONDS)
+            max_window: Longest rolling window in seconds (default: config.LIVE_MAX_WINDOW)
+            diarization_interval: Seconds of new audio between diarization passes
+                                  (default: config.LIVE_DIARIZATION_INTERVAL)
+            diarization_window: Audio each diarization pass looks at
+                                (default: config.LIVE_DIARIZATION_WINDOW)
+            link_threshold: Maximum cosine distance for linking a local speaker to a
+                            known one (default: config.SHARD_LINK_THRESHOLD)
+        """
+        if transcriber is None and decode is None:
+            from transcription import AudioTranscriber
+            transcriber = AudioTranscriber()
+        self.transcriber = transcriber
+        self.diarizer = diarizer
+        self.decode = decode or self._decode
+        self.step = step or config.LIVE_STEP_SECONDS
+        self.max_window = max_window or config.LIVE_MAX_WINDOW
+        self.diarization_interval = diarization_interval or config.LIVE_DIARIZATION_INTERVAL
+        self.diarization_window = diarization_window or config.LIVE_DIARIZATION_WINDOW
+        self.linker = SpeakerLinker(link_threshold)
+        self.agreement = LocalAgreement()
+        self.sample_rate = config.SAMPLE_RATE
+
+        # Recent audio, starting at self.offset on the stream's timeline
+        self.samples = np.zeros(0, dtype=np.float32)
+        self.offset = 0.0
+        self.received = 0.0
+        self.window_start = 0.0
+        # Committed words (all, and those still waiting for a speaker)
+        self.words: List[Word] = []
+        self._pending: List[Word] = []
+        self._prompt = ""
+        self.speaker_segments: List[Tuple[float, float, str]] = []
+        self.diarized_until = 0.0
+        self._diarized_at = 0.0
+        self.emitted_until = 0.0
+        self._lags: List[float] = []
+        self._backlogs: List[float] = []
+        self._step_seconds: List[float] = []
+
+    def run(self, source: Iterable[np.ndarray], background: bool = True) -> Iterator[Dict[str, Any]]:
+        """
+        Process a PCM source until it ends
+
+        Args:
+            source: Iterable of float32 chunks, e.g. listen() or replay()
+            background: Read the source on its own thread, so audio keeps
+                        arriving while a step decodes and the next step takes
+                        everything received so far. False reads it between
+                        steps, stepping exactly every step seconds of audio
+                        (deterministic, e.g. for replays at speed 0)
+
+        Yields:
+            One update per step: the lines released in it (unstripped
+            TranscriptLine records, see merge_lines), the tentative text,
+            and received/committed_until/emitted_until/lag/backlog/step_seconds
+        """
+        decoded_until = 0.0
+        for samples in (self._drain(source) if background else source):
+            self._append(samples)
+            if self.received - decoded_until >= self.step:
+                backlog = self.received - decoded_until
+                decoded_until = self.received
+                yield self._step(backlog, final=False)
+        yield self._step(self.received - decoded_until, final=True)
+
+        stats = self.stats()
+        metrics.add_span("live", stats.pop("processing_seconds"), **stats)
+
+    @staticmethod
+    def _drain(source: Iterable[np.ndarray]) -> Iterator[np.ndarray]:
+        """Read the source on a thread; yield everything that arrived since the last call at once"""
+        chunks: "queue.Queue[Optional[np.ndarray]]" = queue.Queue()
+
+        def _read():
+            try:
+                for chunk in source:
+                    chunks.put(chunk)
+            finally:
+                chunks.put(None)
+
+        threading.Thread(target=contextvars.copy_context().run, args=(_read,),
+                         name="voxlens-live-source", daemon=True).start()
+        finished = False
+        while not finished:
+            pieces = [chunks.get()]
+            while pieces[-1] is not None and not chunks.empty():
+                pieces.append(chunks.get_nowait())
+            finished = pieces[-1] is None
+            pieces = [piece for piece in pieces if piece is not None]
+            if pieces:
+                yield np.concatenate(pieces)
+
+    def _append(self, samples: np.ndarray):
+        self.samples = np.concatenate((self.samples, samples))
+        self.received += len(samples) / self.sample_rate
+
+    def _audio(self, start: float) -> AudioBuffer:
+        """Kept audio from a time on the stream's timeline"""
+        first = max(0, int(round((start - self.offset) * self.sample_rate)))
+        return AudioBuffer(self.samples[first:], self.sample_rate)
+
+    def _step(self, backlog: float, final: bool) -> Dict[str, Any]:
+        started = time.perf_counter()
+        window = self._audio(self.window_start)
+        words = self.decode(window, self.window_start, self._prompt) if window.duration > 0 else []
+        self._commit(self.agreement.update(words))
+        if final:
+            self._commit(self.agreement.flush())
+        self._trim()
+
+        if self.diarizer is not None and (final or self.received - self._diarized_at >= self.diarization_interval):
+            self._diarize(final)
+        lines = self._release(final)
+        step_seconds = time.perf_counter() - started
+
+        lag = self.received - self.emitted_until
+        self._lags.append(lag)
+        self._backlogs.append(backlog)
+        self._step_seconds.append(step_seconds)
+        return {
+            "lines": lines,
+            "tentative": "".join(word[2] for word in self.agreement.tentative).strip(),
+            "received": self.received,
+            "committed_until": self.agreement.committed_until,
+            "emitted_until": self.emitted_until,
+            "lag": lag,
+            "backlog": backlog,
+            "step_seconds": step_seconds,
+            "final": final,
+        }
+
+    def _commit(self, words: List[Word]):
+        if not words:
+            return
+        self.words.extend(words)
+        self._pending.extend(words)
+        self._prompt = (self._prompt + "".join(word[2] for word in words))[-config.LIVE_PROMPT_CHARS:]
+
+    def _trim(self):
+        """Keep the rolling window within max_window and drop audio no step needs any more"""
+        if self.received - self.window_start > self.max_window:
+            if self.agreement.committed_until <= self.window_start:
+                # Nothing stabilized within a whole window; take Whisper's word for it
+                self._commit(self.agreement.flush())
+            self.window_start = max(self.agreement.committed_until, self.received - self.max_window)
+        keep_from = min(self.window_start, self.received - self.diarization_window)
+        if self.diarizer is not None:
+            keep_from = min(keep_from, self.diarized_until)
+        if keep_from > self.offset:
+            self.samples = self.samples[int(round((keep_from - self.offset) * self.sample_rate)):]
+            self.offset = keep_from
+
+    def _diarize(self, final: bool):
+        """Diarize the latest audio and extend the speaker turns with its newest part"""
+        # A backlog longer than the window is diarized whole rather than left without speakers
+        region_start = max(self.offset, min(self.diarized_until, self.received - self.diarization_window))
+        region = self._audio(region_start)
+        if region.duration < 1.0:
+            return
+        self._diarized_at = self.received
+        segments, embeddings = self.diarizer.diarize_with_embeddings(region)
+        durations: Dict[str, float] = {}
+        for start, end, label in segments:
+            durations[label] = durations.get(label, 0.0) + end - start
+        mapping = self.linker.link(embeddings, durations)
+
+        # The newest audio is diarized with too little context; the next pass covers it
+        until = self.received if final else max(self.diarized_until, self.received - config.LIVE_DIARIZATION_GUARD)
+        for start, end, label in segments:
+            start, end = max(start + region_start, self.diarized_until), min(end + region_start, until)
+            if end <= start:
+                continue
+            turns = self.speaker_segments
+            speaker = mapping[label]
+            if turns and turns[-1][2] == speaker and start - turns[-1][1] < 1e-3:
+                turns[-1] = (turns[-1][0], end, speaker)
+            else:
+                turns.append((start, end, speaker))
+        self.diarized_until = until
+
+    def _release(self, final: bool) -> List[TranscriptLine]:
+        """Align the committed words the speaker turns already cover"""
+        if self.diarizer is None:
+            ready, self._pending = self._pending, []
+            turns = [(0.0, float("inf"), "SPEAKER_00")]
+        else:
+            horizon = float("inf") if final else self.diarized_until
+            count = next((i for i, word in enumerate(self._pending) if word[1] > horizon), len(self._pending))
+            ready, self._pending = self._pending[:count], self._pending[count:]
+            # Turns that can still overlap the words, within the alignment gap
+            earliest = ready[0][0] - config.ALIGNMENT_MAX_GAP if ready else 0.0
+            turns = [turn for turn in self.speaker_segments if turn[1] >= earliest]
+        if not ready:
+            return []
+        self.emitted_until = ready[-1][1]
+        starts, ends, texts = zip(*ready)
+        return align(starts, ends, texts, SpeakerIndex(turns), joiner="", strip=False)
+
+    def _decode(self, audio: AudioBuffer, offset: float, prompt: str) -> List[Word]:
+        """Decode the rolling window with faster-whisper"""
+        transcriber = self.transcriber
+        if transcriber.model is None:
+            transcriber.load_model()
+        segments, _ = transcriber.model.transcribe(
+            audio.as_whisper(),
+            language=config.TRANSCRIPTION_LANGUAGE,
+            beam_size=config.BEAM_SIZE,
+            vad_filter=config.VAD_FILTER,
+            word_timestamps=True,
+            initial_prompt=prompt or None,
+            condition_on_previous_text=False
+        )
+        return [
+            (offset + word.start, offset + word.end, word.word)
+            for segment in segments for word in (segment.words or [])
+        ]
+
+    def units(self) -> Tuple[list, list, list, str]:
+        """Committed words as transcription units (see alignment.collect_units)"""
+        return [word[0] for word in self.words], [word[1] for word in self.words], [word[2] for word in self.words], ""
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        Lag behind real time over the session
+
+        lag is the received audio not yet released as speaker-labelled text
+        after a step; backlog is the audio that piled up while the previous
+        step ran.
+        """
+        lags = np.asarray(self._lags or [0.0])
+        processing = float(sum(self._step_seconds))
+        return {
+            "audio_seconds": self.received,
+            "processing_seconds": processing,
+            "steps": len(self._step_seconds),
+            "lag_mean": float(lags.mean()),
+            "lag_p95": float(np.percentile(lags, 95)),
+            "lag_max": float(lags.max()),
+            "backlog_max": float(max(self._backlogs or [0.0])),
+        }
+
+
+def add_arguments(parser):
+    """Register the live subcommand's arguments"""
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument("--listen", metavar="[HOST:]PORT", nargs="?", const="",
+                        help=f"Read 16 kHz s16le mono PCM from one TCP connection "
+                             f"(default: {config.LIVE_HOST}:{config.LIVE_PORT})")
+    source.add_argument("--replay", metavar="FILE", help="Play a recording back at real-time speed")
+    parser.add_argument("--speed", type=float, default=1.0,
+                        help="Replay speed relative to real time (0 = as fast as possible)")
+    parser.add_argument("--no-diarization", action="store_true", help="Label everything SPEAKER_00")
+    parser.add_argument("--hf-token", default=os.getenv("HF_TOKEN"),
+                        help="HuggingFace token (default: HF_TOKEN environment variable)")
+    parser.add_argument("-o", "--output", help="Write the final transcript (.txt/.srt/.vtt/.jsonl)")
+
+
+def main(args) -> int:
+    """Transcribe a live stream, printing lines as they are released"""
+    from transcript import Transcript
+
+    if args.replay:
+        source = replay(args.replay, speed=args.speed)
+    else:
+        host, _, port = args.listen.rpartition(":")
+        source = listen(host or None, int(port) if port else None)
+
+    diarizer = None
+    if not args.no_diarization:
+        from diarization import SpeakerDiarizer
+        diarizer = SpeakerDiarizer(huggingface_token=args.hf_token)
+    session = LiveTranscriber(diarizer=diarizer)
+
+    for update in session.run(source):
+        for start, end, speaker, text in merge_lines(update["lines"]):
+            print(f"[{start:8.1f}] {speaker}: {text}", flush=True)
+
+    stats = session.stats()
+    print(f"Audio {stats['audio_seconds']:.1f}s in {stats['steps']} steps; "
+          f"lag mean {stats['lag_mean']:.2f}s, p95 {stats['lag_p95']:.2f}s, max {stats['lag_max']:.2f}s")
+    if args.output:
+        transcript = Transcript.from_units(session.units(), session.speaker_segments or [(0.0, session.received, "SPEAKER_00")])
+        print(f"Saved: {transcript.export(args.output)}")
+    return 0
@@ -0,0 +1,489 @@
+"""
+Token-aware, concurrent MapReduce summarization for long transcripts
+"""
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
+import asyncio
+import contextvars
+import hashlib
+import threading
+import config
+import metrics
+from result_cache import summary_key
+
+
+# Map step: summarize one chunk of consecutive speaker turns
+MAP_PROMPT_TEMPLATE = """以下は話者ごとに分類された会話の文字起こしの一部です。
+話者間の関係性や発言の流れを保ちながら、この部分の重要なポイントを簡潔に要約してください。
+
+文字起こし（一部）:
+{text}
+
+部分要約:"""
+
+# Reduce step: merge partial summaries into one
+REDUCE_PROMPT_TEMPLATE = """以下は長い会話を分割して作成した部分要約です。
+話者間の関係性や会話全体の流れを考慮して、重要なポイントを統合し、簡潔な要約を作成してください。
+
+部分要約:
+{text}
+
+要約:"""
+
+
+def token_counter(llm) -> Callable[[str], int]:
+    """
+    Return a function counting tokens for the given LLM
+
+    Uses the LLM's own tokenizer when LangChain can load one and otherwise
+    falls back to one token per character, which over-counts English and
+    roughly matches Japanese, so chunks err on the small side.
+    """
+    def _count(text: str) -> int:
+        try:
+            return llm.get_num_tokens(text)
+        except Exception:
+            return len(text)
+
+    try:
+        llm.get_num_tokens("test")
+        return _count
+    except Exception:
+        return len
+
+
+def stream_llm(llm, prompt: str, span_name: str, count_tokens: Callable[[str], int]) -> Iterator[str]:
+    """
+    Stream an LLM response as it is generated, timed as one span
+
+    Args:
+        llm: LangChain LLM supporting stream()
+        prompt: Complete prompt
+        span_name: Metrics span, e.g. "llm.stuff"
+        count_tokens: Token counter for tokens_in and tokens_out
+
+    Returns:
+        Generator of response pieces; closing it ends the request
+    """
+    return metrics.timed_iter(
+        span_name,
+        llm.stream(prompt),
+        counters=lambda piece: {"tokens_out": count_tokens(piece)},
+        tokens_in=count_tokens(prompt),
+        tokens_out=0
+    )
+
+
+class SummaryCancelled(Exception):
+    """Raised in map and reduce calls that were about to start after their stream was closed"""
+
+
+def split_turns(transcription: str, max_tokens: int, count_tokens: Callable[[str], int]) -> List[str]:
+    """
+    Split a transcription into speaker turns no longer than max_tokens
+
+    Turns are the "SPEAKER_XX: text" rows. A turn that alone exceeds the
+    budget is split further, repeating its speaker label on every piece.
+    """
+    turns = []
+    for line in transcription.splitlines():
+        if not line.strip():
+            continue
+        if count_tokens(line) <= max_tokens:
+            turns.append(line)
+            continue
+
+        from langchain.text_splitter import RecursiveCharacterTextSplitter
+
+        speaker, sep, text = line.partition(": ")
+        prefix = f"{speaker}: " if sep else ""
+        splitter = RecursiveCharacterTextSplitter(
+            chunk_size=max(1, max_tokens - count_tokens(prefix)),
+            chunk_overlap=0,
+            length_function=count_tokens,
+            separators=["\n", "。", ". ", "、", ", ", " ", ""]
+        )
+        turns.extend(prefix + piece for piece in splitter.split_text(text if sep else line))
+    return turns
+
+
+def pack_chunks(items: List[str], max_tokens: int, count_tokens: Callable[[str], int]) -> List[str]:
+    """Greedily pack consecutive items into newline-joined chunks within max_tokens"""
+    chunks = []
+    current: List[str] = []
+    current_tokens = 0
+    for item in items:
+        tokens = count_tokens(item) + 1  # newline separator
+        if current and current_tokens + tokens > max_tokens:
+            chunks.append("\n".join(current))
+            current, current_tokens = [], 0
+        current.append(item)
+        current_tokens += tokens
+    if current:
+        chunks.append("\n".join(current))
+    return chunks
+
+
+def stable_chunks(
+    items: List[str],
+    max_tokens: int,
+    count_tokens: Callable[[str], int],
+    boundary_every: int = None,
+    min_fill: float = 0.6
+) -> List[str]:
+    """
+    Pack consecutive items into chunks whose boundaries depend on content, not position
+
+    A chunk ends after an item whose hash marks it as a boundary (about one
+    in boundary_every items) once the chunk holds min_fill of max_tokens.
+    When the next item would not fit first, the chunk ends after the last
+    boundary item it holds below min_fill, so overflow cuts are content-defined
+    too; only a chunk without one is cut where it overflows. Editing an item
+    therefore changes only the chunks around it, and appending items
+    leaves every chunk but the last unchanged, so map results memoized by
+    chunk content stay valid.
+
+    Args:
+        items: Speaker turns, each within max_tokens
+        max_tokens: Token budget of a chunk
+        count_tokens: Token counter
+        boundary_every: Average items between content-defined boundaries
+                        (default: config.MAP_CHUNK_BOUNDARY_TURNS)
+        min_fill: Fraction of max_tokens a chunk holds before it may end at a boundary
+
+    Returns:
+        Newline-joined chunks
+    """
+    boundary_every = boundary_every or config.MAP_CHUNK_BOUNDARY_TURNS
+    min_tokens = max_tokens * min_fill
+    sizes = [count_tokens(item) + 1 for item in items]  # newline separator
+    digests = [
+        int.from_bytes(hashlib.blake2b(item.encode("utf-8"), digest_size=8).digest(), "big")
+        for item in items
+    ]
+
+    chunks = []
+    start = 0
+    while start < len(items):
+        end, tokens, backup = start, 0, None
+        while end < len(items):
+            if end > start and tokens + sizes[end] > max_tokens:
+                end = backup or end
+                break
+            tokens += sizes[end]
+            end += 1
+            if digests[end - 1] % boundary_every == 0:
+                if tokens >= min_tokens:
+                    break
+                backup = end
+        chunks.append("\n".join(items[start:end]))
+        start = end
+    return chunks
+
+
+class MapReduceSummarizer:
+    """MapReduce summarization with token-sized chunks and concurrent LLM calls
+
+    The transcript is split on speaker-turn boundaries into chunks sized to
+    the model's context window. Map calls run concurrently with at most
+    ``max_concurrency`` requests in flight, and the partial summaries are
+    reduced level by level, each level also running concurrently.
+
+    Every response is memoized by (prompt, text, model): in this instance,
+    and across runs when a cache is given. Since chunk boundaries depend on
+    content, re-summarizing an edited transcript or one with another reduce
+    prompt only calls the LLM for changed chunks and the reduce steps.
+    """
+
+    def __init__(
+        self,
+        llm,
+        context_window: int = None,
+        max_output_tokens: int = None,
+        max_concurrency: int = None,
+        map_prompt: str = MAP_PROMPT_TEMPLATE,
+        reduce_prompt: str = REDUCE_PROMPT_TEMPLATE,
+        direct_prompt: str = None,
+        cache=None,
+        model: str = None
+    ):
+        """
+        Initialize the summarizer
+
+        Args:
+            llm: LangChain LLM supporting ainvoke() (and stream() for stream())
+            context_window: Model context size in tokens
+            max_output_tokens: Tokens reserved for each response
+            max_concurrency: Maximum number of concurrent LLM requests
+            map_prompt: Prompt template with a {text} placeholder for map calls
+            reduce_prompt: Prompt template with a {text} placeholder for reduce calls
+            direct_prompt: Prompt template used instead of map and reduce when
+                           the transcription fits in a single chunk
+            cache: Optional ResultCache memoizing responses across runs
+            model: Model name in the memo keys (default: config.LLM_MODEL)
+        """
+        self.llm = llm
+        self.context_window = context_window or config.LLM_CONTEXT_WINDOW
+        self.max_output_tokens = max_output_tokens or config.SUMMARY_MAX_TOKENS
+        self.max_concurrency = max_concurrency or config.MAP_CONCURRENCY
+        self.map_prompt = map_prompt
+        self.reduce_prompt = reduce_prompt
+        self.direct_prompt = direct_prompt
+        self.count_tokens = token_counter(llm)
+        self.cache = cache
+        self.model = model or config.LLM_MODEL
+        self.calls = 0
+        self.reused = 0
+        self._memo: Dict[str, str] = {}
+        # Set when a stream() is closed; stops map and reduce calls from starting
+        self._cancelled = threading.Event()
+
+    def chunk_budget(self, prompt: str) -> int:
+        """Tokens left for the {text} part of a prompt"""
+        overhead = self.count_tokens(prompt.replace("{text}", ""))
+        return max(1, self.context_window - self.max_output_tokens - overhead)
+
+    def split(self, transcription: str) -> List[str]:
+        """Split a transcription into map chunks on speaker-turn boundaries"""
+        budget = self.chunk_budget(self.map_prompt)
+        turns = split_turns(transcription, budget, self.count_tokens)
+        if sum(self.count_tokens(turn) + 1 for turn in turns) <= budget:
+            return ["\n".join(turns)] if turns else []
+        return stable_chunks(turns, budget, self.count_tokens)
+
+    def run(self, transcription: str, chunks: List[str] = None) -> str:
+        """
+        Summarize a transcription
+
+        Args:
+            transcription: Full transcription with speaker labels
+            chunks: Map chunks the transcription was already split into
+
+        Returns:
+            Summary text
+        """
+        try:
+            asyncio.get_running_loop()
+        except RuntimeError:
+            return asyncio.run(self.arun(transcription, chunks))
+
+        # Already inside an event loop: run ours in a helper thread
+        thread, result = self._start_thread(self.arun, transcription, chunks)
+        thread.join()
+        if "error" in result:
+            raise result["error"]
+        return result["value"]
+
+    def stream(self, transcription: str, heartbeat: float = 0.2) -> Iterator[str]:
+        """
+        Summarize a transcription, yielding the final call's response as it is generated
+
+        The map calls and all but the last reduce level run first, in a
+        helper thread; meanwhile an empty string is yielded every heartbeat
+        seconds so the consumer can update its display or stop. Closing the
+        generator ends the streamed request, and map and reduce calls that
+        have not started yet are skipped.
+
+        Args:
+            transcription: Full transcription with speaker labels
+            heartbeat: Seconds between empty strings while the map calls run
+
+        Yields:
+            Pieces of the summary; joined and stripped they are what run() returns
+        """
+        self._cancelled.clear()
+        thread, result = self._start_thread(self.aplan, transcription)
+        try:
+            while True:
+                thread.join(heartbeat)
+                if not thread.is_alive():
+                    break
+                yield ""
+            if "error" in result:
+                raise result["error"]
+            if result["value"] is None:
+                return
+            prompt, text = result["value"]
+            key = self._memo_key(prompt, text)
+            response = self._recall(key)
+            if response is not None:
+                yield response
+                return
+            self.calls += 1
+            pieces = []
+            for piece in stream_llm(self.llm, prompt.format(text=text), f"llm.{self._step(prompt)}",
+                                    self.count_tokens):
+                pieces.append(piece)
+                yield piece
+            self._remember(key, "".join(pieces).strip())
+        finally:
+            self._cancelled.set()
+
+    def _start_thread(self, coroutine_function, *args):
+        """Run a coroutine function in its own event loop on a helper thread"""
+        result = {}
+
+        def _run():
+            try:
+                result["value"] = asyncio.run(coroutine_function(*args))
+            except BaseException as e:
+                result["error"] = e
+
+        # Copy the context so metrics spans opened in the loop reach the caller's job
+        thread = threading.Thread(target=contextvars.copy_context().run, args=(_run,), daemon=True)
+        thread.start()
+        return thread, result
+
+    async def arun(self, transcription: str, chunks: List[str] = None) -> str:
+        """Asynchronous version of run()"""
+        semaphore = asyncio.Semaphore(self.max_concurrency)
+        plan = await self.aplan(transcription, semaphore, chunks)
+        if plan is None:
+            return ""
+        return await self._acall(*plan, semaphore)
+
+    async def aplan(
+        self,
+        transcription: str,
+        semaphore: Optional[asyncio.Semaphore] = None,
+        chunks: List[str] = None
+    ) -> Optional[Tuple[str, str]]:
+        """
+        Run every call but the last one
+
+        Args:
+            transcription: Full transcription with speaker labels
+            semaphore: Limits the concurrent LLM calls
+            chunks: Map chunks the transcription was already split into
+
+        Returns:
+            (prompt template, text) of the final call, or None if there is
+            nothing to summarize
+        """
+        semaphore = semaphore or asyncio.Semaphore(self.max_concurrency)
+        if chunks is None:
+            chunks = self.split(transcription)
+        if len(chunks) == 1 and self.direct_prompt:
+            return self.direct_prompt, chunks[0]
+        summaries = await self.amap(chunks, semaphore)
+        if not summaries:
+            return None
+        return self.reduce_prompt, await self._areduce_to_one(summaries, semaphore)
+
+    async def amap(self, chunks: List[str], semaphore: Optional[asyncio.Semaphore] = None) -> List[str]:
+        """Summarize every chunk concurrently, preserving order"""
+        semaphore = semaphore or asyncio.Semaphore(self.max_concurrency)
+        return list(await asyncio.gather(
+            *(self._acall(self.map_prompt, chunk, semaphore) for chunk in chunks)
+        ))
+
+    async def areduce(self, summaries: List[str], semaphore: Optional[asyncio.Semaphore] = None) -> str:
+        """Reduce partial summaries level by level until one remains"""
+        semaphore = semaphore or asyncio.Semaphore(self.max_concurrency)
+        if not summaries:
+            return ""
+        text = await self._areduce_to_one(summaries, semaphore)
+        return await self._acall(self.reduce_prompt, text, semaphore)
+
+    async def _areduce_to_one(self, summaries: List[str], semaphore: asyncio.Semaphore) -> str:
+        """Reduce level by level until the summaries fit one reduce call, returning its text"""
+        budget = self.chunk_budget(self.reduce_prompt)
+        while True:
+            groups = pack_chunks(summaries, budget, self.count_tokens)
+            if len(groups) == 1:
+                return groups[0]
+            if len(groups) == len(summaries):
+                # Summaries too long to share a call; pair them so the tree still shrinks
+                groups = ["\n".join(summaries[i:i + 2]) for i in range(0, len(summaries), 2)]
+            summaries = list(await asyncio.gather(
+                *(self._acall(self.reduce_prompt, group, semaphore) for group in groups)
+            ))
+
+    def _step(self, prompt: str) -> str:
+        return "map" if prompt is self.map_prompt else "reduce" if prompt is self.reduce_prompt else "direct"
+
+    def _memo_key(self, prompt: str, text: str) -> str:
+        return summary_key(text, prompt, model=self.model, step="llm_call")
+
+    def _recall(self, key: str) -> Optional[str]:
+        """Memoized response of an earlier call, if any"""
+        response = self._memo.get(key)
+        if response is None and self.cache is not None:
+            response = self.cache.get("summary_call", key)
+        if response is not None:
+            self._memo[key] = response
+            self.reused += 1
+            metrics.record(reused_calls=1)
+        return response
+
+    def _remember(self, key: str, response: str):
+        self._memo[key] = response
+        if self.cache is not None:
+            self.cache.put("summary_call", key, response)
+
+    async def _acall(self, prompt: str, text: str, semaphore: asyncio.Semaphore) -> str:
+        key = self._memo_key(prompt, text)
+        response = self._recall(key)
+        if response is not None:
+            return response
+        step = self._step(prompt)
+        prompt = prompt.format(text=text)
+        async with semaphore:
+            if self._cancelled.is_set():
+                raise SummaryCancelled()
+            self.calls += 1
+            with metrics.span(f"llm.{step}", tokens_in=self.count_tokens(prompt)):
+                response = str(await self.llm.ainvoke(prompt)).strip()
+                metrics.record(tokens_out=self.count_tokens(response))
+        self._remember(key, response)
+        return response
+
+
+class RollingSummary:
+    """Summary of a growing transcript, extended instead of recomputed
+
+    Text is appended as it arrives, e.g. from live transcription. update()
+    summarizes the chunks that can no longer change, which are all but the
+    last, still growing one. Their map results and the reduce calls over
+    unchanged groups are memoized by the engine, so an update costs the map
+    calls of newly completed chunks and the reduce calls along the end of
+    the reduce tree.
+    """
+
+    def __init__(self, engine: MapReduceSummarizer):
+        """
+        Initialize the summary
+
+        Args:
+            engine: MapReduceSummarizer whose memo carries over between updates
+        """
+        self.engine = engine
+        self.transcription = ""
+        self.summary = ""
+        self._summarized: List[str] = []
+
+    def append(self, text: str):
+        """Append speaker turns ("SPEAKER_XX: text" lines) to the transcript"""
+        text = text.strip("\n")
+        if text:
+            self.transcription = f"{self.transcription}\n{text}" if self.transcription else text
+
+    def update(self, final: bool = False) -> str:
+        """
+        Extend the summary with the chunks completed since the last update
+
+        Args:
+            final: The transcript is complete; also summarize its last chunk
+
+        Returns:
+            The summary so far ("" until the first chunk is complete)
+        """
+        chunks = self.engine.split(self.transcription)
+        ready = chunks if final else chunks[:-1]
+        if ready and ready != self._summarized:
+            # Chunking is content-defined, so the completed chunks stay the
+            # same and their map calls are memo hits. They are passed as they
+            # are: an overflow cut depends on turns after it, which splitting
+            # the completed text alone would not see
+            self.summary = self.engine.run("\n".join(ready), chunks=ready)
+            self._summarized = ready
+        return self.summary
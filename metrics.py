@@ -0,0 +1,400 @@
+"""
+Lightweight per-job timing and resource metrics for the processing stages
+"""
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional
+import contextvars
+import cProfile
+import io
+import json
+import os
+import pstats
+import sys
+import threading
+import time
+import uuid
+import config
+
+
+def current_rss_mb() -> float:
+    """Resident set size of this process in MB (0.0 if unknown)"""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2**20
+    except (OSError, ValueError, IndexError):
+        pass
+    try:
+        import resource
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # kilobytes on Linux, bytes on macOS
+        return peak / 2**20 if sys.platform == "darwin" else peak / 1024
+    except (ImportError, OSError):
+        return 0.0
+
+
+class Span:
+    """One timed region of a job, with counters and nested child spans
+
+    CPU time is process-wide, so spans running concurrently on several
+    threads each see the CPU time of all of them.
+    """
+
+    def __init__(self, name: str, **attrs: Any):
+        self.name = name
+        self.attrs: Dict[str, Any] = dict(attrs)
+        self.children: List["Span"] = []
+        self.offset = 0.0
+        self.wall_seconds = 0.0
+        self.cpu_seconds = 0.0
+        self.peak_rss_mb = 0.0
+
+    def add(self, **values: Any):
+        """Add numbers to counters of the same name; other values are set"""
+        for key, value in values.items():
+            if isinstance(value, (int, float)) and not isinstance(value, bool) and key in self.attrs:
+                self.attrs[key] += value
+            else:
+                self.attrs[key] = value
+
+    def add_child(self, name: str, wall_seconds: float, **attrs: Any) -> "Span":
+        """Attach an already measured child span"""
+        child = Span(name, **attrs)
+        child.wall_seconds = wall_seconds
+        self.children.append(child)
+        return child
+
+    def to_dict(self) -> Dict[str, Any]:
+        result = {
+            "name": self.name,
+            "offset_seconds": round(self.offset, 6),
+            "wall_seconds": round(self.wall_seconds, 6),
+            "cpu_seconds": round(self.cpu_seconds, 6),
+            "peak_rss_mb": round(self.peak_rss_mb, 1),
+        }
+        result.update(self.attrs)
+        audio_seconds = self.attrs.get("audio_seconds")
+        if audio_seconds:
+            result["real_time_factor"] = round(self.wall_seconds / audio_seconds, 6)
+        if self.children:
+            result["children"] = [child.to_dict() for child in self.children]
+        return result
+
+
+class JobMetrics:
+    """Spans of one job, plus a thread sampling the peak RSS of open spans"""
+
+    def __init__(self, job_id: str = None, profile_stage: str = None, sample_interval: float = 0.05):
+        """
+        Initialize the tracker
+
+        Args:
+            job_id: Identifier written to the report (random if not given)
+            profile_stage: Span name to run under cProfile (default: config.PROFILE_STAGE)
+            sample_interval: Seconds between RSS samples
+        """
+        self.job_id = job_id or uuid.uuid4().hex[:12]
+        self.profile_stage = profile_stage if profile_stage is not None else config.PROFILE_STAGE
+        self.sample_interval = sample_interval
+        self.root = Span("job")
+        # Span name -> pstats report of its profiled run
+        self.profiles: Dict[str, str] = {}
+        self._open: List[Span] = []
+        self._lock = threading.Lock()
+        self._active = 0
+        self._started: Optional[float] = None
+        self._stop = threading.Event()
+        self._sampler: Optional[threading.Thread] = None
+
+    def _activate(self):
+        with self._lock:
+            self._active += 1
+            if self._active > 1:
+                return
+            if self._started is None:
+                self._started = time.perf_counter()
+            self._open.append(self.root)
+            self._stop.clear()
+        self._sample()
+        self._sampler = threading.Thread(target=self._sample_loop, name="voxlens-metrics", daemon=True)
+        self._sampler.start()
+
+    def _deactivate(self):
+        with self._lock:
+            self._active -= 1
+            if self._active:
+                return
+            self._stop.set()
+            self._open.remove(self.root)
+            self.root.wall_seconds = time.perf_counter() - self._started
+        self._sampler.join()
+
+    def _sample_loop(self):
+        while not self._stop.wait(self.sample_interval):
+            self._sample()
+
+    def _sample(self):
+        rss = current_rss_mb()
+        with self._lock:
+            for span in self._open:
+                span.peak_rss_mb = max(span.peak_rss_mb, rss)
+
+    def open_span(self, name: str, parent: Span, attrs: Dict[str, Any]) -> Span:
+        span = Span(name, **attrs)
+        span.offset = time.perf_counter() - (self._started or time.perf_counter())
+        with self._lock:
+            parent.children.append(span)
+            self._open.append(span)
+        self._sample()
+        return span
+
+    def close_span(self, span: Span):
+        self._sample()
+        with self._lock:
+            self._open.remove(span)
+
+    @property
+    def wall_seconds(self) -> float:
+        """Time since the job was first tracked (until the last track() ended)"""
+        with self._lock:
+            if self._active:
+                return time.perf_counter() - self._started
+            return self.root.wall_seconds
+
+    def to_dict(self) -> Dict[str, Any]:
+        """Report as a JSON-serializable dict"""
+        return {
+            "job_id": self.job_id,
+            "wall_seconds": round(self.wall_seconds, 6),
+            "peak_rss_mb": round(self.root.peak_rss_mb, 1),
+            "spans": [child.to_dict() for child in self.root.children],
+            "profiles": dict(self.profiles),
+        }
+
+    def save(self, path: str = None) -> str:
+        """
+        Write the report as JSON
+
+        Args:
+            path: Destination (default: <config.METRICS_DIR>/<job_id>.json)
+
+        Returns:
+            Path of the written file
+        """
+        path = path or os.path.join(config.METRICS_DIR, f"{self.job_id}.json")
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(self.to_dict(), f, ensure_ascii=False, indent=2)
+        return path
+
+    def rows(self) -> List[Dict[str, Any]]:
+        """
+        Flattened spans for display, siblings of the same name merged
+
+        Returns:
+            One dict per span name and depth with summed times and counters
+            and the number of merged spans
+        """
+        rows = []
+
+        def _walk(spans: List[Span], depth: int):
+            merged: Dict[str, List[Span]] = {}
+            for span in spans:
+                merged.setdefault(span.name, []).append(span)
+            for name, group in merged.items():
+                audio_seconds = sum(s.attrs.get("audio_seconds") or 0.0 for s in group)
+                wall = sum(s.wall_seconds for s in group)
+                rows.append({
+                    "stage": "  " * depth + name,
+                    "count": len(group),
+                    "wall_seconds": round(wall, 3),
+                    "cpu_seconds": round(sum(s.cpu_seconds for s in group), 3),
+                    "peak_rss_mb": round(max(s.peak_rss_mb for s in group), 1),
+                    "audio_seconds": round(audio_seconds, 1) if audio_seconds else None,
+                    "real_time_factor": round(wall / audio_seconds, 4) if audio_seconds else None,
+                    "tokens_in": sum(s.attrs.get("tokens_in") or 0 for s in group) or None,
+                    "tokens_out": sum(s.attrs.get("tokens_out") or 0 for s in group) or None,
+                })
+                _walk([child for s in group for child in s.children], depth + 1)
+
+        _walk(self.root.children, 0)
+        return rows
+
+    def _start_profile(self, name: str) -> Optional[cProfile.Profile]:
+        if name != self.profile_stage:
+            return None
+        profiler = cProfile.Profile()
+        try:
+            profiler.enable()
+        except ValueError:
+            # Another profiler is already active (Python 3.12+ allows only one)
+            return None
+        return profiler
+
+    def _stop_profile(self, name: str, profiler: Optional[cProfile.Profile]):
+        if profiler is None:
+            return
+        profiler.disable()
+        out = io.StringIO()
+        pstats.Stats(profiler, stream=out).sort_stats("cumulative").print_stats(30)
+        with self._lock:
+            self.profiles[name] = self.profiles.get(name, "") + out.getvalue()
+
+
+_job: contextvars.ContextVar[Optional[JobMetrics]] = contextvars.ContextVar("voxlens_job", default=None)
+_span: contextvars.ContextVar[Optional[Span]] = contextvars.ContextVar("voxlens_span", default=None)
+
+
+@contextmanager
+def track(job: JobMetrics):
+    """
+    Record spans opened in this context (and contexts copied from it) into job
+
+    A job may be tracked from several threads in turn, e.g. by the stages
+    of the batch scheduler; its wall time runs from the first track() to
+    the end of the last one.
+    """
+    job_token = _job.set(job)
+    span_token = _span.set(job.root)
+    job._activate()
+    try:
+        yield job
+    finally:
+        job._deactivate()
+        _span.reset(span_token)
+        _job.reset(job_token)
+
+
+def current_job() -> Optional[JobMetrics]:
+    """The job tracked in this context, if any"""
+    return _job.get()
+
+
+@contextmanager
+def span(name: str, **attrs: Any):
+    """
+    Time a block as a child of the current span
+
+    Does nothing (and yields None) when no job is tracked.
+
+    Args:
+        name: Span name, e.g. "diarization.inference"
+        attrs: Initial counters, e.g. audio_seconds
+    """
+    job = _job.get()
+    if job is None:
+        yield None
+        return
+
+    current = job.open_span(name, _span.get() or job.root, attrs)
+    token = _span.set(current)
+    profiler = job._start_profile(name)
+    cpu_started, started = time.process_time(), time.perf_counter()
+    try:
+        yield current
+    finally:
+        current.wall_seconds += time.perf_counter() - started
+        current.cpu_seconds += time.process_time() - cpu_started
+        job._stop_profile(name, profiler)
+        _span.reset(token)
+        job.close_span(current)
+
+
+def record(**values: Any):
+    """Add counters (audio_seconds, tokens_in, ...) to the current span"""
+    current = _span.get()
+    if current is not None and _job.get() is not None:
+        current.add(**values)
+
+
+def add_span(name: str, wall_seconds: float, **attrs: Any):
+    """
+    Attach an already measured span to the current span
+
+    For work timed piecewise, e.g. the decode steps of a live session, which
+    would otherwise add one span per step.
+    """
+    current = _span.get()
+    if current is not None and _job.get() is not None:
+        current.add_child(name, wall_seconds, **attrs)
+
+
+def timed_iter(name: str, iterable: Iterable, counters: Callable[[Any], Dict[str, Any]] = None,
+               **attrs: Any) -> Iterator:
+    """
+    Iterate while timing only the work of producing the items
+
+    For lazy producers such as faster-whisper segments or streamed LLM
+    tokens, where a span around the loop would also count the consumer's
+    time. Closing this generator closes the producer.
+
+    Args:
+        name: Span name
+        iterable: Items to pass through
+        counters: Returns counters to add for each item, e.g. its tokens
+        attrs: Initial counters of the span; "items" counts the yielded items
+    """
+    job = _job.get()
+    if job is None:
+        # yield from also passes close() on to the producer
+        yield from iterable
+        return
+
+    current = job.open_span(name, _span.get() or job.root, dict(attrs, items=0))
+    iterator = iter(iterable)
+    try:
+        while True:
+            # Make spans opened by the producer children of this one, but only
+            # while it runs: the consumer must not see it as current
+            token = _span.set(current)
+            cpu_started, started = time.process_time(), time.perf_counter()
+            try:
+                item = next(iterator)
+            except StopIteration:
+                return
+            finally:
+                current.wall_seconds += time.perf_counter() - started
+                current.cpu_seconds += time.process_time() - cpu_started
+                _span.reset(token)
+            current.attrs["items"] += 1
+            if counters is not None:
+                current.add(**counters(item))
+            yield item
+    finally:
+        _close(iterator)
+        job.close_span(current)
+
+
+def _close(iterator: Iterator):
+    """Close a generator (e.g. an HTTP response stream) that was not exhausted"""
+    close = getattr(iterator, "close", None)
+    if close is not None:
+        close()
+
+
+class PyannoteStepTimer:
+    """pyannote pipeline hook splitting a diarization run into its steps
+
+    pyannote calls the hook with the name of each step as it progresses and
+    once when the step finishes. A step's time is counted from the end of the
+    previous step to its final call; the clustering and reconstruction work
+    happens between the "embeddings" and "discrete_diarization" calls.
+    """
+
+    STEP_NAMES = {"discrete_diarization": "clustering"}
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.last_seen: Dict[str, float] = {}
+
+    def __call__(self, step_name: str, step_artifact: Any = None, file=None, total=None, completed=None):
+        self.last_seen[step_name] = time.perf_counter()
+
+    def record(self):
+        """Add one child span per step to the current span"""
+        current = _span.get()
+        if current is None or _job.get() is None:
+            return
+        previous = self.started
+        for step_name, seen in sorted(self.last_seen.items(), key=lambda item: item[1]):
+            current.add_child(self.STEP_NAMES.get(step_name, step_name), seen - previous)
+            previous = seen
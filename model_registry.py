@@ -0,0 +1,191 @@
+"""
+Process-wide registry that keeps loaded models warm between jobs
+"""
+from collections import OrderedDict
+from typing import Callable, Dict, Hashable, List, Optional, Tuple
+import sys
+import threading
+import config
+from pipeline import estimate_model_memory_mb
+
+
+ModelKey = Tuple[Hashable, ...]  # (model_name, device, compute_type, load options...)
+
+
+def _free_model(model):
+    """Release a model's device memory"""
+    # pyannote pipelines live on the GPU until moved back; CTranslate2 models
+    # release their memory when the last reference is dropped. A torch model
+    # means torch is imported already, so unloading never imports it
+    torch = sys.modules.get("torch")
+    if torch is None or not hasattr(model, "to"):
+        return
+    model.to(torch.device("cpu"))
+    if torch.cuda.is_available():
+        torch.cuda.empty_cache()
+
+
+class ModelRegistry:
+    """LRU cache of loaded models bounded by an approximate memory budget
+
+    Models are keyed by (model_name, device, compute_type), followed by any
+    load-time options the model cannot change afterwards, such as the CPU
+    thread count of a Whisper model.
+
+    Every get() takes a hold on the model that release() gives back. A model
+    is only unloaded, by release() or eviction, once nobody holds it, since
+    other callers may still be running inference with the same instance.
+    """
+
+    def __init__(self, budget_mb: Optional[float] = None):
+        """
+        Initialize the registry
+
+        Args:
+            budget_mb: Total size of resident models in MB before the least
+                       recently used ones are evicted (None = unbounded)
+        """
+        self.budget_mb = budget_mb
+        self._entries: "OrderedDict[Hashable, Tuple[object, float]]" = OrderedDict()
+        self._lock = threading.RLock()
+        self._key_locks: Dict[Hashable, threading.Lock] = {}
+        self._holders: Dict[Hashable, int] = {}
+
+    def get(
+        self,
+        key: ModelKey,
+        loader: Callable[[], object],
+        size_mb: Optional[float] = None,
+        hold: bool = True
+    ):
+        """
+        Return a warm model, loading it on first use
+
+        Args:
+            key: (model_name, device, compute_type, load options...)
+            loader: Callable that loads and returns the model
+            size_mb: Approximate resident size (estimated from the name if omitted)
+            hold: Take a hold on the model, to be given back with release()
+
+        Returns:
+            The loaded model
+        """
+        with self._lock:
+            if key in self._entries:
+                return self._checkout(key, hold)
+            key_lock = self._key_locks.setdefault(key, threading.Lock())
+
+        # Load outside the registry lock so different models can load in parallel,
+        # but never load the same model twice
+        with key_lock:
+            with self._lock:
+                if key in self._entries:
+                    return self._checkout(key, hold)
+
+            if size_mb is None:
+                size_mb = estimate_model_memory_mb(key[0])
+            with self._lock:
+                self._evict(reserve_mb=size_mb)
+
+            model = loader()
+            with self._lock:
+                self._entries[key] = (model, size_mb)
+                return self._checkout(key, hold)
+
+    def _checkout(self, key: ModelKey, hold: bool):
+        """Mark a resident model as recently used and optionally hold it"""
+        self._entries.move_to_end(key)
+        if hold:
+            self._holders[key] = self._holders.get(key, 0) + 1
+        return self._entries[key][0]
+
+    def release(self, key: ModelKey, unload: bool = True) -> bool:
+        """
+        Give back a hold on a model and unload it once nobody holds it
+
+        Args:
+            key: (model_name, device, compute_type, load options...)
+            unload: Free the model if this was the last hold; False keeps it warm
+
+        Returns:
+            True if the model was unloaded
+        """
+        with self._lock:
+            holders = self._holders.pop(key, 0) - 1
+            if holders > 0:
+                self._holders[key] = holders
+                return False
+            if not unload:
+                return False
+            entry = self._entries.pop(key, None)
+        if entry is None:
+            return False
+        _free_model(entry[0])
+        return True
+
+    def holders(self, key: ModelKey) -> int:
+        """Number of callers currently holding a model"""
+        with self._lock:
+            return self._holders.get(key, 0)
+
+    def clear(self):
+        """Unload every model nobody holds"""
+        for key in self.keys():
+            if not self.holders(key):
+                self.release(key)
+
+    def keys(self) -> List[Hashable]:
+        """Resident model keys, least recently used first"""
+        with self._lock:
+            return list(self._entries)
+
+    def resident_mb(self) -> float:
+        """Approximate total size of resident models"""
+        with self._lock:
+            return sum(size for _, size in self._entries.values())
+
+    def preload(self, key: ModelKey, loader: Callable[[], object], size_mb: Optional[float] = None) -> threading.Thread:
+        """
+        Load a model in a background thread
+
+        Returns:
+            The started daemon thread
+        """
+        def _load():
+            try:
+                self.get(key, loader, size_mb, hold=False)
+            except Exception:
+                # Preloading is best effort; the job will surface the error
+                pass
+
+        thread = threading.Thread(target=_load, name=f"voxlens-preload-{key[0]}", daemon=True)
+        thread.start()
+        return thread
+
+    def _evict(self, reserve_mb: float = 0.0):
+        """Evict least recently used models until reserve_mb more fits in the budget
+
+        Held models are never evicted, so the budget may be exceeded while
+        they are in use.
+        """
+        if self.budget_mb is None:
+            return
+        for key in list(self._entries):
+            if self.resident_mb() + reserve_mb <= self.budget_mb:
+                break
+            if self._holders.get(key, 0) == 0:
+                model, _ = self._entries.pop(key)
+                _free_model(model)
+
+
+_registry: Optional[ModelRegistry] = None
+_registry_lock = threading.Lock()
+
+
+def get_registry() -> ModelRegistry:
+    """Return the process-wide model registry"""
+    global _registry
+    with _registry_lock:
+        if _registry is None:
+            _registry = ModelRegistry(budget_mb=config.MODEL_REGISTRY_BUDGET_MB)
+        return _registry
@@ -0,0 +1,368 @@
+"""
+Shared Ollama client with keep-alive connections, model residency control
+and round-robin over several Ollama hosts
+"""
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List, Optional, Sequence, Tuple, Union
+import http.client
+import itertools
+import json
+import threading
+import urllib.parse
+import config
+
+
+class OllamaError(Exception):
+    """Error response of an Ollama server"""
+
+    def __init__(self, status: int, message: str):
+        super().__init__(f"{status}: {message}")
+        self.status = status
+        self.message = message
+
+
+class OllamaEndpoint:
+    """One Ollama server: a bounded number of concurrent requests over reused connections"""
+
+    def __init__(self, base_url: str, max_concurrency: int, timeout: float):
+        """
+        Initialize the endpoint
+
+        Args:
+            base_url: e.g. "http://localhost:11434"
+            max_concurrency: Requests in flight at most (match OLLAMA_NUM_PARALLEL)
+            timeout: Socket timeout in seconds
+        """
+        self.base_url = base_url.rstrip("/")
+        parts = urllib.parse.urlsplit(self.base_url)
+        self._connection_class = http.client.HTTPSConnection if parts.scheme == "https" else http.client.HTTPConnection
+        self._netloc = parts.netloc
+        self._prefix = parts.path
+        self.max_concurrency = max_concurrency
+        self.timeout = timeout
+        self._slots = threading.BoundedSemaphore(max_concurrency)
+        self._idle: List[http.client.HTTPConnection] = []
+        self._lock = threading.Lock()
+        self.in_flight = 0
+        self.requests = 0
+        self.connections_opened = 0
+
+    @contextmanager
+    def _slot(self):
+        self._slots.acquire()
+        with self._lock:
+            self.in_flight += 1
+            self.requests += 1
+        try:
+            yield
+        finally:
+            with self._lock:
+                self.in_flight -= 1
+            self._slots.release()
+
+    def _connection(self) -> Tuple[http.client.HTTPConnection, bool]:
+        """An idle connection (reused=True) or a new one"""
+        with self._lock:
+            if self._idle:
+                return self._idle.pop(), True
+            self.connections_opened += 1
+        return self._connection_class(self._netloc, timeout=self.timeout), False
+
+    def _release(self, connection: http.client.HTTPConnection):
+        with self._lock:
+            self._idle.append(connection)
+
+    def _send(self, path: str, payload: Dict[str, Any]) -> Tuple[http.client.HTTPConnection, http.client.HTTPResponse]:
+        """POST JSON, retrying once on a fresh connection if a reused one was closed by the server"""
+        body = json.dumps(payload).encode("utf-8")
+        while True:
+            connection, reused = self._connection()
+            try:
+                connection.request("POST", self._prefix + path, body=body,
+                                   headers={"Content-Type": "application/json"})
+                response = connection.getresponse()
+            except (http.client.RemoteDisconnected, ConnectionResetError, BrokenPipeError):
+                connection.close()
+                if reused:
+                    continue
+                raise
+            except BaseException:
+                connection.close()
+                raise
+            if response.status != 200:
+                message = response.read().decode("utf-8", "replace")
+                self._release(connection)
+                try:
+                    message = json.loads(message).get("error", message)
+                except (ValueError, AttributeError):
+                    pass
+                raise OllamaError(response.status, message)
+            return connection, response
+
+    def post(self, path: str, payload: Dict[str, Any]) -> Dict[str, Any]:
+        """POST a request and return the JSON response"""
+        with self._slot():
+            connection, response = self._send(path, payload)
+            try:
+                result = json.loads(response.read())
+            except BaseException:
+                connection.close()
+                raise
+            self._release(connection)
+            return result
+
+    def post_stream(self, path: str, payload: Dict[str, Any]) -> Iterator[Dict[str, Any]]:
+        """
+        POST a streaming request and yield its JSON lines
+
+        Closing the generator early closes the connection, which makes
+        Ollama stop generating.
+        """
+        with self._slot():
+            connection, response = self._send(path, payload)
+            finished = False
+            try:
+                for line in response:
+                    if not line.strip():
+                        continue
+                    message = json.loads(line)
+                    if message.get("error"):
+                        raise OllamaError(500, message["error"])
+                    yield message
+                    if message.get("done"):
+                        break
+                # Drain the rest so the connection can carry the next request
+                response.read()
+                finished = True
+            finally:
+                if finished:
+                    self._release(connection)
+                else:
+                    connection.close()
+
+    def close(self):
+        """Close idle connections"""
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for connection in idle:
+            connection.close()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "base_url": self.base_url,
+                "in_flight": self.in_flight,
+                "requests": self.requests,
+                "connections_opened": self.connections_opened,
+                "idle_connections": len(self._idle),
+            }
+
+
+class OllamaPool:
+    """Ollama client shared by all summarizations of a process
+
+    Requests reuse HTTP connections, ask Ollama to keep the model loaded for
+    ``keep_alive`` and are spread round-robin over the endpoints, skipping
+    endpoints whose concurrency limit is reached while another has room.
+    """
+
+    def __init__(
+        self,
+        base_urls: Sequence[str] = None,
+        model: str = None,
+        keep_alive: Union[int, str] = None,
+        max_concurrency: int = None,
+        timeout: float = None
+    ):
+        """
+        Initialize the pool
+
+        Args:
+            base_urls: Ollama servers (default: config.OLLAMA_BASE_URLS)
+            model: Model used for every request (default: config.LLM_MODEL)
+            keep_alive: How long Ollama keeps the model loaded after a request,
+                        seconds or a duration like "30m"; -1 keeps it loaded
+                        (default: config.OLLAMA_KEEP_ALIVE)
+            max_concurrency: Requests in flight per server (default: config.OLLAMA_MAX_CONCURRENCY)
+            timeout: Socket timeout in seconds (default: config.OLLAMA_TIMEOUT)
+        """
+        self.model = model or config.LLM_MODEL
+        self.keep_alive = keep_alive if keep_alive is not None else config.OLLAMA_KEEP_ALIVE
+        max_concurrency = max_concurrency or config.OLLAMA_MAX_CONCURRENCY
+        timeout = timeout or config.OLLAMA_TIMEOUT
+        self.endpoints = [
+            OllamaEndpoint(url, max_concurrency, timeout) for url in (base_urls or config.OLLAMA_BASE_URLS)
+        ]
+        if not self.endpoints:
+            raise ValueError("At least one Ollama base URL is required")
+        self._turn = itertools.count()
+        self._llms: Dict[Tuple, Any] = {}
+        self._lock = threading.Lock()
+
+    @property
+    def capacity(self) -> int:
+        """Requests the pool runs at once over all endpoints"""
+        return sum(endpoint.max_concurrency for endpoint in self.endpoints)
+
+    def _endpoint(self) -> OllamaEndpoint:
+        """Next endpoint in turn with a free slot (or simply the next one if all are busy)"""
+        start = next(self._turn)
+        candidates = [self.endpoints[(start + i) % len(self.endpoints)] for i in range(len(self.endpoints))]
+        for endpoint in candidates:
+            if endpoint.in_flight < endpoint.max_concurrency:
+                return endpoint
+        return candidates[0]
+
+    def _payload(self, prompt: str, stream: bool, options: Dict[str, Any] = None,
+                 stop: List[str] = None) -> Dict[str, Any]:
+        options = dict(options or {})
+        if stop:
+            options["stop"] = stop
+        return {"model": self.model, "prompt": prompt, "stream": stream,
+                "keep_alive": self.keep_alive, "options": options}
+
+    def generate(self, prompt: str, options: Dict[str, Any] = None, stop: List[str] = None) -> str:
+        """
+        Generate a complete response
+
+        Args:
+            prompt: Prompt text
+            options: Ollama model options, e.g. {"temperature": 0.3, "num_ctx": 8192}
+            stop: Stop sequences
+
+        Returns:
+            Response text
+        """
+        return self._endpoint().post("/api/generate", self._payload(prompt, False, options, stop))["response"]
+
+    def stream(self, prompt: str, options: Dict[str, Any] = None, stop: List[str] = None) -> Iterator[str]:
+        """Like generate(), yielding the response as it is generated"""
+        for message in self._endpoint().post_stream("/api/generate", self._payload(prompt, True, options, stop)):
+            if message.get("response"):
+                yield message["response"]
+
+    def preload(self, keep_alive: Union[int, str] = None) -> List[threading.Thread]:
+        """
+        Load the model on every endpoint in the background
+
+        A generate request without a prompt makes Ollama load the model and
+        keep it for keep_alive, so the first summary does not wait for it.
+
+        Returns:
+            The started threads, one per endpoint
+        """
+        payload = {"model": self.model, "stream": False,
+                   "keep_alive": keep_alive if keep_alive is not None else self.keep_alive}
+
+        def _load(endpoint: OllamaEndpoint):
+            try:
+                endpoint.post("/api/generate", payload)
+            except (OSError, OllamaError):
+                # Unreachable or missing model; the first real request reports it
+                pass
+
+        threads = [
+            threading.Thread(target=_load, args=(endpoint,), name="voxlens-ollama-preload", daemon=True)
+            for endpoint in self.endpoints
+        ]
+        for thread in threads:
+            thread.start()
+        return threads
+
+    def unload(self):
+        """Ask every endpoint to unload the model now"""
+        for thread in self.preload(keep_alive=0):
+            thread.join()
+
+    def llm(self, temperature: float = 0.3, num_ctx: int = None):
+        """
+        LangChain LLM sending its requests through this pool
+
+        Instances are shared per option set, so every job uses the same one.
+        """
+        key = (temperature, num_ctx)
+        with self._lock:
+            if key not in self._llms:
+                self._llms[key] = _pooled_llm_class()(pool=self, temperature=temperature, num_ctx=num_ctx)
+            return self._llms[key]
+
+    def stats(self) -> List[Dict[str, Any]]:
+        """Request and connection counts per endpoint"""
+        return [endpoint.stats() for endpoint in self.endpoints]
+
+    def close(self):
+        """Close all idle connections"""
+        for endpoint in self.endpoints:
+            endpoint.close()
+
+
+_pooled_llm = None
+
+
+def _pooled_llm_class():
+    """LangChain LLM class backed by an OllamaPool, defined on first use to keep LangChain lazy"""
+    global _pooled_llm
+    if _pooled_llm is not None:
+        return _pooled_llm
+
+    from langchain_core.language_models.llms import LLM
+    from langchain_core.outputs import GenerationChunk
+
+    class PooledOllama(LLM):
+        """Ollama LLM whose requests go through a shared OllamaPool"""
+
+        pool: Any
+        temperature: float = 0.3
+        num_ctx: Optional[int] = None
+
+        @property
+        def _llm_type(self) -> str:
+            return "ollama-pool"
+
+        @property
+        def _identifying_params(self) -> Dict[str, Any]:
+            return {
+                "model": self.pool.model,
+                "base_urls": [endpoint.base_url for endpoint in self.pool.endpoints],
+                "temperature": self.temperature,
+                "num_ctx": self.num_ctx,
+            }
+
+        def _options(self) -> Dict[str, Any]:
+            options = {"temperature": self.temperature}
+            if self.num_ctx:
+                options["num_ctx"] = self.num_ctx
+            return options
+
+        def _call(self, prompt: str, stop: Optional[List[str]] = None, run_manager=None, **kwargs: Any) -> str:
+            return self.pool.generate(prompt, self._options(), stop)
+
+        def _stream(self, prompt: str, stop: Optional[List[str]] = None, run_manager=None,
+                    **kwargs: Any) -> Iterator[GenerationChunk]:
+            for text in self.pool.stream(prompt, self._options(), stop):
+                chunk = GenerationChunk(text=text)
+                if run_manager is not None:
+                    run_manager.on_llm_new_token(text, chunk=chunk)
+                yield chunk
+
+    _pooled_llm = PooledOllama
+    return _pooled_llm
+
+
+_pools: Dict[Tuple, OllamaPool] = {}
+_pools_lock = threading.Lock()
+
+
+def get_ollama_pool(base_urls: Sequence[str] = None, model: str = None) -> OllamaPool:
+    """
+    Return the process-wide pool for a set of servers and a model
+
+    Args:
+        base_urls: Ollama servers (default: config.OLLAMA_BASE_URLS)
+        model: Model name (default: config.LLM_MODEL)
+    """
+    key = (tuple(base_urls or config.OLLAMA_BASE_URLS), model or config.LLM_MODEL)
+    with _pools_lock:
+        if key not in _pools:
+            _pools[key] = OllamaPool(list(key[0]), key[1])
+        return _pools[key]
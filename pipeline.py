@@ -0,0 +1,425 @@
+"""
+Pipeline orchestration for diarization and transcription
+"""
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from typing import Iterator, List, Optional, Tuple
+import contextvars
+import os
+import queue
+import shutil
+import sys
+import threading
+import config
+from alignment import SpeakerIndex, TranscriptLine, align, align_stream
+from audio_loader import AudioInput, load_audio
+from result_cache import diarization_key, transcription_key
+
+
+def resolve_device() -> str:
+    """Return the device the models will actually run on"""
+    if config.DEVICE == "cuda":
+        import torch
+        if torch.cuda.is_available():
+            return "cuda"
+    return "cpu"
+
+
+def cuda_available() -> bool:
+    """
+    Whether a CUDA GPU looks usable, without importing torch
+
+    Asks torch if something already imported it; otherwise only checks for
+    the NVIDIA driver, which is enough for UI defaults but may be wrong when
+    torch was built without CUDA.
+    """
+    if "torch" in sys.modules:
+        return sys.modules["torch"].cuda.is_available()
+    return os.path.exists("/proc/driver/nvidia/version") or shutil.which("nvidia-smi") is not None
+
+
+def available_memory_mb(device: str) -> Optional[float]:
+    """
+    Memory that models may use on a device
+
+    Args:
+        device: "cuda" or "cpu"
+
+    Returns:
+        config.MEMORY_BUDGET_MB if set, otherwise the free VRAM/RAM in MB,
+        or None if it cannot be determined
+    """
+    if config.MEMORY_BUDGET_MB:
+        return float(config.MEMORY_BUDGET_MB)
+    if device == "cuda":
+        import torch
+        free, _ = torch.cuda.mem_get_info()
+        return free / 2**20
+    try:
+        return os.sysconf("SC_AVPHYS_PAGES") * os.sysconf("SC_PAGE_SIZE") / 2**20
+    except (AttributeError, ValueError, OSError):
+        return None
+
+
+def estimate_model_memory_mb(model_name: str) -> float:
+    """Approximate resident size of a model, see config.MODEL_MEMORY_MB"""
+    return float(config.MODEL_MEMORY_MB.get(model_name, config.MODEL_MEMORY_MB["default"]))
+
+
+def split_threads(total: int = None) -> Tuple[int, int]:
+    """
+    Split CPU cores between diarization and transcription
+
+    Args:
+        total: Number of cores to split (defaults to os.cpu_count())
+
+    Returns:
+        Tuple of (diarization_threads, transcription_threads)
+    """
+    total = total or os.cpu_count() or 1
+    diarization_threads = config.DIARIZATION_THREADS or max(1, total // 2)
+    transcription_threads = config.TRANSCRIPTION_THREADS or max(1, total - diarization_threads)
+    return diarization_threads, transcription_threads
+
+
+@contextmanager
+def _override_threads(instance, attribute: str, threads: Optional[int]):
+    """Give a model instance another thread count for a block (None = unchanged)
+
+    The previous count is restored afterwards, so a split for stages running
+    side by side does not stick to instances that are reused sequentially.
+    """
+    if threads is None:
+        yield
+        return
+    previous = getattr(instance, attribute)
+    setattr(instance, attribute, threads)
+    try:
+        yield
+    finally:
+        setattr(instance, attribute, previous)
+
+
+class TranscriptionPipeline:
+    """Run diarization and transcription, concurrently when memory allows
+
+    The Whisper pass does not need the speaker turns until the final
+    alignment, so both stages can run side by side and be merged at the end.
+    When the memory budget cannot hold both models, the stages run one after
+    the other and the diarization model is released before transcription.
+    """
+
+    def __init__(self, diarizer, transcriber, parallel=None, cache=None):
+        """
+        Initialize the pipeline
+
+        Args:
+            diarizer: SpeakerDiarizer instance
+            transcriber: AudioTranscriber instance
+            parallel: True/False to force a mode, "auto" or None to decide
+                      from config.PARALLEL_STAGES and the memory budget
+            cache: Optional ResultCache for stage results
+        """
+        self.diarizer = diarizer
+        self.transcriber = transcriber
+        self.parallel = config.PARALLEL_STAGES if parallel is None else parallel
+        self.cache = cache
+        # Set while stream() runs, for progress reporting
+        self.speaker_segments = None
+        self.duration = None
+
+    def can_run_parallel(self) -> bool:
+        """Check whether both models fit in the memory budget at once"""
+        if config.TRANSCRIPTION_MODE == "batched":
+            # Batched transcription decodes the diarized turns, so it has to wait for them
+            return False
+        if self.parallel != "auto":
+            return bool(self.parallel)
+
+        available = available_memory_mb(resolve_device())
+        if available is None:
+            return False
+        required = (
+            estimate_model_memory_mb(config.DIARIZATION_MODEL)
+            + estimate_model_memory_mb(config.TRANSCRIPTION_MODEL)
+        )
+        return required <= available
+
+    def preload(self) -> List[threading.Thread]:
+        """
+        Start loading both models into the model registry in the background
+
+        The Whisper model is keyed by its CPU thread count, so it is loaded
+        with the count a run will give it: its share of the cores when the
+        stages will run side by side on CPU.
+
+        Returns:
+            The loading threads
+        """
+        _, transcription_threads = self._parallel_threads()
+        if transcription_threads is not None and not self.can_run_parallel():
+            transcription_threads = None
+        with _override_threads(self.transcriber, "cpu_threads", transcription_threads):
+            return [self.diarizer.preload(), self.transcriber.preload()]
+
+    def release_before_transcription(self, transcriber=None) -> bool:
+        """
+        Whether the diarization model has to be unloaded before the Whisper pass
+
+        With config.MODEL_RESIDENCY = "per_stage" it always is. Otherwise it
+        stays warm unless the Whisper model still has to be loaded and does
+        not fit in the memory left next to the diarization model.
+
+        Args:
+            transcriber: Transcriber of the Whisper pass (default: self.transcriber)
+        """
+        if config.MODEL_RESIDENCY == "per_stage":
+            return True
+        transcriber = transcriber or self.transcriber
+        if getattr(transcriber, "model", None) is not None:
+            return False
+        model_key = getattr(transcriber, "model_key", None)
+        if model_key is not None:
+            from model_registry import get_registry
+            if model_key() in get_registry().keys():
+                return False
+
+        # Diarization has imported torch already unless a stand-in ran it
+        available = available_memory_mb(resolve_device() if cuda_available() else "cpu")
+        if available is None:
+            return True
+        required = estimate_model_memory_mb(getattr(transcriber, "model_name", config.TRANSCRIPTION_MODEL))
+        if config.MEMORY_BUDGET_MB:
+            # A fixed budget has to hold both models; measured free memory
+            # already excludes the loaded diarization model
+            required += estimate_model_memory_mb(config.DIARIZATION_MODEL)
+        return required > available
+
+    def lookup(self, stage: str, audio_hash: Optional[str]):
+        """
+        Fetch a cached stage result
+
+        Args:
+            stage: "diarization" or "transcription"
+            audio_hash: Content hash of the audio (None disables the cache)
+
+        Returns:
+            Speaker segments or transcription units, or None on a miss
+        """
+        if self.cache is None or audio_hash is None:
+            return None
+        value = self.cache.get(stage, self._cache_key(stage, audio_hash))
+        if value is None:
+            return None
+        if stage == "diarization":
+            return [tuple(segment) for segment in value]
+        return tuple(value)
+
+    def store(self, stage: str, audio_hash: Optional[str], value):
+        """Cache a stage result, see lookup()"""
+        if self.cache is None or audio_hash is None:
+            return
+        self.cache.put(stage, self._cache_key(stage, audio_hash), value)
+
+    def _cache_key(self, stage: str, audio_hash: str) -> str:
+        """Result cache key of a stage; Whisper results are keyed by our transcriber's model and beam size"""
+        if stage == "diarization":
+            return diarization_key(audio_hash)
+        return transcription_key(
+            audio_hash,
+            model_name=getattr(self.transcriber, "model_name", None),
+            beam_size=getattr(self.transcriber, "beam_size", None)
+        )
+
+    def diarize(self, audio: AudioInput, audio_hash: str = None) -> List[Tuple[float, float, str]]:
+        """Run only the diarization stage, using the cache when possible"""
+        speaker_segments = self.lookup("diarization", audio_hash)
+        if speaker_segments is None:
+            speaker_segments = self.diarizer.diarize(load_audio(audio))
+            self.store("diarization", audio_hash, speaker_segments)
+        return speaker_segments
+
+    def transcribe(
+        self,
+        audio: AudioInput,
+        audio_hash: str = None,
+        speaker_segments: List[Tuple[float, float, str]] = None
+    ) -> Tuple[list, list, list, str]:
+        """Run only the Whisper stage, using the cache when possible
+
+        speaker_segments restricts batched-mode decoding to the diarized turns.
+        """
+        units = self.lookup("transcription", audio_hash)
+        if units is None:
+            units = self.transcriber.transcribe(load_audio(audio), speaker_segments)
+            self.store("transcription", audio_hash, units)
+        return units
+
+    def run(self, audio: AudioInput, audio_hash: str = None) -> Tuple[List[Tuple[float, float, str]], str]:
+        """
+        Diarize and transcribe audio
+
+        Args:
+            audio: Path to audio file or a decoded AudioBuffer
+            audio_hash: Content hash of the audio, enables the result cache
+
+        Returns:
+            Tuple of (speaker_segments, transcription with speaker labels)
+        """
+        speaker_segments = self.lookup("diarization", audio_hash)
+        units = self.lookup("transcription", audio_hash)
+
+        if speaker_segments is None and units is None:
+            audio = load_audio(audio)
+            if self.can_run_parallel():
+                speaker_segments, units = self._run_parallel(audio)
+            else:
+                speaker_segments = self.diarizer.diarize(audio)
+                # Free VRAM before the transcription model is loaded if it needs the room
+                self.diarizer.cleanup(release=self.release_before_transcription())
+                units = self.transcriber.transcribe(audio, speaker_segments)
+            self.store("diarization", audio_hash, speaker_segments)
+            self.store("transcription", audio_hash, units)
+        elif speaker_segments is None:
+            speaker_segments = self.diarize(audio, audio_hash)
+        elif units is None:
+            units = self.transcribe(audio, audio_hash, speaker_segments)
+
+        return speaker_segments, self.transcriber.assign_speakers(units, speaker_segments)
+
+    def stream(self, audio: AudioInput, audio_hash: str = None) -> Iterator[TranscriptLine]:
+        """
+        Diarize and transcribe audio, yielding speaker-labelled records as they are decoded
+
+        Diarization has to finish before the first record can be aligned. In
+        parallel mode Whisper keeps decoding in the background meanwhile, and
+        its buffered segments are flushed as soon as the speaker turns are known.
+        After diarization, ``speaker_segments`` holds the turns and ``duration``
+        the audio length in seconds (None if the audio was never decoded).
+
+        Args:
+            audio: Path to audio file or a decoded AudioBuffer
+            audio_hash: Content hash of the audio, enables the result cache
+
+        Yields:
+            Unstripped (start_time, end_time, speaker_label, text) records,
+            see alignment.merge_lines
+        """
+        self.speaker_segments = self.duration = None
+        speaker_segments = self.lookup("diarization", audio_hash)
+        units = self.lookup("transcription", audio_hash)
+
+        if speaker_segments is None or units is None:
+            audio = load_audio(audio)
+            self.duration = audio.duration
+
+        segments = None
+        if speaker_segments is None:
+            if units is None and self.can_run_parallel():
+                segments, speaker_segments = self._diarize_while_decoding(audio)
+            else:
+                speaker_segments = self.diarizer.diarize(audio)
+                if units is None:
+                    # Free VRAM before the transcription model is loaded if it needs the room
+                    self.diarizer.cleanup(release=self.release_before_transcription())
+            self.store("diarization", audio_hash, speaker_segments)
+
+        self.speaker_segments = speaker_segments
+        index = SpeakerIndex(speaker_segments)
+
+        if units is not None:
+            starts, ends, texts, joiner = units
+            yield from align(starts, ends, texts, index, joiner=joiner, strip=False)
+            return
+
+        if segments is None:
+            segments = self.transcriber.iter_segments(audio, speaker_segments)
+        units = ([], [], [], "" if config.WORD_TIMESTAMPS else " ")
+        yield from align_stream(segments, index, units)
+        self.store("transcription", audio_hash, units)
+
+    def _parallel_threads(self) -> Tuple[Optional[int], Optional[int]]:
+        """CPU threads of diarization and transcription running side by side, (None, None) on GPU"""
+        if resolve_device() == "cpu":
+            return split_threads()
+        return None, None
+
+    def _diarize_while_decoding(self, audio, transcriber=None):
+        """
+        Diarize while a transcriber (default: ours) decodes in a background thread
+
+        Each side gets its share of the CPU cores for the duration of its work.
+
+        Returns:
+            Tuple of (Whisper segments, see _background_segments; speaker_segments)
+        """
+        diarization_threads, transcription_threads = self._parallel_threads()
+        segments = self._background_segments(audio, transcriber, cpu_threads=transcription_threads)
+        with _override_threads(self.diarizer, "num_threads", diarization_threads):
+            return segments, self.diarizer.diarize(audio)
+
+    def _background_segments(self, audio, transcriber=None, cpu_threads: int = None) -> Iterator:
+        """Decode Whisper segments in a background thread and yield them in order
+
+        transcriber replaces ours, e.g. for the draft pass of two-pass transcription,
+        and cpu_threads its thread count while decoding.
+        Closing or dropping the returned generator stops the decoding after
+        the current segment.
+        """
+        transcriber = transcriber or self.transcriber
+        buffered = queue.Queue()
+        done = object()
+        stop = threading.Event()
+
+        def _produce():
+            segments = None
+            try:
+                with _override_threads(transcriber, "cpu_threads", cpu_threads):
+                    segments = transcriber.iter_segments(audio)
+                    for segment in segments:
+                        if stop.is_set():
+                            break
+                        buffered.put(segment)
+                buffered.put(done)
+            except BaseException as e:
+                buffered.put(e)
+            finally:
+                # Let the decoding generator clean up now instead of on garbage collection
+                if hasattr(segments, "close"):
+                    segments.close()
+
+        # Run in a copy of this context so metrics spans reach the caller's job
+        threading.Thread(
+            target=contextvars.copy_context().run, args=(_produce,), name="voxlens-whisper", daemon=True
+        ).start()
+
+        def _consume():
+            try:
+                yield
+                while True:
+                    item = buffered.get()
+                    if item is done:
+                        return
+                    if isinstance(item, BaseException):
+                        raise item
+                    yield item
+            finally:
+                stop.set()
+
+        consumer = _consume()
+        # Start the generator so that closing it, even before the first
+        # segment is taken (e.g. when diarization fails), runs its finally
+        next(consumer)
+        return consumer
+
+    def _run_parallel(self, audio):
+        """Run both stages in threads; the heavy work runs in native code without the GIL"""
+        diarization_threads, transcription_threads = self._parallel_threads()
+
+        with _override_threads(self.diarizer, "num_threads", diarization_threads), \
+                _override_threads(self.transcriber, "cpu_threads", transcription_threads), \
+                ThreadPoolExecutor(max_workers=2, thread_name_prefix="voxlens-stage") as executor:
+            # Each thread needs its own copy of the context, see metrics.track
+            diarization = executor.submit(contextvars.copy_context().run, self.diarizer.diarize, audio)
+            transcription = executor.submit(contextvars.copy_context().run, self.transcriber.transcribe, audio)
+            return diarization.result(), transcription.result()
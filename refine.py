@@ -0,0 +1,169 @@
+"""
+Two-pass transcription: a fast draft model first, then the configured model
+refines the transcript region by region
+"""
+from typing import Iterator, List, Sequence, Tuple
+import threading
+import numpy as np
+import config
+import metrics
+from alignment import speech_chunks
+from audio_loader import AudioBuffer
+
+
+# (starts, ends, texts, joiner), see alignment.collect_units
+Units = Tuple[list, list, list, str]
+
+
+def make_draft_transcriber(enabled: bool = None):
+    """
+    The transcriber of the draft pass
+
+    Args:
+        enabled: Run two passes (default: config.DRAFT_ENABLED)
+
+    Returns:
+        AudioTranscriber with config.DRAFT_MODEL and config.DRAFT_BEAM_SIZE, or None
+    """
+    if not (config.DRAFT_ENABLED if enabled is None else enabled):
+        return None
+    from transcription import AudioTranscriber
+    return AudioTranscriber(model_name=config.DRAFT_MODEL, beam_size=config.DRAFT_BEAM_SIZE)
+
+
+def refinement_regions(
+    speaker_segments: Sequence[Tuple[float, float, str]],
+    duration: float,
+    max_seconds: float = None,
+    cuts: Sequence[float] = ()
+) -> List[Tuple[float, float]]:
+    """
+    Tile the recording with regions that are refined one at a time
+
+    Speech turns are packed like batched decoding packs them (see
+    alignment.speech_chunks); neighbouring regions meet in the middle of
+    the pause between two chunks, so no word is cut at a region boundary
+    unless a single turn is longer than max_seconds.
+
+    Args:
+        speaker_segments: List of (start_time, end_time, speaker_label) tuples
+        duration: Audio length in seconds
+        max_seconds: Longest region (default: config.REFINE_REGION_SECONDS)
+        cuts: Extra boundaries, e.g. where an earlier run stopped
+
+    Returns:
+        Consecutive (start, end) regions from 0 to duration
+    """
+    chunks = speech_chunks(speaker_segments, policy="merge",
+                           max_seconds=max_seconds or config.REFINE_REGION_SECONDS, duration=duration)
+    bounds = {0.0, float(duration)}
+    bounds.update((previous_end + next_start) / 2 for (_, previous_end), (next_start, _) in zip(chunks, chunks[1:]))
+    bounds.update(cut for cut in cuts if 0.0 < cut < duration)
+    bounds = sorted(bounds)
+    return list(zip(bounds[:-1], bounds[1:]))
+
+
+class TranscriptRefiner:
+    """Replace a draft transcription region by region with another model's decoding
+
+    Draft units belong to the region holding their midpoint. Refining a
+    region decodes only that region's audio and swaps its units, so the
+    transcript stays complete throughout: refined where the refinement
+    got to, draft after it. Regions are refined in time order.
+    """
+
+    def __init__(
+        self,
+        transcriber,
+        audio: AudioBuffer,
+        speaker_segments: Sequence[Tuple[float, float, str]],
+        draft: Units,
+        refined_until: float = 0.0,
+        max_seconds: float = None
+    ):
+        """
+        Initialize the refiner
+
+        Args:
+            transcriber: AudioTranscriber with the refining model
+            audio: The recording
+            speaker_segments: Diarized turns (restrict decoding in batched mode)
+            draft: Draft units on the recording's timeline
+            refined_until: Audio before this time is already refined (a resumed run)
+            max_seconds: Longest region (default: config.REFINE_REGION_SECONDS)
+        """
+        self.transcriber = transcriber
+        self.audio = audio
+        self.speaker_segments = list(speaker_segments)
+        self.joiner = draft[3]
+        self.regions = refinement_regions(self.speaker_segments, audio.duration, max_seconds, cuts=[refined_until])
+
+        starts, ends, texts = draft[0], draft[1], draft[2]
+        middles = (np.asarray(starts, dtype=np.float64) + np.asarray(ends, dtype=np.float64)) / 2
+        owners = np.searchsorted([end for _, end in self.regions[:-1]], middles, side="right")
+        self.region_units: List[Tuple[list, list, list]] = [([], [], []) for _ in self.regions]
+        for i, owner in enumerate(owners.tolist()):
+            region = self.region_units[owner]
+            region[0].append(starts[i])
+            region[1].append(ends[i])
+            region[2].append(texts[i])
+        self.refined = [end <= refined_until + 1e-6 for _, end in self.regions]
+        self._lock = threading.Lock()
+
+    @property
+    def done(self) -> bool:
+        """Whether every region is refined"""
+        return all(self.refined)
+
+    @property
+    def progress(self) -> float:
+        """Share of the audio refined so far"""
+        total = sum(end - start for start, end in self.regions)
+        refined = sum(end - start for (start, end), done in zip(self.regions, self.refined) if done)
+        return refined / total if total else 1.0
+
+    def units(self) -> Units:
+        """Current units: refined regions and the draft of the rest, in time order"""
+        starts, ends, texts = [], [], []
+        with self._lock:
+            for region in self.region_units:
+                starts.extend(region[0])
+                ends.extend(region[1])
+                texts.extend(region[2])
+        return starts, ends, texts, self.joiner
+
+    def refine_region(self, index: int) -> Units:
+        """
+        Decode one region with the refining model and replace its draft units
+
+        Args:
+            index: Position in ``regions``
+
+        Returns:
+            The region's new units on the recording's timeline
+        """
+        start, end = self.regions[index]
+        turns = [
+            (max(turn_start, start) - start, min(turn_end, end) - start, label)
+            for turn_start, turn_end, label in self.speaker_segments
+            if turn_end > start and turn_start < end
+        ]
+        with metrics.span("refine.region", audio_seconds=end - start):
+            starts, ends, texts, _ = self.transcriber.transcribe(self.audio.slice(start, end), turns)
+        region = ([s + start for s in starts], [e + start for e in ends], list(texts))
+        with self._lock:
+            self.region_units[index] = region
+            self.refined[index] = True
+        return region[0], region[1], region[2], self.joiner
+
+    def iter_refine(self) -> Iterator[int]:
+        """
+        Refine every region not refined yet, in time order
+
+        Yields:
+            Index of each region after it was replaced
+        """
+        for index, done in enumerate(self.refined):
+            if not done:
+                self.refine_region(index)
+                yield index
@@ -0,0 +1,216 @@
+"""
+Content-addressed on-disk cache for pipeline stage results
+"""
+from typing import Any, Dict, Optional
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import zlib
+import config
+
+
+def hash_file(path: str, chunk_size: int = 1 << 20) -> str:
+    """
+    Hash a file's content without reading it into memory at once
+
+    Args:
+        path: Path to the file
+        chunk_size: Bytes read per step
+
+    Returns:
+        Hex SHA-256 digest
+    """
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def make_key(*parts: Any) -> str:
+    """Derive a cache key from JSON-serializable parts"""
+    payload = json.dumps(parts, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def diarization_key(audio_hash: str) -> str:
+    """Key of the diarization result for an audio file"""
+    return make_key("diarization", audio_hash, config.DIARIZATION_MODEL)
+
+
+def transcription_key(audio_hash: str, model_name: str = None, beam_size: int = None) -> str:
+    """Key of the Whisper result for an audio file
+
+    model_name and beam_size are the transcriber's own (default:
+    config.TRANSCRIPTION_MODEL and config.BEAM_SIZE).
+    """
+    parts = [
+        "transcription",
+        audio_hash,
+        model_name or config.TRANSCRIPTION_MODEL,
+        beam_size or config.BEAM_SIZE,
+        config.TRANSCRIPTION_LANGUAGE,
+        config.VAD_FILTER,
+        config.WORD_TIMESTAMPS,
+        # Quantized and float decodings differ; same choice as AudioTranscriber.model_key
+        config.COMPUTE_TYPE if config.DEVICE == "cuda" else config.CPU_COMPUTE_TYPE,
+    ]
+    if config.TRANSCRIPTION_MODE == "batched":
+        # Batched mode decodes only the diarized turns, so the result also
+        # depends on the diarization model and the chunk packing
+        parts += [
+            config.TRANSCRIPTION_MODE,
+            config.DIARIZATION_MODEL,
+            config.WHISPER_BATCH_SIZE,
+            config.WHISPER_PACKING,
+            config.WHISPER_CHUNK_SECONDS,
+            config.WHISPER_MERGE_GAP,
+            config.WHISPER_CHUNK_PADDING,
+        ]
+    return make_key(*parts)
+
+
+def summary_key(transcription: str, prompt: str, model: str = None, **options: Any) -> str:
+    """Key of a summary of a transcription"""
+    transcription_hash = hashlib.sha256(transcription.encode("utf-8")).hexdigest()
+    return make_key("summary", transcription_hash, model or config.LLM_MODEL, prompt, options)
+
+
+class ResultCache:
+    """Size-bounded cache storing each stage's output as compressed JSON
+
+    Entries are files named by stage and key. Reading an entry refreshes its
+    modification time, and the least recently used files are deleted when the
+    cache grows past its size limit.
+    """
+
+    def __init__(self, cache_dir: str = None, max_mb: float = None):
+        """
+        Initialize the cache
+
+        Args:
+            cache_dir: Directory holding the entries
+            max_mb: Maximum total size of the entries in MB
+        """
+        self.cache_dir = cache_dir or config.CACHE_DIR
+        self.max_bytes = int((max_mb if max_mb is not None else config.CACHE_MAX_MB) * 2**20)
+        self.hits: Dict[str, int] = {}
+        self.misses: Dict[str, int] = {}
+        self._lock = threading.Lock()
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+    def _path(self, stage: str, key: str) -> str:
+        return os.path.join(self.cache_dir, f"{stage}-{key}.json.z")
+
+    def get(self, stage: str, key: str) -> Optional[Any]:
+        """
+        Look up a stage result
+
+        Args:
+            stage: Stage name, e.g. "diarization"
+            key: Cache key from one of the *_key helpers
+
+        Returns:
+            The stored value or None on a miss
+        """
+        path = self._path(stage, key)
+        try:
+            with open(path, "rb") as f:
+                value = json.loads(zlib.decompress(f.read()).decode("utf-8"))
+            os.utime(path)
+        except (OSError, ValueError, zlib.error):
+            self._count(self.misses, stage)
+            return None
+        self._count(self.hits, stage)
+        return value
+
+    def put(self, stage: str, key: str, value: Any):
+        """
+        Store a stage result and evict old entries if over the size limit
+
+        Args:
+            stage: Stage name
+            key: Cache key
+            value: JSON-serializable result
+        """
+        data = zlib.compress(
+            json.dumps(value, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+        )
+        # Write atomically so concurrent readers never see a partial entry
+        fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            os.replace(tmp_path, self._path(stage, key))
+        except OSError:
+            if os.path.exists(tmp_path):
+                os.unlink(tmp_path)
+            raise
+        self._evict()
+
+    def stats(self) -> Dict[str, Any]:
+        """Hit/miss counters and current size"""
+        with self._lock:
+            return {
+                "hits": dict(self.hits),
+                "misses": dict(self.misses),
+                "size_mb": self._size_bytes() / 2**20,
+            }
+
+    def clear(self):
+        """Delete all entries"""
+        for _, _, path in self._entries():
+            try:
+                os.unlink(path)
+            except OSError:
+                pass
+
+    def _count(self, counter: Dict[str, int], stage: str):
+        with self._lock:
+            counter[stage] = counter.get(stage, 0) + 1
+
+    def _entries(self):
+        """(mtime, size, path) of every entry, skipping files removed meanwhile"""
+        entries = []
+        for entry in os.scandir(self.cache_dir):
+            if not entry.name.endswith(".json.z"):
+                continue
+            try:
+                stat = entry.stat()
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, entry.path))
+        return entries
+
+    def _size_bytes(self) -> int:
+        return sum(size for _, size, _ in self._entries())
+
+    def _evict(self):
+        """Delete least recently used entries until the cache fits its limit"""
+        entries = sorted(self._entries())
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in entries:
+            if total <= self.max_bytes:
+                break
+            try:
+                os.unlink(path)
+                total -= size
+            except OSError:
+                pass
+
+
+_cache: Optional[ResultCache] = None
+_cache_lock = threading.Lock()
+
+
+def get_result_cache() -> Optional[ResultCache]:
+    """Return the process-wide result cache, or None if caching is disabled"""
+    global _cache
+    if not config.CACHE_ENABLED:
+        return None
+    with _cache_lock:
+        if _cache is None:
+            _cache = ResultCache()
+        return _cache
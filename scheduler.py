@@ -0,0 +1,237 @@
+"""
+Stage-pipelined scheduler that overlaps processing stages across items
+"""
+from typing import Any, Callable, Dict, Iterable, List, Optional
+import queue
+import threading
+import time
+
+
+class Stage:
+    """One processing step with its own worker threads"""
+
+    def __init__(self, name: str, func: Callable[[Any], Any], workers: int = 1):
+        """
+        Define a stage
+
+        Args:
+            name: Stage name used in statistics
+            func: Function turning the previous stage's output into this stage's output
+            workers: Number of threads running this stage
+        """
+        self.name = name
+        self.func = func
+        self.workers = max(1, workers)
+        self.processed = 0
+        self.failed = 0
+        self.busy_seconds = 0.0
+        self._lock = threading.Lock()
+
+    def _record(self, seconds: float, ok: bool):
+        with self._lock:
+            self.busy_seconds += seconds
+            if ok:
+                self.processed += 1
+            else:
+                self.failed += 1
+
+
+class _MonitoredQueue(queue.Queue):
+    """Bounded queue that records its depth every time an item is added"""
+
+    def __init__(self, maxsize: int):
+        super().__init__(maxsize)
+        self.depth_sum = 0
+        self.depth_samples = 0
+        self.depth_max = 0
+
+    def put(self, item, block=True, timeout=None):
+        super().put(item, block, timeout)
+        depth = self.qsize()
+        with self.mutex:
+            self.depth_sum += depth
+            self.depth_samples += 1
+            self.depth_max = max(self.depth_max, depth)
+
+
+class _Failed:
+    """Marks an item whose processing raised, so later stages pass it through"""
+
+    def __init__(self, stage: str, error: BaseException):
+        self.stage = stage
+        self.error = error
+
+
+_DONE = object()
+
+
+class StagePipeline:
+    """Run items through stages connected by bounded queues
+
+    While item N is in stage 2, item N+1 can already be in stage 1. Each
+    queue holds at most ``queue_size`` items, so a slow stage blocks the
+    ones before it instead of letting intermediate results pile up in memory.
+    If a callback raises, the stages are stopped and the error is passed on.
+    """
+
+    # How often blocked workers check whether the run is being stopped
+    POLL_SECONDS = 0.1
+
+    def __init__(self, stages: List[Stage], queue_size: int = 2):
+        """
+        Initialize the pipeline
+
+        Args:
+            stages: Stages in processing order
+            queue_size: Capacity of each queue between stages
+        """
+        self.stages = stages
+        self.queue_size = max(1, queue_size)
+        self._queues: List[_MonitoredQueue] = []
+        self._stopping = threading.Event()
+        self.elapsed = 0.0
+
+    def run(
+        self,
+        items: Iterable[Any],
+        on_result: Optional[Callable[[Any, Any], None]] = None,
+        on_error: Optional[Callable[[Any, str, BaseException], None]] = None
+    ) -> List[Any]:
+        """
+        Process items and wait for all of them
+
+        Args:
+            items: Inputs of the first stage
+            on_result: Called with (item, result) as each item finishes
+            on_error: Called with (item, stage_name, error) when an item fails
+
+        Returns:
+            Results of the last stage in input order (None for failed items)
+
+        Raises:
+            Whatever on_result or on_error raised, once the workers have stopped
+        """
+        self._queues = [_MonitoredQueue(self.queue_size) for _ in range(len(self.stages) + 1)]
+        self._stopping.clear()
+        items = list(items)
+        results: List[Any] = [None] * len(items)
+        started = time.perf_counter()
+
+        threads = []
+        for position, stage in enumerate(self.stages):
+            remaining = [stage.workers]
+            remaining_lock = threading.Lock()
+            for n in range(stage.workers):
+                thread = threading.Thread(
+                    target=self._work,
+                    args=(stage, self._queues[position], self._queues[position + 1],
+                          remaining, remaining_lock),
+                    name=f"voxlens-{stage.name}-{n}",
+                    daemon=True
+                )
+                thread.start()
+                threads.append(thread)
+
+        def _feed():
+            for index, item in enumerate(items):
+                if not self._put(self._queues[0], (index, item)):
+                    return
+            self._put(self._queues[0], _DONE)
+
+        feeder = threading.Thread(target=_feed, name="voxlens-feeder", daemon=True)
+        feeder.start()
+
+        output = self._queues[-1]
+        try:
+            while True:
+                entry = output.get()
+                if entry is _DONE:
+                    break
+                index, value = entry
+                if isinstance(value, _Failed):
+                    if on_error is not None:
+                        on_error(items[index], value.stage, value.error)
+                    continue
+                results[index] = value
+                if on_result is not None:
+                    on_result(items[index], value)
+        except BaseException:
+            # Nobody drains the queues any more; stop the workers blocked on them
+            self._stopping.set()
+            raise
+        finally:
+            feeder.join()
+            for thread in threads:
+                thread.join()
+            self.elapsed = time.perf_counter() - started
+        return results
+
+    def _put(self, target: queue.Queue, entry) -> bool:
+        """Put an entry, giving up when the run is stopped; False if it was dropped"""
+        while not self._stopping.is_set():
+            try:
+                target.put(entry, timeout=self.POLL_SECONDS)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def _get(self, source: queue.Queue):
+        """Take the next entry, or _DONE when the run is stopped"""
+        while not self._stopping.is_set():
+            try:
+                return source.get(timeout=self.POLL_SECONDS)
+            except queue.Empty:
+                continue
+        return _DONE
+
+    def _work(self, stage: Stage, inbox: queue.Queue, outbox: queue.Queue, remaining, remaining_lock):
+        while True:
+            entry = self._get(inbox)
+            if entry is _DONE:
+                # Let sibling workers see the end marker too; the last one forwards it
+                self._put(inbox, _DONE)
+                with remaining_lock:
+                    remaining[0] -= 1
+                    last = remaining[0] == 0
+                if last:
+                    self._put(outbox, _DONE)
+                return
+
+            index, value = entry
+            if not isinstance(value, _Failed):
+                started = time.perf_counter()
+                try:
+                    value = stage.func(value)
+                    stage._record(time.perf_counter() - started, ok=True)
+                except Exception as e:
+                    stage._record(time.perf_counter() - started, ok=False)
+                    value = _Failed(stage.name, e)
+            if not self._put(outbox, (index, value)):
+                return
+
+    def stats(self) -> Dict[str, Dict[str, float]]:
+        """
+        Per-stage statistics of the last run
+
+        Returns:
+            Dict by stage name with processed/failed counts, busy seconds,
+            utilization (busy time over elapsed time times workers) and the
+            mean/max depth of the queue feeding the stage
+        """
+        stats = {}
+        for position, stage in enumerate(self.stages):
+            inbox = self._queues[position] if self._queues else None
+            capacity = self.elapsed * stage.workers
+            stats[stage.name] = {
+                "workers": stage.workers,
+                "processed": stage.processed,
+                "failed": stage.failed,
+                "busy_seconds": stage.busy_seconds,
+                "utilization": stage.busy_seconds / capacity if capacity else 0.0,
+                "queue_depth_mean": (
+                    inbox.depth_sum / inbox.depth_samples if inbox and inbox.depth_samples else 0.0
+                ),
+                "queue_depth_max": inbox.depth_max if inbox else 0,
+            }
+        return stats
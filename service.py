@@ -0,0 +1,843 @@
+"""
+Local job service: persistent queue, worker processes and an HTTP API
+"""
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from typing import Any, BinaryIO, Callable, Dict, List, Optional
+import json
+import multiprocessing
+import os
+import sqlite3
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+import config
+import metrics
+from alignment import format_transcript, merge_lines
+from audio_loader import save_upload
+from jobs import Job, JobRunner, find_job, pid_alive
+from refine import make_draft_transcriber
+
+
+# Queue states after which a job no longer changes
+FINAL_STATES = ("done", "failed", "cancelled", "timeout")
+
+
+class JobCancelled(Exception):
+    """Raised in a worker when its running job was cancelled"""
+
+
+class JobTimedOut(Exception):
+    """Raised in a worker when its running job passed its time limit"""
+
+
+class ServiceError(Exception):
+    """Error response of the job service"""
+
+    def __init__(self, status: int, message: str):
+        super().__init__(f"{status}: {message}")
+        self.status = status
+
+
+class JobQueue:
+    """Job queue in SQLite, shared by the API server and the worker processes
+
+    A row holds the scheduling state of a job: status, options, time limit,
+    progress and the cancellation request. The job's data and checkpoints
+    live in its jobs.Job working directory under the same id.
+    """
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS jobs (
+            job_id TEXT PRIMARY KEY,
+            status TEXT NOT NULL,
+            options TEXT NOT NULL,
+            timeout REAL,
+            attempts INTEGER NOT NULL DEFAULT 0,
+            submitted REAL NOT NULL,
+            started REAL,
+            finished REAL,
+            worker_pid INTEGER,
+            cancel_requested REAL,
+            progress REAL NOT NULL DEFAULT 0,
+            message TEXT,
+            preview TEXT,
+            error TEXT
+        )
+    """
+    # Columns workers may update while a job runs
+    PROGRESS_FIELDS = ("progress", "message", "preview")
+
+    def __init__(self, path: str = None):
+        """
+        Open or create the queue
+
+        Args:
+            path: SQLite database file (default: config.JOB_QUEUE_PATH)
+        """
+        self.path = path or config.JOB_QUEUE_PATH
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        with self._db() as db:
+            # WAL lets the workers write progress while the API reads it
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute(self.SCHEMA)
+
+    @contextmanager
+    def _db(self):
+        # A connection per call: used from request threads and several processes
+        db = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        db.row_factory = sqlite3.Row
+        try:
+            yield db
+        finally:
+            db.close()
+
+    @staticmethod
+    def _row(row: Optional[sqlite3.Row]) -> Optional[Dict[str, Any]]:
+        if row is None:
+            return None
+        entry = dict(row)
+        entry["options"] = json.loads(entry["options"])
+        return entry
+
+    def submit(self, job_id: str, options: Dict[str, Any] = None, timeout: float = None) -> Dict[str, Any]:
+        """
+        Queue a job, or re-queue one that ended without finishing
+
+        A job that is already queued or running is left as it is.
+
+        Args:
+            job_id: Id of an existing jobs.Job
+            options: Processing options, e.g. {"summarize": True, "use_map_reduce": False, "draft": True}
+            timeout: Time limit in seconds once running (default: config.JOB_TIMEOUT, 0 = none)
+
+        Returns:
+            The job's queue entry
+        """
+        timeout = config.JOB_TIMEOUT if timeout is None else timeout
+        options = json.dumps(options or {})
+        with self._db() as db:
+            db.execute("BEGIN IMMEDIATE")
+            current = db.execute("SELECT status FROM jobs WHERE job_id = ?", (job_id,)).fetchone()
+            if current is None:
+                db.execute(
+                    "INSERT INTO jobs (job_id, status, options, timeout, submitted) VALUES (?, 'queued', ?, ?, ?)",
+                    (job_id, options, timeout, time.time())
+                )
+            elif current["status"] not in ("queued", "running"):
+                db.execute(
+                    "UPDATE jobs SET status = 'queued', options = ?, timeout = ?, attempts = 0, submitted = ?, "
+                    "started = NULL, finished = NULL, worker_pid = NULL, cancel_requested = NULL, "
+                    "progress = 0, message = NULL, preview = NULL, error = NULL WHERE job_id = ?",
+                    (options, timeout, time.time(), job_id)
+                )
+            db.execute("COMMIT")
+        return self.get(job_id)
+
+    def claim(self, worker_pid: int) -> Optional[Dict[str, Any]]:
+        """
+        Take the oldest queued job for a worker
+
+        Returns:
+            The job's queue entry, now running, or None if the queue is empty
+        """
+        with self._db() as db:
+            db.execute("BEGIN IMMEDIATE")
+            row = db.execute(
+                "SELECT job_id FROM jobs WHERE status = 'queued' ORDER BY submitted LIMIT 1"
+            ).fetchone()
+            if row is not None:
+                db.execute(
+                    "UPDATE jobs SET status = 'running', started = ?, worker_pid = ?, attempts = attempts + 1, "
+                    "progress = 0, message = NULL WHERE job_id = ?",
+                    (time.time(), worker_pid, row["job_id"])
+                )
+            db.execute("COMMIT")
+        return self.get(row["job_id"]) if row is not None else None
+
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        """The job's queue entry, or None if it was never submitted"""
+        with self._db() as db:
+            return self._row(db.execute("SELECT * FROM jobs WHERE job_id = ?", (job_id,)).fetchone())
+
+    def list(self, limit: int = 100) -> List[Dict[str, Any]]:
+        """Most recently submitted entries first"""
+        with self._db() as db:
+            rows = db.execute("SELECT * FROM jobs ORDER BY submitted DESC LIMIT ?", (limit,)).fetchall()
+        return [self._row(row) for row in rows]
+
+    def report(self, job_id: str, **fields: Any) -> Optional[Dict[str, Any]]:
+        """
+        Record a running job's progress
+
+        Args:
+            job_id: Job id
+            fields: progress (0..1), message and/or preview
+
+        Returns:
+            The updated entry, so the worker sees cancellation requests
+        """
+        fields = {key: value for key, value in fields.items() if key in self.PROGRESS_FIELDS}
+        if fields:
+            assignments = ", ".join(f"{key} = ?" for key in fields)
+            with self._db() as db:
+                db.execute(f"UPDATE jobs SET {assignments} WHERE job_id = ? AND status = 'running'",
+                           (*fields.values(), job_id))
+        return self.get(job_id)
+
+    def cancel(self, job_id: str) -> Optional[Dict[str, Any]]:
+        """
+        Cancel a job
+
+        A queued job is cancelled at once; a running job is asked to stop
+        and its worker is restarted if it does not within the grace period.
+
+        Returns:
+            The job's queue entry, or None if it was never submitted
+        """
+        now = time.time()
+        with self._db() as db:
+            db.execute("UPDATE jobs SET status = 'cancelled', finished = ? WHERE job_id = ? AND status = 'queued'",
+                       (now, job_id))
+            db.execute("UPDATE jobs SET cancel_requested = ? WHERE job_id = ? AND status = 'running' "
+                       "AND cancel_requested IS NULL", (now, job_id))
+        return self.get(job_id)
+
+    def finish(self, job_id: str, status: str, error: str = None):
+        """Move a running job to a final state (no-op if it already left running)"""
+        with self._db() as db:
+            db.execute(
+                "UPDATE jobs SET status = ?, error = ?, finished = ?, "
+                "progress = CASE WHEN ? = 'done' THEN 1 ELSE progress END "
+                "WHERE job_id = ? AND status = 'running'",
+                (status, error, time.time(), status, job_id)
+            )
+
+    def overdue(self, grace: float) -> List[Dict[str, Any]]:
+        """Running jobs that ignored a cancellation or their time limit for longer than grace seconds"""
+        now = time.time()
+        with self._db() as db:
+            rows = db.execute(
+                "SELECT * FROM jobs WHERE status = 'running' AND ("
+                "(cancel_requested IS NOT NULL AND cancel_requested + ? < ?) "
+                "OR (timeout > 0 AND started + timeout + ? < ?))",
+                (grace, now, grace, now)
+            ).fetchall()
+        return [self._row(row) for row in rows]
+
+    def release(self, worker_pid: int = None, max_attempts: int = None) -> int:
+        """
+        Re-queue the jobs of a dead worker
+
+        Jobs resume from their checkpoints. A job that already took
+        max_attempts workers down with it is marked failed instead.
+
+        Args:
+            worker_pid: Worker that died (None: every worker process not alive any more)
+            max_attempts: Runs allowed per job (default: config.JOB_MAX_ATTEMPTS)
+
+        Returns:
+            Number of released jobs
+        """
+        max_attempts = max_attempts or config.JOB_MAX_ATTEMPTS
+        with self._db() as db:
+            rows = db.execute("SELECT job_id, worker_pid, attempts FROM jobs WHERE status = 'running'").fetchall()
+            released = 0
+            for row in rows:
+                if worker_pid is not None and row["worker_pid"] != worker_pid:
+                    continue
+                if worker_pid is None and pid_alive(row["worker_pid"]):
+                    continue
+                if row["attempts"] >= max_attempts:
+                    db.execute("UPDATE jobs SET status = 'failed', finished = ?, error = ? "
+                               "WHERE job_id = ? AND status = 'running'",
+                               (time.time(), "Worker process died", row["job_id"]))
+                else:
+                    db.execute("UPDATE jobs SET status = 'queued', worker_pid = NULL "
+                               "WHERE job_id = ? AND status = 'running'", (row["job_id"],))
+                released += 1
+        return released
+
+
+class Worker:
+    """Takes jobs off the queue and runs them with warm models
+
+    Cancellation and time limits are checked whenever the job reports
+    progress: between stages and after every transcribed segment. A job
+    stuck inside one model call is stopped by the service restarting the
+    worker process, see JobService.
+    """
+
+    def __init__(
+        self,
+        queue: JobQueue,
+        huggingface_token: str = None,
+        pipeline_factory: Callable[[], Any] = None,
+        summarizer_factory: Callable[[], Any] = None,
+        poll_interval: float = 1.0,
+        report_interval: float = 0.5
+    ):
+        """
+        Initialize the worker
+
+        Args:
+            queue: Queue to take jobs from
+            huggingface_token: HuggingFace access token for pyannote
+            pipeline_factory: Builds the TranscriptionPipeline (default: real models)
+            summarizer_factory: Builds the ConversationSummarizer (default: Ollama)
+            poll_interval: Seconds between looks at an empty queue
+            report_interval: Minimum seconds between progress updates
+        """
+        self.queue = queue
+        self.huggingface_token = huggingface_token or os.getenv("HF_TOKEN")
+        self.pipeline_factory = pipeline_factory or self._default_pipeline
+        self.summarizer_factory = summarizer_factory or self._default_summarizer
+        self.poll_interval = poll_interval
+        self.report_interval = report_interval
+        self.pid = os.getpid()
+        self._last_report = 0.0
+
+    def _default_pipeline(self):
+        from diarization import SpeakerDiarizer
+        from transcription import AudioTranscriber
+        from pipeline import TranscriptionPipeline
+        from result_cache import get_result_cache
+
+        return TranscriptionPipeline(
+            SpeakerDiarizer(huggingface_token=self.huggingface_token), AudioTranscriber(), cache=get_result_cache()
+        )
+
+    def _default_summarizer(self):
+        from result_cache import get_result_cache
+        from summarization import ConversationSummarizer
+
+        return ConversationSummarizer(cache=get_result_cache())
+
+    def run_forever(self, stop: threading.Event = None):
+        """Process jobs until stop is set"""
+        stop = stop or threading.Event()
+        while not stop.is_set():
+            if self.run_once() is None:
+                stop.wait(self.poll_interval)
+
+    def run_once(self) -> Optional[str]:
+        """
+        Run the oldest queued job, if any
+
+        Returns:
+            Its job id, or None if the queue was empty
+        """
+        entry = self.queue.claim(self.pid)
+        if entry is None:
+            return None
+        job_id = entry["job_id"]
+        deadline = entry["started"] + entry["timeout"] if entry["timeout"] else None
+        try:
+            self._run(entry, deadline)
+        except JobCancelled:
+            self.queue.finish(job_id, "cancelled")
+        except JobTimedOut:
+            self.queue.finish(job_id, "timeout", f"Time limit of {entry['timeout']:.0f}s exceeded")
+        except Exception as e:
+            self.queue.finish(job_id, "failed", f"{type(e).__name__}: {e}")
+        else:
+            self.queue.finish(job_id, "done")
+        return job_id
+
+    def _report(self, job_id: str, deadline: Optional[float], force: bool = False,
+                preview: Callable[[], str] = None, **fields: Any):
+        """Publish progress at most every report_interval and stop if asked to"""
+        now = time.monotonic()
+        if not force and now - self._last_report < self.report_interval:
+            return
+        self._last_report = now
+        if preview is not None:
+            fields["preview"] = preview()
+        entry = self.queue.report(job_id, **fields)
+        if entry is None or entry["cancel_requested"] is not None or entry["status"] != "running":
+            raise JobCancelled(job_id)
+        if deadline is not None and time.time() > deadline:
+            raise JobTimedOut(job_id)
+
+    def _run(self, entry: Dict[str, Any], deadline: Optional[float]):
+        job_id, options = entry["job_id"], entry["options"]
+        job = Job.open(job_id)
+        job_metrics = metrics.JobMetrics(job_id=job_id)
+        pipeline = self.pipeline_factory()
+        draft_transcriber = make_draft_transcriber(options.get("draft"))
+        runner = JobRunner(job, pipeline, draft_transcriber)
+        joiner = "" if config.WORD_TIMESTAMPS else " "
+        records = []
+
+        def _tail() -> str:
+            return format_transcript(merge_lines(records[-200:], joiner)[-20:])
+
+        try:
+            with metrics.track(job_metrics):
+                self._report(job_id, deadline, force=True, progress=0.05, message="diarization")
+                stream = runner.stream()
+                try:
+                    for record in stream:
+                        records.append(record)
+                        done = min(record[1] / runner.duration, 1.0) if runner.duration else 0.0
+                        self._report(job_id, deadline, preview=_tail, progress=0.1 + 0.6 * done,
+                                     message="transcription")
+                finally:
+                    stream.close()
+                self._report(job_id, deadline, force=True, preview=_tail, progress=0.7, message="transcribed")
+
+                def _refine():
+                    # The preview shows the whole transcript as refined regions replace the draft
+                    runner.refine(on_update=lambda refiner: self._report(
+                        job_id, deadline, preview=lambda: runner.transcript.to_text(),
+                        progress=0.7 + 0.05 * refiner.progress, message="refining"
+                    ))
+
+                summarize = options.get("summarize", True)
+                if runner.refiner is not None and (config.DRAFT_SUMMARY_WAITS or not summarize):
+                    _refine()
+                if summarize:
+                    self._report(job_id, deadline, force=True, message="summarization")
+                    # The summary so far becomes the preview; a cancel stops the generation
+                    pieces = []
+                    stream = runner.summarize_stream(self.summarizer_factory(),
+                                                     use_map_reduce=options.get("use_map_reduce", False))
+                    try:
+                        for piece in stream:
+                            pieces.append(piece)
+                            self._report(job_id, deadline, preview=lambda: "".join(pieces).strip(),
+                                         progress=0.75, message="summarization")
+                    finally:
+                        stream.close()
+                # The summary was written from the draft
+                if runner.refiner is not None:
+                    _refine()
+                runner.finish()
+        finally:
+            # Models stay warm in the registry for the next job unless MODEL_RESIDENCY is "per_stage"
+            pipeline.diarizer.cleanup()
+            pipeline.transcriber.cleanup()
+            if draft_transcriber is not None:
+                draft_transcriber.cleanup()
+            if config.METRICS_ENABLED:
+                job_metrics.save(str(job.workdir / "metrics.json"))
+
+
+def _worker_main(queue_path: str, huggingface_token: str = None):
+    """Entry point of a worker process started by JobService"""
+    if config.PRELOAD_MODELS and config.OLLAMA_POOLED:
+        from ollama_client import get_ollama_pool
+
+        get_ollama_pool().preload()
+    try:
+        Worker(JobQueue(queue_path), huggingface_token=huggingface_token).run_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+class _BodyReader:
+    """File-like view of a request body of known length"""
+
+    def __init__(self, stream: BinaryIO, length: int):
+        self.stream = stream
+        self.remaining = length
+
+    def read(self, size: int = -1) -> bytes:
+        size = self.remaining if size < 0 else min(size, self.remaining)
+        if size <= 0:
+            return b""
+        data = self.stream.read(size)
+        self.remaining -= len(data)
+        return data
+
+
+def job_status(queue: JobQueue, job_id: str) -> Optional[Dict[str, Any]]:
+    """Queue entry of a job with its checkpointed stages, as returned by the API"""
+    entry = queue.get(job_id)
+    if entry is None:
+        return None
+    try:
+        entry["completed"] = Job.open(job_id).manifest["completed"]
+    except (OSError, ValueError):
+        entry["completed"] = []
+    return entry
+
+
+def job_result(job_id: str) -> Dict[str, Any]:
+    """Outputs of a finished job, as returned by the API"""
+    job = Job.open(job_id)
+    result: Dict[str, Any] = {
+        "job_id": job_id,
+        "source": job.manifest["source"],
+        "speaker_segments": job.load("diarization"),
+        "transcription": (job.workdir / "transcript.txt").read_text(encoding="utf-8"),
+        "summary": job.load("summary"),
+        "metrics": None,
+    }
+    metrics_path = job.workdir / "metrics.json"
+    if metrics_path.exists():
+        result["metrics"] = json.loads(metrics_path.read_text(encoding="utf-8"))
+    return result
+
+
+class JobService:
+    """HTTP API over the job queue, supervising a pool of worker processes
+
+    Endpoints (JSON responses):
+
+    - POST /jobs?name=&summarize=&map_reduce=&timeout= with the recording as
+      the request body: create (or resume) a job and queue it
+    - GET /jobs: recent jobs
+    - GET /jobs/<id>: status, progress and a preview of the transcript
+    - GET /jobs/<id>/result: transcript, summary and metrics of a done job
+    - POST /jobs/<id>/cancel: cancel a queued or running job
+    - GET /health
+
+    Every worker process holds its own models. A worker that does not stop
+    a cancelled or timed out job within the grace period is restarted, and
+    the jobs of a worker that died are re-queued to resume from their
+    checkpoints.
+    """
+
+    def __init__(
+        self,
+        host: str = None,
+        port: int = None,
+        workers: int = None,
+        queue_path: str = None,
+        huggingface_token: str = None,
+        kill_grace: float = None
+    ):
+        """
+        Initialize the service
+
+        Args:
+            host: Address to listen on (default: config.JOB_SERVICE_HOST)
+            port: Port to listen on, 0 for a free one (default: config.JOB_SERVICE_PORT)
+            workers: Worker processes to run (0 = API only, workers started separately)
+            queue_path: SQLite queue file (default: config.JOB_QUEUE_PATH)
+            huggingface_token: HuggingFace access token passed to the workers
+            kill_grace: Seconds a worker gets to stop a job before it is restarted
+        """
+        self.host = host or config.JOB_SERVICE_HOST
+        self.port = config.JOB_SERVICE_PORT if port is None else port
+        self.workers = config.JOB_SERVICE_WORKERS if workers is None else workers
+        self.queue = JobQueue(queue_path)
+        self.huggingface_token = huggingface_token or os.getenv("HF_TOKEN")
+        self.kill_grace = config.JOB_KILL_GRACE if kill_grace is None else kill_grace
+        self._processes: List[multiprocessing.Process] = []
+        self._server: Optional[ThreadingHTTPServer] = None
+        self._stop = threading.Event()
+        self._threads: List[threading.Thread] = []
+
+    @property
+    def url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def start(self):
+        """Start the API server, the workers and their supervisor"""
+        # Jobs of workers that died with an earlier service resume from their checkpoints
+        self.queue.release()
+        self._server = ThreadingHTTPServer((self.host, self.port), self._handler())
+        self._server.daemon_threads = True
+        self._stop.clear()
+        for _ in range(self.workers):
+            self._processes.append(self._spawn_worker())
+        for target, name in ((self._server.serve_forever, "voxlens-api"), (self._supervise, "voxlens-supervisor")):
+            thread = threading.Thread(target=target, name=name, daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def stop(self):
+        """Stop the API server and the workers; running jobs resume on the next start"""
+        self._stop.set()
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+        for process in self._processes:
+            process.terminate()
+        for process in self._processes:
+            process.join()
+        self._processes = []
+        for thread in self._threads:
+            thread.join()
+        self._threads = []
+
+    def serve_forever(self):
+        """Run until interrupted"""
+        self.start()
+        print(f"VoxLens job service on {self.url} with {self.workers} worker(s)", flush=True)
+        try:
+            while not self._stop.wait(1.0):
+                pass
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self.stop()
+
+    def _spawn_worker(self) -> multiprocessing.Process:
+        # spawn: forking a process that already initialized torch or CUDA is unsafe
+        process = multiprocessing.get_context("spawn").Process(
+            target=_worker_main, args=(self.queue.path, self.huggingface_token),
+            name="voxlens-worker", daemon=True
+        )
+        process.start()
+        return process
+
+    def _supervise(self):
+        """Restart stuck or dead workers"""
+        while not self._stop.wait(1.0):
+            for entry in self.queue.overdue(self.kill_grace):
+                if entry["cancel_requested"] is not None:
+                    self.queue.finish(entry["job_id"], "cancelled")
+                else:
+                    self.queue.finish(entry["job_id"], "timeout",
+                                      f"Time limit of {entry['timeout']:.0f}s exceeded")
+                for process in self._processes:
+                    if process.pid == entry["worker_pid"]:
+                        process.terminate()
+                        process.join()
+
+            for position, process in enumerate(self._processes):
+                if not process.is_alive() and not self._stop.is_set():
+                    self.queue.release(process.pid)
+                    self._processes[position] = self._spawn_worker()
+
+    def submit(self, stream: BinaryIO, name: str, options: Dict[str, Any], timeout: float = None) -> Dict[str, Any]:
+        """
+        Store an uploaded recording as a job and queue it
+
+        A recording whose earlier job did not finish resumes that job.
+
+        Args:
+            stream: The recording's bytes
+            name: Original file name
+            options: Processing options
+            timeout: Time limit in seconds (default: config.JOB_TIMEOUT)
+
+        Returns:
+            The job's status
+        """
+        path, audio_hash = save_upload(stream, suffix=Path(name).suffix, directory=config.JOBS_DIR)
+        job = find_job(audio_hash)
+        if job is None:
+            job = Job.create(path, source_name=name, audio_hash=audio_hash, move=True)
+        else:
+            os.unlink(path)
+        self.queue.submit(job.job_id, options, timeout)
+        return job_status(self.queue, job.job_id)
+
+    def _handler(self):
+        service = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, *args):
+                pass
+
+            def do_GET(self):
+                parts = self._parts()
+                if parts == ["health"]:
+                    self._send(200, {"status": "ok", "workers": sum(p.is_alive() for p in service._processes)})
+                elif parts == ["jobs"]:
+                    self._send(200, {"jobs": service.queue.list()})
+                elif len(parts) == 2 and parts[0] == "jobs":
+                    entry = job_status(service.queue, parts[1])
+                    if entry is None:
+                        self._error(404, "Unknown job")
+                    else:
+                        self._send(200, entry)
+                elif len(parts) == 3 and parts[0] == "jobs" and parts[2] == "result":
+                    entry = service.queue.get(parts[1])
+                    if entry is None:
+                        self._error(404, "Unknown job")
+                    elif entry["status"] != "done":
+                        self._error(409, f"Job is {entry['status']}")
+                    else:
+                        self._send(200, job_result(parts[1]))
+                else:
+                    self._error(404, "Not found")
+
+            def do_POST(self):
+                parts = self._parts()
+                if parts == ["jobs"]:
+                    length = self.headers.get("Content-Length")
+                    if length is None:
+                        self._error(411, "Content-Length required")
+                        return
+                    query = urllib.parse.parse_qs(urllib.parse.urlsplit(self.path).query)
+                    name = query.get("name", ["upload.wav"])[0]
+                    body = _BodyReader(self.rfile, int(length))
+                    if Path(name).suffix.lower().lstrip(".") not in config.SUPPORTED_FORMATS:
+                        # Read the body anyway, so the client is not cut off mid-upload
+                        while body.read(1 << 20):
+                            pass
+                        self._error(415, f"Unsupported format: {name}")
+                        return
+                    options = {
+                        "summarize": query.get("summarize", ["1"])[0] != "0",
+                        "use_map_reduce": query.get("map_reduce", ["0"])[0] == "1",
+                    }
+                    if "draft" in query:
+                        options["draft"] = query["draft"][0] == "1"
+                    timeout = float(query["timeout"][0]) if "timeout" in query else None
+                    entry = service.submit(body, name, options, timeout)
+                    self._send(202, entry)
+                elif len(parts) == 3 and parts[0] == "jobs" and parts[2] == "cancel":
+                    entry = service.queue.cancel(parts[1])
+                    if entry is None:
+                        self._error(404, "Unknown job")
+                    else:
+                        self._send(200, entry)
+                else:
+                    self._error(404, "Not found")
+
+            def _parts(self) -> List[str]:
+                return [part for part in urllib.parse.urlsplit(self.path).path.split("/") if part]
+
+            def _error(self, status: int, message: str):
+                self._send(status, {"error": message})
+
+            def _send(self, status: int, payload: Any):
+                body = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+        return Handler
+
+
+class ServiceClient:
+    """Client of the job service API, used by app.py when config.JOB_SERVICE_URL is set"""
+
+    def __init__(self, base_url: str = None, timeout: float = 30.0):
+        self.base_url = (base_url or config.JOB_SERVICE_URL).rstrip("/")
+        self.timeout = timeout
+
+    def _request(self, method: str, path: str, data=None, headers: Dict[str, str] = None) -> Dict[str, Any]:
+        request = urllib.request.Request(f"{self.base_url}{path}", data=data, method=method, headers=headers or {})
+        try:
+            with urllib.request.urlopen(request, timeout=self.timeout) as response:
+                return json.loads(response.read())
+        except urllib.error.HTTPError as e:
+            try:
+                message = json.loads(e.read()).get("error", e.reason)
+            except ValueError:
+                message = e.reason
+            raise ServiceError(e.code, message) from None
+
+    def submit(
+        self,
+        stream: BinaryIO,
+        name: str,
+        summarize: bool = True,
+        use_map_reduce: bool = False,
+        timeout: float = None,
+        draft: bool = None
+    ) -> Dict[str, Any]:
+        """
+        Upload a recording and queue it
+
+        Args:
+            stream: Seekable binary file object, e.g. a Streamlit UploadedFile
+            name: File name (its extension selects the decoder)
+            summarize: Also summarize the transcript
+            use_map_reduce: Use MapReduce summarization
+            timeout: Time limit in seconds (default: the service's)
+            draft: Show a draft model's transcript first and refine it
+                   (default: the service's config.DRAFT_ENABLED)
+
+        Returns:
+            The job's status, including its job_id
+        """
+        query = {"name": name, "summarize": int(summarize), "map_reduce": int(use_map_reduce)}
+        if timeout is not None:
+            query["timeout"] = timeout
+        if draft is not None:
+            query["draft"] = int(draft)
+        stream.seek(0, os.SEEK_END)
+        size = stream.tell()
+        stream.seek(0)
+        # The body is sent in blocks straight from the file object
+        return self._request("POST", "/jobs?" + urllib.parse.urlencode(query), data=stream,
+                             headers={"Content-Length": str(size), "Content-Type": "application/octet-stream"})
+
+    def status(self, job_id: str) -> Dict[str, Any]:
+        return self._request("GET", f"/jobs/{job_id}")
+
+    def result(self, job_id: str) -> Dict[str, Any]:
+        return self._request("GET", f"/jobs/{job_id}/result")
+
+    def cancel(self, job_id: str) -> Dict[str, Any]:
+        return self._request("POST", f"/jobs/{job_id}/cancel", data=b"")
+
+    def jobs(self) -> List[Dict[str, Any]]:
+        return self._request("GET", "/jobs")["jobs"]
+
+    def wait(
+        self,
+        job_id: str,
+        poll_interval: float = 1.0,
+        on_status: Callable[[Dict[str, Any]], None] = None
+    ) -> Dict[str, Any]:
+        """
+        Poll a job until it reaches a final state
+
+        Args:
+            job_id: Job id
+            poll_interval: Seconds between polls
+            on_status: Called with every polled status
+
+        Returns:
+            The final status
+        """
+        while True:
+            status = self.status(job_id)
+            if on_status is not None:
+                on_status(status)
+            if status["status"] in FINAL_STATES:
+                return status
+            time.sleep(poll_interval)
+
+
+def add_arguments(parser):
+    """Register the serve subcommand's arguments"""
+    parser.add_argument("--host", default=config.JOB_SERVICE_HOST, help="Address to listen on")
+    parser.add_argument("--port", type=int, default=config.JOB_SERVICE_PORT, help="Port to listen on")
+    parser.add_argument("-w", "--workers", type=int, default=config.JOB_SERVICE_WORKERS,
+                        help="Worker processes (0 = API only; start workers with 'voxlens worker')")
+    parser.add_argument("--hf-token", default=os.getenv("HF_TOKEN"),
+                        help="HuggingFace token (default: HF_TOKEN environment variable)")
+
+
+def main(args) -> int:
+    """Run the serve subcommand"""
+    JobService(args.host, args.port, args.workers, huggingface_token=args.hf_token).serve_forever()
+    return 0
+
+
+def add_worker_arguments(parser):
+    """Register the worker subcommand's arguments"""
+    parser.add_argument("--hf-token", default=os.getenv("HF_TOKEN"),
+                        help="HuggingFace token (default: HF_TOKEN environment variable)")
+
+
+def worker_main(args) -> int:
+    """Run the worker subcommand: process queued jobs alongside a running service"""
+    _worker_main(config.JOB_QUEUE_PATH, args.hf_token)
+    return 0
@@ -0,0 +1,386 @@
+"""
+Sharded processing of long recordings over a process pool
+"""
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, List, Optional, Sequence, Tuple
+import multiprocessing
+import os
+import numpy as np
+import config
+from alignment import SpeakerIndex, align, format_transcript
+from audio_loader import AudioBuffer, AudioInput, load_audio
+from result_cache import diarization_key, make_key, transcription_key
+
+
+Window = Tuple[float, float]
+
+
+def plan_windows(duration: float, window: float = None, overlap: float = None) -> List[Window]:
+    """
+    Cut a recording into overlapping windows
+
+    Args:
+        duration: Audio length in seconds
+        window: Window length in seconds
+        overlap: Seconds shared by consecutive windows
+
+    Returns:
+        List of (start, end) times covering the whole recording
+    """
+    window = window or config.SHARD_WINDOW
+    overlap = config.SHARD_OVERLAP if overlap is None else overlap
+    if overlap >= window:
+        raise ValueError("Shard overlap must be shorter than the window")
+
+    windows = []
+    start = 0.0
+    while True:
+        end = min(start + window, duration)
+        windows.append((start, end))
+        if end >= duration:
+            return windows
+        start = end - overlap
+
+
+def cut_points(windows: Sequence[Window]) -> List[float]:
+    """
+    Boundaries between the parts of the timeline each window owns
+
+    Each overlap is split at its midpoint, the point furthest from both
+    windows' edges, where Whisper and pyannote have the most context.
+
+    Returns:
+        len(windows) + 1 times from the start of the first to the end of the last window
+    """
+    cuts = [windows[0][0]]
+    for (_, previous_end), (next_start, _) in zip(windows, windows[1:]):
+        cuts.append((next_start + previous_end) / 2)
+    cuts.append(windows[-1][1])
+    return cuts
+
+
+class SpeakerLinker:
+    """Online clustering of speaker embeddings into recording-wide speakers
+
+    Each call to link() matches the local speakers of one window one-to-one
+    against the global speakers seen so far by cosine distance of their
+    embeddings (Hungarian assignment); pairs further apart than the
+    threshold, and speakers without an embedding, start a new global
+    speaker. Global centroids are running means weighted by speaking time.
+    """
+
+    def __init__(self, threshold: float = None):
+        """
+        Initialize the linker
+
+        Args:
+            threshold: Maximum cosine distance for two labels to be the same speaker
+                       (default: config.SHARD_LINK_THRESHOLD)
+        """
+        self.threshold = config.SHARD_LINK_THRESHOLD if threshold is None else threshold
+        # Unit-length centroid per global speaker (None if it was never embedded)
+        self.centroids: List[Optional[np.ndarray]] = []
+        self.weights: List[float] = []
+
+    def link(self, embeddings: Dict[str, np.ndarray], durations: Dict[str, float] = None) -> Dict[str, str]:
+        """
+        Map one window's local speaker labels onto global labels
+
+        Args:
+            embeddings: {local_label: embedding}
+            durations: {local_label: seconds spoken}, used as weights
+
+        Returns:
+            {local_label: "SPEAKER_XX"}
+        """
+        from scipy.optimize import linear_sum_assignment
+
+        durations = durations or {}
+        centroids, weights = self.centroids, self.weights
+        labels = sorted(embeddings)
+        vectors = [_normalize(embeddings[label]) for label in labels]
+        mapping: Dict[str, str] = {}
+
+        rows = [i for i, vector in enumerate(vectors) if vector is not None]
+        cols = [j for j, centroid in enumerate(centroids) if centroid is not None]
+        if rows and cols:
+            distances = 1.0 - np.stack([vectors[i] for i in rows]) @ np.stack([centroids[j] for j in cols]).T
+            for row, col in zip(*linear_sum_assignment(distances)):
+                if distances[row, col] > self.threshold:
+                    continue
+                label, index = labels[rows[row]], cols[col]
+                weight = max(durations.get(label, 1.0), 1e-3)
+                centroid = centroids[index] * weights[index] + vectors[rows[row]] * weight
+                centroids[index] = _normalize(centroid)
+                weights[index] += weight
+                mapping[label] = _global_label(index)
+
+        for label, vector in zip(labels, vectors):
+            if label not in mapping:
+                mapping[label] = _global_label(len(centroids))
+                centroids.append(vector)
+                weights.append(max(durations.get(label, 1.0), 1e-3))
+        return mapping
+
+
+def relink_speakers(
+    window_embeddings: Sequence[Dict[str, np.ndarray]],
+    window_durations: Sequence[Dict[str, float]] = None,
+    threshold: float = None
+) -> List[Dict[str, str]]:
+    """
+    Map each window's local speaker labels onto recording-wide labels
+
+    Windows are linked in order with a SpeakerLinker.
+
+    Args:
+        window_embeddings: Per window, {local_label: embedding}
+        window_durations: Per window, {local_label: seconds spoken}, used as weights
+        threshold: Maximum cosine distance for two labels to be the same speaker
+
+    Returns:
+        Per window, {local_label: "SPEAKER_XX"}
+    """
+    linker = SpeakerLinker(threshold)
+    return [
+        linker.link(embeddings, window_durations[position] if window_durations else None)
+        for position, embeddings in enumerate(window_embeddings)
+    ]
+
+
+def _normalize(vector: np.ndarray) -> Optional[np.ndarray]:
+    vector = np.asarray(vector, dtype=np.float32)
+    norm = np.linalg.norm(vector)
+    if not np.isfinite(norm) or norm == 0:
+        return None
+    return vector / norm
+
+
+def _global_label(index: int) -> str:
+    return f"SPEAKER_{index:02d}"
+
+
+def stitch(
+    windows: Sequence[Window],
+    results: Sequence[dict],
+    mappings: Sequence[Dict[str, str]]
+) -> Tuple[List[Tuple[float, float, str]], Tuple[list, list, list, str]]:
+    """
+    Join per-window results into recording-wide speaker turns and text units
+
+    Each window keeps the part of the timeline between its cut points: text
+    units whose midpoint falls inside it and speaker turns clipped to it, so
+    text decoded twice in an overlap is kept exactly once.
+
+    Args:
+        windows: (start, end) of each window
+        results: Per-window results of process_window(), times relative to the window
+        mappings: Per-window label mappings from relink_speakers()
+
+    Returns:
+        Tuple of (speaker_segments, units) on the recording's timeline
+    """
+    cuts = cut_points(windows)
+    speaker_segments: List[Tuple[float, float, str]] = []
+    starts, ends, texts = [], [], []
+    joiner = ""
+
+    for position, ((offset, _), result, mapping) in enumerate(zip(windows, results, mappings)):
+        low, high = cuts[position], cuts[position + 1]
+        last = position == len(windows) - 1
+
+        for start, end, label in result["speaker_segments"]:
+            start, end = max(start + offset, low), min(end + offset, high)
+            if end <= start:
+                continue
+            speaker = mapping[label]
+            if speaker_segments and speaker_segments[-1][2] == speaker and start - speaker_segments[-1][1] < 1e-3:
+                # A turn crossing the cut continues the previous window's turn
+                speaker_segments[-1] = (speaker_segments[-1][0], end, speaker)
+            else:
+                speaker_segments.append((start, end, speaker))
+
+        unit_starts, unit_ends, unit_texts, joiner = result["units"]
+        for start, end, text in zip(unit_starts, unit_ends, unit_texts):
+            start, end = start + offset, end + offset
+            middle = (start + end) / 2
+            if low <= middle and (middle < high or last):
+                starts.append(start)
+                ends.append(end)
+                texts.append(text)
+
+    speaker_segments.sort()
+    return speaker_segments, (starts, ends, texts, joiner)
+
+
+def process_window(samples: np.ndarray, huggingface_token: str = None, threads: int = 0) -> dict:
+    """
+    Diarize and transcribe one window; runs inside a pool worker
+
+    Models come from the worker process's own registry and stay loaded for
+    the next window the worker receives.
+
+    Args:
+        samples: PCM samples of the window
+        huggingface_token: HuggingFace access token for pyannote
+        threads: torch/CTranslate2 threads for this worker (0 = library default)
+
+    Returns:
+        Dict with speaker_segments, embeddings, durations and units, times
+        relative to the window start
+    """
+    from diarization import SpeakerDiarizer
+    from transcription import AudioTranscriber
+
+    audio = AudioBuffer(samples)
+    diarizer = SpeakerDiarizer(huggingface_token=huggingface_token, num_threads=threads)
+    speaker_segments, embeddings = diarizer.diarize_with_embeddings(audio)
+    units = AudioTranscriber(cpu_threads=threads).transcribe(audio, speaker_segments)
+
+    durations: Dict[str, float] = {}
+    for start, end, label in speaker_segments:
+        durations[label] = durations.get(label, 0.0) + end - start
+    return {
+        "speaker_segments": speaker_segments,
+        "embeddings": embeddings,
+        "durations": durations,
+        "units": units,
+    }
+
+
+def default_workers() -> int:
+    """Worker processes that fit in CPU cores and memory, see config.SHARD_WORKERS
+
+    On CUDA the workers share the GPU, so the free VRAM caps them as well.
+    """
+    if config.SHARD_WORKERS:
+        return config.SHARD_WORKERS
+    from pipeline import available_memory_mb, estimate_model_memory_mb, resolve_device
+
+    workers = os.cpu_count() or 1
+    # Every worker holds its own copy of both models
+    per_worker = (
+        estimate_model_memory_mb(config.DIARIZATION_MODEL)
+        + estimate_model_memory_mb(config.TRANSCRIPTION_MODEL)
+    )
+    devices = ["cpu", "cuda"] if resolve_device() == "cuda" else ["cpu"]
+    for device in devices:
+        available = available_memory_mb(device)
+        if available is not None:
+            workers = min(workers, int(available // per_worker))
+    return max(1, workers)
+
+
+class ShardedPipeline:
+    """Diarize and transcribe a long recording as overlapping windows in parallel
+
+    Windows are spread over a pool of worker processes, each with its own
+    warm models and an even share of the CPU cores. The results are stitched
+    back together: speaker labels are re-linked across windows by embedding
+    similarity and duplicated text in the overlaps is dropped.
+
+    The pool is kept between runs; call close() (or use a with block) when done.
+    """
+
+    def __init__(
+        self,
+        huggingface_token: str = None,
+        workers: int = None,
+        window: float = None,
+        overlap: float = None,
+        cache=None
+    ):
+        """
+        Initialize the pipeline
+
+        Args:
+            huggingface_token: HuggingFace access token for pyannote
+            workers: Worker processes (defaults to default_workers())
+            window: Window length in seconds
+            overlap: Seconds shared by consecutive windows
+            cache: Optional ResultCache for the stitched results
+        """
+        self.huggingface_token = huggingface_token or os.getenv("HF_TOKEN")
+        self.workers = workers or default_workers()
+        self.window = window or config.SHARD_WINDOW
+        self.overlap = config.SHARD_OVERLAP if overlap is None else overlap
+        self.cache = cache
+        self._executor: Optional[ProcessPoolExecutor] = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        """Shut the worker processes down"""
+        if self._executor is not None:
+            self._executor.shutdown()
+            self._executor = None
+
+    def _cache_key(self, audio_hash: str) -> str:
+        return make_key(
+            "sharded", diarization_key(audio_hash), transcription_key(audio_hash),
+            self.window, self.overlap, config.SHARD_LINK_THRESHOLD
+        )
+
+    def process(
+        self,
+        audio: AudioInput,
+        audio_hash: str = None
+    ) -> Tuple[List[Tuple[float, float, str]], Tuple[list, list, list, str]]:
+        """
+        Diarize and transcribe audio window by window
+
+        Args:
+            audio: Path to audio file or a decoded AudioBuffer
+            audio_hash: Content hash of the audio, enables the result cache
+
+        Returns:
+            Tuple of (speaker_segments, units) on the recording's timeline
+        """
+        if self.cache is not None and audio_hash is not None:
+            cached = self.cache.get("sharded", self._cache_key(audio_hash))
+            if cached is not None:
+                return [tuple(segment) for segment in cached["speaker_segments"]], tuple(cached["units"])
+
+        audio = load_audio(audio)
+        windows = plan_windows(audio.duration, self.window, self.overlap)
+        results = self._map([audio.slice(start, end).samples for start, end in windows])
+        mappings = relink_speakers(
+            [result["embeddings"] for result in results],
+            [result["durations"] for result in results]
+        )
+        speaker_segments, units = stitch(windows, results, mappings)
+
+        if self.cache is not None and audio_hash is not None:
+            self.cache.put("sharded", self._cache_key(audio_hash),
+                           {"speaker_segments": speaker_segments, "units": units})
+        return speaker_segments, units
+
+    def run(self, audio: AudioInput, audio_hash: str = None) -> Tuple[List[Tuple[float, float, str]], str]:
+        """
+        Diarize and transcribe audio, same contract as TranscriptionPipeline.run
+
+        Returns:
+            Tuple of (speaker_segments, transcription with speaker labels)
+        """
+        speaker_segments, (starts, ends, texts, joiner) = self.process(audio, audio_hash)
+        lines = align(starts, ends, texts, SpeakerIndex(speaker_segments), joiner=joiner)
+        return speaker_segments, format_transcript(lines)
+
+    def _map(self, window_samples: List[np.ndarray]) -> List[dict]:
+        """Process windows on the pool, returning results in window order"""
+        if self._executor is None:
+            # spawn: forking a process that already initialized torch or CUDA is unsafe
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.workers,
+                mp_context=multiprocessing.get_context("spawn")
+            )
+        threads = max(1, (os.cpu_count() or 1) // self.workers)
+        futures = [
+            self._executor.submit(process_window, samples, self.huggingface_token, threads)
+            for samples in window_samples
+        ]
+        return [future.result() for future in futures]
@@ -1,40 +1,105 @@
 """
 Summarization module using LangChain and Ollama
 """
-from typing import Optional
-from langchain.text_splitter import RecursiveCharacterTextSplitter
-from langchain.chains.summarize import load_summarize_chain
-from langchain.chains.combine_documents.stuff import StuffDocumentsChain
-from langchain.chains.llm import LLMChain
-from langchain.prompts import PromptTemplate
-from langchain_community.llms import Ollama
-from langchain.docstore.document import Document
+from typing import Iterator, Optional
+import time
 import config
+from result_cache import summary_key
+from mapreduce import REDUCE_PROMPT_TEMPLATE, MapReduceSummarizer, RollingSummary, stream_llm, token_counter
+from ollama_client import get_ollama_pool
+import metrics
+from lazy_imports import lazy_attr
+
+# Imported on first use so that importing this module stays cheap
+StuffDocumentsChain = lazy_attr("langchain.chains.combine_documents.stuff", "StuffDocumentsChain")
+LLMChain = lazy_attr("langchain.chains.llm", "LLMChain")
+PromptTemplate = lazy_attr("langchain.prompts", "PromptTemplate")
+Ollama = lazy_attr("langchain_community.llms", "Ollama")
+Document = lazy_attr("langchain.docstore.document", "Document")
+
+
+# Prompt used by summarize(); considers speaker relationships
+SUMMARY_PROMPT_TEMPLATE = """以下は話者ごとに分類された会話の文字起こしです。
+話者間の関係性や会話の流れを考慮して、重要なポイントを抽出し、簡潔な要約を作成してください。
+
+文字起こし:
+{text}
+
+要約:"""
+
+# Default prompt for summarize_with_custom_prompt()
+DEFAULT_CUSTOM_PROMPT_TEMPLATE = """以下の会話を要約してください:
+
+{text}
+
+要約:"""
 
 
 class ConversationSummarizer:
     """Summarize conversations using LangChain and Ollama"""
     
-    def __init__(self, model_name: str = None, base_url: str = None):
+    def __init__(self, model_name: str = None, base_url: str = None, cache=None):
         """
         Initialize the summarizer
         
         Args:
             model_name: Name of the Ollama model to use
-            base_url: Base URL for Ollama API
+            base_url: Base URL for Ollama API (default: round-robin over
+                      config.OLLAMA_BASE_URLS with the pooled client)
+            cache: Optional ResultCache for finished summaries
         """
         self.model_name = model_name or config.LLM_MODEL
         self.base_url = base_url or config.OLLAMA_BASE_URL
+        self.base_urls = [base_url] if base_url else config.OLLAMA_BASE_URLS
         self.llm = None
+        self.cache = cache
         
     def _initialize_llm(self):
-        """Initialize the Ollama LLM"""
+        """Initialize the Ollama LLM, shared by all summarizers when config.OLLAMA_POOLED"""
         if self.llm is None:
-            self.llm = Ollama(
-                model=self.model_name,
-                base_url=self.base_url,
-                temperature=0.3
-            )
+            if config.OLLAMA_POOLED:
+                self.llm = get_ollama_pool(self.base_urls, self.model_name).llm(
+                    temperature=0.3,
+                    num_ctx=config.LLM_CONTEXT_WINDOW
+                )
+            else:
+                self.llm = Ollama(
+                    model=self.model_name,
+                    base_url=self.base_url,
+                    temperature=0.3,
+                    num_ctx=config.LLM_CONTEXT_WINDOW
+                )
+    
+    def _map_reduce(
+        self,
+        reduce_prompt: str = REDUCE_PROMPT_TEMPLATE,
+        direct_prompt: str = SUMMARY_PROMPT_TEMPLATE
+    ) -> MapReduceSummarizer:
+        """
+        MapReduce engine sharing memoized map results through the result cache
+        
+        With the pooled client as many map calls run as all servers take.
+        """
+        max_concurrency = get_ollama_pool(self.base_urls, self.model_name).capacity if config.OLLAMA_POOLED else None
+        return MapReduceSummarizer(
+            self.llm,
+            max_concurrency=max_concurrency,
+            reduce_prompt=reduce_prompt,
+            direct_prompt=direct_prompt,
+            cache=self.cache,
+            model=self.model_name
+        )
+    
+    def rolling(self) -> RollingSummary:
+        """
+        Summary of a transcript that grows, e.g. during live transcription
+        
+        Returns:
+            RollingSummary; append() the new lines and call update() to
+            extend the summary, update(final=True) once the transcript is complete
+        """
+        self._initialize_llm()
+        return RollingSummary(self._map_reduce())
     
     def summarize(self, transcription: str, use_map_reduce: bool = False) -> str:
         """
@@ -47,77 +112,178 @@ class ConversationSummarizer:
         Returns:
             Summary text
         """
-        self._initialize_llm()
+        use_map_reduce = use_map_reduce or len(transcription) > config.MAX_STUFF_CHAIN_LENGTH
+        cache_key = self._cache_key(
+            transcription,
+            SUMMARY_PROMPT_TEMPLATE,
+            map_reduce=use_map_reduce,
+            context_window=config.LLM_CONTEXT_WINDOW if use_map_reduce else None
+        )
+        with metrics.span("summarization", map_reduce=use_map_reduce):
+            if self.cache is not None:
+                cached = self.cache.get("summary", cache_key)
+                if cached is not None:
+                    metrics.record(cached=True)
+                    return cached
+            
+            self._initialize_llm()
+            
+            # Create document from transcription
+            doc = Document(page_content=transcription)
+            
+            prompt = PromptTemplate.from_template(SUMMARY_PROMPT_TEMPLATE)
+            
+            # Check if we should use MapReduce for long documents
+            if use_map_reduce:
+                # Use MapReduce for long documents: token-sized chunks on speaker
+                # turns, concurrent map calls and a hierarchical reduce
+                summary = self._map_reduce().run(transcription)
+            else:
+                # Use Stuff chain for shorter documents
+                llm_chain = LLMChain(llm=self.llm, prompt=prompt)
+                stuff_chain = StuffDocumentsChain(
+                    llm_chain=llm_chain,
+                    document_variable_name="text"
+                )
+                summary = self._run_stuff_chain(stuff_chain, doc, SUMMARY_PROMPT_TEMPLATE)
+            
+            summary = summary.strip()
+            if self.cache is not None:
+                self.cache.put("summary", cache_key, summary)
+            return summary
+    
+    def summarize_stream(self, transcription: str, use_map_reduce: bool = False) -> Iterator[str]:
+        """
+        Summarize like summarize(), yielding the summary as Ollama generates it
         
-        # Create document from transcription
-        doc = Document(page_content=transcription)
+        In MapReduce mode only the final reduce call is streamed; while the
+        map calls run, empty strings are yielded as heartbeats. Closing the
+        generator cancels the generation. Only complete summaries are cached.
         
-        # Define prompt template for summarization
-        prompt_template = """以下は話者ごとに分類された会話の文字起こしです。
-話者間の関係性や会話の流れを考慮して、重要なポイントを抽出し、簡潔な要約を作成してください。
-
-文字起こし:
-{text}
-
-要約:"""
+        Args:
+            transcription: Full transcription with speaker labels
+            use_map_reduce: Whether to use MapReduce for long documents
+            
+        Returns:
+            Generator of summary pieces; joined and stripped they are the summary
+        """
+        use_map_reduce = use_map_reduce or len(transcription) > config.MAX_STUFF_CHAIN_LENGTH
+        cache_key = self._cache_key(
+            transcription,
+            SUMMARY_PROMPT_TEMPLATE,
+            map_reduce=use_map_reduce,
+            context_window=config.LLM_CONTEXT_WINDOW if use_map_reduce else None
+        )
+        # Only the generation is timed, not the consumer rendering the pieces
+        return metrics.timed_iter(
+            "summarization",
+            self._stream_summary(transcription, use_map_reduce, cache_key),
+            map_reduce=use_map_reduce
+        )
+    
+    def _stream_summary(self, transcription: str, use_map_reduce: bool, cache_key: str) -> Iterator[str]:
+        if self.cache is not None:
+            cached = self.cache.get("summary", cache_key)
+            if cached is not None:
+                metrics.record(cached=True)
+                yield cached
+                return
         
-        prompt = PromptTemplate.from_template(prompt_template)
+        self._initialize_llm()
         
-        # Check if we should use MapReduce for long documents
-        if use_map_reduce or len(transcription) > config.MAX_STUFF_CHAIN_LENGTH:
-            # Use MapReduce for long documents
-            chain = load_summarize_chain(
-                self.llm,
-                chain_type="map_reduce",
-                return_intermediate_steps=False
-            )
-            summary = chain.run([doc])
+        if use_map_reduce:
+            pieces = self._map_reduce().stream(transcription)
         else:
-            # Use Stuff chain for shorter documents
-            llm_chain = LLMChain(llm=self.llm, prompt=prompt)
-            stuff_chain = StuffDocumentsChain(
-                llm_chain=llm_chain,
-                document_variable_name="text"
+            # A stuff chain over one document only fills in the prompt, so the
+            # prompt goes to the LLM directly
+            pieces = stream_llm(
+                self.llm,
+                SUMMARY_PROMPT_TEMPLATE.format(text=transcription),
+                "llm.stuff",
+                token_counter(self.llm)
             )
-            summary = stuff_chain.run([doc])
         
-        return summary.strip()
+        started = time.perf_counter()
+        summary = []
+        try:
+            for piece in pieces:
+                if piece and not summary:
+                    # What the user waits for before text appears
+                    metrics.record(first_token_seconds=round(time.perf_counter() - started, 6))
+                if piece:
+                    summary.append(piece)
+                yield piece
+        finally:
+            pieces.close()
+        
+        if self.cache is not None:
+            self.cache.put("summary", cache_key, "".join(summary).strip())
+    
+    def _run_stuff_chain(self, stuff_chain, doc, prompt_template: str) -> str:
+        """Run a single-call chain, recording its token counts"""
+        count_tokens = token_counter(self.llm)
+        with metrics.span("llm.stuff", tokens_in=count_tokens(prompt_template.format(text=doc.page_content))):
+            summary = stuff_chain.run([doc])
+            metrics.record(tokens_out=count_tokens(summary))
+        return summary
     
     def summarize_with_custom_prompt(
         self, 
         transcription: str, 
-        custom_prompt: Optional[str] = None
+        custom_prompt: Optional[str] = None,
+        use_map_reduce: bool = False
     ) -> str:
         """
         Summarize with a custom prompt template
         
+        Long transcriptions are summarized with MapReduce, the custom prompt
+        merging the partial summaries. The map step is the same as in
+        summarize(), so trying another prompt on a transcript summarized
+        before reuses the memoized partial summaries.
+        
         Args:
             transcription: Full transcription with speaker labels
             custom_prompt: Custom prompt template (must include {text} placeholder)
+            use_map_reduce: Whether to use MapReduce for long documents
             
         Returns:
             Summary text
         """
-        self._initialize_llm()
-        
-        doc = Document(page_content=transcription)
-        
-        if custom_prompt:
-            prompt = PromptTemplate.from_template(custom_prompt)
-        else:
-            # Use default prompt
-            prompt_template = """以下の会話を要約してください:
-
-{text}
-
-要約:"""
-            prompt = PromptTemplate.from_template(prompt_template)
-        
-        llm_chain = LLMChain(llm=self.llm, prompt=prompt)
-        stuff_chain = StuffDocumentsChain(
-            llm_chain=llm_chain,
-            document_variable_name="text"
+        # Use default prompt unless a custom one is given
+        prompt_template = custom_prompt or DEFAULT_CUSTOM_PROMPT_TEMPLATE
+        use_map_reduce = use_map_reduce or len(transcription) > config.MAX_STUFF_CHAIN_LENGTH
+        cache_key = self._cache_key(
+            transcription,
+            prompt_template,
+            **({"map_reduce": True, "context_window": config.LLM_CONTEXT_WINDOW} if use_map_reduce else {})
         )
+        if self.cache is not None:
+            cached = self.cache.get("summary", cache_key)
+            if cached is not None:
+                return cached
+        
+        self._initialize_llm()
         
-        summary = stuff_chain.run([doc])
-        return summary.strip()
+        with metrics.span("summarization", custom_prompt=custom_prompt is not None, map_reduce=use_map_reduce):
+            if use_map_reduce:
+                summary = self._map_reduce(
+                    reduce_prompt=prompt_template,
+                    direct_prompt=prompt_template
+                ).run(transcription).strip()
+            else:
+                doc = Document(page_content=transcription)
+                prompt = PromptTemplate.from_template(prompt_template)
+                
+                llm_chain = LLMChain(llm=self.llm, prompt=prompt)
+                stuff_chain = StuffDocumentsChain(
+                    llm_chain=llm_chain,
+                    document_variable_name="text"
+                )
+                summary = self._run_stuff_chain(stuff_chain, doc, prompt_template).strip()
+        if self.cache is not None:
+            self.cache.put("summary", cache_key, summary)
+        return summary
+    
+    def _cache_key(self, transcription: str, prompt_template: str, **options) -> str:
+        """Cache key of a summary produced by this summarizer's model"""
+        return summary_key(transcription, prompt_template, model=self.model_name, **options)
@@ -8,6 +8,15 @@ import tempfile
 import os
 
 
+@pytest.fixture(autouse=True)
+def reset_model_registry():
+    """Start every test with an empty process-wide model registry"""
+    import model_registry
+    model_registry._registry = None
+    yield
+    model_registry._registry = None
+
+
 class TestSpeakerDiarizer:
     """Tests for SpeakerDiarizer class"""
     
@@ -70,6 +79,155 @@ class TestSpeakerDiarizer:
         
         assert diarizer.pipeline is None
         mock_torch.cuda.empty_cache.assert_called()
+    
+    @patch('diarization.torch')
+    def test_cpu_threads_are_restored_after_inference(self, mock_torch):
+        """Test that the process-wide torch thread count only changes during inference"""
+        from diarization import _torch_threads
+        
+        mock_torch.get_num_threads.return_value = 8
+        with _torch_threads(2):
+            mock_torch.set_num_threads.assert_called_once_with(2)
+        mock_torch.set_num_threads.assert_called_with(8)
+        
+        mock_torch.set_num_threads.reset_mock()
+        with pytest.raises(RuntimeError):
+            with _torch_threads(2):
+                raise RuntimeError("inference failed")
+        mock_torch.set_num_threads.assert_called_with(8)
+        
+        mock_torch.set_num_threads.reset_mock()
+        with _torch_threads(0):
+            pass
+        mock_torch.set_num_threads.assert_not_called()
+    
+    @staticmethod
+    def _artifacts(chunks=5, speakers=3):
+        import numpy as np
+        from diarization import DiarizationArtifacts
+        
+        rng = np.random.default_rng(0)
+        return DiarizationArtifacts(
+            rng.random((chunks, 589, speakers)).astype(np.float16),
+            (0.0, 10.0, 1.0),
+            rng.integers(0, 3, size=(1000, 1)).astype(np.int8),
+            (0.0, 0.0619, 0.0169),
+            rng.standard_normal((chunks, speakers, 256)).astype(np.float32)
+        )
+    
+    def test_artifacts_roundtrip(self, tmp_path):
+        """Test that kept artifacts are saved and loaded unchanged"""
+        import numpy as np
+        from diarization import DiarizationArtifacts
+        
+        artifacts = self._artifacts()
+        path = tmp_path / "artifacts.npz"
+        artifacts.save(str(path))
+        loaded = DiarizationArtifacts.load(str(path))
+        
+        assert list(tmp_path.iterdir()) == [path]
+        assert loaded.segmentation.dtype == np.float16
+        assert np.array_equal(loaded.segmentation, artifacts.segmentation)
+        assert np.array_equal(loaded.count, artifacts.count)
+        assert np.array_equal(loaded.embeddings, artifacts.embeddings)
+        assert loaded.segmentation_window == artifacts.segmentation_window
+        assert loaded.count_window == pytest.approx(artifacts.count_window)
+        assert loaded.nbytes == artifacts.nbytes
+    
+    @staticmethod
+    def _recluster(powerset):
+        """Run the real recluster() on a stub pipeline, returning the turns and the stub"""
+        from types import SimpleNamespace
+        import numpy as np
+        from diarization import SpeakerDiarizer
+        
+        class Annotation:
+            def __init__(self, tracks):
+                self.tracks = tracks
+            
+            def labels(self):
+                return sorted({label for _, label in self.tracks})
+            
+            def rename_labels(self, mapping):
+                return Annotation([(turn, mapping[label]) for turn, label in self.tracks])
+            
+            def itertracks(self, yield_label=False):
+                for turn, label in self.tracks:
+                    yield turn, None, label
+        
+        segmentation = SimpleNamespace(min_duration_off=0.0)
+        if not powerset:
+            segmentation.threshold = 0.4
+        clustering = Mock(threshold=0.7, return_value=(np.zeros((5, 3), dtype=np.int64), None, None))
+        pipeline = SimpleNamespace(
+            set_num_speakers=lambda num_speakers, min_speakers, max_speakers: (num_speakers, 1, 3),
+            segmentation=segmentation,
+            clustering=clustering,
+            _segmentation=SimpleNamespace(model=SimpleNamespace(
+                specifications=SimpleNamespace(powerset=powerset), receptive_field="frames"
+            )),
+            reconstruct=Mock(return_value="discrete"),
+            to_annotation=Mock(return_value=Annotation([(SimpleNamespace(start=0.0, end=4.0), 0)])),
+            classes=lambda: iter(["SPEAKER_00", "SPEAKER_01"]),
+        )
+        
+        def _feature(data, window):
+            return SimpleNamespace(data=data, sliding_window=window)
+        
+        binarized = SimpleNamespace(data=np.ones((5, 589, 3)))
+        diarizer = SpeakerDiarizer(huggingface_token="test_token")
+        diarizer.pipeline = pipeline
+        with patch("diarization.SlidingWindow", lambda **kwargs: kwargs), \
+                patch("diarization.SlidingWindowFeature", _feature), \
+                patch("diarization.binarize", return_value=binarized) as binarize:
+            turns = diarizer.recluster(TestSpeakerDiarizer._artifacts(), num_speakers=2)
+        return turns, pipeline, binarize
+    
+    def test_recluster_powerset_segmentation(self):
+        """Test that powerset segmentations are clustered as they are"""
+        turns, pipeline, binarize = self._recluster(powerset=True)
+        
+        binarize.assert_not_called()
+        segmentations = pipeline.clustering.call_args.kwargs["segmentations"]
+        assert segmentations is pipeline.reconstruct.call_args[0][0]
+        assert pipeline.clustering.call_args.kwargs["num_clusters"] == 2
+        assert turns == [(0.0, 4.0, "SPEAKER_00")]
+    
+    def test_recluster_multilabel_segmentation(self):
+        """Test that multi-label segmentation scores are binarized at the pipeline's threshold"""
+        turns, pipeline, binarize = self._recluster(powerset=False)
+        
+        assert binarize.call_args.kwargs["onset"] == 0.4
+        assert pipeline.clustering.call_args.kwargs["segmentations"] is binarize.return_value
+        assert pipeline.clustering.threshold == 0.7
+        assert turns == [(0.0, 4.0, "SPEAKER_00")]
+    
+    def test_artifact_capture(self):
+        """Test that the hook keeps each step's final output and passes every call on"""
+        from types import SimpleNamespace
+        import numpy as np
+        from diarization import _ArtifactCapture
+        
+        def _feature(data, start=0.0, duration=10.0, step=1.0):
+            return SimpleNamespace(data=data, sliding_window=SimpleNamespace(start=start, duration=duration, step=step))
+        
+        inner = Mock()
+        capture = _ArtifactCapture(inner)
+        capture("segmentation", None, total=4, completed=1)
+        capture("segmentation", _feature(np.full((4, 10, 3), 0.25)))
+        assert capture.artifacts() is None
+        
+        capture("speaker_counting", _feature(np.ones((50, 1)), duration=0.06, step=0.02))
+        capture("embeddings", None, total=12, completed=12)
+        capture("embeddings", np.zeros((4, 3, 8)))
+        capture("discrete_diarization", _feature(np.zeros((50, 2))))
+        
+        assert inner.call_count == 6
+        artifacts = capture.artifacts()
+        assert artifacts.segmentation.dtype == np.float16 and artifacts.segmentation.shape == (4, 10, 3)
+        assert artifacts.count.dtype == np.int8
+        assert artifacts.count_window == (0.0, 0.06, 0.02)
+        assert artifacts.embeddings.shape == (4, 3, 8)
 
 
 class TestAudioTranscriber:
@@ -118,6 +276,25 @@ class TestAudioTranscriber:
         
         assert transcriber.model is None
         mock_torch.cuda.empty_cache.assert_called()
+    
+    @patch('config.DEVICE', "cpu")
+    def test_cpu_threads_are_part_of_the_model_key(self):
+        """Test that a thread count change loads another model and cleanup releases the loaded one"""
+        from model_registry import get_registry
+        from transcription import AudioTranscriber
+        
+        assert AudioTranscriber(cpu_threads=2).model_key() != AudioTranscriber(cpu_threads=4).model_key()
+        with patch('config.DEVICE', "cuda"):
+            assert AudioTranscriber(cpu_threads=2).model_key() == AudioTranscriber(cpu_threads=4).model_key()
+        
+        transcriber = AudioTranscriber(cpu_threads=2)
+        get_registry().preload(transcriber.model_key(), MagicMock, size_mb=1).join()
+        transcriber.load_model()
+        # e.g. a thread count changed after the model was loaded
+        transcriber.cpu_threads = 4
+        transcriber.cleanup(release=True)
+        
+        assert get_registry().keys() == []
 
 
 class TestConversationSummarizer:
@@ -130,6 +307,7 @@ class TestConversationSummarizer:
         summarizer = ConversationSummarizer()
         assert summarizer.llm is None
     
+    @patch('config.OLLAMA_POOLED', False)
     @patch('summarization.Ollama')
     def test_initialize_llm(self, mock_ollama):
         """Test LLM initialization"""
@@ -164,6 +342,2233 @@ class TestConversationSummarizer:
         assert isinstance(result, str)
 
 
+class TestAlignment:
+    """Tests for speaker alignment"""
+    
+    def test_word_goes_to_speaker_with_most_overlap(self):
+        """Test that a word spanning two turns is assigned exactly once"""
+        from alignment import SpeakerIndex, align
+        
+        index = SpeakerIndex([(0.0, 2.0, "SPEAKER_00"), (2.0, 4.0, "SPEAKER_01")])
+        lines = align(
+            [0.5, 1.8, 3.0],
+            [1.0, 2.6, 3.5],
+            [" Hello", " there", " Hi"],
+            index
+        )
+        
+        assert lines == [
+            (0.5, 1.0, "SPEAKER_00", "Hello"),
+            (1.8, 3.5, "SPEAKER_01", "there Hi"),
+        ]
+    
+    def test_overlapping_and_unsorted_turns(self):
+        """Test assignment with overlapping turns given out of order"""
+        from alignment import SpeakerIndex
+        
+        index = SpeakerIndex([
+            (5.0, 6.0, "SPEAKER_01"),
+            (0.0, 10.0, "SPEAKER_00"),
+            (6.5, 7.0, "SPEAKER_02"),
+        ])
+        ids = index.assign([5.1, 6.6, 8.0], [5.9, 6.9, 9.0])
+        
+        assert [index.speakers[i] for i in ids] == ["SPEAKER_00", "SPEAKER_00", "SPEAKER_00"]
+    
+    def test_gap_fallback(self):
+        """Test that words between turns go to the nearest turn within max_gap"""
+        from alignment import SpeakerIndex
+        
+        index = SpeakerIndex([(0.0, 1.0, "SPEAKER_00"), (3.0, 4.0, "SPEAKER_01")])
+        ids = index.assign([1.2, 2.7, 10.0], [1.4, 2.9, 11.0], max_gap=0.5)
+        
+        assert ids.tolist() == [0, 1, -1]
+    
+    def test_matches_brute_force(self):
+        """Test the sweep against a brute-force maximum overlap search"""
+        from benchmark import make_synthetic_alignment_input
+        from alignment import SpeakerIndex
+        
+        segments, starts, ends, _ = make_synthetic_alignment_input(200, seed=1)
+        index = SpeakerIndex(segments)
+        ids = index.assign(starts, ends, max_gap=0.0)
+        
+        for word_start, word_end, speaker_id in zip(starts, ends, ids):
+            overlaps = [min(e, word_end) - max(s, word_start) for s, e, _ in segments]
+            best = max(overlaps)
+            if best > 0:
+                assert segments[overlaps.index(best)][2] == index.speakers[speaker_id]
+    
+    def test_spanning_turn(self):
+        """Test that one turn spanning the recording does not widen the scan of the short turns"""
+        from benchmark import make_synthetic_alignment_input
+        from alignment import SpeakerIndex
+        
+        segments, starts, ends, _ = make_synthetic_alignment_input(300, seed=2)
+        total = max(end for _, end, _ in segments)
+        segments = segments + [(0.0, total, "SPEAKER_BG")]
+        index = SpeakerIndex(segments)
+        ids = index.assign(starts, ends, max_gap=0.0)
+        
+        for word_start, word_end, speaker_id in zip(starts, ends, ids):
+            overlaps = {}
+            for s, e, label in segments:
+                overlaps[label] = max(overlaps.get(label, 0.0), min(e, word_end) - max(s, word_start))
+            assert overlaps[index.speakers[speaker_id]] == max(overlaps.values())
+        
+        # The spanning turn sits alone in its bucket; the short turns are
+        # scanned no further back than the longest of them (8 s)
+        members, _, longest = index.buckets[-1]
+        assert len(members) == 1 and longest == total
+        assert all(longest <= 8.0 for _, _, longest in index.buckets[:-1])
+    
+    def test_collect_units_without_words(self):
+        """Test segment-level fallback and transcript formatting"""
+        from alignment import SpeakerIndex, align, collect_units, format_transcript
+        
+        segments = [
+            Mock(start=0.0, end=1.0, text=" Hello ", words=None),
+            Mock(start=1.0, end=2.0, text=" world", words=None),
+        ]
+        starts, ends, texts, joiner = collect_units(segments, use_words=False)
+        lines = align(starts, ends, texts, SpeakerIndex([(0.0, 2.0, "SPEAKER_00")]), joiner=joiner)
+        
+        assert format_transcript(lines) == "SPEAKER_00: Hello world"
+
+
+class TestAudioIngest:
+    """Tests for chunked upload copies and memory-mapped WAV input"""
+    
+    @staticmethod
+    def _write_wav(path, samples, sample_rate=16000, channels=1, audio_format=1):
+        import struct
+        data = samples.tobytes()
+        bits = samples.dtype.itemsize * 8
+        fmt = struct.pack("<HHIIHH", audio_format, channels, sample_rate,
+                          sample_rate * channels * bits // 8, channels * bits // 8, bits)
+        with open(path, "wb") as f:
+            f.write(b"RIFF" + struct.pack("<I", 4 + 8 + len(fmt) + 8 + 10 + 8 + len(data)) + b"WAVE")
+            f.write(b"fmt " + struct.pack("<I", len(fmt)) + fmt)
+            # An unrelated chunk before the data must be skipped
+            f.write(b"LIST" + struct.pack("<I", 10) + b"0123456789")
+            f.write(b"data" + struct.pack("<I", len(data)) + data)
+    
+    def test_save_upload_hashes_while_copying(self):
+        """Test that the copy and its hash match the upload"""
+        import io
+        from audio_loader import save_upload
+        from result_cache import hash_file
+        
+        content = os.urandom(3 * 1024 + 5)
+        upload = io.BytesIO(content)
+        upload.read(10)  # the copy must start from the beginning regardless
+        path, digest = save_upload(upload, suffix=".wav", chunk_size=1024)
+        try:
+            assert path.endswith(".wav")
+            with open(path, "rb") as f:
+                assert f.read() == content
+            assert digest == hash_file(path)
+        finally:
+            os.unlink(path)
+    
+    def test_float_wav_is_memory_mapped(self):
+        """Test that 16 kHz mono float WAV samples are used in place"""
+        import numpy as np
+        from audio_loader import AudioBuffer
+        
+        samples = np.linspace(-1, 1, 16000, dtype=np.float32)
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "a.wav")
+            self._write_wav(path, samples, audio_format=3)
+            buffer = AudioBuffer.from_file(path)
+            
+            assert buffer.memory_mapped
+            assert buffer.duration == 1.0
+            np.testing.assert_array_equal(buffer.samples, samples)
+            del buffer
+    
+    def test_int16_stereo_wav_is_converted_in_chunks(self):
+        """Test PCM16 scaling and channel averaging"""
+        import numpy as np
+        from audio_loader import AudioBuffer
+        
+        left = np.arange(0, 1000, dtype=np.int16)
+        right = np.full(1000, 16384, dtype=np.int16)
+        interleaved = np.stack([left, right], axis=1)
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "b.wav")
+            self._write_wav(path, interleaved, channels=2)
+            buffer = AudioBuffer.from_wav(path, chunk_frames=300)
+        
+        assert buffer.samples.dtype == np.float32 and len(buffer.samples) == 1000
+        np.testing.assert_allclose(buffer.samples, (left + 16384) / 2 / 32768.0, rtol=1e-6)
+    
+    def test_other_sample_rates_use_the_decoder(self):
+        """Test that WAVs needing resampling are not memory-mapped"""
+        import numpy as np
+        from audio_loader import AudioBuffer, read_wav_layout
+        
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "c.wav")
+            self._write_wav(path, np.zeros(441, dtype=np.int16), sample_rate=44100)
+            
+            assert read_wav_layout(path)["sample_rate"] == 44100
+            assert AudioBuffer.from_wav(path) is None
+
+
+class TestSpeechChunks:
+    """Tests for packing diarized turns into batched Whisper chunks"""
+    
+    TURNS = [(0.0, 4.0, "SPEAKER_00"), (3.5, 6.0, "SPEAKER_01"), (6.5, 8.0, "SPEAKER_00"), (20.0, 22.0, "SPEAKER_01")]
+    
+    def test_merge_policy_joins_neighbours(self):
+        """Test that close turns share a chunk and silence is skipped"""
+        from alignment import speech_chunks
+        
+        chunks = speech_chunks(self.TURNS, policy="merge", max_seconds=30.0, max_gap=1.0, padding=0.0)
+        
+        assert chunks == [(0.0, 8.0), (20.0, 22.0)]
+    
+    def test_turn_policy_never_decodes_audio_twice(self):
+        """Test that overlapping turns are trimmed instead of duplicated"""
+        from alignment import speech_chunks
+        
+        chunks = speech_chunks(self.TURNS, policy="turn", padding=0.5, duration=21.0)
+        
+        assert chunks == [(0.0, 4.5), (4.5, 6.5), (6.5, 8.5), (19.5, 21.0)]
+    
+    def test_long_turns_are_split(self):
+        """Test that no chunk exceeds the Whisper window"""
+        from alignment import speech_chunks
+        
+        chunks = speech_chunks([(0.0, 70.0, "SPEAKER_00")], max_seconds=30.0, padding=0.0)
+        
+        assert len(chunks) == 3
+        assert all(end - start <= 30.0 for start, end in chunks)
+        assert chunks[0][0] == 0.0 and chunks[-1][1] == 70.0
+    
+    def test_batched_mode_diarizes_first_and_changes_cache_key(self):
+        """Test that batched mode hands the turns to the transcriber"""
+        import numpy as np
+        import config
+        from audio_loader import AudioBuffer
+        from pipeline import TranscriptionPipeline
+        from result_cache import transcription_key
+        
+        diarizer = MagicMock()
+        diarizer.diarize.return_value = [(0.0, 1.0, "SPEAKER_00")]
+        transcriber = MagicMock()
+        transcriber.transcribe.return_value = ([0.1], [0.5], ["Hello"], " ")
+        sequential_key = transcription_key("abc")
+        
+        with patch.object(config, "TRANSCRIPTION_MODE", "batched"):
+            pipeline = TranscriptionPipeline(diarizer, transcriber, parallel=True)
+            assert not pipeline.can_run_parallel()
+            pipeline.run(AudioBuffer(np.zeros(16000, dtype=np.float32)))
+            assert transcription_key("abc") != sequential_key
+        
+        assert transcriber.transcribe.call_args[0][1] == [(0.0, 1.0, "SPEAKER_00")]
+
+
+class TestAudioBuffer:
+    """Tests for the shared decoded audio buffer"""
+    
+    def test_buffer_properties(self):
+        """Test dtype conversion, duration and pass-through loading"""
+        import numpy as np
+        from audio_loader import AudioBuffer, load_audio
+        
+        audio = AudioBuffer(np.zeros(32000, dtype=np.float64), 16000)
+        
+        assert audio.samples.dtype == np.float32
+        assert audio.duration == 2.0
+        assert load_audio(audio) is audio
+        assert audio.as_whisper() is audio.samples
+    
+    def test_pyannote_view_shares_memory(self):
+        """Test that the pyannote waveform is a zero-copy view"""
+        import numpy as np
+        pytest.importorskip("torch")
+        from audio_loader import AudioBuffer
+        
+        audio = AudioBuffer(np.zeros(16000, dtype=np.float32), 16000)
+        data = audio.as_pyannote()
+        audio.samples[0] = 1.0
+        
+        assert data["sample_rate"] == 16000
+        assert tuple(data["waveform"].shape) == (1, 16000)
+        assert data["waveform"][0, 0].item() == 1.0
+
+
+class TestTranscriptionPipeline:
+    """Tests for the diarization/transcription orchestrator"""
+    
+    def _mocks(self):
+        diarizer = MagicMock()
+        diarizer.diarize.return_value = [(0.0, 1.0, "SPEAKER_00")]
+        transcriber = MagicMock()
+        transcriber.transcribe.return_value = ([0.1], [0.5], ["Hello"], " ")
+        transcriber.assign_speakers.return_value = "SPEAKER_00: Hello"
+        return diarizer, transcriber
+    
+    def test_sequential_frees_diarizer_first(self):
+        """Test that the sequential order releases the diarizer before transcribing"""
+        import numpy as np
+        from audio_loader import AudioBuffer
+        from pipeline import TranscriptionPipeline
+        
+        diarizer, transcriber = self._mocks()
+        order = Mock()
+        order.attach_mock(diarizer.cleanup, "cleanup")
+        order.attach_mock(transcriber.transcribe, "transcribe")
+        
+        audio = AudioBuffer(np.zeros(16000, dtype=np.float32))
+        segments, text = TranscriptionPipeline(diarizer, transcriber, parallel=False).run(audio)
+        
+        assert segments == [(0.0, 1.0, "SPEAKER_00")]
+        assert text == "SPEAKER_00: Hello"
+        assert [c[0] for c in order.mock_calls] == ["cleanup", "transcribe"]
+    
+    @patch('pipeline.resolve_device', return_value="cpu")
+    def test_parallel_splits_threads(self, _):
+        """Test that the parallel mode splits cores and merges at alignment"""
+        import numpy as np
+        from audio_loader import AudioBuffer
+        from pipeline import TranscriptionPipeline
+        
+        diarizer, transcriber = self._mocks()
+        diarizer.num_threads, transcriber.cpu_threads = 0, 0
+        seen = {}
+        
+        def diarize(audio):
+            seen["diarize"] = diarizer.num_threads
+            return [(0.0, 1.0, "SPEAKER_00")]
+        
+        def transcribe(audio):
+            seen["transcribe"] = transcriber.cpu_threads
+            return [0.1], [0.5], ["Hello"], " "
+        
+        diarizer.diarize.side_effect = diarize
+        transcriber.transcribe.side_effect = transcribe
+        audio = AudioBuffer(np.zeros(16000, dtype=np.float32))
+        
+        with patch('pipeline.split_threads', return_value=(3, 5)):
+            TranscriptionPipeline(diarizer, transcriber, parallel=True).run(audio)
+        
+        # The split holds while the stages run and does not stick to the instances
+        assert seen == {"diarize": 3, "transcribe": 5}
+        assert diarizer.num_threads == 0 and transcriber.cpu_threads == 0
+        diarizer.cleanup.assert_not_called()
+        transcriber.assign_speakers.assert_called_once_with(
+            ([0.1], [0.5], ["Hello"], " "), [(0.0, 1.0, "SPEAKER_00")]
+        )
+    
+    @patch('pipeline.resolve_device', return_value="cpu")
+    def test_release_before_transcription(self, _):
+        """Test that the diarizer is only unloaded for per-stage residency or to make room"""
+        from pipeline import TranscriptionPipeline
+        
+        transcriber = Mock(spec=["model", "model_name"], model=None, model_name="large-v3")
+        pipeline = TranscriptionPipeline(Mock(), transcriber, parallel=False)
+        with patch('config.MEMORY_BUDGET_MB', 100000):
+            assert pipeline.release_before_transcription() is False
+            with patch('config.MODEL_RESIDENCY', "per_stage"):
+                assert pipeline.release_before_transcription() is True
+        with patch('config.MEMORY_BUDGET_MB', 100):
+            assert pipeline.release_before_transcription() is True
+            # A loaded Whisper model needs no room
+            transcriber.model = object()
+            assert pipeline.release_before_transcription() is False
+    
+    @patch('pipeline.resolve_device', return_value="cpu")
+    def test_auto_mode_respects_memory_budget(self, _):
+        """Test the fallback to sequential when both models do not fit"""
+        from pipeline import TranscriptionPipeline
+        
+        pipeline = TranscriptionPipeline(Mock(), Mock(), parallel="auto")
+        with patch('config.MEMORY_BUDGET_MB', 100):
+            assert pipeline.can_run_parallel() is False
+        with patch('config.MEMORY_BUDGET_MB', 100000):
+            assert pipeline.can_run_parallel() is True
+    
+    def test_closing_background_segments_stops_decoding(self):
+        """Test that the Whisper thread stops once its consumer is closed or dropped"""
+        import threading
+        from pipeline import TranscriptionPipeline
+        
+        def run(take):
+            resume = threading.Event()
+            produced = []
+            
+            def iter_segments(audio):
+                for i in range(100):
+                    produced.append(i)
+                    yield i
+                    if i == 1:
+                        resume.wait(timeout=5)
+            
+            transcriber = Mock()
+            transcriber.iter_segments = iter_segments
+            segments = TranscriptionPipeline(Mock(), transcriber)._background_segments(None)
+            assert [next(segments) for _ in range(take)] == list(range(take))
+            del segments
+            resume.set()
+            for thread in threading.enumerate():
+                if thread.name == "voxlens-whisper":
+                    thread.join(timeout=5)
+            return produced
+        
+        # Closed after one segment, or before any (e.g. diarization failed)
+        assert len(run(1)) <= 3
+        assert len(run(0)) <= 3
+    
+    @patch('config.DEVICE', "cpu")
+    @patch('pipeline.resolve_device', return_value="cpu")
+    def test_preload_keys_whisper_by_the_threads_of_a_run(self, _):
+        """Test that the warm Whisper model is the one a parallel run on CPU will use"""
+        from model_registry import get_registry
+        from pipeline import TranscriptionPipeline
+        from transcription import AudioTranscriber
+        
+        transcriber = AudioTranscriber(cpu_threads=8)
+        diarizer = Mock()
+        with patch('pipeline.split_threads', return_value=(3, 5)), \
+                patch.object(AudioTranscriber, "_load_whisper", return_value=object()) as load:
+            for thread in TranscriptionPipeline(diarizer, transcriber, parallel=True).preload():
+                thread.join()
+            assert load.call_args[0][0][3] == 5
+            for thread in TranscriptionPipeline(diarizer, transcriber, parallel=False).preload():
+                thread.join()
+            assert load.call_args[0][0][3] == 8
+        
+        assert transcriber.cpu_threads == 8
+        diarizer.preload.assert_called()
+        assert len(get_registry().keys()) == 2
+    
+    def test_split_threads(self):
+        """Test the default core split"""
+        from pipeline import split_threads
+        
+        assert split_threads(8) == (4, 4)
+        assert split_threads(1) == (1, 1)
+
+
+class TestModelRegistry:
+    """Tests for the process-wide model registry"""
+    
+    def test_reuses_loaded_model(self):
+        """Test that a model is loaded once and then served warm"""
+        from model_registry import ModelRegistry
+        
+        registry = ModelRegistry()
+        loader = Mock(return_value=object())
+        key = ("tiny", "cpu", "int8")
+        
+        first = registry.get(key, loader, size_mb=10)
+        second = registry.get(key, loader, size_mb=10)
+        
+        assert first is second
+        loader.assert_called_once()
+    
+    def test_lru_eviction_over_budget(self):
+        """Test that the least recently used model is evicted first"""
+        from model_registry import ModelRegistry
+        
+        registry = ModelRegistry(budget_mb=250)
+        a, b, c = ("a", "cpu", None), ("b", "cpu", None), ("c", "cpu", None)
+        registry.get(a, object, size_mb=100, hold=False)
+        registry.get(b, object, size_mb=100, hold=False)
+        registry.get(a, object, size_mb=100, hold=False)  # touch a, so b is now oldest
+        registry.get(c, object, size_mb=100, hold=False)
+        
+        assert registry.keys() == [a, c]
+        assert registry.resident_mb() == 200
+    
+    def test_held_models_are_not_freed(self):
+        """Test that neither release nor eviction frees a model another caller holds"""
+        from model_registry import ModelRegistry
+        
+        registry = ModelRegistry(budget_mb=150)
+        a, b = ("a", "cpu", None), ("b", "cpu", None)
+        model = object()
+        with patch('model_registry._free_model') as free:
+            registry.get(a, lambda: model, size_mb=100)
+            registry.get(a, lambda: model, size_mb=100)
+            assert registry.holders(a) == 2
+            
+            # Over budget, but a is in use
+            registry.get(b, object, size_mb=100, hold=False)
+            assert registry.keys() == [a, b]
+            
+            assert registry.release(a) is False
+            assert registry.keys() == [a, b]
+            free.assert_not_called()
+            
+            assert registry.release(a) is True
+            assert registry.keys() == [b]
+            free.assert_called_once_with(model)
+    
+    def test_free_model_only_touches_torch_models(self):
+        """Test that unloading never imports torch and skips models without .to"""
+        import sys
+        from model_registry import _free_model
+        
+        torch = MagicMock()
+        torch.cuda.is_available.return_value = True
+        with patch.dict(sys.modules):
+            sys.modules.pop("torch", None)
+            _free_model(MagicMock())
+            assert "torch" not in sys.modules
+        with patch.dict(sys.modules, {"torch": torch}):
+            _free_model(object())
+            torch.cuda.empty_cache.assert_not_called()
+            
+            pipeline = MagicMock()
+            _free_model(pipeline)
+        
+        pipeline.to.assert_called_once_with(torch.device.return_value)
+        torch.cuda.empty_cache.assert_called_once()
+    
+    def test_release_without_unload_keeps_model(self):
+        """Test that giving back a hold with unload=False keeps the model warm"""
+        from model_registry import ModelRegistry
+        
+        registry = ModelRegistry()
+        key = ("m", "cpu", None)
+        registry.get(key, object, size_mb=1)
+        
+        assert registry.release(key, unload=False) is False
+        assert registry.holders(key) == 0
+        assert registry.keys() == [key]
+    
+    def test_concurrent_get_loads_once(self):
+        """Test that concurrent requests for one model share a single load"""
+        import threading
+        import time
+        from model_registry import ModelRegistry
+        
+        registry = ModelRegistry()
+        calls = []
+        
+        def loader():
+            calls.append(1)
+            time.sleep(0.05)
+            return object()
+        
+        results = []
+        threads = [
+            threading.Thread(target=lambda: results.append(registry.get(("m", "cpu", None), loader, 1)))
+            for _ in range(4)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        
+        assert len(calls) == 1
+        assert len({id(r) for r in results}) == 1
+    
+    def test_preload_and_release(self):
+        """Test background preloading and explicit release"""
+        from model_registry import ModelRegistry
+        
+        registry = ModelRegistry()
+        key = ("m", "cpu", None)
+        registry.preload(key, object, size_mb=1).join()
+        
+        assert registry.keys() == [key]
+        assert registry.release(key) is True
+        assert registry.release(key) is False
+    
+    def test_cleanup_policy(self):
+        """Test that cleanup keeps models warm unless per-stage residency is set"""
+        pytest.importorskip("faster_whisper")
+        from model_registry import get_registry
+        from transcription import AudioTranscriber
+        
+        transcriber = AudioTranscriber()
+        get_registry().preload(transcriber.model_key(), MagicMock, size_mb=1).join()
+        transcriber.load_model()
+        transcriber.cleanup()
+        assert get_registry().keys() == [transcriber.model_key()]
+        
+        transcriber.load_model()
+        with patch('config.MODEL_RESIDENCY', "per_stage"):
+            transcriber.cleanup()
+        assert get_registry().keys() == []
+
+
+class TestResultCache:
+    """Tests for the on-disk stage result cache"""
+    
+    def test_round_trip_and_counters(self):
+        """Test storing, loading and hit/miss counting"""
+        from result_cache import ResultCache
+        
+        with tempfile.TemporaryDirectory() as cache_dir:
+            cache = ResultCache(cache_dir, max_mb=1)
+            
+            assert cache.get("diarization", "k") is None
+            cache.put("diarization", "k", [[0.0, 1.5, "SPEAKER_00"]])
+            
+            assert cache.get("diarization", "k") == [[0.0, 1.5, "SPEAKER_00"]]
+            assert cache.stats()["hits"] == {"diarization": 1}
+            assert cache.stats()["misses"] == {"diarization": 1}
+    
+    def test_size_bounded_eviction(self):
+        """Test that the least recently used entries are evicted"""
+        import time
+        from result_cache import ResultCache
+        
+        with tempfile.TemporaryDirectory() as cache_dir:
+            cache = ResultCache(cache_dir, max_mb=0.05)
+            payload = os.urandom(40000).hex()  # ~40 KB each after compression
+            cache.put("summary", "old", payload)
+            time.sleep(0.01)
+            cache.put("summary", "new", payload)
+            
+            assert cache.get("summary", "old") is None
+            assert cache.get("summary", "new") == payload
+    
+    def test_keys_depend_on_settings(self):
+        """Test that only the relevant settings change each stage key"""
+        from result_cache import diarization_key, transcription_key, summary_key
+        
+        d_key, t_key = diarization_key("abc"), transcription_key("abc")
+        with patch('config.BEAM_SIZE', 1):
+            assert diarization_key("abc") == d_key
+            assert transcription_key("abc") != t_key
+        # Only the compute type of the device in use counts
+        with patch('config.DEVICE', "cpu"):
+            cpu_key = transcription_key("abc")
+            with patch('config.COMPUTE_TYPE', "int8_float16"):
+                assert transcription_key("abc") == cpu_key
+            with patch('config.CPU_COMPUTE_TYPE', "float32"):
+                assert transcription_key("abc") != cpu_key
+        with patch('config.DEVICE', "cuda"):
+            cuda_key = transcription_key("abc")
+            with patch('config.COMPUTE_TYPE', "int8_float16"):
+                assert transcription_key("abc") != cuda_key
+        # A transcriber's own model and beam size key its results
+        assert transcription_key("abc", model_name="tiny") != t_key
+        assert transcription_key("abc", beam_size=1) != t_key
+        assert summary_key("text", "p1") != summary_key("text", "p2")
+    
+    def test_pipeline_reuses_cached_stages(self):
+        """Test that the pipeline skips diarization and Whisper on a cache hit"""
+        from pipeline import TranscriptionPipeline
+        from result_cache import ResultCache
+        
+        diarizer = MagicMock()
+        diarizer.diarize.return_value = [(0.0, 1.0, "SPEAKER_00")]
+        transcriber = MagicMock()
+        transcriber.transcribe.return_value = ([0.1], [0.5], ["Hello"], " ")
+        
+        with tempfile.TemporaryDirectory() as cache_dir:
+            cache = ResultCache(cache_dir)
+            pipeline = TranscriptionPipeline(diarizer, transcriber, parallel=False, cache=cache)
+            with patch('pipeline.load_audio'):
+                pipeline.run("audio.wav", audio_hash="abc")
+                pipeline.run("audio.wav", audio_hash="abc")
+        
+        diarizer.diarize.assert_called_once()
+        transcriber.transcribe.assert_called_once()
+        assert transcriber.assign_speakers.call_args[0] == (
+            ([0.1], [0.5], ["Hello"], " "), [(0.0, 1.0, "SPEAKER_00")]
+        )
+
+    
+    def test_transcribers_of_other_models_do_not_share_results(self):
+        """Test that a non-default transcriber, e.g. the draft model, misses the default one's results"""
+        from benchmark_stubs import StubTranscriber
+        from pipeline import TranscriptionPipeline
+        from result_cache import ResultCache
+        
+        draft = StubTranscriber()
+        draft.model_name, draft.beam_size = "tiny", 1
+        with tempfile.TemporaryDirectory() as cache_dir:
+            cache = ResultCache(cache_dir)
+            units = ([0.1], [0.5], ["hi"], "")
+            TranscriptionPipeline(Mock(), StubTranscriber(), cache=cache).store("transcription", "abc", units)
+            
+            assert TranscriptionPipeline(Mock(), StubTranscriber(), cache=cache).lookup("transcription", "abc") == units
+            assert TranscriptionPipeline(Mock(), draft, cache=cache).lookup("transcription", "abc") is None
+
+class TestStreamingTranscription:
+    """Tests for incremental speaker-labelled transcription"""
+    
+    def _segments(self):
+        word = lambda start, end, text: Mock(start=start, end=end, word=text)
+        return [
+            Mock(start=0.0, end=1.0, text=" Hello there", words=[word(0.0, 0.4, " Hello"), word(0.5, 1.0, " there")]),
+            Mock(start=1.0, end=2.0, text=" General", words=[word(1.0, 1.5, " General")]),
+            Mock(start=2.0, end=3.0, text=" Kenobi", words=[word(2.1, 2.9, " Kenobi")]),
+        ]
+    
+    def test_stream_matches_batch_alignment(self):
+        """Test that merged streamed records equal the batch result"""
+        from alignment import SpeakerIndex, align, align_stream, collect_units, merge_lines
+        
+        index = SpeakerIndex([(0.0, 1.2, "SPEAKER_00"), (1.2, 3.0, "SPEAKER_01")])
+        records = list(align_stream(self._segments(), index))
+        
+        assert len(records) == 3
+        starts, ends, texts, joiner = collect_units(self._segments())
+        assert merge_lines(records, joiner) == align(starts, ends, texts, index, joiner=joiner)
+    
+    def test_pipeline_stream(self):
+        """Test streaming through the pipeline in sequential and parallel mode"""
+        import numpy as np
+        from alignment import merge_lines
+        from audio_loader import AudioBuffer
+        from pipeline import TranscriptionPipeline
+        
+        audio = AudioBuffer(np.zeros(48000, dtype=np.float32))
+        for parallel in (False, True):
+            diarizer = MagicMock()
+            diarizer.diarize.return_value = [(0.0, 3.0, "SPEAKER_00")]
+            transcriber = MagicMock()
+            transcriber.iter_segments.side_effect = lambda *_: iter(self._segments())
+            
+            pipeline = TranscriptionPipeline(diarizer, transcriber, parallel=parallel)
+            with patch('pipeline.resolve_device', return_value="cpu"):
+                lines = merge_lines(pipeline.stream(audio))
+            
+            assert lines == [(0.0, 2.9, "SPEAKER_00", "Hello there General Kenobi")]
+            assert pipeline.duration == 3.0
+            assert pipeline.speaker_segments == [(0.0, 3.0, "SPEAKER_00")]
+    
+    def test_pipeline_stream_propagates_errors(self):
+        """Test that a failing background Whisper pass raises in the consumer"""
+        import numpy as np
+        from audio_loader import AudioBuffer
+        from pipeline import TranscriptionPipeline
+        
+        diarizer = MagicMock()
+        diarizer.diarize.return_value = [(0.0, 3.0, "SPEAKER_00")]
+        transcriber = MagicMock()
+        transcriber.iter_segments.side_effect = RuntimeError("decode failed")
+        
+        pipeline = TranscriptionPipeline(diarizer, transcriber, parallel=True)
+        with patch('pipeline.resolve_device', return_value="cpu"):
+            with pytest.raises(RuntimeError):
+                list(pipeline.stream(AudioBuffer(np.zeros(16000, dtype=np.float32))))
+
+
+class FakeLLM:
+    """Async LLM stand-in that counts tokens as characters and tracks concurrency"""
+    
+    def __init__(self, delay=0.01):
+        self.delay = delay
+        self.prompts = []
+        self.in_flight = 0
+        self.max_in_flight = 0
+    
+    def get_num_tokens(self, text):
+        return len(text)
+    
+    async def ainvoke(self, prompt):
+        import asyncio
+        self.prompts.append(prompt)
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        await asyncio.sleep(self.delay)
+        self.in_flight -= 1
+        return f"summary{len(self.prompts)}"
+    
+    def stream(self, prompt):
+        self.prompts.append(prompt)
+        yield from ["stream", "ed ", f"summary{len(self.prompts)}"]
+
+
+class TestMapReduceSummarizer:
+    """Tests for the concurrent MapReduce engine"""
+    
+    def test_chunks_respect_turns_and_budget(self):
+        """Test that chunks split on speaker turns and fit the token budget"""
+        from mapreduce import MapReduceSummarizer
+        
+        transcription = "\n".join(f"SPEAKER_0{i % 2}: " + "x" * 50 for i in range(40))
+        engine = MapReduceSummarizer(FakeLLM(), context_window=600, max_output_tokens=100,
+                                     map_prompt="{text}")
+        chunks = engine.split(transcription)
+        
+        assert len(chunks) > 1
+        assert "\n".join(chunks) == transcription
+        assert all(len(chunk) <= 500 for chunk in chunks)
+    
+    def test_concurrent_map_and_hierarchical_reduce(self):
+        """Test bounded concurrency and that the reduce collapses to one summary"""
+        from mapreduce import MapReduceSummarizer
+        
+        llm = FakeLLM()
+        transcription = "\n".join(f"SPEAKER_00: " + "y" * 80 for _ in range(30))
+        engine = MapReduceSummarizer(llm, context_window=300, max_output_tokens=50,
+                                     max_concurrency=3, map_prompt="{text}",
+                                     reduce_prompt="R:{text}")
+        summary = engine.run(transcription)
+        
+        map_calls = len(engine.split(transcription))
+        assert summary.startswith("summary")
+        assert 1 < llm.max_in_flight <= 3
+        assert engine.calls == len(llm.prompts) > map_calls
+        assert llm.prompts[-1].startswith("R:")
+    
+    def test_single_chunk_uses_direct_prompt(self):
+        """Test that short input takes one call with the direct prompt"""
+        from mapreduce import MapReduceSummarizer
+        
+        llm = FakeLLM()
+        engine = MapReduceSummarizer(llm, direct_prompt="D:{text}")
+        
+        assert engine.run("SPEAKER_00: hi") == "summary1"
+        assert llm.prompts == ["D:SPEAKER_00: hi"]
+    
+    def test_stream_streams_only_the_final_call(self):
+        """Test that map calls run first and the final reduce is streamed"""
+        from mapreduce import MapReduceSummarizer
+        
+        llm = FakeLLM(delay=0.02)
+        transcription = "\n".join(f"SPEAKER_00: " + "y" * 80 for _ in range(30))
+        engine = MapReduceSummarizer(llm, context_window=300, max_output_tokens=50,
+                                     map_prompt="{text}", reduce_prompt="R:{text}")
+        pieces = list(engine.stream(transcription, heartbeat=0.005))
+        
+        # Heartbeats while the map calls run, then the streamed reduce
+        assert pieces[0] == ""
+        assert pieces[-3:] == ["stream", "ed ", f"summary{len(llm.prompts)}"]
+        assert llm.prompts[-1].startswith("R:")
+        assert engine.calls == len(llm.prompts)
+    
+    def test_closing_stream_skips_pending_calls(self):
+        """Test that map calls not yet started are skipped after close()"""
+        import time
+        from mapreduce import MapReduceSummarizer
+        
+        llm = FakeLLM(delay=0.05)
+        transcription = "\n".join(f"SPEAKER_00: " + "y" * 80 for _ in range(30))
+        engine = MapReduceSummarizer(llm, context_window=300, max_output_tokens=50,
+                                     max_concurrency=1, map_prompt="{text}")
+        stream = engine.stream(transcription, heartbeat=0.005)
+        assert next(stream) == ""
+        stream.close()
+        time.sleep(0.2)
+        
+        assert len(llm.prompts) <= 2 < len(engine.split(transcription))
+    
+    def test_summarizer_streams_and_caches(self, tmp_path):
+        """Test ConversationSummarizer.summarize_stream with the result cache"""
+        from result_cache import ResultCache
+        from summarization import ConversationSummarizer
+        
+        summarizer = ConversationSummarizer(cache=ResultCache(str(tmp_path)))
+        summarizer.llm = FakeLLM()
+        transcription = "SPEAKER_00: Hello\nSPEAKER_01: Hi there"
+        
+        assert list(summarizer.summarize_stream(transcription)) == ["stream", "ed ", "summary1"]
+        assert "SPEAKER_01: Hi there" in summarizer.llm.prompts[0]
+        # A complete summary is cached and then yielded whole
+        assert list(summarizer.summarize_stream(transcription)) == ["streamed summary1"]
+        
+        stream = summarizer.summarize_stream(transcription + "\nSPEAKER_00: Bye")
+        next(stream)
+        stream.close()
+        assert list(summarizer.summarize_stream(transcription + "\nSPEAKER_00: Bye"))[-1] == "summary3"
+
+
+class TestIncrementalSummaries:
+    """Tests for content-defined chunks, memoized LLM calls and rolling summaries"""
+    
+    @staticmethod
+    def _turns(count, start=0):
+        return [f"SPEAKER_0{i % 2}: turn {i} " + "y" * (40 + i % 7 * 5) for i in range(start, start + count)]
+    
+    @staticmethod
+    def _engine(llm, **kwargs):
+        from mapreduce import MapReduceSummarizer
+        
+        options = dict(context_window=500, max_output_tokens=50, map_prompt="M:{text}", reduce_prompt="R:{text}")
+        return MapReduceSummarizer(llm, **dict(options, **kwargs))
+    
+    def test_chunks_are_stable_under_edits_and_appends(self):
+        """Test that an edit or an append changes only the chunks around it"""
+        turns = self._turns(80)
+        engine = self._engine(FakeLLM())
+        chunks = engine.split("\n".join(turns))
+        assert len(chunks) > 4
+        
+        appended = engine.split("\n".join(turns + self._turns(10, start=80)))
+        assert appended[:len(chunks) - 1] == chunks[:-1]
+        
+        turns[40] = turns[40].replace("turn 40", "turn forty")
+        edited = engine.split("\n".join(turns))
+        assert len(set(edited) - set(chunks)) <= 2
+    
+    def test_overflow_cuts_resynchronize_after_an_edit(self):
+        """Test that with turns of varied length an edit changes only a few chunks"""
+        import random
+        from mapreduce import stable_chunks
+        
+        rng = random.Random(0)
+        turns = [f"SPEAKER_0{i % 3}: turn {i} " + "y" * rng.choice([10, 40, 80, 120]) for i in range(1000)]
+        chunks = stable_chunks(turns, 600, len, boundary_every=4)
+        assert len(chunks) > 150
+        
+        # Cutting where a chunk overflows shifted every later cut: up to 18 changed chunks
+        changed = []
+        for position in range(0, len(turns), 5):
+            edited = list(turns)
+            edited[position] = edited[position].replace("turn", "TURN")
+            changed.append(len(set(stable_chunks(edited, 600, len, boundary_every=4)) - set(chunks)))
+        assert max(changed) <= 6
+        assert sum(changed) / len(changed) < 1.5
+    
+    def test_only_changed_chunks_and_reduce_are_recomputed(self, tmp_path):
+        """Test map results memoized across runs through the result cache"""
+        from result_cache import ResultCache
+        
+        cache = ResultCache(str(tmp_path))
+        turns = self._turns(80)
+        first = FakeLLM()
+        self._engine(first, cache=cache).run("\n".join(turns))
+        map_calls = sum(prompt.startswith("M:") for prompt in first.prompts)
+        
+        turns[40] = turns[40].replace("turn 40", "turn forty")
+        second = FakeLLM()
+        engine = self._engine(second, cache=cache)
+        engine.run("\n".join(turns))
+        assert 1 <= sum(prompt.startswith("M:") for prompt in second.prompts) <= 2 < map_calls
+        assert engine.reused >= map_calls - 2
+        
+        # Another reduce prompt reuses every map result
+        third = FakeLLM()
+        self._engine(third, cache=cache, reduce_prompt="Other:{text}").run("\n".join(turns))
+        assert third.prompts and all(prompt.startswith("Other:") for prompt in third.prompts)
+    
+    def test_rolling_summary_maps_each_chunk_once(self):
+        """Test extending a summary as the transcript grows"""
+        from mapreduce import RollingSummary
+        
+        llm = FakeLLM()
+        rolling = RollingSummary(self._engine(llm))
+        assert rolling.update() == ""
+        
+        for start in range(0, 100, 10):
+            rolling.append("\n".join(self._turns(10, start=start)))
+            rolling.update()
+        assert rolling.summary.startswith("summary")
+        summary = rolling.update(final=True)
+        
+        map_prompts = [prompt for prompt in llm.prompts if prompt.startswith("M:")]
+        assert len(map_prompts) == len(set(map_prompts)) == len(rolling.engine.split(rolling.transcription))
+        assert summary == rolling.summary
+
+
+class TestOllamaPool:
+    """Tests for the shared Ollama client"""
+    
+    def test_connections_are_reused(self):
+        """Test keep-alive reuse, keep_alive and streamed responses"""
+        from benchmark_stubs import FakeOllamaServer
+        from ollama_client import OllamaPool
+        
+        with FakeOllamaServer(response_words=5) as server:
+            pool = OllamaPool([server.url], model="m", keep_alive="5m")
+            first = pool.generate("hello", {"temperature": 0.3})
+            assert "".join(pool.stream("hello")) == first
+            assert pool.generate("again")
+            
+            assert server.last_payload["keep_alive"] == "5m"
+            assert pool.stats()[0]["connections_opened"] == 1
+            
+            # A stream closed early drops its connection instead of reusing it
+            stream = pool.stream("hello")
+            next(stream)
+            stream.close()
+            pool.generate("after")
+            assert pool.stats()[0]["connections_opened"] == 2
+            pool.close()
+    
+    def test_round_robin_with_bounded_concurrency(self):
+        """Test that requests spread over servers within each server's limit"""
+        from concurrent.futures import ThreadPoolExecutor
+        from benchmark_stubs import FakeOllamaServer
+        from ollama_client import OllamaPool
+        
+        with FakeOllamaServer(latency=0.02) as first, FakeOllamaServer(latency=0.02) as second:
+            pool = OllamaPool([first.url, second.url], max_concurrency=2)
+            assert pool.capacity == 4
+            with ThreadPoolExecutor(8) as executor:
+                list(executor.map(pool.generate, [f"prompt {i}" for i in range(16)]))
+            
+            assert first.calls + second.calls == 16
+            assert first.calls >= 4 and second.calls >= 4
+            assert first.max_in_flight <= 2 and second.max_in_flight <= 2
+            
+            for thread in pool.preload():
+                thread.join()
+            assert first.last_payload == {"model": pool.model, "stream": False, "keep_alive": pool.keep_alive}
+            pool.close()
+    
+    def test_shared_pool_per_servers_and_model(self):
+        """Test the process-wide pool registry"""
+        from ollama_client import OllamaError, OllamaPool, get_ollama_pool
+        
+        assert get_ollama_pool(["http://a:1"], "m") is get_ollama_pool(["http://a:1"], "m")
+        assert get_ollama_pool(["http://a:1"], "m") is not get_ollama_pool(["http://b:1"], "m")
+        
+        # Unreachable servers raise instead of hanging
+        with pytest.raises((OSError, OllamaError)):
+            OllamaPool(["http://127.0.0.1:9"], timeout=2).generate("hello")
+
+
+class TestBatchProcessor:
+    """Tests for headless batch processing"""
+    
+    def test_find_audio_files(self):
+        """Test that only supported formats are picked up"""
+        from batch import find_audio_files
+        
+        with tempfile.TemporaryDirectory() as directory:
+            for name in ("b.mp3", "a.WAV", "notes.txt"):
+                open(os.path.join(directory, name), "w").close()
+            
+            assert [p.name for p in find_audio_files(directory)] == ["a.WAV", "b.mp3"]
+    
+    def test_output_paths_do_not_collide(self):
+        """Test that outputs keep the suffix and the subdirectory of their file"""
+        from pathlib import Path
+        from batch import output_paths
+        
+        root, out = Path("/in"), Path("/out")
+        metas = {
+            output_paths(root / name, out, root)["meta"]
+            for name in ("a.mp3", "a.wav", "x/a.mp3", "y/a.mp3")
+        }
+        
+        assert len(metas) == 4
+        assert output_paths(root / "x/a.mp3", out, root)["transcript"] == Path("/out/x/a.mp3.transcript.txt")
+        assert output_paths(root / "x/a.mp3", out)["meta"] == Path("/out/a.mp3.json")
+    
+    def test_run_skips_done_files_and_reports_throughput(self):
+        """Test skipping, parallel processing and statistics"""
+        from pathlib import Path
+        from batch import BatchProcessor
+        
+        with tempfile.TemporaryDirectory() as directory:
+            files = [Path(directory, f"{i}.wav") for i in range(4)]
+            out = Path(directory, "out")
+            out.mkdir()
+            (out / "0.wav.json").write_text("{}")
+            
+            processor = BatchProcessor(str(out), workers=2)
+            meta = {"audio_seconds": 60.0, "processing_seconds": 6.0}
+            with patch.object(processor, "_warm_up"), \
+                    patch.object(processor, "process_file", return_value=meta) as process_file:
+                stats = processor.run(files)
+        
+        assert process_file.call_count == 3
+        assert stats["processed"] == 3
+        assert stats["skipped"] == 1
+        assert stats["audio_seconds"] == 180.0
+        assert stats["files_per_hour"] > 0
+    
+    def test_failures_are_reported(self):
+        """Test that one failing file does not stop the batch"""
+        from pathlib import Path
+        from batch import BatchProcessor
+        
+        with tempfile.TemporaryDirectory() as directory:
+            processor = BatchProcessor(directory, workers=1)
+            with patch.object(processor, "_warm_up"), \
+                    patch.object(processor, "process_file", side_effect=RuntimeError("boom")):
+                stats = processor.run([Path(directory, "x.mp3")])
+        
+        assert stats["processed"] == 0
+        assert len(stats["failed"]) == 1
+    
+    def test_warm_up_does_not_hold_models(self):
+        """Test that warming up preloads without a hold, and only when files will use the models"""
+        from pathlib import Path
+        from batch import BatchProcessor
+        from diarization import SpeakerDiarizer
+        from transcription import AudioTranscriber
+        
+        with tempfile.TemporaryDirectory() as directory:
+            files = [Path(directory, "a.wav")]
+            with patch.object(SpeakerDiarizer, "preload") as diarizer_preload, \
+                    patch.object(AudioTranscriber, "preload") as transcriber_preload, \
+                    patch.object(SpeakerDiarizer, "load_model") as diarizer_load, \
+                    patch.object(AudioTranscriber, "load_model") as transcriber_load, \
+                    patch('pipeline.resolve_device', return_value="cuda"):
+                BatchProcessor(directory, shard=False)._warm_up([])
+                BatchProcessor(directory, shard=True)._warm_up(files)
+                assert diarizer_preload.call_count == transcriber_preload.call_count == 0
+                
+                BatchProcessor(directory, shard=False)._warm_up(files)
+        
+        assert diarizer_preload.call_count == transcriber_preload.call_count == 1
+        diarizer_preload.return_value.join.assert_called_once()
+        transcriber_preload.return_value.join.assert_called_once()
+        diarizer_load.assert_not_called()
+        transcriber_load.assert_not_called()
+    
+    def test_pipelined_run_chains_stages(self):
+        """Test that the pipelined mode passes each file through all stages"""
+        from pathlib import Path
+        from batch import BatchProcessor
+        
+        with tempfile.TemporaryDirectory() as directory:
+            files = [Path(directory, f"{i}.wav") for i in range(3)]
+            processor = BatchProcessor(directory, workers=1)
+            with patch.object(processor, "_warm_up"), \
+                    patch.object(processor, "_diarize", side_effect=lambda p: {"path": p}), \
+                    patch.object(processor, "_transcribe", side_effect=lambda job: job), \
+                    patch.object(processor, "_summarize",
+                                 return_value={"audio_seconds": 10.0, "processing_seconds": 1.0}):
+                stats = processor.run(files, pipelined=True)
+        
+        assert stats["processed"] == 3
+        assert stats["audio_seconds"] == 30.0
+        assert set(stats["stages"]) == {"diarize", "transcribe", "summarize"}
+        assert stats["stages"]["summarize"]["processed"] == 3
+
+    
+    def test_pipelined_stages_release_their_models(self):
+        """Test that each pipelined stage gives back its model, also when it fails"""
+        from pathlib import Path
+        from batch import BatchProcessor
+        
+        with tempfile.TemporaryDirectory() as directory:
+            processor = BatchProcessor(directory, workers=1)
+            pipeline = MagicMock()
+            pipeline.transcriber.assign_speakers.return_value = "SPEAKER_00: hi"
+            audio = MagicMock(duration=1.0)
+            
+            def _load(job):
+                job["audio_hash"], job["audio"] = None, audio
+            
+            with patch.object(processor, "_pipeline", return_value=pipeline), \
+                    patch.object(processor, "_load", side_effect=_load):
+                job = processor._diarize(Path(directory, "a.wav"))
+                pipeline.diarizer.cleanup.assert_called_once()
+                
+                processor._transcribe(job)
+                pipeline.transcriber.cleanup.assert_called_once()
+                
+                pipeline.diarize.side_effect = RuntimeError("boom")
+                with pytest.raises(RuntimeError):
+                    processor._diarize(Path(directory, "b.wav"))
+        
+        assert pipeline.diarizer.cleanup.call_count == 2
+    
+    def test_pipelined_run_shards_long_files(self):
+        """Test that --shard also applies in pipelined mode"""
+        from pathlib import Path
+        from batch import BatchProcessor
+        
+        with tempfile.TemporaryDirectory() as directory:
+            processor = BatchProcessor(directory, workers=1, shard=True)
+            sharded = MagicMock()
+            sharded.run.return_value = ([(0.0, 1.0, "SPEAKER_00")], "SPEAKER_00: hi")
+            
+            def _load(job):
+                job["audio_hash"], job["audio"] = None, MagicMock(duration=7200.0)
+            
+            with patch.object(processor, "_load", side_effect=_load), \
+                    patch.object(processor, "_sharded_pipeline", return_value=sharded), \
+                    patch.object(processor, "_pipeline") as pipeline:
+                job = processor._transcribe(processor._diarize(Path(directory, "long.wav")))
+            
+            pipeline.assert_not_called()
+            assert job["transcription"] == "SPEAKER_00: hi"
+            assert job["audio_seconds"] == 7200.0
+            assert job["paths"]["transcript"].read_text(encoding="utf-8") == "SPEAKER_00: hi"
+
+class TestSharding:
+    """Tests for sharded long-audio processing"""
+    
+    def test_plan_windows_cover_audio_with_overlap(self):
+        """Test that windows overlap and cover the whole recording"""
+        from sharding import plan_windows, cut_points
+        
+        windows = plan_windows(250.0, window=100.0, overlap=10.0)
+        
+        assert windows == [(0.0, 100.0), (90.0, 190.0), (180.0, 250.0)]
+        assert cut_points(windows) == [0.0, 95.0, 185.0, 250.0]
+        assert plan_windows(30.0, window=100.0, overlap=10.0) == [(0.0, 30.0)]
+    
+    @patch('config.SHARD_WORKERS', 0)
+    def test_default_workers_fit_in_vram(self):
+        """Test that on CUDA the free VRAM caps the worker count"""
+        from pipeline import estimate_model_memory_mb
+        from sharding import default_workers
+        import config
+        
+        per_worker = (estimate_model_memory_mb(config.DIARIZATION_MODEL)
+                      + estimate_model_memory_mb(config.TRANSCRIPTION_MODEL))
+        free = {"cpu": per_worker * 64, "cuda": per_worker * 2.5}
+        with patch('os.cpu_count', return_value=16), \
+                patch('pipeline.available_memory_mb', side_effect=free.get):
+            with patch('pipeline.resolve_device', return_value="cuda"):
+                assert default_workers() == 2
+            with patch('pipeline.resolve_device', return_value="cpu"):
+                assert default_workers() == 16
+    
+    def test_relink_speakers_by_embedding(self):
+        """Test that labels swapped between windows map to the same speakers"""
+        pytest.importorskip("scipy")
+        import numpy as np
+        from sharding import relink_speakers
+        
+        alice, bob, carol = np.eye(3, dtype=np.float32)
+        mappings = relink_speakers([
+            {"SPEAKER_00": alice, "SPEAKER_01": bob},
+            {"SPEAKER_00": bob + 0.1 * alice, "SPEAKER_01": alice, "SPEAKER_02": carol},
+            {"SPEAKER_00": np.full(3, np.nan, dtype=np.float32)},
+        ], threshold=0.3)
+        
+        assert mappings[0] == {"SPEAKER_00": "SPEAKER_00", "SPEAKER_01": "SPEAKER_01"}
+        assert mappings[1] == {"SPEAKER_00": "SPEAKER_01", "SPEAKER_01": "SPEAKER_00", "SPEAKER_02": "SPEAKER_02"}
+        # Without an embedding nothing can be linked
+        assert mappings[2] == {"SPEAKER_00": "SPEAKER_03"}
+    
+    def test_sharded_run_stitches_windows(self):
+        """Test that overlap text is kept once and turns carry global labels"""
+        pytest.importorskip("scipy")
+        import numpy as np
+        from audio_loader import AudioBuffer
+        from sharding import ShardedPipeline
+        
+        alice, bob = np.eye(2, dtype=np.float32)
+        results = [
+            {
+                "speaker_segments": [(0.0, 10.0, "SPEAKER_00"), (10.0, 12.0, "SPEAKER_01")],
+                "embeddings": {"SPEAKER_00": alice, "SPEAKER_01": bob},
+                "durations": {"SPEAKER_00": 10.0, "SPEAKER_01": 2.0},
+                "units": ([1.0, 9.0, 10.5], [2.0, 9.5, 11.0], ["a", "b", "c"], ""),
+            },
+            {
+                # Window starts at 8s; local labels are swapped
+                "speaker_segments": [(0.0, 2.0, "SPEAKER_01"), (2.0, 12.0, "SPEAKER_00")],
+                "embeddings": {"SPEAKER_00": bob, "SPEAKER_01": alice},
+                "durations": {"SPEAKER_00": 10.0, "SPEAKER_01": 2.0},
+                "units": ([1.0, 2.5, 11.0], [1.5, 3.0, 11.5], ["b", "c", "d"], ""),
+            },
+        ]
+        audio = AudioBuffer(np.zeros(16000 * 20, dtype=np.float32))
+        
+        pipeline = ShardedPipeline(workers=1, window=12.0, overlap=4.0)
+        with patch.object(pipeline, "_map", return_value=results) as fake_map:
+            speaker_segments, units = pipeline.process(audio)
+            _, transcription = pipeline.run(audio)
+        
+        assert len(fake_map.call_args[0][0]) == 2
+        assert units[2] == ["a", "b", "c", "d"]
+        assert speaker_segments == [(0.0, 10.0, "SPEAKER_00"), (10.0, 20.0, "SPEAKER_01")]
+        assert transcription == "SPEAKER_00: ab\nSPEAKER_01: cd"
+
+
+
+class TestLive:
+    """Tests for live transcription"""
+    
+    @staticmethod
+    def _decode(words, total):
+        """Decoder returning the true words inside a window, mishearing a last word cut short by its end"""
+        def decode(audio, offset, prompt):
+            end = offset + audio.duration
+            heard = [word for word in words if word[0] >= offset - 1e-6 and word[1] <= end + 1e-6]
+            if heard and end - heard[-1][1] < 0.5 and end < total - 0.01:
+                heard[-1] = (heard[-1][0], heard[-1][1], heard[-1][2] + "?")
+            return heard
+        return decode
+    
+    def test_local_agreement_commits_the_common_prefix(self):
+        """Test that only words two hypotheses agree on are committed"""
+        from live import LocalAgreement
+        
+        agreement = LocalAgreement()
+        
+        assert agreement.update([(0.0, 0.5, " a"), (0.5, 1.0, " b?")]) == []
+        assert agreement.update([(0.0, 0.5, " A"), (0.5, 1.0, " b"), (1.0, 1.5, " c?")]) == [(0.0, 0.5, " A")]
+        assert agreement.committed_until == 0.5
+        # Words before the committed time are not committed twice
+        assert agreement.update([(0.0, 0.5, " a"), (0.5, 1.0, " b"), (1.0, 1.5, " c")]) == [(0.5, 1.0, " b")]
+        assert agreement.flush() == [(1.0, 1.5, " c")]
+        assert agreement.tentative == []
+    
+    def test_replayed_stream_commits_every_word_once(self):
+        """Test that rolling-window decoding commits each word once with bounded lag"""
+        import numpy as np
+        from audio_loader import AudioBuffer
+        from live import LiveTranscriber, replay
+        
+        words = [(i * 0.5, i * 0.5 + 0.4, f" w{i}") for i in range(40)]
+        audio = AudioBuffer(np.zeros(16000 * 20, dtype=np.float32))
+        session = LiveTranscriber(decode=self._decode(words, 20.0), step=1.0, max_window=4.0)
+        
+        updates = list(session.run(replay(audio, chunk_seconds=0.5, speed=0), background=False))
+        lines = [line for update in updates for line in update["lines"]]
+        stats = session.stats()
+        
+        assert session.words == words
+        assert "".join(text for _, _, _, text in lines) == "".join(word[2] for word in words)
+        assert {speaker for _, _, speaker, _ in lines} == {"SPEAKER_00"}
+        assert updates[-1]["final"] and updates[-1]["tentative"] == ""
+        # The window never grows past max_window, so lag stays within it plus a step
+        assert stats["audio_seconds"] == 20.0
+        assert stats["lag_max"] <= 5.0
+        assert stats["steps"] == len(updates)
+    
+    def test_speakers_stay_consistent_across_diarization_passes(self):
+        """Test that local labels of each pass are linked to the same global speakers"""
+        pytest.importorskip("scipy")
+        import itertools
+        import numpy as np
+        from benchmark_stubs import StubDiarizer, make_synthetic_audio
+        from live import LiveTranscriber, replay
+        
+        audio, turns = make_synthetic_audio(40.0, num_speakers=2, seed=3)
+        words = []
+        for start, end, label in turns:
+            for t in np.arange(start + 0.2, end - 0.5, 0.4):
+                words.append((float(t), float(t) + 0.3, f" {label[-1]}"))
+        
+        class ShuffledDiarizer(StubDiarizer):
+            """Stub that renames its speakers on every call, like independent pyannote runs"""
+            calls = itertools.count()
+            
+            def diarize_with_embeddings(self, audio):
+                swap = next(self.calls) % 2
+                rename = {f"SPEAKER_0{i}": f"SPEAKER_0{i ^ swap}" for i in range(2)}
+                segments = [(start, end, rename[label]) for start, end, label in self.diarize(audio)]
+                embeddings = {rename[f"SPEAKER_0{i}"]: np.eye(2, dtype=np.float32)[i] for i in range(2)}
+                return segments, embeddings
+        
+        session = LiveTranscriber(diarizer=ShuffledDiarizer(), decode=self._decode(words, 40.0),
+                                  step=1.0, max_window=6.0, diarization_interval=4.0, diarization_window=10.0)
+        updates = session.run(replay(audio, chunk_seconds=0.5, speed=0), background=False)
+        lines = [line for update in updates for line in update["lines"]]
+        
+        assert "".join(text for _, _, _, text in lines) == "".join(word[2] for word in words)
+        pairs = {(speaker, text.strip()[0]) for _, _, speaker, text in lines}
+        # Each global speaker only ever says its own true speaker's words
+        assert len(pairs) == 2
+        assert len({speaker for speaker, _ in pairs}) == 2
+        for _, _, speaker, text in lines:
+            assert len(set(text.split())) == 1
+
+
+class TestStagePipeline:
+    """Tests for the stage-pipelined scheduler"""
+    
+    def test_results_keep_input_order(self):
+        """Test that results come back in input order with parallel workers"""
+        import random
+        import time
+        from scheduler import Stage, StagePipeline
+        
+        def slow_double(x):
+            time.sleep(random.random() * 0.01)
+            return x * 2
+        
+        pipeline = StagePipeline([Stage("double", slow_double, workers=3), Stage("inc", lambda x: x + 1)])
+        
+        assert pipeline.run(range(10)) == [x * 2 + 1 for x in range(10)]
+    
+    def test_failed_items_skip_later_stages(self):
+        """Test that a failure is reported once and does not stop other items"""
+        from scheduler import Stage, StagePipeline
+        
+        def fail_on_two(x):
+            if x == 2:
+                raise ValueError("bad item")
+            return x
+        
+        later = []
+        errors = []
+        pipeline = StagePipeline([Stage("check", fail_on_two), Stage("later", lambda x: later.append(x) or x)])
+        results = pipeline.run(range(4), on_error=lambda item, stage, e: errors.append((item, stage)))
+        
+        assert results == [0, 1, None, 3]
+        assert errors == [(2, "check")]
+        assert 2 not in later
+    
+    def test_stages_overlap_and_report_stats(self):
+        """Test that stages run concurrently and queues stay bounded"""
+        import threading
+        from scheduler import Stage, StagePipeline
+        
+        # Stage a only finishes item 1 once stage b is working on item 0,
+        # which can only happen if the stages overlap
+        b_started = threading.Event()
+        overlapped = []
+        
+        def a(x):
+            if x == 1:
+                overlapped.append(b_started.wait(timeout=5))
+            return x
+        
+        def b(x):
+            if x == 0:
+                b_started.set()
+            return x
+        
+        pipeline = StagePipeline([Stage("a", a), Stage("b", b)], queue_size=1)
+        assert pipeline.run(range(6)) == list(range(6))
+        stats = pipeline.stats()
+        
+        assert overlapped == [True]
+        assert stats["a"]["processed"] == stats["b"]["processed"] == 6
+        assert stats["b"]["queue_depth_max"] <= 1
+        assert 0 < stats["b"]["utilization"] <= 1
+    
+    def test_callback_error_stops_the_stages(self):
+        """Test that an exception in on_result is raised after the workers stopped"""
+        import threading
+        from scheduler import Stage, StagePipeline
+        
+        def on_result(item, result):
+            raise RuntimeError("callback failed")
+        
+        pipeline = StagePipeline([Stage("a", lambda x: x), Stage("b", lambda x: x)], queue_size=1)
+        with pytest.raises(RuntimeError, match="callback failed"):
+            pipeline.run(range(50), on_result=on_result)
+        
+        assert not [t for t in threading.enumerate() if t.name.startswith(("voxlens-a-", "voxlens-b-", "voxlens-feeder"))]
+        assert pipeline.stats()["a"]["processed"] < 50
+
+
+class TestBenchmarkSuite:
+    """Tests for the synthetic benchmark suite and its stand-in backends"""
+    
+    def test_stub_diarizer_recovers_synthetic_turns(self):
+        """Test that the stand-in diarizer finds the generated speakers"""
+        from benchmark_stubs import StubDiarizer, make_synthetic_audio
+        
+        audio, turns = make_synthetic_audio(30.0, num_speakers=3)
+        found = StubDiarizer().diarize(audio)
+        
+        assert [label for _, _, label in found] == [label for _, _, label in turns]
+        assert all(abs(a[0] - b[0]) < 0.2 and abs(a[1] - b[1]) < 0.2 for a, b in zip(found, turns))
+    
+    def test_fake_ollama_server_counts_calls(self):
+        """Test the fake generate API in streaming and non-streaming form"""
+        import json
+        import urllib.request
+        from benchmark_stubs import FakeOllamaServer, OllamaHTTPClient
+        
+        with FakeOllamaServer(response_words=3) as server:
+            assert OllamaHTTPClient(server.url).invoke("hello") != ""
+            request = urllib.request.Request(
+                f"{server.url}/api/generate", data=json.dumps({"prompt": "hi"}).encode("utf-8")
+            )
+            with urllib.request.urlopen(request) as response:
+                lines = [json.loads(line) for line in response.read().splitlines()]
+        
+        assert server.calls == 2
+        assert lines[-1]["done"] and len(lines) == 4
+    
+    def test_suite_reports_every_stage(self):
+        """Test a short stub run and the comparison of two results"""
+        import copy
+        from benchmark import compare_results, run_suite
+        
+        result = run_suite(duration=20.0, transcript_turns=50, backend="stub", llm="fake", llm_latency=0.0)
+        
+        for stage in ("diarization", "transcription", "alignment", "pipeline", "summarization_map_reduce"):
+            assert result["stages"][stage]["wall_seconds"] >= 0
+            assert result["stages"][stage]["peak_rss_mb"] > 0
+        assert result["stages"]["diarization"]["real_time_factor"] is not None
+        assert result["stages"]["summarization_map_reduce"]["llm_calls"] >= 1
+        
+        slower = copy.deepcopy(result)
+        slower["stages"]["pipeline"]["wall_seconds"] = result["stages"]["pipeline"]["wall_seconds"] * 2 + 1
+        regressions = [row[0] for row in compare_results(result, slower) if row[4]]
+        assert regressions == ["pipeline"]
+
+
+class TestMetrics:
+    """Tests for per-job spans and reports"""
+    
+    def test_spans_nest_and_are_noops_without_a_job(self):
+        """Test nesting, counters and the untracked fast path"""
+        import metrics
+        
+        with metrics.span("untracked") as nothing:
+            metrics.record(tokens_in=5)
+        assert nothing is None
+        
+        job = metrics.JobMetrics(job_id="test")
+        with metrics.track(job):
+            with metrics.span("summarization"):
+                for _ in range(3):
+                    with metrics.span("llm.map", tokens_in=10):
+                        metrics.record(tokens_out=2)
+                        metrics.record(tokens_out=1)
+        
+        report = job.to_dict()
+        summarization = report["spans"][0]
+        assert summarization["name"] == "summarization"
+        assert [child["tokens_out"] for child in summarization["children"]] == [3, 3, 3]
+        assert report["wall_seconds"] >= summarization["wall_seconds"]
+        rows = job.rows()
+        assert rows[1]["stage"] == "  llm.map"
+        assert rows[1]["count"] == 3 and rows[1]["tokens_in"] == 30
+    
+    def test_timed_iter_excludes_consumer_time(self):
+        """Test that only the producer's work is counted"""
+        import time
+        import metrics
+        
+        def produce():
+            for i in range(3):
+                time.sleep(0.01)
+                yield i
+        
+        job = metrics.JobMetrics()
+        with metrics.track(job):
+            for _ in metrics.timed_iter("transcription.decode", produce(), audio_seconds=60.0):
+                time.sleep(0.03)
+        
+        decode = job.to_dict()["spans"][0]
+        assert decode["items"] == 3
+        assert 0.03 <= decode["wall_seconds"] < 0.08
+        assert decode["real_time_factor"] == pytest.approx(decode["wall_seconds"] / 60.0, rel=1e-3)
+    
+    def test_spans_follow_copied_contexts_into_threads(self):
+        """Test that threads started with a copied context report to the job"""
+        import contextvars
+        import threading
+        import metrics
+        
+        job = metrics.JobMetrics()
+        with metrics.track(job):
+            with metrics.span("pipeline"):
+                def work():
+                    with metrics.span("diarization.inference"):
+                        pass
+                thread = threading.Thread(target=contextvars.copy_context().run, args=(work,))
+                thread.start()
+                thread.join()
+        
+        assert job.to_dict()["spans"][0]["children"][0]["name"] == "diarization.inference"
+    
+    def test_pyannote_steps_and_profile(self):
+        """Test the pyannote hook breakdown, cProfile capture and the JSON report"""
+        import json
+        import metrics
+        
+        job = metrics.JobMetrics(job_id="profiled", profile_stage="diarization.inference")
+        with metrics.track(job):
+            with metrics.span("diarization.inference"):
+                steps = metrics.PyannoteStepTimer()
+                for step in ("segmentation", "segmentation", "speaker_counting", "embeddings",
+                             "discrete_diarization"):
+                    sum(range(1000))
+                    steps(step, None)
+                steps.record()
+        
+        children = job.to_dict()["spans"][0]["children"]
+        assert [child["name"] for child in children] == [
+            "segmentation", "speaker_counting", "embeddings", "clustering"
+        ]
+        assert "diarization.inference" in job.profiles
+        with tempfile.TemporaryDirectory() as directory:
+            path = job.save(os.path.join(directory, "job.json"))
+            with open(path, encoding="utf-8") as f:
+                assert json.load(f)["job_id"] == "profiled"
+    
+    def test_map_reduce_calls_are_recorded(self):
+        """Test that every LLM call of a MapReduce run becomes a span with tokens"""
+        import metrics
+        from mapreduce import MapReduceSummarizer
+        
+        transcription = "\n".join(f"SPEAKER_0{i % 2}: " + "x" * 40 for i in range(10))
+        job = metrics.JobMetrics()
+        with metrics.track(job):
+            summarizer = MapReduceSummarizer(FakeLLM(), context_window=200, max_output_tokens=20)
+            summarizer.run(transcription)
+        
+        calls = [row for row in job.rows() if row["stage"].startswith("llm.")]
+        assert sum(row["count"] for row in calls) == summarizer.calls
+        assert all(row["tokens_in"] and row["tokens_out"] for row in calls)
+
+
+class TestTranscript:
+    """Tests for the array-backed transcript model"""
+    
+    @staticmethod
+    def _units():
+        units = ([0.0, 0.5, 1.0, 2.2, 2.6, 4.0], [0.5, 1.0, 1.5, 2.6, 3.0, 4.4],
+                 [" Hello", " there,", " world.", " こんにちは", "。", " "], "")
+        segments = [(0.0, 2.0, "SPEAKER_00"), (2.0, 3.5, "SPEAKER_01"), (3.9, 4.5, "SPEAKER_00")]
+        return units, segments
+    
+    def test_matches_align(self):
+        """Test that the transcript has the same lines as align() and format_transcript()"""
+        from alignment import SpeakerIndex, align, format_transcript
+        from benchmark_stubs import StubDiarizer, StubTranscriber, make_synthetic_audio
+        from transcript import Transcript
+        
+        units, segments = self._units()
+        transcript = Transcript.from_units(units, segments)
+        lines = align(*units[:3], SpeakerIndex(segments), joiner=units[3])
+        assert list(transcript.iter_lines()) == lines
+        assert transcript.to_text() == format_transcript(lines)
+        assert transcript.line_words(0) == [(0.0, 0.5, "Hello"), (0.5, 1.0, "there,"), (1.0, 1.5, "world.")]
+        assert transcript.line(1) == (2.2, 3.0, "SPEAKER_01", "こんにちは。")
+        
+        audio, _ = make_synthetic_audio(60.0, num_speakers=3)
+        segments = StubDiarizer().diarize(audio)
+        transcriber = StubTranscriber()
+        units = transcriber.transcribe(audio, segments)
+        assert Transcript.from_units(units, segments).to_text() == transcriber.assign_speakers(units, segments)
+        assert Transcript.from_units(([], [], [], ""), segments).to_text() == ""
+    
+    def test_save_and_load(self, tmp_path):
+        """Test that the binary file restores the transcript exactly"""
+        from transcript import Transcript
+        
+        transcript = Transcript.from_units(*self._units())
+        path = tmp_path / "transcript.npz"
+        transcript.save(str(path))
+        loaded = Transcript.load(str(path))
+        
+        assert list(tmp_path.iterdir()) == [path]
+        assert loaded.lines.dtype == transcript.lines.dtype
+        assert list(loaded.iter_lines()) == list(transcript.iter_lines())
+        assert loaded.line_words(1) == transcript.line_words(1)
+        assert loaded.speakers == transcript.speakers
+    
+    def test_exports(self, tmp_path):
+        """Test the TXT, SRT, WebVTT and JSON Lines exports"""
+        import json
+        from transcript import Transcript
+        
+        transcript = Transcript.from_units(*self._units())
+        srt = "".join(transcript.iter_format("srt"))
+        assert srt.startswith("1\n00:00:00,000 --> 00:00:01,500\nSPEAKER_00: Hello there, world.\n\n2\n")
+        vtt = "".join(transcript.iter_format("vtt"))
+        assert vtt.startswith("WEBVTT\n\n00:00:00.000 --> 00:00:01.500\n<v SPEAKER_00>Hello")
+        
+        path = transcript.export(str(tmp_path / "meeting.jsonl"), words=True)
+        records = [json.loads(line) for line in open(path, encoding="utf-8")]
+        assert [record["speaker"] for record in records] == ["SPEAKER_00", "SPEAKER_01"]
+        assert records[1]["words"] == [[2.2, 2.6, "こんにちは"], [2.6, 3.0, "。"]]
+        
+        path = transcript.export(str(tmp_path / "meeting.txt"))
+        assert open(path, encoding="utf-8").read() == transcript.to_text() + "\n"
+        with pytest.raises(ValueError):
+            transcript.export(str(tmp_path / "meeting.docx"))
+
+
+class TestJobs:
+    """Tests for checkpointed, resumable jobs"""
+    
+    @staticmethod
+    def _make_job(tmp_path, duration=30.0):
+        from benchmark_stubs import make_synthetic_audio
+        from jobs import Job
+        
+        audio, _ = make_synthetic_audio(duration, num_speakers=2)
+        path = tmp_path / "meeting.wav"
+        TestAudioIngest._write_wav(path, audio.samples, audio_format=3)
+        return Job.create(str(path), jobs_dir=str(tmp_path / "jobs"))
+    
+    @staticmethod
+    def _runner(job, transcriber=None, diarizer=None):
+        from benchmark_stubs import StubDiarizer, StubTranscriber
+        from jobs import JobRunner
+        from pipeline import TranscriptionPipeline
+        
+        pipeline = TranscriptionPipeline(diarizer or StubDiarizer(), transcriber or StubTranscriber(),
+                                         parallel=False)
+        return JobRunner(job, pipeline)
+    
+    def test_finished_stages_are_not_run_again(self, tmp_path):
+        """Test that a rerun of a job reuses every checkpoint"""
+        from jobs import Job, find_job
+        
+        job = self._make_job(tmp_path)
+        summarizer = Mock()
+        summarizer.summarize.return_value = "要約"
+        result = self._runner(job).run(summarizer)
+        
+        job = Job.open(job.job_id, jobs_dir=str(tmp_path / "jobs"))
+        assert job.status == "done"
+        assert list(job.manifest["completed"]) == ["diarization", "transcription", "summary"]
+        assert (job.workdir / "transcript.txt").read_text(encoding="utf-8") == result["transcription"]
+        assert not job.audio_path.exists()
+        assert find_job(job.audio_hash, jobs_dir=str(tmp_path / "jobs")) is None
+        
+        diarizer, transcriber = Mock(), Mock()
+        transcriber.assign_speakers.return_value = result["transcription"]
+        again = self._runner(job, transcriber=transcriber, diarizer=diarizer).run(summarizer)
+        
+        diarizer.diarize.assert_not_called()
+        transcriber.iter_segments.assert_not_called()
+        assert summarizer.summarize.call_count == 1
+        assert again["summary"] == "要約"
+        assert again["speaker_segments"] == result["speaker_segments"]
+    
+    def test_interrupted_transcription_resumes_at_committed_offset(self, tmp_path):
+        """Test that decoding continues after the last committed segment"""
+        from benchmark_stubs import StubTranscriber
+        from jobs import Job
+        
+        class Failing(StubTranscriber):
+            def iter_segments(self, audio, speaker_segments=None):
+                for n, segment in enumerate(super().iter_segments(audio, speaker_segments)):
+                    if n == 3:
+                        raise RuntimeError("Ollama timed out")
+                    yield segment
+        
+        class Recording(StubTranscriber):
+            durations = []
+            
+            def iter_segments(self, audio, speaker_segments=None):
+                self.durations.append(audio.duration)
+                return super().iter_segments(audio, speaker_segments)
+        
+        job = self._make_job(tmp_path)
+        with pytest.raises(RuntimeError):
+            for _ in self._runner(job, transcriber=Failing()).stream():
+                pass
+        
+        job = Job.open(job.job_id, jobs_dir=str(tmp_path / "jobs"))
+        assert job.status == "failed" and "timed out" in job.manifest["error"]
+        assert job.is_done("diarization") and not job.is_done("transcription")
+        (committed, _, _, _), offset = job.committed_units("")
+        assert offset > 0 and committed
+        
+        # A commit cut short by a crash is dropped
+        with open(job.workdir / job.PARTIAL, "a", encoding="utf-8") as f:
+            f.write('{"offset": 99')
+        
+        diarizer = Mock()
+        runner = self._runner(job, transcriber=Recording(), diarizer=diarizer)
+        records = list(runner.stream())
+        
+        diarizer.diarize.assert_not_called()
+        assert runner.resumed_from == offset
+        assert Recording.durations == [pytest.approx(runner.duration - offset, abs=1e-3)]
+        starts, ends, texts, _ = job.load("transcription")
+        assert starts[:len(committed)] == committed
+        assert starts == sorted(starts) and len(starts) > len(committed)
+        assert records[-1][1] > offset
+        assert not (job.workdir / job.PARTIAL).exists()
+    
+    def test_only_unowned_jobs_are_resumed(self, tmp_path):
+        """Test that a job running in a live process is not picked up twice"""
+        from jobs import Job, find_job
+        
+        jobs_dir = str(tmp_path / "jobs")
+        job = self._make_job(tmp_path)
+        # Pending or running under a live owner: left alone
+        assert find_job(job.audio_hash, jobs_dir=jobs_dir) is None
+        job.set_status("running")
+        assert job.manifest["owner"]["pid"] == os.getpid()
+        assert find_job(job.audio_hash, jobs_dir=jobs_dir) is None
+        
+        # The owner died without recording it
+        with patch('jobs.pid_alive', return_value=False):
+            assert find_job(job.audio_hash, jobs_dir=jobs_dir).job_id == job.job_id
+        
+        for status in ("failed", "interrupted"):
+            job.set_status(status)
+            assert find_job(job.audio_hash, jobs_dir=jobs_dir).job_id == job.job_id
+        job.set_status("done")
+        assert find_job(job.audio_hash, jobs_dir=jobs_dir) is None
+    
+    def test_concurrent_checkpoints_are_all_recorded(self, tmp_path):
+        """Test that stages saved from two threads both end up completed"""
+        import threading
+        import time
+        import jobs
+        
+        job = self._make_job(tmp_path)
+        write = jobs._write_atomic
+        
+        def slow_write(path, text):
+            time.sleep(0.02)
+            write(path, text)
+        
+        with patch('jobs._write_atomic', side_effect=slow_write):
+            threads = [
+                threading.Thread(target=job.save, args=(stage, [])) for stage in ("transcription", "summary")
+            ]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        
+        assert sorted(job.manifest["completed"]) == ["summary", "transcription"]
+        assert sorted(jobs.Job(job.workdir).manifest["completed"]) == ["summary", "transcription"]
+    
+    def test_recluster_relabels_the_transcript(self, tmp_path):
+        """Test that another speaker count reuses the kept artifacts and the transcription"""
+        import numpy as np
+        from benchmark_stubs import StubDiarizer
+        
+        class Keeping(StubDiarizer):
+            def diarize(self, audio):
+                self.last_artifacts = TestSpeakerDiarizer._artifacts()
+                return super().diarize(audio)
+        
+        job = self._make_job(tmp_path)
+        runner = self._runner(job, diarizer=Keeping())
+        for _ in runner.stream():
+            pass
+        assert job.artifacts_path.exists() and runner.can_recluster()
+        assert len({label for _, _, label in job.load("diarization")}) > 1
+        
+        diarizer, transcriber = Mock(), Mock()
+        diarizer.recluster.return_value = [(0.0, runner.duration, "SPEAKER_00")]
+        again = self._runner(job, transcriber=transcriber, diarizer=diarizer)
+        transcript = again.recluster(num_speakers=1)
+        
+        artifacts = diarizer.recluster.call_args[0][0]
+        assert np.array_equal(artifacts.embeddings, TestSpeakerDiarizer._artifacts().embeddings)
+        assert diarizer.recluster.call_args[1]["num_speakers"] == 1
+        diarizer.diarize.assert_not_called()
+        transcriber.iter_segments.assert_not_called()
+        assert transcript.count("\n") == 0 and transcript.startswith("SPEAKER_00: ")
+        assert job.load("diarization") == [(0.0, runner.duration, "SPEAKER_00")]
+        assert (job.workdir / "transcript.txt").read_text(encoding="utf-8") == transcript
+        assert job.transcript().speakers == ["SPEAKER_00"]
+    
+    def test_recluster_without_artifacts(self, tmp_path):
+        """Test that a job diarized without artifacts cannot be re-clustered"""
+        job = self._make_job(tmp_path)
+        runner = self._runner(job)
+        for _ in runner.stream():
+            pass
+        
+        assert not runner.can_recluster()
+        with pytest.raises(FileNotFoundError):
+            runner.recluster(num_speakers=2)
+
+
+
+class TestRefine:
+    """Tests for two-pass draft-then-refine transcription"""
+    
+    @staticmethod
+    def _two_pass_runner(job, transcriber=None):
+        from benchmark_stubs import StubDiarizer, StubTranscriber
+        from jobs import JobRunner
+        from pipeline import TranscriptionPipeline
+        
+        class Draft(StubTranscriber):
+            """Draft model that hears every word as x"""
+            
+            def iter_segments(self, audio, speaker_segments=None):
+                for segment in super().iter_segments(audio, speaker_segments):
+                    for word in segment.words:
+                        word.word = "x"
+                    yield segment
+        
+        pipeline = TranscriptionPipeline(StubDiarizer(), transcriber or StubTranscriber(), parallel=False)
+        return JobRunner(job, pipeline, draft_transcriber=Draft())
+    
+    def test_regions_meet_in_pauses(self):
+        """Test that regions tile the recording and split between speech chunks"""
+        from refine import refinement_regions
+        
+        turns = [(1.0, 5.0, "SPEAKER_00"), (8.0, 12.0, "SPEAKER_01"), (12.5, 20.0, "SPEAKER_00")]
+        
+        assert refinement_regions(turns, 25.0, max_seconds=30.0) == [(0.0, 6.5), (6.5, 25.0)]
+        assert refinement_regions(turns, 25.0, max_seconds=30.0, cuts=[3.0]) == [(0.0, 3.0), (3.0, 6.5), (6.5, 25.0)]
+        assert refinement_regions([], 10.0) == [(0.0, 10.0)]
+    
+    def test_draft_is_shown_first_and_replaced_in_place(self, tmp_path):
+        """Test that the draft transcript is complete at once and refined region by region"""
+        from jobs import Job
+        
+        job = TestJobs._make_job(tmp_path, duration=90.0)
+        runner = self._two_pass_runner(job)
+        records = list(runner.stream())
+        
+        assert records and all(set(text) == {"x"} for _, _, _, text in records)
+        assert all(set(line.split(": ")[1]) == {"x"} for line in runner.transcription.split("\n"))
+        assert not job.is_done("transcription")
+        regions = len(runner.refiner.regions)
+        assert regions > 1
+        
+        seen = []
+        runner.refine(on_update=lambda refiner: seen.append((refiner.progress, runner.transcript.to_text())))
+        
+        assert [progress for progress, _ in seen] == sorted(progress for progress, _ in seen)
+        assert seen[-1][0] == 1.0 and len(seen) == regions
+        # Halfway through, refined text and the draft of the rest make up the transcript
+        middle = seen[len(seen) // 2][1].split("\n")
+        assert "x" not in middle[0] and set(middle[-1].split(": ")[1]) == {"x"}
+        assert "x" not in runner.transcription
+        assert runner.refiner is None
+        job = Job.open(job.job_id, jobs_dir=str(tmp_path / "jobs"))
+        assert job.is_done("transcription")
+        assert (job.workdir / "transcript.txt").read_text(encoding="utf-8") == runner.transcription
+    
+    def test_refinement_builds_the_transcript_on_demand(self, tmp_path):
+        """Test that refined regions do not each rebuild the whole transcript"""
+        from transcript import Transcript
+        
+        job = TestJobs._make_job(tmp_path, duration=90.0)
+        runner = self._two_pass_runner(job)
+        list(runner.stream())
+        regions = len(runner.refiner.regions)
+        shown = []
+        
+        def on_update(refiner):
+            if len(refiner.refined) - sum(refiner.refined) == 1:
+                shown.append(runner.transcript.to_text())
+        
+        with patch.object(Transcript, "from_units", wraps=Transcript.from_units) as from_units:
+            runner.refine(on_update=on_update)
+        
+        # One rebuild for the preview and one for the final transcript
+        assert regions > 2 and from_units.call_count == 2
+        assert "x" in shown[0] and "x" not in runner.transcription
+    
+    def test_interrupted_refinement_resumes_after_the_last_region(self, tmp_path):
+        """Test that refined regions are committed and not decoded again"""
+        from benchmark_stubs import StubTranscriber
+        from jobs import Job
+        
+        class Failing(StubTranscriber):
+            calls = 0
+            
+            def transcribe(self, audio, speaker_segments=None):
+                Failing.calls += 1
+                if Failing.calls == 3:
+                    raise RuntimeError("out of memory")
+                return super().transcribe(audio, speaker_segments)
+        
+        job = TestJobs._make_job(tmp_path, duration=90.0)
+        runner = self._two_pass_runner(job, transcriber=Failing())
+        list(runner.stream())
+        regions = runner.refiner.regions
+        with pytest.raises(RuntimeError):
+            runner.refine()
+        
+        job = Job.open(job.job_id, jobs_dir=str(tmp_path / "jobs"))
+        assert job.status == "failed"
+        _, offset = job.committed_units("")
+        assert offset == regions[1][1]
+        
+        runner = self._two_pass_runner(job)
+        list(runner.stream())
+        assert runner.refiner.refined[:2] == [True, True] and not any(runner.refiner.refined[2:])
+        runner.refine()
+        
+        starts = job.load("transcription")[0]
+        assert starts == sorted(starts) and len(starts) == len(set(starts))
+        assert "x" not in runner.transcription
+    
+    def test_cancelled_refinement_stops_and_can_resume(self, tmp_path):
+        """Test that cancel_refine stops after the current region and leaves the job resumable"""
+        from jobs import Job, find_job
+        
+        job = TestJobs._make_job(tmp_path, duration=90.0)
+        runner = self._two_pass_runner(job)
+        list(runner.stream())
+        regions = runner.refiner.regions
+        transcriber = runner.pipeline.transcriber
+        with patch.object(transcriber, "transcribe", wraps=transcriber.transcribe) as transcribe:
+            runner.refine(on_update=lambda refiner: runner.cancel_refine())
+        
+        assert transcribe.call_count == 1
+        assert runner.refiner is not None and not runner.refiner.done
+        job = Job.open(job.job_id, jobs_dir=str(tmp_path / "jobs"))
+        assert job.status == "interrupted"
+        assert job.committed_units("")[1] == regions[0][1]
+        assert find_job(job.audio_hash, jobs_dir=str(tmp_path / "jobs")).job_id == job.job_id
+    
+    def test_summary_waits_for_the_refined_text(self, tmp_path):
+        """Test that the summary is written from the refined text unless told not to wait"""
+        import config
+        
+        job = TestJobs._make_job(tmp_path, duration=40.0)
+        summarizer = Mock()
+        summarizer.summarize.return_value = "要約"
+        
+        with patch.object(config, "DRAFT_SUMMARY_WAITS", True):
+            result = self._two_pass_runner(job).run(summarizer)
+        
+        assert summarizer.summarize.call_args[0][0] == result["transcription"]
+        assert "x" not in result["transcription"]
+        
+        (tmp_path / "draft").mkdir()
+        job = TestJobs._make_job(tmp_path / "draft", duration=40.0)
+        summarizer.reset_mock()
+        with patch.object(config, "DRAFT_SUMMARY_WAITS", False):
+            result = self._two_pass_runner(job).run(summarizer)
+        
+        assert "x" in summarizer.summarize.call_args[0][0]
+        assert "x" not in result["transcription"]
+
+
+class TestJobService:
+    """Tests for the job queue, its workers and the HTTP API"""
+    
+    @pytest.fixture
+    def service(self, tmp_path):
+        from service import JobService
+        
+        with patch("config.JOBS_DIR", str(tmp_path / "jobs")):
+            with JobService(host="127.0.0.1", port=0, workers=0, queue_path=str(tmp_path / "queue.db")) as service:
+                yield service
+    
+    @staticmethod
+    def _upload(duration=20.0):
+        import io
+        from benchmark_stubs import make_synthetic_audio
+        
+        audio, _ = make_synthetic_audio(duration, num_speakers=2)
+        path = tempfile.mktemp(suffix=".wav")
+        TestAudioIngest._write_wav(path, audio.samples, audio_format=3)
+        with open(path, "rb") as f:
+            data = f.read()
+        os.unlink(path)
+        return io.BytesIO(data)
+    
+    @staticmethod
+    def _worker(queue, transcriber=None, **kwargs):
+        from benchmark_stubs import StubDiarizer, StubTranscriber
+        from pipeline import TranscriptionPipeline
+        from service import Worker
+        
+        summarizer = Mock()
+        summarizer.summarize_stream.side_effect = lambda text, use_map_reduce: (piece for piece in ["要", "約"])
+        return Worker(
+            queue,
+            pipeline_factory=lambda: TranscriptionPipeline(StubDiarizer(), transcriber or StubTranscriber(),
+                                                           parallel=False),
+            summarizer_factory=lambda: summarizer,
+            **kwargs
+        )
+    
+    def test_submit_run_and_fetch_result(self, service):
+        """Test a job from upload over the API to its result"""
+        from service import ServiceClient, ServiceError
+        
+        client = ServiceClient(service.url)
+        submitted = client.submit(self._upload(), "meeting.wav")
+        assert submitted["status"] == "queued"
+        with pytest.raises(ServiceError) as error:
+            client.result(submitted["job_id"])
+        assert error.value.status == 409
+        
+        assert self._worker(service.queue).run_once() == submitted["job_id"]
+        assert self._worker(service.queue).run_once() is None
+        
+        status = client.wait(submitted["job_id"], poll_interval=0.01)
+        assert status["status"] == "done" and status["progress"] == 1.0
+        assert status["completed"] == ["diarization", "transcription", "summary"]
+        result = client.result(submitted["job_id"])
+        assert result["summary"] == "要約"
+        assert result["transcription"].startswith("SPEAKER_")
+        assert client.jobs()[0]["job_id"] == submitted["job_id"]
+        
+        with pytest.raises(ServiceError) as error:
+            client.submit(self._upload(), "notes.txt")
+        assert error.value.status == 415
+    
+    def test_cancel_and_timeout(self, service):
+        """Test cancelling queued and running jobs and the time limit"""
+        from benchmark_stubs import StubTranscriber
+        from jobs import Job
+        from service import ServiceClient
+        
+        client = ServiceClient(service.url)
+        queued = client.submit(self._upload(10.0), "a.wav")
+        assert client.cancel(queued["job_id"])["status"] == "cancelled"
+        assert self._worker(service.queue).run_once() is None
+        
+        class Cancelling(StubTranscriber):
+            def iter_segments(self, audio, speaker_segments=None):
+                for segment in super().iter_segments(audio, speaker_segments):
+                    client.cancel(running["job_id"])
+                    yield segment
+        
+        running = client.submit(self._upload(12.0), "b.wav")
+        self._worker(service.queue, transcriber=Cancelling(), report_interval=0.0).run_once()
+        assert client.status(running["job_id"])["status"] == "cancelled"
+        assert Job.open(running["job_id"]).status == "interrupted"
+        
+        slow = client.submit(self._upload(14.0), "c.wav", timeout=1e-6)
+        self._worker(service.queue).run_once()
+        status = client.status(slow["job_id"])
+        assert status["status"] == "timeout" and "Time limit" in status["error"]
+        
+        # A job that ended without finishing is queued again when resubmitted
+        assert client.submit(self._upload(14.0), "c.wav")["status"] == "queued"
+    
+    def test_jobs_of_dead_workers_are_released(self, tmp_path):
+        """Test re-queueing after a worker crash and giving up after repeated crashes"""
+        from service import JobQueue
+        
+        queue = JobQueue(str(tmp_path / "queue.db"))
+        queue.submit("job-1", {}, timeout=0)
+        dead_pid = 2**22 + 12345
+        
+        assert queue.claim(dead_pid)["attempts"] == 1
+        assert queue.release() == 1
+        assert queue.get("job-1")["status"] == "queued"
+        
+        queue.claim(dead_pid)
+        assert queue.release(dead_pid, max_attempts=2) == 1
+        entry = queue.get("job-1")
+        assert entry["status"] == "failed" and "died" in entry["error"]
+
+
+class TestLazyImports:
+    """Tests for deferred imports and the cold start budget"""
+    
+    def test_lazy_module_imports_on_first_use(self):
+        """The module is imported when an attribute is first read"""
+        from lazy_imports import is_imported, lazy_import
+        
+        lazy_json = lazy_import("json")
+        assert not is_imported(lazy_json)
+        assert lazy_json.dumps([1]) == "[1]"
+        assert is_imported(lazy_json)
+        # Patched stand-ins count as imported
+        assert is_imported(Mock())
+    
+    def test_lazy_attribute_forwards_calls(self):
+        """Calls and attribute access reach the imported object"""
+        from lazy_imports import is_imported, lazy_attr
+        
+        ordered = lazy_attr("collections", "OrderedDict")
+        assert not is_imported(ordered)
+        assert ordered(a=1) == {"a": 1}
+        assert ordered.fromkeys("ab") == {"a": None, "b": None}
+        assert is_imported(ordered)
+    
+    def test_pipeline_modules_import_within_budget(self):
+        """Importing the pipeline modules loads no heavy dependency"""
+        import config
+        from lazy_imports import check_startup
+        
+        # Generous margin for slow CI machines; the budget is about not
+        # importing torch & co., which take seconds
+        results = check_startup(config.STARTUP_MODULES, config.IMPORT_BUDGET_SECONDS * 3)
+        for result in results:
+            assert result["error"] is None, result
+            assert result["heavy"] == [], result
+            assert result["ok"], result
+    
+    def test_app_imports_without_heavy_modules(self):
+        """The UI module itself defers torch, pyannote, faster-whisper and LangChain"""
+        pytest.importorskip("streamlit")
+        from lazy_imports import probe_import
+        
+        assert probe_import("app")["heavy"] == []
+    
+    def test_cleanup_without_torch_import(self):
+        """Clearing the cache before any model ran does not import torch"""
+        import diarization
+        from lazy_imports import is_imported
+        
+        diarizer = diarization.SpeakerDiarizer(huggingface_token="test_token")
+        if not is_imported(diarization.torch):
+            diarizer.cleanup()
+            assert not is_imported(diarization.torch)
+
+
+class TestAutotune:
+    """Tests for host calibration and host profiles"""
+    
+    @staticmethod
+    def _probe(calls):
+        # Decode cost per audio second: larger models, beams and precise types are slower
+        cost = {"large-v3": 1.2, "medium": 0.5, "small": 0.2}
+        
+        def _decode(settings, audio):
+            calls.append(settings)
+            threads = settings["cpu_threads"] or 1
+            factor = {5: 1.0, 2: 0.6, 1: 0.4}[settings["beam_size"]]
+            factor *= 1.0 if settings["compute_type"] == "float32" else 0.5
+            return audio.duration * cost[settings["model"]] * factor * (1 + 4 / threads)
+        return _decode
+    
+    @staticmethod
+    def _audio(seconds=10.0):
+        import numpy as np
+        from audio_loader import AudioBuffer
+        
+        return AudioBuffer(np.zeros(int(seconds * 16000), dtype=np.float32))
+    
+    def test_picks_most_accurate_setting_within_target(self):
+        """Test that the search skips models that cannot keep up and prefers larger beams"""
+        from autotune import Calibrator
+        
+        calls = []
+        calibrator = Calibrator(self._audio(), target_rtf=0.3, models=["large-v3", "medium", "small"],
+                                compute_types=["float32", "int8"], beam_sizes=[1, 5, 2], device="cpu",
+                                probe=self._probe(calls))
+        with patch("os.cpu_count", return_value=8):
+            profile = calibrator.run()
+        
+        # 8 threads win the sweep; large-v3 misses even at int8/beam 1 (0.36);
+        # medium meets the target with int8 at beam 2 (0.225) but not beam 5 (0.375)
+        assert profile["met"]
+        assert profile["settings"] == {
+            "DEVICE": "cpu", "TRANSCRIPTION_MODEL": "medium", "CPU_COMPUTE_TYPE": "int8", "BEAM_SIZE": 2,
+            "WHISPER_CPU_THREADS": 8, "WHISPER_NUM_WORKERS": 1,
+        }
+        assert [call["cpu_threads"] for call in calls[:3]] == [8, 4, 2]
+        assert len(calls) == len({tuple(sorted(call.items())) for call in calls})
+        assert not any(call["model"] == "large-v3" and call["beam_size"] == 5 for call in calls)
+    
+    def test_missed_target_settles_for_fastest(self):
+        """Test that the fastest measured setting is saved when nothing meets the target"""
+        from autotune import Calibrator
+        
+        calibrator = Calibrator(self._audio(), target_rtf=0.01, models=["medium", "small"],
+                                compute_types=["float16", "int8_float16"], beam_sizes=[5, 1], device="cuda",
+                                probe=self._probe([]))
+        profile = calibrator.run()
+        
+        assert not profile["met"]
+        assert profile["settings"]["TRANSCRIPTION_MODEL"] == "small"
+        assert profile["settings"]["COMPUTE_TYPE"] == "int8_float16"
+        assert profile["settings"]["BEAM_SIZE"] == 1
+        assert profile["settings"]["WHISPER_CPU_THREADS"] == 0
+    
+    def test_profile_applies_only_on_the_same_host(self, tmp_path, monkeypatch):
+        """Test that a saved profile overrides config on its host and is ignored elsewhere"""
+        import autotune
+        import config
+        
+        for name in autotune.PROFILE_SETTINGS:
+            monkeypatch.setattr(config, name, getattr(config, name))
+        monkeypatch.setattr(config, "HOST_PROFILE_ENABLED", True)
+        path = str(tmp_path / "profile.json")
+        profile = {"host": autotune.host_fingerprint(), "settings": {
+            "DEVICE": "cpu", "TRANSCRIPTION_MODEL": "small", "BEAM_SIZE": 2, "WHISPER_CPU_THREADS": 6,
+            "LLM_MODEL": "ignored",
+        }}
+        autotune.save_host_profile(profile, path)
+        
+        assert autotune.apply_host_profile(path, force=True)["settings"]["BEAM_SIZE"] == 2
+        assert (config.DEVICE, config.TRANSCRIPTION_MODEL, config.BEAM_SIZE) == ("cpu", "small", 2)
+        assert config.LLM_MODEL != "ignored"
+        assert autotune.apply_host_profile(path) is None
+        
+        from transcription import AudioTranscriber
+        assert AudioTranscriber().cpu_threads == 6
+        assert AudioTranscriber(cpu_threads=2).cpu_threads == 2
+        
+        profile["host"] = dict(profile["host"], cpu_count=-1)
+        autotune.save_host_profile(profile, path)
+        assert autotune.load_host_profile(path) is None
+        assert autotune.load_host_profile(str(tmp_path / "missing.json")) is None
+
+
 class TestConfig:
     """Tests for configuration"""
     
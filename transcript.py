@@ -0,0 +1,261 @@
+"""
+Array-backed transcript model with binary storage and streaming exports
+"""
+from typing import Any, Dict, IO, Iterator, List, Sequence, Tuple
+import json
+import os
+import tempfile
+import numpy as np
+import metrics
+from alignment import SpeakerIndex, TranscriptLine
+
+
+# One row per speaker line; text_start/text_end index into Transcript.text,
+# first_word/last_word (exclusive) into Transcript.words
+LINE_DTYPE = np.dtype([
+    ("start", "<f8"), ("end", "<f8"), ("speaker", "<i4"),
+    ("first_word", "<i8"), ("last_word", "<i8"),
+    ("text_start", "<i8"), ("text_end", "<i8"),
+])
+
+# One row per timed text unit (a word, or a Whisper segment without word timestamps)
+WORD_DTYPE = np.dtype([
+    ("start", "<f8"), ("end", "<f8"), ("text_start", "<i8"), ("text_end", "<i8"),
+])
+
+FORMATS = ("txt", "srt", "vtt", "jsonl")
+
+
+def _timestamp(seconds: float, separator: str) -> str:
+    """HH:MM:SS,mmm (SRT) or HH:MM:SS.mmm (WebVTT)"""
+    millis = int(round(max(seconds, 0.0) * 1000))
+    hours, millis = divmod(millis, 3_600_000)
+    minutes, millis = divmod(millis, 60_000)
+    secs, millis = divmod(millis, 1000)
+    return f"{hours:02d}:{minutes:02d}:{secs:02d}{separator}{millis:03d}"
+
+
+class Transcript:
+    """Speaker-labelled transcript held in a few NumPy arrays and one string
+
+    Lines and word timings are structured arrays; all text lives in a single
+    string that the rows point into, so a long recording costs a handful of
+    objects instead of several per word. save() writes the arrays as they
+    are and load() reads them back without parsing any text.
+    """
+
+    def __init__(self, lines: np.ndarray, words: np.ndarray, text: str, speakers: Sequence[str]):
+        """
+        Initialize the transcript
+
+        Args:
+            lines: Array of LINE_DTYPE
+            words: Array of WORD_DTYPE
+            text: Stripped line texts joined by newlines
+            speakers: Speaker labels, indexed by the lines' speaker ids
+        """
+        self.lines = lines
+        self.words = words
+        self.text = text
+        self.speakers = list(speakers)
+
+    @classmethod
+    def from_units(
+        cls,
+        units: Tuple[list, list, list, str],
+        speaker_segments: Sequence[Tuple[float, float, str]],
+        max_gap: float = None
+    ) -> "Transcript":
+        """
+        Align transcribed units to speaker turns
+
+        Gives the same lines as alignment.align(), keeping each unit's timing.
+
+        Args:
+            units: (starts, ends, texts, joiner), see alignment.collect_units
+            speaker_segments: List of (start_time, end_time, speaker_label) tuples
+            max_gap: See SpeakerIndex.assign
+
+        Returns:
+            The transcript
+        """
+        starts, ends, texts, joiner = units
+        index = SpeakerIndex(speaker_segments)
+        with metrics.span("alignment", units=len(starts)):
+            starts = np.asarray(starts, dtype=np.float64)
+            ends = np.asarray(ends, dtype=np.float64)
+            speaker_ids = index.assign(starts, ends, max_gap=max_gap)
+            kept = np.nonzero(speaker_ids >= 0)[0]
+            kept_ids = speaker_ids[kept]
+            breaks = np.nonzero(np.diff(kept_ids))[0] + 1
+            run_starts = np.concatenate(([0], breaks)).astype(np.int64)
+            run_ends = np.concatenate((breaks, [kept.size])).astype(np.int64)
+
+            line_rows: List[tuple] = []
+            word_parts: List[np.ndarray] = []
+            pieces: List[str] = []
+            position = 0
+            word_count = 0
+            for first, last in zip(run_starts.tolist(), run_ends.tolist()):
+                members = kept[first:last]
+                raw = joiner.join(texts[i] for i in members.tolist())
+                stripped = raw.strip()
+                if not stripped:
+                    continue
+
+                # Offsets of each unit in the joined line, shifted by the
+                # stripped leading whitespace and clipped to the stripped text
+                lengths = np.fromiter((len(texts[i]) for i in members.tolist()), dtype=np.int64,
+                                      count=members.size)
+                raw_starts = np.concatenate(([0], np.cumsum(lengths + len(joiner))[:-1]))
+                lead = len(raw) - len(raw.lstrip())
+                part = np.empty(members.size, dtype=WORD_DTYPE)
+                part["start"] = starts[members]
+                part["end"] = ends[members]
+                part["text_start"] = position + np.clip(raw_starts - lead, 0, len(stripped))
+                part["text_end"] = position + np.clip(raw_starts + lengths - lead, 0, len(stripped))
+                word_parts.append(part)
+
+                line_rows.append((
+                    starts[members[0]], ends[members[-1]], kept_ids[first],
+                    word_count, word_count + members.size,
+                    position, position + len(stripped)
+                ))
+                word_count += members.size
+                pieces.append(stripped)
+                position += len(stripped) + 1
+
+        lines = np.array(line_rows, dtype=LINE_DTYPE)
+        words = np.concatenate(word_parts) if word_parts else np.empty(0, dtype=WORD_DTYPE)
+        return cls(lines, words, "\n".join(pieces), index.speakers)
+
+    def __len__(self) -> int:
+        return len(self.lines)
+
+    @property
+    def duration(self) -> float:
+        """End time of the last line in seconds"""
+        return float(self.lines["end"].max()) if len(self.lines) else 0.0
+
+    @property
+    def nbytes(self) -> int:
+        """Approximate memory held by the transcript"""
+        return self.lines.nbytes + self.words.nbytes + len(self.text.encode("utf-8"))
+
+    def line(self, i: int) -> TranscriptLine:
+        """Line i as (start_time, end_time, speaker_label, text)"""
+        row = self.lines[i]
+        return (float(row["start"]), float(row["end"]), self.speakers[row["speaker"]],
+                self.text[row["text_start"]:row["text_end"]])
+
+    def iter_lines(self) -> Iterator[TranscriptLine]:
+        """Yield every line as (start_time, end_time, speaker_label, text)"""
+        text, speakers = self.text, self.speakers
+        columns = zip(self.lines["start"].tolist(), self.lines["end"].tolist(), self.lines["speaker"].tolist(),
+                      self.lines["text_start"].tolist(), self.lines["text_end"].tolist())
+        for start, end, speaker, text_start, text_end in columns:
+            yield start, end, speakers[speaker], text[text_start:text_end]
+
+    def line_words(self, i: int) -> List[Tuple[float, float, str]]:
+        """(start_time, end_time, text) of every unit of line i"""
+        row = self.lines[i]
+        words = self.words[row["first_word"]:row["last_word"]]
+        return [
+            (start, end, self.text[text_start:text_end].strip())
+            for start, end, text_start, text_end in zip(
+                words["start"].tolist(), words["end"].tolist(),
+                words["text_start"].tolist(), words["text_end"].tolist()
+            )
+        ]
+
+    def to_text(self) -> str:
+        """The transcript as "SPEAKER_XX: text" rows, like alignment.format_transcript"""
+        return "".join(self.iter_format("txt")).rstrip("\n")
+
+    def iter_format(self, fmt: str, words: bool = False) -> Iterator[str]:
+        """
+        Render the transcript piece by piece
+
+        Args:
+            fmt: One of FORMATS
+            words: Include word timings (jsonl only)
+
+        Yields:
+            Text pieces that concatenate to the whole file
+        """
+        if fmt not in FORMATS:
+            raise ValueError(f"Unknown transcript format: {fmt}")
+        if fmt == "vtt":
+            yield "WEBVTT\n\n"
+        for n, (start, end, speaker, text) in enumerate(self.iter_lines()):
+            if fmt == "txt":
+                yield f"{speaker}: {text}\n"
+            elif fmt == "srt":
+                yield f"{n + 1}\n{_timestamp(start, ',')} --> {_timestamp(end, ',')}\n{speaker}: {text}\n\n"
+            elif fmt == "vtt":
+                yield f"{_timestamp(start, '.')} --> {_timestamp(end, '.')}\n<v {speaker}>{text}\n\n"
+            else:
+                record: Dict[str, Any] = {"start": start, "end": end, "speaker": speaker, "text": text}
+                if words:
+                    record["words"] = self.line_words(n)
+                yield json.dumps(record, ensure_ascii=False) + "\n"
+
+    def write(self, f: IO[str], fmt: str, words: bool = False):
+        """Write the transcript to an open text file in one of FORMATS"""
+        for piece in self.iter_format(fmt, words=words):
+            f.write(piece)
+
+    def export(self, path: str, fmt: str = None, words: bool = False) -> str:
+        """
+        Write the transcript to a file (atomically)
+
+        Args:
+            path: Output file
+            fmt: One of FORMATS (default: the file extension)
+            words: Include word timings (jsonl only)
+
+        Returns:
+            The path
+        """
+        fmt = fmt or os.path.splitext(path)[1].lstrip(".").lower()
+        if fmt not in FORMATS:
+            raise ValueError(f"Unknown transcript format: {fmt}")
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(path)), suffix=".tmp")
+        try:
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                self.write(f, fmt, words=words)
+            os.replace(tmp_path, path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.unlink(tmp_path)
+            raise
+        return path
+
+    def save(self, path: str):
+        """Write the arrays and the text as an uncompressed .npz file (atomically)"""
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(path)), suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                np.savez(
+                    f,
+                    lines=self.lines,
+                    words=self.words,
+                    text=np.frombuffer(self.text.encode("utf-8"), dtype=np.uint8),
+                    speakers=np.array(self.speakers, dtype=str)
+                )
+            os.replace(tmp_path, path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.unlink(tmp_path)
+            raise
+
+    @classmethod
+    def load(cls, path: str) -> "Transcript":
+        """Read a transcript written by save()"""
+        with np.load(path) as data:
+            return cls(
+                data["lines"],
+                data["words"],
+                data["text"].tobytes().decode("utf-8"),
+                data["speakers"].tolist()
+            )
@@ -1,91 +1,262 @@
 """
 Transcription module using faster-whisper
 """
-from typing import List, Tuple
-import torch
-from faster_whisper import WhisperModel
+from functools import partial
+from typing import Iterator, List, Tuple
+from audio_loader import AudioBuffer, AudioInput, load_audio
+from model_registry import get_registry
+from alignment import (
+    SpeakerIndex, TranscriptLine, align, align_stream, collect_units, format_transcript, speech_chunks
+)
 import config
+import metrics
+from autotune import apply_host_profile
+from lazy_imports import is_imported, lazy_attr, lazy_import
+
+# Imported on first use so that importing this module stays cheap
+torch = lazy_import("torch")
+WhisperModel = lazy_attr("faster_whisper", "WhisperModel")
+BatchedInferencePipeline = lazy_attr("faster_whisper", "BatchedInferencePipeline")
 
 
 class AudioTranscriber:
     """Audio transcription using faster-whisper"""
     
-    def __init__(self):
-        """Initialize the transcription model"""
+    def __init__(
+        self,
+        cpu_threads: int = 0,
+        num_workers: int = None,
+        model_name: str = None,
+        beam_size: int = None
+    ):
+        """
+        Initialize the transcription model
+        
+        Args:
+            cpu_threads: CTranslate2 intra-op threads on CPU
+                         (0 = config.WHISPER_CPU_THREADS)
+            num_workers: Number of transcriptions the model can run in parallel
+                         when called from several threads (default: config.WHISPER_NUM_WORKERS)
+            model_name: Whisper model (default: config.TRANSCRIPTION_MODEL)
+            beam_size: Beam size, 1 for greedy decoding (default: config.BEAM_SIZE)
+        """
+        # A calibrated host profile (see autotune.py) overrides the config defaults
+        apply_host_profile()
         self.model = None
+        self._batched_pipeline = None
+        # Registry key the model was loaded under, released by cleanup()
+        self._loaded_key = None
+        self.cpu_threads = cpu_threads or config.WHISPER_CPU_THREADS
+        self.num_workers = num_workers or config.WHISPER_NUM_WORKERS
+        self.model_name = model_name or config.TRANSCRIPTION_MODEL
+        self.beam_size = beam_size or config.BEAM_SIZE
         
+    def model_key(self):
+        """Key of the Whisper model in the model registry
+        
+        CTranslate2 fixes the CPU thread count when the model is loaded, so
+        on CPU instances with other cpu_threads get a model of their own.
+        """
+        device = config.DEVICE if config.DEVICE == "cuda" else "cpu"
+        compute_type = config.COMPUTE_TYPE if device == "cuda" else config.CPU_COMPUTE_TYPE
+        return (self.model_name, device, compute_type, self.cpu_threads if device == "cpu" else None)
+    
     def load_model(self):
-        """Load the faster-whisper model"""
+        """Load the faster-whisper model, reusing a warm instance if one is registered"""
         if self.model is None:
-            device = config.DEVICE if config.DEVICE == "cuda" else "cpu"
-            self.model = WhisperModel(
-                config.TRANSCRIPTION_MODEL,
+            self._loaded_key = self.model_key()
+            self.model = get_registry().get(self._loaded_key, partial(self._load_whisper, self._loaded_key))
+    
+    def _load_whisper(self, key):
+        """Create the faster-whisper model described by a model_key()"""
+        model_name, device, compute_type, cpu_threads = key
+        with metrics.span("transcription.load_model"):
+            return WhisperModel(
+                model_name,
                 device=device,
-                compute_type=config.COMPUTE_TYPE if device == "cuda" else "int8"
+                compute_type=compute_type,
+                cpu_threads=self.cpu_threads if cpu_threads is None else cpu_threads,
+                num_workers=self.num_workers
             )
     
-    def transcribe_with_speakers(
-        self, 
-        audio_path: str, 
-        speaker_segments: List[Tuple[float, float, str]]
-    ) -> str:
+    def preload(self):
+        """Start loading the model into the registry in the background"""
+        key = self.model_key()
+        # Bound now: the thread count may change before the background load runs
+        return get_registry().preload(key, partial(self._load_whisper, key))
+    
+    @property
+    def batched(self) -> bool:
+        """Whether transcription decodes diarized speech turns in batches"""
+        return config.TRANSCRIPTION_MODE == "batched"
+    
+    def iter_segments(
+        self,
+        audio: AudioInput,
+        speaker_segments: List[Tuple[float, float, str]] = None
+    ) -> Iterator:
         """
-        Transcribe audio with speaker labels
+        Lazily transcribe audio, yielding faster-whisper segments as they are decoded
         
         Args:
-            audio_path: Path to audio file
-            speaker_segments: List of (start_time, end_time, speaker_label) tuples
+            audio: Path to audio file or a decoded AudioBuffer
+            speaker_segments: Diarized turns; in batched mode only these are decoded
             
-        Returns:
-            Full transcription with speaker labels in "SPEAKER_XX: text" format
+        Yields:
+            faster-whisper segments in time order
         """
         if self.model is None:
             self.load_model()
         
-        # Transcribe the entire audio once
-        segments, _ = self.model.transcribe(
-            audio_path,
-            language=config.TRANSCRIPTION_LANGUAGE,
-            beam_size=config.BEAM_SIZE,
-            vad_filter=config.VAD_FILTER,
-            vad_parameters=dict(min_silence_duration_ms=500)
-        )
+        if self.batched and speaker_segments is not None:
+            segments, info = self._transcribe_batched(load_audio(audio), speaker_segments)
+        else:
+            if isinstance(audio, AudioBuffer):
+                audio = audio.as_whisper()
+            
+            # Transcribe the entire audio once
+            segments, info = self.model.transcribe(
+                audio,
+                language=config.TRANSCRIPTION_LANGUAGE,
+                beam_size=self.beam_size,
+                vad_filter=config.VAD_FILTER,
+                vad_parameters=dict(min_silence_duration_ms=500),
+                word_timestamps=config.WORD_TIMESTAMPS
+            )
         
-        # Convert segments to a list for easier processing
-        all_segments = list(segments)
+        # Segments are decoded lazily, so this is where the inference runs
+        audio_seconds = info.duration if info is not None else None
+        yield from metrics.timed_iter("transcription.decode", segments, audio_seconds=audio_seconds)
+        
+        # Clear VRAM cache after inference to optimize memory usage
+        self.clear_cache()
+    
+    def _transcribe_batched(self, audio: AudioBuffer, speaker_segments: List[Tuple[float, float, str]]):
+        """Decode the speech chunks of the diarized turns together"""
+        chunks = speech_chunks(speaker_segments, duration=audio.duration)
+        if not chunks:
+            return iter(()), None
+        if self._batched_pipeline is None:
+            self._batched_pipeline = BatchedInferencePipeline(model=self.model)
         
-        full_transcription = []
+        # The batched pipeline takes the regions as sample offsets and skips its own VAD
+        clip_timestamps = [
+            {"start": int(start * audio.sample_rate), "end": int(end * audio.sample_rate)}
+            for start, end in chunks
+        ]
+        segments, info = self._batched_pipeline.transcribe(
+            audio.as_whisper(),
+            language=config.TRANSCRIPTION_LANGUAGE,
+            beam_size=self.beam_size,
+            vad_filter=False,
+            clip_timestamps=clip_timestamps,
+            batch_size=config.WHISPER_BATCH_SIZE,
+            word_timestamps=config.WORD_TIMESTAMPS
+        )
+        return segments, info
+    
+    def transcribe(
+        self,
+        audio: AudioInput,
+        speaker_segments: List[Tuple[float, float, str]] = None
+    ) -> Tuple[list, list, list, str]:
+        """
+        Transcribe audio without speaker labels
         
-        # Match transcribed segments with speaker segments
-        for start_time, end_time, speaker_label in speaker_segments:
-            # Find all transcription segments that overlap with this speaker segment
-            segment_texts = []
+        Args:
+            audio: Path to audio file or a decoded AudioBuffer
+            speaker_segments: Diarized turns, required for batched mode
             
-            for segment in all_segments:
-                # Check if segment overlaps with speaker time range
-                if segment.start < end_time and segment.end > start_time:
-                    segment_texts.append(segment.text.strip())
+        Returns:
+            Timed text units (starts, ends, texts, joiner), see alignment.collect_units
+        """
+        return collect_units(self.iter_segments(audio, speaker_segments), use_words=config.WORD_TIMESTAMPS)
+    
+    def stream_with_speakers(
+        self,
+        audio: AudioInput,
+        speaker_segments: List[Tuple[float, float, str]]
+    ) -> Iterator[TranscriptLine]:
+        """
+        Transcribe audio with speaker labels, yielding lines as Whisper produces them
+        
+        Args:
+            audio: Path to audio file or a decoded AudioBuffer
+            speaker_segments: List of (start_time, end_time, speaker_label) tuples
             
-            if segment_texts:  # Only add non-empty transcriptions
-                # Format as "SPEAKER_XX: text"
-                combined_text = " ".join(segment_texts)
-                full_transcription.append(f"{speaker_label}: {combined_text}")
+        Yields:
+            (start_time, end_time, speaker_label, text) records in time order.
+            Text keeps its leading whitespace; merge_lines() joins the records
+            into the same lines transcribe_with_speakers() would produce
+        """
+        segments = self.iter_segments(audio, speaker_segments)
+        yield from align_stream(segments, SpeakerIndex(speaker_segments))
+    
+    def assign_speakers(
+        self,
+        units: Tuple[list, list, list, str],
+        speaker_segments: List[Tuple[float, float, str]]
+    ) -> str:
+        """
+        Attach speaker labels to transcribed units
         
-        # Clear VRAM cache after inference to optimize memory usage
-        self.clear_cache()
+        Args:
+            units: Timed text units returned by transcribe()
+            speaker_segments: List of (start_time, end_time, speaker_label) tuples
+            
+        Returns:
+            Full transcription with speaker labels in "SPEAKER_XX: text" format
+        """
+        # Give every word (or segment) to the single speaker overlapping it most
+        starts, ends, texts, joiner = units
+        with metrics.span("alignment", units=len(starts)):
+            lines = align(starts, ends, texts, SpeakerIndex(speaker_segments), joiner=joiner)
+            return format_transcript(lines)
+    
+    def transcribe_with_speakers(
+        self, 
+        audio: AudioInput, 
+        speaker_segments: List[Tuple[float, float, str]]
+    ) -> str:
+        """
+        Transcribe audio with speaker labels
         
-        return "\n".join(full_transcription)
+        Args:
+            audio: Path to audio file or a decoded AudioBuffer
+            speaker_segments: List of (start_time, end_time, speaker_label) tuples
+            
+        Returns:
+            Full transcription with speaker labels in "SPEAKER_XX: text" format
+        """
+        return self.assign_speakers(self.transcribe(audio, speaker_segments), speaker_segments)
     
     def clear_cache(self):
         """Clear GPU cache to free VRAM after inference"""
-        if torch.cuda.is_available():
+        # Nothing can be cached before torch has been imported
+        if is_imported(torch) and torch.cuda.is_available():
             torch.cuda.empty_cache()
     
-    def cleanup(self):
-        """Cleanup method to release resources and clear VRAM"""
+    def cleanup(self, release: bool = None):
+        """
+        Release this instance's model
+        
+        With config.MODEL_RESIDENCY = "persistent" the model stays warm in the
+        registry for the next job; with "per_stage" it is unloaded to free VRAM
+        unless another instance still holds it.
+        
+        Args:
+            release: Force unloading (True) or keeping (False) the model
+                     regardless of config.MODEL_RESIDENCY
+        """
+        if release is None:
+            release = config.MODEL_RESIDENCY == "per_stage"
         if self.model is not None:
             # faster-whisper uses CTranslate2 backend which doesn't have .to() method
-            # Simply delete the model object to free resources
+            # Dropping the last reference frees resources, so the registry must let go too;
+            # it only does once no other transcriber holds the same model
+            get_registry().release(self._loaded_key or self.model_key(), unload=release)
             del self.model
             self.model = None
+            self._loaded_key = None
+            self._batched_pipeline = None
         self.clear_cache()
@@ -0,0 +1,62 @@
+#!/usr/bin/env python
+"""
+VoxLens command line interface
+Run with: python -m voxlens batch <directory>
+"""
+import argparse
+import sys
+
+import autotune
+import batch
+import jobs
+import live
+import service
+
+
+def main(argv=None) -> int:
+    """Command line entry point"""
+    parser = argparse.ArgumentParser(prog="voxlens", description="VoxLens command line tools")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    batch.add_arguments(subparsers.add_parser(
+        "batch", help="Process every recording in a directory without the UI"
+    ))
+
+    jobs.add_arguments(subparsers.add_parser(
+        "jobs", help="List checkpointed jobs, resume one or export its transcript"
+    ))
+
+    autotune.add_arguments(subparsers.add_parser(
+        "calibrate", help="Probe Whisper settings on this host and save a host profile"
+    ))
+
+    live.add_arguments(subparsers.add_parser(
+        "live", help="Transcribe a live PCM stream (or a replayed recording) as it arrives"
+    ))
+
+    service.add_arguments(subparsers.add_parser(
+        "serve", help="Run the job service (HTTP API and worker processes)"
+    ))
+    service.add_worker_arguments(subparsers.add_parser(
+        "worker", help="Run an extra worker process for a running job service"
+    ))
+
+    args = parser.parse_args(argv)
+
+    if args.command == "batch":
+        return batch.main(args)
+    if args.command == "jobs":
+        return jobs.main(args)
+    if args.command == "calibrate":
+        return autotune.main(args)
+    if args.command == "live":
+        return live.main(args)
+    if args.command == "serve":
+        return service.main(args)
+    if args.command == "worker":
+        return service.worker_main(args)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())